@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+
+
+class AlarmCache:
+    """
+    Alarm cache
+
+    Mirrors first tracks of alarm playlist into a RAM backed directory (tmpfs) so alarm
+    playback never waits for SD card. Cache size is capped and least recently used tracks
+    are evicted first.
+
+    Tracks are copied (or trimmed) to a temporary file without holding the cache lock, so
+    playing a track (get_path) is never delayed by a running sync. The lock is only taken to
+    evict tracks and to move copied file into place.
+    """
+
+    DEFAULT_PATH = "/dev/shm/localmusic"
+    DEFAULT_MAX_SIZE = 67108864
+    DEFAULT_MAX_TRACKS = 3
+    MIN_TRIM_OFFSET = 0.5  # seconds
+
+    def __init__(
+        self,
+        logger,
+        cache_path=DEFAULT_PATH,
+        max_size=DEFAULT_MAX_SIZE,
+        max_tracks=DEFAULT_MAX_TRACKS,
+    ):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            cache_path (str): cache directory (should be on tmpfs)
+            max_size (int): max cache size in bytes
+            max_tracks (int): max number of tracks to cache
+        """
+        self.logger = logger
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.max_tracks = max_tracks
+        self.enabled = False
+        self.__lock = threading.RLock()
+        # serializes syncs, so room made for a track is not used by another sync
+        self.__sync_lock = threading.Lock()
+        # cached tracks ordered from least to most recently used
+        # {
+        #   source path (str): {
+        #       path (str): cached file path
+        #       size (int): cached file size
+        #       sourcesize (int): source file size
+        #       mtime (float): source file modification time
+        #       offset (float): requested leading audio trim (seconds)
+        #   },
+        #   ...
+        # }
+        self.__tracks = OrderedDict()
+
+    def get_size(self):
+        """
+        Return current cache size
+
+        Returns:
+            int: cache size in bytes
+        """
+        with self.__lock:
+            return sum(track["size"] for track in self.__tracks.values())
+
+    def get_cached_tracks(self):
+        """
+        Return cached tracks
+
+        Returns:
+            list: list of cached source paths (least recently used first)
+        """
+        with self.__lock:
+            return list(self.__tracks.keys())
+
+    def get_path(self, path):
+        """
+        Return path to use to play specified track
+
+        Args:
+            path (str): track path
+
+        Returns:
+            str: cached track path if track is cached, specified path otherwise
+        """
+        with self.__lock:
+            track = self.__tracks.get(path)
+            if not self.enabled or not track or not os.path.exists(track["path"]):
+                return path
+
+            self.__tracks.move_to_end(path)
+            return track["path"]
+
+    def sync(self, tracks, start_offsets=None):
+        """
+        Synchronize cache content with specified playlist tracks
+
+        Args:
+            tracks (list): list of playlist track paths
+            start_offsets (dict): offsets where sound starts by track path (seconds). Leading
+                                  silence of cached tracks is trimmed if ffmpeg is installed
+        """
+        if not self.enabled:
+            return
+
+        start_offsets = start_offsets or {}
+        with self.__sync_lock:
+            os.makedirs(self.cache_path, exist_ok=True)
+
+            # cache tracks in reverse order so first track is the most recently used
+            heads = self.__get_heads(tracks)
+            for path in reversed(heads):
+                offset = start_offsets.get(path) or 0.0
+                if offset < self.MIN_TRIM_OFFSET:
+                    offset = 0.0
+                self.__cache_track(path, offset, protected=heads)
+
+    def __get_heads(self, tracks):
+        """
+        Return first tracks that fit in cache
+
+        Args:
+            tracks (list): list of playlist track paths
+
+        Returns:
+            list: list of track paths to cache
+        """
+        heads = []
+        total_size = 0
+        for path in tracks[: self.max_tracks]:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                self.logger.debug('Unable to cache unavailable track "%s"', path)
+                continue
+            if total_size + size > self.max_size:
+                break
+            total_size += size
+            heads.append(path)
+
+        return heads
+
+    def __cache_track(self, path, offset, protected):
+        """
+        Copy track into cache evicting least recently used tracks if necessary. Track is
+        copied to a temporary file outside cache lock, then renamed into place
+
+        Args:
+            path (str): track path
+            offset (float): leading audio to trim (seconds)
+            protected (list): list of tracks that must not be evicted
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        with self.__lock:
+            track = self.__tracks.get(path)
+            if (
+                track
+                and track["mtime"] == stat.st_mtime
+                and track["sourcesize"] == stat.st_size
+                and track["offset"] == offset
+                and os.path.exists(track["path"])
+            ):
+                self.__tracks.move_to_end(path)
+                return
+            if track:
+                self.__evict(path)
+            self.__make_room(stat.st_size, protected)
+
+        name = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+        extension = os.path.splitext(path)[1]
+        cached_path = os.path.join(self.cache_path, name + extension)
+        # keep extension so ffmpeg guesses output format
+        temp_path = os.path.join(self.cache_path, name + ".part" + extension)
+        if offset and self.__trim_track(path, temp_path, offset):
+            size = os.path.getsize(temp_path)
+        else:
+            try:
+                shutil.copyfile(path, temp_path)
+            except OSError:
+                self.logger.exception('Unable to cache track "%s"', path)
+                self.__remove_file(temp_path)
+                return
+            size = stat.st_size
+
+        with self.__lock:
+            if not self.enabled:
+                self.__remove_file(temp_path)
+                return
+            try:
+                os.replace(temp_path, cached_path)
+            except OSError:
+                self.logger.exception('Unable to cache track "%s"', path)
+                self.__remove_file(temp_path)
+                return
+
+            self.__tracks[path] = {
+                "path": cached_path,
+                "size": size,
+                "sourcesize": stat.st_size,
+                "mtime": stat.st_mtime,
+                "offset": offset,
+            }
+            self.__tracks.move_to_end(path)
+        self.logger.debug('Track "%s" cached to "%s"', path, cached_path)
+
+    def __trim_track(self, path, cached_path, offset):
+        """
+        Copy track into cache without its leading silence. Track is not reencoded, so it is cut
+        on the frame (or packet) boundary preceding offset: cut is not sample accurate
+
+        Args:
+            path (str): track path
+            cached_path (str): cached track path
+            offset (float): leading audio to trim (seconds)
+
+        Returns:
+            bool: True if track trimmed successfully
+        """
+        if not shutil.which("ffmpeg"):
+            return False
+
+        try:
+            subprocess.run(
+                [
+                    "ffmpeg",
+                    "-nostdin",
+                    "-y",
+                    "-loglevel",
+                    "error",
+                    "-ss",
+                    str(offset),
+                    "-i",
+                    path,
+                    "-map",
+                    "0:a",
+                    "-c",
+                    "copy",
+                    cached_path,
+                ],
+                capture_output=True,
+                timeout=60,
+                check=True,
+            )
+            self.logger.debug('Trimmed %ss of silence from "%s"', offset, path)
+            return True
+        except (subprocess.SubprocessError, OSError):
+            self.logger.warning('Unable to trim leading silence of "%s"', path)
+            self.__remove_file(cached_path)
+            return False
+
+    def __make_room(self, size, protected):
+        """
+        Evict least recently used tracks until specified size fits in cache
+
+        Args:
+            size (int): size to free
+            protected (list): list of tracks that must not be evicted
+        """
+        for path in list(self.__tracks.keys()):
+            if self.get_size() + size <= self.max_size:
+                return
+            if path not in protected:
+                self.__evict(path)
+
+    def __evict(self, path):
+        """
+        Remove track from cache
+
+        Args:
+            path (str): track path
+        """
+        track = self.__tracks.pop(path, None)
+        if track:
+            self.logger.debug('Track "%s" evicted from cache', path)
+            self.__remove_file(track["path"])
+
+    def __remove_file(self, path):
+        """
+        Remove file silently
+
+        Args:
+            path (str): file path
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """
+        Remove all cached tracks
+        """
+        with self.__lock:
+            for path in list(self.__tracks.keys()):
+                self.__evict(path)
@@ -0,0 +1,600 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+SAMPLE_RATE = 22050
+DECODE_TIMEOUT = 300
+# decoded samples are processed by chunks so a long track never lives in memory
+CHUNK_SIZE = 88200  # samples (4 seconds)
+
+# loudness computation (EBU R128 gating, without K-weighting filter)
+LOUDNESS_BLOCK = 0.4  # seconds
+LOUDNESS_OVERLAP = 0.75
+LOUDNESS_ABSOLUTE_GATE = -70.0  # LUFS
+LOUDNESS_RELATIVE_GATE = -10.0  # LU
+LOUDNESS_TARGET = -18.0  # LUFS (ReplayGain 2.0 reference level)
+
+# silence detection
+SILENCE_FRAME = 0.02  # seconds
+SILENCE_THRESHOLD = -50.0  # dBFS
+
+# waveform peaks (stored resolution, lower resolutions are downsampled from it)
+WAVEFORM_RESOLUTION = 2048
+WAVEFORM_RESOLUTIONS = [128, 256, 512, 1024, 2048]
+# max number of intermediate peak blocks per waveform peak
+WAVEFORM_OVERSAMPLING = 16
+
+
+def decode_pcm(path, sample_rate=SAMPLE_RATE, chunk_size=CHUNK_SIZE):
+    """
+    Decode audio file to mono float PCM samples using ffmpeg. Samples are streamed by chunks
+
+    Args:
+        path (str): audio file path
+        sample_rate (int): output sample rate
+        chunk_size (int): number of samples per chunk
+
+    Yields:
+        numpy.ndarray: chunk of samples in range [-1.0, 1.0]
+
+    Raises:
+        Exception: if decoding failed or timed out
+    """
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-nostdin",
+                "-loglevel",
+                "error",
+                "-i",
+                path,
+                "-vn",
+                "-ac",
+                "1",
+                "-ar",
+                str(sample_rate),
+                "-f",
+                "s16le",
+                "-",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+        )
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(DECODE_TIMEOUT, kill)
+        timer.start()
+        try:
+            while True:
+                data = process.stdout.read(chunk_size * 2)
+                # drop incomplete sample
+                data = data[: len(data) - len(data) % 2]
+                if not data:
+                    break
+                yield numpy.frombuffer(data, dtype="<i2").astype(numpy.float32) / 32768.0
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+        if timed_out.is_set():
+            raise Exception(f"Unable to decode {path}: decoding timed out")
+        if returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+            raise Exception(f"Unable to decode {path}: {message}")
+
+
+class _FrameAccumulator:
+    """
+    Base of streaming analyses working on fixed size frames of samples. Samples of an
+    incomplete frame are kept until next chunk
+    """
+
+    def __init__(self, frame_size):
+        """
+        Constructor
+
+        Args:
+            frame_size (int): number of samples per frame
+        """
+        self.frame_size = max(1, frame_size)
+        self.__carry = numpy.zeros(0, dtype=numpy.float32)
+
+    def update(self, samples):
+        """
+        Process chunk of samples
+
+        Args:
+            samples (numpy.ndarray): mono samples in range [-1.0, 1.0]
+        """
+        if self.__carry.size:
+            samples = numpy.concatenate((self.__carry, samples))
+        frames_count = samples.size // self.frame_size
+        if frames_count:
+            frames = samples[: frames_count * self.frame_size]
+            self._process_frames(frames.reshape(frames_count, self.frame_size))
+        self.__carry = samples[frames_count * self.frame_size :].copy()
+
+    def _process_frames(self, frames):
+        """
+        Process complete frames
+
+        Args:
+            frames (numpy.ndarray): 2D array of frames
+        """
+        raise NotImplementedError()
+
+
+class LoudnessMeter(_FrameAccumulator):
+    """
+    Streaming gated integrated loudness and peak. Sums of squares are kept per block step
+    (0.1 second), overlapping blocks are rebuilt from them
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        """
+        Constructor
+
+        Args:
+            sample_rate (int): samples rate
+        """
+        block_size = int(LOUDNESS_BLOCK * sample_rate)
+        step = max(1, int(block_size * (1.0 - LOUDNESS_OVERLAP)))
+        super().__init__(step)
+        self.steps_per_block = max(1, block_size // step)
+        self.peak = 0.0
+        self.__steps = []
+
+    def update(self, samples):
+        if samples.size:
+            self.peak = max(self.peak, float(numpy.max(numpy.abs(samples))))
+        super().update(samples)
+
+    def _process_frames(self, frames):
+        self.__steps.append(numpy.sum(frames.astype(numpy.float64) ** 2, axis=1))
+
+    def result(self):
+        """
+        Return loudness infos
+
+        Returns:
+            dict: loudness infos::
+
+                {
+                    loudness (float): integrated loudness (LUFS). None if track is silent
+                    peak (float): sample peak (0.0-1.0)
+                    gain (float): gain to reach target loudness (dB)
+                }
+
+        """
+        peak = self.peak
+        steps = numpy.concatenate(self.__steps) if self.__steps else numpy.zeros(0)
+        if steps.size < self.steps_per_block:
+            return {"loudness": None, "peak": peak, "gain": 0.0}
+
+        # mean square of overlapping blocks
+        sums = numpy.concatenate(([0.0], numpy.cumsum(steps)))
+        starts = numpy.arange(steps.size - self.steps_per_block + 1)
+        block_size = self.steps_per_block * self.frame_size
+        powers = (sums[starts + self.steps_per_block] - sums[starts]) / block_size
+
+        with numpy.errstate(divide="ignore"):
+            loudnesses = -0.691 + 10.0 * numpy.log10(powers)
+        gated = powers[loudnesses > LOUDNESS_ABSOLUTE_GATE]
+        if gated.size == 0:
+            return {"loudness": None, "peak": peak, "gain": 0.0}
+        relative_gate = (
+            -0.691 + 10.0 * numpy.log10(gated.mean()) + LOUDNESS_RELATIVE_GATE
+        )
+        gated = gated[-0.691 + 10.0 * numpy.log10(gated) > relative_gate]
+        loudness = float(-0.691 + 10.0 * numpy.log10(gated.mean()))
+
+        # do not amplify above full scale
+        gain = LOUDNESS_TARGET - loudness
+        if peak > 0.0:
+            gain = min(gain, -20.0 * numpy.log10(peak))
+
+        return {
+            "loudness": round(loudness, 2),
+            "peak": round(peak, 4),
+            "gain": round(float(gain), 2),
+        }
+
+
+class SilenceDetector(_FrameAccumulator):
+    """
+    Streaming leading and trailing silence detection. Only first and last sound frames are
+    kept
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        """
+        Constructor
+
+        Args:
+            sample_rate (int): samples rate
+        """
+        super().__init__(int(SILENCE_FRAME * sample_rate))
+        self.sample_rate = sample_rate
+        self.threshold = 10.0 ** (SILENCE_THRESHOLD / 20.0)
+        self.samples_count = 0
+        self.frames_count = 0
+        self.first_sound = None
+        self.last_sound = None
+
+    def update(self, samples):
+        self.samples_count += samples.size
+        super().update(samples)
+
+    def _process_frames(self, frames):
+        rms = numpy.sqrt(numpy.mean(frames.astype(numpy.float64) ** 2, axis=1))
+        sound_frames = numpy.flatnonzero(rms > self.threshold)
+        if sound_frames.size:
+            if self.first_sound is None:
+                self.first_sound = self.frames_count + int(sound_frames[0])
+            self.last_sound = self.frames_count + int(sound_frames[-1])
+        self.frames_count += frames.shape[0]
+
+    def result(self):
+        """
+        Return sound offsets
+
+        Returns:
+            dict: sound offsets::
+
+                {
+                    soundstart (float): offset where sound starts (seconds)
+                    soundend (float): offset where sound ends (seconds)
+                }
+
+        """
+        if self.frames_count == 0:
+            return {"soundstart": 0.0, "soundend": self.samples_count / self.sample_rate}
+        if self.first_sound is None:
+            return {"soundstart": 0.0, "soundend": 0.0}
+
+        return {
+            "soundstart": round(float(self.first_sound * SILENCE_FRAME), 2),
+            "soundend": round(float((self.last_sound + 1) * SILENCE_FRAME), 2),
+        }
+
+
+class WaveformBuilder:
+    """
+    Streaming waveform min/max peaks. Min and max are kept per block of samples. When there
+    are too many blocks, adjacent blocks are merged and block size doubles, so memory stays
+    bounded whatever track duration
+    """
+
+    def __init__(self, resolution=WAVEFORM_RESOLUTION):
+        """
+        Constructor
+
+        Args:
+            resolution (int): number of peaks
+        """
+        self.resolution = resolution
+        self.capacity = 2 * WAVEFORM_OVERSAMPLING * resolution
+        self.block_size = 1
+        self.samples_count = 0
+        self.__mins = numpy.zeros(0, dtype=numpy.float32)
+        self.__maxs = numpy.zeros(0, dtype=numpy.float32)
+        # incomplete last block: [min, max, samples count]
+        self.__pending = None
+
+    def update(self, samples):
+        """
+        Process chunk of samples
+
+        Args:
+            samples (numpy.ndarray): mono samples in range [-1.0, 1.0]
+        """
+        self.samples_count += samples.size
+        if self.__pending and samples.size:
+            needed = self.block_size - self.__pending[2]
+            head, samples = samples[:needed], samples[needed:]
+            self.__pending = [
+                min(self.__pending[0], float(head.min())),
+                max(self.__pending[1], float(head.max())),
+                self.__pending[2] + head.size,
+            ]
+            if self.__pending[2] == self.block_size:
+                self.__append([self.__pending[0]], [self.__pending[1]])
+                self.__pending = None
+
+        blocks_count = samples.size // self.block_size
+        if blocks_count:
+            blocks = samples[: blocks_count * self.block_size].reshape(
+                blocks_count, self.block_size
+            )
+            self.__append(blocks.min(axis=1), blocks.max(axis=1))
+        tail = samples[blocks_count * self.block_size :]
+        if tail.size:
+            self.__pending = [float(tail.min()), float(tail.max()), tail.size]
+
+    def __append(self, mins, maxs):
+        """
+        Append complete blocks, merging blocks if capacity is exceeded
+
+        Args:
+            mins (list): blocks min
+            maxs (list): blocks max
+        """
+        self.__mins = numpy.concatenate((self.__mins, mins))
+        self.__maxs = numpy.concatenate((self.__maxs, maxs))
+        while self.__mins.size > self.capacity:
+            if self.__mins.size % 2:
+                # odd last block becomes part of pending block of new size
+                pending = self.__pending or [numpy.inf, -numpy.inf, 0]
+                self.__pending = [
+                    min(pending[0], float(self.__mins[-1])),
+                    max(pending[1], float(self.__maxs[-1])),
+                    pending[2] + self.block_size,
+                ]
+                self.__mins = self.__mins[:-1]
+                self.__maxs = self.__maxs[:-1]
+            self.__mins = self.__mins.reshape(-1, 2).min(axis=1)
+            self.__maxs = self.__maxs.reshape(-1, 2).max(axis=1)
+            self.block_size *= 2
+
+    def result(self):
+        """
+        Return waveform
+
+        Returns:
+            dict: waveform::
+
+                {
+                    waveform (bytes): interleaved min and max peaks as int8 values (-127 to 127)
+                }
+
+        """
+        mins, maxs = self.__mins, self.__maxs
+        if self.__pending:
+            mins = numpy.append(mins, self.__pending[0])
+            maxs = numpy.append(maxs, self.__pending[1])
+        if mins.size < self.resolution:
+            # short track is padded with silence
+            mins = numpy.pad(mins, (0, self.resolution - mins.size))
+            maxs = numpy.pad(maxs, (0, self.resolution - maxs.size))
+            starts = numpy.arange(self.resolution)
+        else:
+            # first block starting in each peak
+            starts = -(
+                -numpy.arange(self.resolution)
+                * self.samples_count
+                // (self.resolution * self.block_size)
+            )
+        peaks = numpy.stack(
+            (numpy.minimum.reduceat(mins, starts), numpy.maximum.reduceat(maxs, starts)),
+            axis=1,
+        )
+
+        return {
+            "waveform": numpy.clip(numpy.round(peaks * 127.0), -127, 127)
+            .astype(numpy.int8)
+            .tobytes()
+        }
+
+
+def compute_loudness(samples, sample_rate=SAMPLE_RATE):
+    """
+    Compute gated integrated loudness and peak of specified samples (see LoudnessMeter)
+
+    Args:
+        samples (numpy.ndarray): mono samples in range [-1.0, 1.0]
+        sample_rate (int): samples rate
+
+    Returns:
+        dict: loudness infos (see LoudnessMeter.result)
+    """
+    meter = LoudnessMeter(sample_rate)
+    meter.update(samples)
+    return meter.result()
+
+
+def compute_silence(samples, sample_rate=SAMPLE_RATE):
+    """
+    Detect leading and trailing silence of specified samples (see SilenceDetector)
+
+    Args:
+        samples (numpy.ndarray): mono samples in range [-1.0, 1.0]
+        sample_rate (int): samples rate
+
+    Returns:
+        dict: sound offsets (see SilenceDetector.result)
+    """
+    detector = SilenceDetector(sample_rate)
+    detector.update(samples)
+    return detector.result()
+
+
+def compute_waveform(samples, resolution=WAVEFORM_RESOLUTION):
+    """
+    Compute waveform min/max peaks of specified samples (see WaveformBuilder)
+
+    Args:
+        samples (numpy.ndarray): mono samples in range [-1.0, 1.0]
+        resolution (int): number of peaks
+
+    Returns:
+        dict: waveform (see WaveformBuilder.result)
+    """
+    builder = WaveformBuilder(resolution)
+    builder.update(samples)
+    return builder.result()
+
+
+def downsample_waveform(waveform, resolution):
+    """
+    Downsample waveform peaks to specified resolution
+
+    Args:
+        waveform (bytes): waveform as computed by compute_waveform
+        resolution (int): number of peaks (must divide waveform resolution)
+
+    Returns:
+        bytes: interleaved min and max peaks as int8 values
+    """
+    peaks = numpy.frombuffer(waveform, dtype=numpy.int8).reshape(resolution, -1, 2)
+    return (
+        numpy.stack((peaks[:, :, 0].min(axis=1), peaks[:, :, 1].max(axis=1)), axis=1)
+        .astype(numpy.int8)
+        .tobytes()
+    )
+
+
+ANALYSES = {
+    "loudness": LoudnessMeter,
+    "silence": SilenceDetector,
+    "waveform": WaveformBuilder,
+}
+
+
+def analyze(path, analyses):
+    """
+    Analyze specified audio file. File is decoded once for all analyses, by chunks
+
+    Args:
+        path (str): audio file path
+        analyses (tuple): analyses names to perform (see ANALYSES)
+
+    Returns:
+        dict: merged analyses results
+    """
+    accumulators = [ANALYSES[analysis]() for analysis in analyses]
+    for samples in decode_pcm(path):
+        for accumulator in accumulators:
+            accumulator.update(samples)
+
+    result = {}
+    for accumulator in accumulators:
+        result.update(accumulator.result())
+
+    return result
+
+
+def _lower_priority():
+    """
+    Process pool initializer that lowers worker priority to protect playback
+    """
+    os.nice(19)
+
+
+class AudioAnalyzer:
+    """
+    Audio analyzer
+
+    Runs CPU heavy audio analysis (decoding and NumPy computation) in a low priority process
+    pool. Results are returned through callbacks.
+    """
+
+    def __init__(self, logger, max_workers=1):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            max_workers (int): max number of worker processes
+        """
+        self.logger = logger
+        self.max_workers = max_workers
+        self.__executor = None
+        self.__pending = set()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def is_available():
+        """
+        Check if analysis can be performed (numpy and decoder are installed)
+
+        Returns:
+            bool: True if analysis is available
+        """
+        return numpy is not None and shutil.which("ffmpeg") is not None
+
+    def stop(self):
+        """
+        Stop analyzer cancelling pending analyses
+        """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+            self.__pending.clear()
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, path, analyses, on_result, analysis=analyze, on_error=None):
+        """
+        Submit analysis of specified file. Same analysis already pending for a file is not queued twice
+
+        Args:
+            path (str): audio file path
+            analyses (tuple): analyses names to perform (see ANALYSES)
+            on_result (function): function called with path and analysis result
+            analysis (function): analysis function (module level function taking file path and analyses)
+            on_error (function): function called with path and error if analysis failed
+        """
+        key = (path, tuple(analyses))
+        with self.__lock:
+            if key in self.__pending:
+                return
+            if not self.__executor:
+                self.__executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, initializer=_lower_priority
+                )
+            self.__pending.add(key)
+            future = self.__executor.submit(analysis, path, tuple(analyses))
+
+        future.add_done_callback(
+            lambda future: self.__on_done(key, path, future, on_result, on_error)
+        )
+
+    def __on_done(self, key, path, future, on_result, on_error):
+        """
+        Analysis done callback
+
+        Args:
+            key (tuple): pending analysis key
+            path (str): audio file path
+            future (Future): analysis future
+            on_result (function): result callback
+            on_error (function): error callback
+        """
+        with self.__lock:
+            self.__pending.discard(key)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error:
+            self.logger.warning('Analysis of "%s" failed: %s', path, error)
+            if on_error:
+                try:
+                    on_error(path, error)
+                except Exception:
+                    self.logger.exception('Unable to process analysis error of "%s"', path)
+            return
+
+        try:
+            on_result(path, future.result())
+        except Exception:
+            self.logger.exception('Unable to process analysis result of "%s"', path)
@@ -0,0 +1,625 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+
+# max number of bytes scanned to find first audio frame (after ID3v2 tag)
+SCAN_SIZE = 65536
+# integrity check
+SPOT_CHECKS = 8
+SPOT_CHECK_SIZE = 32768
+# number of header packets before first audio packet of Ogg streams
+OGG_HEADER_PACKETS = {"vorbis": 3, "opus": 2}
+
+CODEC_FORMATS = {
+    "mp3": "audio/mpeg",
+    "flac": "audio/flac",
+    "vorbis": "audio/ogg",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+}
+EXTENSION_CODECS = {
+    "mp3": ["mp3"],
+    "flac": ["flac"],
+    "ogg": ["vorbis", "opus"],
+    "aac": ["aac"],
+}
+
+MPEG_VERSION_1 = 3
+MPEG_VERSION_2 = 2
+MPEG_VERSION_25 = 0
+MPEG_LAYER_1 = 3
+MPEG_LAYER_2 = 2
+MPEG_LAYER_3 = 1
+# bitrates (kbps) by bitrate index. MPEG 2.5 uses MPEG 2 tables
+MPEG_BITRATES = {
+    (MPEG_VERSION_1, MPEG_LAYER_1): (
+        [0, 32, 64, 96, 128, 160, 192, 224]
+        + [256, 288, 320, 352, 384, 416, 448]
+    ),
+    (MPEG_VERSION_1, MPEG_LAYER_2): (
+        [0, 32, 48, 56, 64, 80, 96, 112]
+        + [128, 160, 192, 224, 256, 320, 384]
+    ),
+    (MPEG_VERSION_1, MPEG_LAYER_3): (
+        [0, 32, 40, 48, 56, 64, 80, 96]
+        + [112, 128, 160, 192, 224, 256, 320]
+    ),
+    (MPEG_VERSION_2, MPEG_LAYER_1): (
+        [0, 32, 48, 56, 64, 80, 96, 112]
+        + [128, 144, 160, 176, 192, 224, 256]
+    ),
+    (MPEG_VERSION_2, MPEG_LAYER_2): (
+        [0, 8, 16, 24, 32, 40, 48, 56]
+        + [64, 80, 96, 112, 128, 144, 160]
+    ),
+}
+MPEG_BITRATES[(MPEG_VERSION_2, MPEG_LAYER_3)] = MPEG_BITRATES[
+    (MPEG_VERSION_2, MPEG_LAYER_2)
+]
+MPEG_SAMPLE_RATES = {
+    MPEG_VERSION_1: [44100, 48000, 32000],
+    MPEG_VERSION_2: [22050, 24000, 16000],
+    MPEG_VERSION_25: [11025, 12000, 8000],
+}
+ADTS_SAMPLE_RATES = [
+    96000,
+    88200,
+    64000,
+    48000,
+    44100,
+    32000,
+    24000,
+    22050,
+    16000,
+    12000,
+    11025,
+    8000,
+    7350,
+]
+ADTS_FRAME_SAMPLES = 1024
+
+
+def get_id3_size(data):
+    """
+    Return size of ID3v2 tag at beginning of specified data
+
+    Args:
+        data (bytes): first bytes of file (at least 10)
+
+    Returns:
+        int: tag size (header and footer included). 0 if there is no tag
+    """
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    # syncsafe integer
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def parse_mpeg_header(data, offset=0):
+    """
+    Parse MPEG audio frame header
+
+    Args:
+        data (bytes): data
+        offset (int): header offset in data
+
+    Returns:
+        dict: frame infos or None if there is no valid header at offset::
+
+            {
+                version (int): MPEG version (MPEG_VERSION_XXX)
+                layer (int): MPEG layer (MPEG_LAYER_XXX)
+                bitrate (int): frame bitrate (bits per second)
+                samplerate (int): sample rate
+                channels (int): number of channels
+                length (int): frame length (bytes)
+                samples (int): number of samples in frame
+            }
+
+    """
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset : offset + 4]
+    if b0 != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version = (b1 >> 3) & 0x03
+    layer = (b1 >> 1) & 0x03
+    bitrate_index = b2 >> 4
+    samplerate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 0 or bitrate_index in (0, 15) or samplerate_index == 3:
+        # reserved values (free bitrate is not supported)
+        return None
+
+    table_version = MPEG_VERSION_1 if version == MPEG_VERSION_1 else MPEG_VERSION_2
+    bitrate = MPEG_BITRATES[(table_version, layer)][bitrate_index] * 1000
+    samplerate = MPEG_SAMPLE_RATES[version][samplerate_index]
+    padding = (b2 >> 1) & 0x01
+    if layer == MPEG_LAYER_1:
+        length = (12 * bitrate // samplerate + padding) * 4
+        samples = 384
+    elif layer == MPEG_LAYER_3 and version != MPEG_VERSION_1:
+        length = 72 * bitrate // samplerate + padding
+        samples = 576
+    else:
+        length = 144 * bitrate // samplerate + padding
+        samples = 1152
+
+    return {
+        "version": version,
+        "layer": layer,
+        "bitrate": bitrate,
+        "samplerate": samplerate,
+        "channels": 1 if b3 >> 6 == 3 else 2,
+        "length": length,
+        "samples": samples,
+    }
+
+
+def parse_adts_header(data, offset=0):
+    """
+    Parse AAC ADTS frame header
+
+    Args:
+        data (bytes): data
+        offset (int): header offset in data
+
+    Returns:
+        dict: frame infos or None if there is no valid header at offset::
+
+            {
+                samplerate (int): sample rate
+                channels (int): number of channels (0 if defined in stream)
+                length (int): frame length (bytes)
+                samples (int): number of samples in frame
+            }
+
+    """
+    if offset + 7 > len(data):
+        return None
+    b0, b1, b2, b3, b4, b5 = data[offset : offset + 6]
+    # sync word and layer (always 0)
+    if b0 != 0xFF or b1 & 0xF6 != 0xF0:
+        return None
+    samplerate_index = (b2 >> 2) & 0x0F
+    length = ((b3 & 0x03) << 11) | (b4 << 3) | (b5 >> 5)
+    if samplerate_index >= len(ADTS_SAMPLE_RATES) or length < 7:
+        return None
+
+    return {
+        "samplerate": ADTS_SAMPLE_RATES[samplerate_index],
+        "channels": ((b2 & 0x01) << 2) | (b3 >> 6),
+        "length": length,
+        "samples": ADTS_FRAME_SAMPLES,
+    }
+
+
+def find_frame(data, parser, start=0):
+    """
+    Find first valid frame in data. A frame is valid if it is followed by another valid frame
+    (or by end of data)
+
+    Args:
+        data (bytes): data
+        parser (function): frame header parser (parse_mpeg_header or parse_adts_header)
+        start (int): offset to start search from
+
+    Returns:
+        tuple: frame offset and infos. (None, None) if no frame found
+    """
+    offset = data.find(b"\xff", start)
+    while offset != -1:
+        frame = parser(data, offset)
+        if frame:
+            next_offset = offset + frame["length"]
+            if next_offset + 4 > len(data) or parser(data, next_offset):
+                return offset, frame
+        offset = data.find(b"\xff", offset + 1)
+
+    return None, None
+
+
+def _sniff_mp3(data, offset, frame, audio_start, file_size):
+    """
+    Sniff MP3 stream
+
+    Args:
+        data (bytes): scanned data (starting at audio start)
+        offset (int): first frame offset in data
+        frame (dict): first frame infos
+        audio_start (int): audio start offset in file
+        file_size (int): file size
+
+    Returns:
+        dict: audio infos
+    """
+    # Xing/Info header of VBR files gives number of frames
+    mono = frame["channels"] == 1
+    if frame["version"] == MPEG_VERSION_1:
+        xing_offset = offset + (21 if mono else 36)
+    else:
+        xing_offset = offset + (13 if mono else 21)
+    duration = None
+    bitrate = frame["bitrate"]
+    if len(data) >= xing_offset + 12 and data[xing_offset : xing_offset + 4] in (
+        b"Xing",
+        b"Info",
+    ):
+        flags = struct.unpack(">I", data[xing_offset + 4 : xing_offset + 8])[0]
+        if flags & 0x01:
+            frames = struct.unpack(">I", data[xing_offset + 8 : xing_offset + 12])[0]
+            duration = frames * frame["samples"] / frame["samplerate"]
+    audio_size = file_size - audio_start - offset
+    if duration:
+        bitrate = int(audio_size * 8 / duration)
+    else:
+        duration = audio_size * 8 / bitrate
+
+    return {
+        "codec": "mp3",
+        "samplerate": frame["samplerate"],
+        "channels": frame["channels"],
+        "bitrate": bitrate,
+        "duration": duration,
+    }
+
+
+def _sniff_aac(data, offset, frame, audio_start, file_size):
+    """
+    Sniff AAC ADTS stream
+
+    Args:
+        data (bytes): scanned data (starting at audio start)
+        offset (int): first frame offset in data
+        frame (dict): first frame infos
+        audio_start (int): audio start offset in file
+        file_size (int): file size
+
+    Returns:
+        dict: audio infos
+    """
+    # average bitrate over frames of scanned data
+    frames_count = 0
+    frames_size = 0
+    next_frame = frame
+    while next_frame and offset + next_frame["length"] <= len(data):
+        frames_count += 1
+        frames_size += next_frame["length"]
+        offset += next_frame["length"]
+        next_frame = parse_adts_header(data, offset)
+    frames_count = max(frames_count, 1)
+    frames_size = frames_size or frame["length"]
+    bitrate = int(
+        frames_size * 8 * frame["samplerate"] / (frames_count * ADTS_FRAME_SAMPLES)
+    )
+
+    return {
+        "codec": "aac",
+        "samplerate": frame["samplerate"],
+        "channels": frame["channels"],
+        "bitrate": bitrate,
+        "duration": (file_size - audio_start) * 8 / bitrate if bitrate else None,
+    }
+
+
+def _sniff_flac(data, file_size):
+    """
+    Sniff FLAC stream
+
+    Args:
+        data (bytes): scanned data (starting at fLaC marker)
+        file_size (int): file size
+
+    Returns:
+        dict: audio infos or None
+    """
+    # first metadata block is always STREAMINFO
+    if len(data) < 42 or data[4] & 0x7F != 0:
+        return None
+    value = int.from_bytes(data[18:26], "big")
+    samplerate = value >> 44
+    total_samples = value & 0xFFFFFFFFF
+    if not samplerate:
+        return None
+    duration = total_samples / samplerate if total_samples else None
+
+    return {
+        "codec": "flac",
+        "samplerate": samplerate,
+        "channels": ((value >> 41) & 0x07) + 1,
+        "bitrate": int(file_size * 8 / duration) if duration else None,
+        "duration": duration,
+    }
+
+
+def _sniff_ogg(data, fdesc, file_size):
+    """
+    Sniff Ogg stream (Vorbis or Opus)
+
+    Args:
+        data (bytes): scanned data (starting at first page)
+        fdesc (file): opened file (to read last page)
+        file_size (int): file size
+
+    Returns:
+        dict: audio infos or None
+    """
+    if len(data) < 28:
+        return None
+    packet = data[27 + data[26] :]
+    if packet[:7] == b"\x01vorbis" and len(packet) >= 24:
+        codec = "vorbis"
+        channels = packet[11]
+        samplerate, _, nominal_bitrate = struct.unpack("<IiI", packet[12:24])
+        pre_skip = 0
+    elif packet[:8] == b"OpusHead" and len(packet) >= 16:
+        codec = "opus"
+        channels = packet[9]
+        pre_skip = struct.unpack("<H", packet[10:12])[0]
+        # opus is always decoded at 48kHz
+        samplerate = 48000
+        nominal_bitrate = 0
+    else:
+        return None
+    if not samplerate:
+        return None
+
+    # last page granule position is the number of samples of the stream
+    fdesc.seek(max(0, file_size - SCAN_SIZE))
+    tail = fdesc.read(SCAN_SIZE)
+    last_page = tail.rfind(b"OggS")
+    duration = None
+    if last_page != -1 and last_page + 14 <= len(tail):
+        granule = struct.unpack("<q", tail[last_page + 6 : last_page + 14])[0]
+        if granule > pre_skip:
+            duration = (granule - pre_skip) / samplerate
+
+    bitrate = int(file_size * 8 / duration) if duration else nominal_bitrate or None
+    return {
+        "codec": codec,
+        "samplerate": samplerate,
+        "channels": channels,
+        "bitrate": bitrate,
+        "duration": duration,
+    }
+
+
+def sniff(path):
+    """
+    Detect audio stream infos parsing file headers only (no decoding)
+
+    Args:
+        path (str): audio file path
+
+    Returns:
+        dict: audio infos or None if format is not recognized::
+
+            {
+                codec (str): codec (mp3, flac, vorbis, opus, aac)
+                audioformat (str): audio mime type
+                samplerate (int): sample rate
+                channels (int): number of channels
+                bitrate (int): average bitrate (bits per second). None if unknown
+                duration (float): duration (seconds). None if unknown
+            }
+
+    Raises:
+        OSError: if file cannot be read
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as fdesc:
+        audio_start = get_id3_size(fdesc.read(10))
+        fdesc.seek(audio_start)
+        data = fdesc.read(SCAN_SIZE)
+
+        if data[:4] == b"fLaC":
+            infos = _sniff_flac(data, file_size)
+        elif data[:4] == b"OggS":
+            infos = _sniff_ogg(data, fdesc, file_size)
+        else:
+            # mp3 and aac frames have a similar sync word, keep first stream found
+            mpeg_offset, mpeg_frame = find_frame(data, parse_mpeg_header)
+            adts_offset, adts_frame = find_frame(data, parse_adts_header)
+            if adts_frame and (not mpeg_frame or adts_offset < mpeg_offset):
+                infos = _sniff_aac(data, adts_offset, adts_frame, audio_start, file_size)
+            elif mpeg_frame:
+                infos = _sniff_mp3(data, mpeg_offset, mpeg_frame, audio_start, file_size)
+            else:
+                infos = None
+
+    if not infos:
+        return None
+    infos["audioformat"] = CODEC_FORMATS[infos["codec"]]
+    if infos["duration"] is not None:
+        infos["duration"] = round(infos["duration"], 2)
+    return infos
+
+
+def matches_extension(infos, path):
+    """
+    Check detected audio infos match file extension
+
+    Args:
+        infos (dict): audio infos as returned by sniff
+        path (str): file path
+
+    Returns:
+        bool: True if codec is expected for file extension
+    """
+    extension = os.path.splitext(path)[1][1:].lower()
+    return infos is not None and infos["codec"] in EXTENSION_CODECS.get(extension, [])
+
+
+def _has_flac_frame(data):
+    """
+    Check if data contains FLAC frame sync code
+
+    Args:
+        data (bytes): data
+
+    Returns:
+        bool: True if a frame sync code is found
+    """
+    offset = data.find(b"\xff")
+    while offset != -1 and offset + 1 < len(data):
+        if data[offset + 1] in (0xF8, 0xF9):
+            return True
+        offset = data.find(b"\xff", offset + 1)
+    return False
+
+
+def _has_ogg_page(data):
+    """
+    Check if data contains an Ogg page header
+
+    Args:
+        data (bytes): data
+
+    Returns:
+        bool: True if a page capture pattern followed by stream structure version 0 is found
+    """
+    return b"OggS\x00" in data
+
+
+def _skip_flac_metadata(fdesc, audio_start):
+    """
+    Return offset of first FLAC frame, after all metadata blocks (pictures can be large)
+
+    Args:
+        fdesc (file): opened file
+        audio_start (int): offset of fLaC marker
+
+    Returns:
+        int: offset of first frame or None if metadata blocks are truncated
+    """
+    offset = audio_start + 4
+    last = False
+    while not last:
+        fdesc.seek(offset)
+        header = fdesc.read(4)
+        if len(header) < 4:
+            return None
+        last = bool(header[0] & 0x80)
+        offset += 4 + int.from_bytes(header[1:4], "big")
+
+    return offset
+
+
+def _skip_ogg_headers(fdesc, audio_start, codec):
+    """
+    Return offset of first Ogg audio page, after header packets pages. Comment header can span
+    many pages when it embeds a picture. First audio packet always starts on a fresh page
+
+    Args:
+        fdesc (file): opened file
+        audio_start (int): offset of first page
+        codec (str): vorbis or opus
+
+    Returns:
+        int: offset of first audio page or None if header pages are invalid
+    """
+    # vorbis has identification, comment and setup headers, opus has no setup header
+    packets = OGG_HEADER_PACKETS[codec]
+    offset = audio_start
+    while packets > 0:
+        fdesc.seek(offset)
+        header = fdesc.read(27)
+        if len(header) < 27 or header[:5] != b"OggS\x00":
+            return None
+        lacing = fdesc.read(header[26])
+        if len(lacing) < header[26]:
+            return None
+        # a lacing value lower than 255 ends a packet
+        packets -= sum(1 for value in lacing if value < 255)
+        offset += 27 + len(lacing) + sum(lacing)
+
+    return offset
+
+
+def check_integrity(path, spot_checks=SPOT_CHECKS):
+    """
+    Check audio file integrity without decoding it. Headers are parsed then audio frames sync is
+    spot checked at regular intervals through the audio part of the file (after metadata), which
+    detects garbage or zero filled parts of partially uploaded or corrupt files
+
+    Args:
+        path (str): audio file path
+        spot_checks (int): number of places checked through the file
+
+    Returns:
+        str: error description or None if file looks valid
+
+    Raises:
+        OSError: if file cannot be read
+    """
+    infos = sniff(path)
+    if not infos:
+        return "Audio format not recognized"
+
+    codec = infos["codec"]
+    # flac frames and ogg pages can be larger than a spot check window
+    check_size = SCAN_SIZE
+    if codec == "mp3":
+        has_frame = lambda data: find_frame(data, parse_mpeg_header)[1] is not None
+        check_size = SPOT_CHECK_SIZE
+    elif codec == "aac":
+        has_frame = lambda data: find_frame(data, parse_adts_header)[1] is not None
+        check_size = SPOT_CHECK_SIZE
+    elif codec == "flac":
+        has_frame = _has_flac_frame
+    else:
+        has_frame = _has_ogg_page
+
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as fdesc:
+        audio_start = get_id3_size(fdesc.read(10))
+        if codec == "flac":
+            audio_start = _skip_flac_metadata(fdesc, audio_start)
+        elif codec in OGG_HEADER_PACKETS:
+            audio_start = _skip_ogg_headers(fdesc, audio_start, codec)
+        if audio_start is None or audio_start >= file_size:
+            return "Audio headers are truncated"
+
+        span = max(0, file_size - audio_start - check_size)
+        # first frames were checked by sniff, last spot check covers end of file
+        for index in range(1, spot_checks + 1):
+            offset = audio_start + span * index // spot_checks
+            fdesc.seek(offset)
+            if not has_frame(fdesc.read(check_size)):
+                return f"No audio frame found at offset {offset}"
+
+        if codec in ("vorbis", "opus"):
+            fdesc.seek(max(0, file_size - SCAN_SIZE))
+            tail = fdesc.read(SCAN_SIZE)
+            last_page = tail.rfind(b"OggS")
+            # last page must have end of stream flag
+            if last_page == -1 or not tail[last_page + 5 : last_page + 6] or not (
+                tail[last_page + 5] & 0x04
+            ):
+                return "Stream is truncated"
+
+    return None
+
+
+def probe(path, analyses=None):
+    """
+    Check audio file integrity. Entry point compatible with AudioAnalyzer worker pool
+
+    Args:
+        path (str): audio file path
+        analyses (tuple): unused
+
+    Returns:
+        dict: probe result::
+
+            {
+                integrityerror (str): error description or None if file looks valid
+            }
+
+    Raises:
+        OSError: if file cannot be read
+    """
+    return {"integrityerror": check_integrity(path)}
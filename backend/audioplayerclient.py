@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a command is rejected because audioplayer is considered unavailable
+    """
+
+
+class AudioplayerClient:
+    """
+    Audioplayer client
+
+    Dispatches audioplayer commands asynchronously in a small thread pool so independent commands
+    run concurrently. Each command has its own timeout and idempotent commands are retried a
+    bounded number of times. A circuit breaker rejects commands immediately after consecutive
+    transport failures (timeouts, unreachable audioplayer), so callers are not stalled by an
+    unresponsive audioplayer. Errors returned by audioplayer itself do not open the circuit.
+
+    Alarm commands bypass the circuit breaker: they are always sent, once, in their own worker
+    so they are not queued behind stalled commands.
+    """
+
+    DEFAULT_TIMEOUT = 3.0  # seconds
+    TIMEOUTS = {
+        "start_playback": 5.0,
+        "add_tracks": 10.0,
+    }
+    # commands that can be safely sent twice
+    IDEMPOTENT_COMMANDS = ["stop_playback", "pause_playback"]
+    DEFAULT_RETRIES = 2
+    RETRY_DELAY = 0.25  # seconds
+    BREAKER_THRESHOLD = 3
+    BREAKER_COOLDOWN = 30.0  # seconds
+
+    def __init__(
+        self,
+        logger,
+        send_command,
+        max_workers=4,
+        retries=DEFAULT_RETRIES,
+        breaker_threshold=BREAKER_THRESHOLD,
+        breaker_cooldown=BREAKER_COOLDOWN,
+        transport_errors=(OSError,),
+    ):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            send_command (function): function sending command to audioplayer. It takes command name,
+                                     params and timeout, returns command data and raises on failure
+            max_workers (int): max number of commands running concurrently
+            retries (int): max number of retries of failed idempotent commands
+            breaker_threshold (int): number of consecutive failed commands opening the circuit
+            breaker_cooldown (float): duration commands are rejected once circuit is open (seconds)
+            transport_errors (tuple): exception types raised by send_command for timeouts and
+                                      transport failures. Only them count toward the breaker
+        """
+        self.logger = logger
+        self.send_command = send_command
+        self.max_workers = max_workers
+        self.retries = retries
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.transport_errors = transport_errors
+        self.__executor = None
+        self.__bypass_executor = None
+        self.__lock = threading.Lock()
+        self.__failures = 0
+        self.__open_until = 0.0
+        # pending commands by future: (command name, deadline)
+        self.__pending = {}
+
+    def stop(self):
+        """
+        Stop client. Running commands are not waited
+        """
+        with self.__lock:
+            executors = [self.__executor, self.__bypass_executor]
+            self.__executor = self.__bypass_executor = None
+        for executor in executors:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def is_available(self):
+        """
+        Return circuit breaker status
+
+        Returns:
+            bool: False if commands are currently rejected
+        """
+        with self.__lock:
+            return time.monotonic() >= self.__open_until
+
+    def get_timeout(self, command, bypass_breaker=False):
+        """
+        Return max duration of specified command, retries included
+
+        Args:
+            command (str): command name
+            bypass_breaker (bool): True if command bypasses circuit breaker (never retried)
+
+        Returns:
+            float: duration (seconds)
+        """
+        timeout = self.TIMEOUTS.get(command, self.DEFAULT_TIMEOUT)
+        if bypass_breaker or command not in self.IDEMPOTENT_COMMANDS:
+            return timeout
+        return sum(
+            timeout + self.RETRY_DELAY * attempt for attempt in range(self.retries + 1)
+        )
+
+    def submit(self, command, params, bypass_breaker=False):
+        """
+        Send command asynchronously
+
+        Args:
+            command (str): command name
+            params (dict): command parameters
+            bypass_breaker (bool): always send command (single attempt), even if circuit is
+                                   open. Used for alarm commands
+
+        Returns:
+            Future: command future. Future fails with CircuitOpenError if audioplayer is unavailable
+        """
+        with self.__lock:
+            if bypass_breaker:
+                if not self.__bypass_executor:
+                    self.__bypass_executor = ThreadPoolExecutor(
+                        max_workers=1,
+                        thread_name_prefix="localmusic-audioplayer-alarm",
+                    )
+                executor = self.__bypass_executor
+            elif time.monotonic() < self.__open_until:
+                future = Future()
+                future.set_exception(
+                    CircuitOpenError("Audioplayer is unavailable, command rejected")
+                )
+                return future
+            else:
+                if not self.__executor:
+                    self.__executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="localmusic-audioplayer",
+                    )
+                executor = self.__executor
+
+            future = executor.submit(self.__execute, command, params, bypass_breaker)
+            self.__pending[future] = (
+                command,
+                time.monotonic() + self.get_timeout(command, bypass_breaker) + 1.0,
+            )
+
+        future.add_done_callback(self.__on_done)
+        return future
+
+    def wait(self, futures):
+        """
+        Wait for specified commands until their deadline
+
+        Args:
+            futures (list): command futures (None values are ignored)
+
+        Returns:
+            list: commands results in futures order. None for failed or timed out commands
+        """
+        with self.__lock:
+            infos = [self.__pending.get(future) for future in futures]
+        deadline = max((info[1] for info in infos if info), default=time.monotonic())
+        wait(
+            [future for future in futures if future],
+            timeout=max(0.0, deadline - time.monotonic()),
+        )
+
+        results = []
+        for future, info in zip(futures, infos):
+            command = info[0] if info else "command"
+            if not future:
+                results.append(None)
+            elif not future.done():
+                self.logger.warning("Audioplayer %s timed out", command)
+                results.append(None)
+            elif future.exception():
+                self.logger.warning(
+                    "Audioplayer %s failed: %s", command, future.exception()
+                )
+                results.append(None)
+            else:
+                results.append(future.result())
+
+        return results
+
+    def call(self, command, params, bypass_breaker=False):
+        """
+        Send command and wait for its result
+
+        Args:
+            command (str): command name
+            params (dict): command parameters
+            bypass_breaker (bool): always send command, even if circuit is open
+
+        Returns:
+            any: command result or None if command failed
+        """
+        return self.wait([self.submit(command, params, bypass_breaker)])[0]
+
+    def __on_done(self, future):
+        """
+        Command done callback
+
+        Args:
+            future (Future): command future
+        """
+        with self.__lock:
+            self.__pending.pop(future, None)
+
+    def __execute(self, command, params, bypass_breaker=False):
+        """
+        Execute command retrying idempotent commands
+
+        Args:
+            command (str): command name
+            params (dict): command parameters
+            bypass_breaker (bool): True to never retry command
+
+        Returns:
+            any: command result
+
+        Raises:
+            Exception: if command failed
+        """
+        timeout = self.TIMEOUTS.get(command, self.DEFAULT_TIMEOUT)
+        retries = self.retries if command in self.IDEMPOTENT_COMMANDS else 0
+        if bypass_breaker:
+            retries = 0
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(self.RETRY_DELAY * attempt)
+            try:
+                result = self.send_command(command, params, timeout)
+                self.__on_success()
+                return result
+            except Exception as error:
+                self.logger.debug(
+                    "Audioplayer %s attempt %s failed: %s", command, attempt + 1, error
+                )
+                last_error = error
+                if not isinstance(error, self.transport_errors):
+                    # audioplayer responded, command itself failed: retrying is useless
+                    self.__on_success()
+                    raise
+
+        self.__on_failure()
+        raise last_error
+
+    def __on_success(self):
+        """
+        Close circuit (audioplayer responded)
+        """
+        with self.__lock:
+            self.__failures = 0
+            self.__open_until = 0.0
+
+    def __on_failure(self):
+        """
+        Count transport failure and open circuit if too many consecutive failures
+        """
+        with self.__lock:
+            self.__failures += 1
+            if self.__failures >= self.breaker_threshold:
+                self.logger.error(
+                    "Audioplayer does not respond, commands rejected during %ss",
+                    self.breaker_cooldown,
+                )
+                self.__open_until = time.monotonic() + self.breaker_cooldown
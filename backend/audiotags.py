@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+from .coverart import get_id3_frame_size, read_ogg_comment_packet
+
+# ID3v2 text frames (v2.3/v2.4 and v2.2 identifiers)
+ID3_FRAMES = {
+    b"TPE1": "artist",
+    b"TPE2": "albumartist",
+    b"TALB": "album",
+    b"TCON": "genre",
+    b"TIT2": "title",
+    b"TRCK": "track",
+    b"TP1": "artist",
+    b"TP2": "albumartist",
+    b"TAL": "album",
+    b"TCO": "genre",
+    b"TT2": "title",
+    b"TRK": "track",
+}
+# Vorbis comment fields (upper case)
+VORBIS_FIELDS = {
+    "ARTIST": "artist",
+    "ALBUMARTIST": "albumartist",
+    "ALBUM ARTIST": "albumartist",
+    "ALBUM": "album",
+    "GENRE": "genre",
+    "TITLE": "title",
+    "TRACKNUMBER": "track",
+}
+ID3_ENCODINGS = ["latin-1", "utf-16", "utf-16-be", "utf-8"]
+# ID3v1 genres referenced by number in old tags
+# fmt: off
+ID3_GENRES = [
+    "Blues", "Classic Rock", "Country", "Dance", "Disco", "Funk", "Grunge", "Hip-Hop",
+    "Jazz", "Metal", "New Age", "Oldies", "Other", "Pop", "R&B", "Rap", "Reggae",
+    "Rock", "Techno", "Industrial", "Alternative", "Ska", "Death Metal", "Pranks",
+    "Soundtrack", "Euro-Techno", "Ambient", "Trip-Hop", "Vocal", "Jazz+Funk", "Fusion",
+    "Trance", "Classical", "Instrumental", "Acid", "House", "Game", "Sound Clip",
+    "Gospel", "Noise", "Alternative Rock", "Bass", "Soul", "Punk", "Space",
+    "Meditative", "Instrumental Pop", "Instrumental Rock", "Ethnic", "Gothic",
+    "Darkwave", "Techno-Industrial", "Electronic", "Pop-Folk", "Eurodance", "Dream",
+    "Southern Rock", "Comedy", "Cult", "Gangsta", "Top 40", "Christian Rap", "Pop/Funk",
+    "Jungle", "Native American", "Cabaret", "New Wave", "Psychedelic", "Rave",
+    "Showtunes", "Trailer", "Lo-Fi", "Tribal", "Acid Punk", "Acid Jazz", "Polka",
+    "Retro", "Musical", "Rock & Roll", "Hard Rock",
+]
+# fmt: on
+MAX_FRAME_SIZE = 65536
+ID3V1_SIZE = 128
+
+
+def _clean_tags(tags):
+    """
+    Normalize read tags: values are stripped, empty values dropped, track is converted to
+    integer and numeric ID3v1 genre references are resolved
+
+    Args:
+        tags (dict): raw tags
+
+    Returns:
+        dict: tags
+    """
+    cleaned = {}
+    for key, value in tags.items():
+        value = value.strip().strip("\x00").strip()
+        if not value:
+            continue
+        if key == "track":
+            # "3/12" format
+            number = value.split("/", 1)[0].strip()
+            if not number.isdigit():
+                continue
+            value = int(number)
+        elif key == "genre":
+            reference = value.strip("()")
+            if reference.isdigit() and int(reference) < len(ID3_GENRES):
+                value = ID3_GENRES[int(reference)]
+        cleaned[key] = value
+
+    return cleaned
+
+
+def _decode_id3_text(frame):
+    """
+    Decode ID3v2 text frame. Only first value is kept for multiple values frames
+
+    Args:
+        frame (bytes): frame content
+
+    Returns:
+        str: text
+    """
+    if not frame or frame[0] >= len(ID3_ENCODINGS):
+        return ""
+    encoding = ID3_ENCODINGS[frame[0]]
+    text = frame[1:].decode(encoding, errors="replace")
+    return text.split("\x00", 1)[0]
+
+
+def _read_id3v2_tags(fdesc):
+    """
+    Read ID3v2 text frames. Other frames (pictures...) are skipped without being read
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        dict: raw tags
+    """
+    header = fdesc.read(10)
+    if len(header) < 10 or header[:3] != b"ID3" or header[3] not in (2, 3, 4):
+        return {}
+    major, flags = header[3], header[5]
+    end = 10 + get_id3_frame_size(header[6:10], 4)
+    if flags & 0x40 and major >= 3:
+        # skip extended header
+        size = get_id3_frame_size(fdesc.read(4), major)
+        fdesc.seek(size - 4 if major >= 4 else size, os.SEEK_CUR)
+
+    id_size, header_size = (3, 6) if major == 2 else (4, 10)
+    tags = {}
+    while fdesc.tell() + header_size <= end:
+        frame_header = fdesc.read(header_size)
+        frame_id = frame_header[:id_size]
+        if len(frame_header) < header_size or not frame_id.strip(b"\x00"):
+            break
+        if major == 2:
+            size = int.from_bytes(frame_header[3:6], "big")
+        else:
+            size = get_id3_frame_size(frame_header[4:8], major)
+        key = ID3_FRAMES.get(frame_id)
+        if key and key not in tags and size <= MAX_FRAME_SIZE:
+            tags[key] = _decode_id3_text(fdesc.read(size))
+        else:
+            fdesc.seek(size, os.SEEK_CUR)
+
+    return tags
+
+
+def _read_id3v1_tags(fdesc):
+    """
+    Read ID3v1 tag at end of file
+
+    Args:
+        fdesc (file): file descriptor
+
+    Returns:
+        dict: raw tags
+    """
+    if fdesc.seek(0, os.SEEK_END) < ID3V1_SIZE:
+        return {}
+    fdesc.seek(-ID3V1_SIZE, os.SEEK_END)
+    data = fdesc.read(ID3V1_SIZE)
+    if data[:3] != b"TAG":
+        return {}
+
+    def text(start, length):
+        return data[start : start + length].split(b"\x00", 1)[0].decode("latin-1")
+
+    tags = {"title": text(3, 30), "artist": text(33, 30), "album": text(63, 30)}
+    if data[125] == 0 and data[126]:
+        tags["track"] = str(data[126])
+    if data[127] < len(ID3_GENRES):
+        tags["genre"] = ID3_GENRES[data[127]]
+
+    return tags
+
+
+def parse_vorbis_comments(data, offset=0):
+    """
+    Parse Vorbis comments block (FLAC VORBIS_COMMENT block, Vorbis and Opus comment headers)
+
+    Args:
+        data (bytes): comments data
+        offset (int): offset of vendor string length in data
+
+    Returns:
+        dict: raw tags
+    """
+    tags = {}
+    try:
+        (vendor_length,) = struct.unpack_from("<I", data, offset)
+        offset += 4 + vendor_length
+        (count,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        for _ in range(count):
+            (length,) = struct.unpack_from("<I", data, offset)
+            comment = data[offset + 4 : offset + 4 + length]
+            offset += 4 + length
+            key, _, value = comment.partition(b"=")
+            field = VORBIS_FIELDS.get(key.decode("ascii", errors="replace").upper())
+            if field and field not in tags:
+                tags[field] = value.decode("utf-8", errors="replace")
+    except struct.error:
+        pass
+
+    return tags
+
+
+def _read_flac_tags(fdesc):
+    """
+    Read FLAC VORBIS_COMMENT metadata block
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        dict: raw tags
+    """
+    if fdesc.read(4) != b"fLaC":
+        return {}
+
+    last = False
+    while not last:
+        header = fdesc.read(4)
+        if len(header) < 4:
+            break
+        last = bool(header[0] & 0x80)
+        size = int.from_bytes(header[1:4], "big")
+        if header[0] & 0x7F == 4:
+            return parse_vorbis_comments(fdesc.read(size))
+        fdesc.seek(size, os.SEEK_CUR)
+
+    return {}
+
+
+def _read_ogg_tags(fdesc):
+    """
+    Read Vorbis or Opus comment header of Ogg stream
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        dict: raw tags
+    """
+    packet = read_ogg_comment_packet(fdesc)
+    if not packet:
+        return {}
+    if packet.startswith(b"\x03vorbis"):
+        return parse_vorbis_comments(packet, 7)
+    if packet.startswith(b"OpusTags"):
+        return parse_vorbis_comments(packet, 8)
+
+    return {}
+
+
+def read_tags(path):
+    """
+    Read track tags (ID3v2 with ID3v1 fallback, FLAC and Ogg Vorbis comments)
+
+    Args:
+        path (str): track path
+
+    Returns:
+        dict: track tags. Missing tags are not returned::
+
+            {
+                artist (str): track artist
+                albumartist (str): album artist
+                album (str): album
+                genre (str): genre
+                title (str): title
+                track (int): track number in album
+            }
+
+    Raises:
+        OSError: if file cannot be read
+    """
+    with open(path, "rb") as fdesc:
+        tags = {}
+        for reader in (_read_id3v2_tags, _read_flac_tags, _read_ogg_tags):
+            fdesc.seek(0)
+            tags = _clean_tags(reader(fdesc))
+            if tags:
+                return tags
+
+        return _clean_tags(_read_id3v1_tags(fdesc))
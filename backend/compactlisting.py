@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import gzip
+import base64
+
+COMPACT_FORMAT = "columnar"
+COMPACT_VERSION = 1
+# payloads smaller than this are never compressed (gzip and base64 overhead)
+GZIP_MIN_SIZE = 16384
+
+
+def get_common_prefix(paths):
+    """
+    Return common directory of specified paths, with trailing separator
+
+    Args:
+        paths (list): absolute paths
+
+    Returns:
+        str: common directory. Empty string if there is no path
+    """
+    if not paths:
+        return ""
+    prefix = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return prefix if prefix.endswith(os.sep) else prefix + os.sep
+
+
+def pack_files(files, ids=None, compress=False, compress_min_size=GZIP_MIN_SIZE):
+    """
+    Pack files list into compact columnar listing. Common path prefix is sent once and
+    each distinct folder once, files referencing their folder by index. File path is
+    rebuilt as prefix + folders[folder] + filename
+
+    Args:
+        files (list): list of files::
+
+            [
+                {
+                    filename (str): filename
+                    path (str): absolute path
+                },
+                ...
+            ]
+
+        ids (list): file identifiers, in files order. Not sent if None
+        compress (bool): gzip columns if payload is larger than compress_min_size
+        compress_min_size (int): min payload size to compress
+
+    Returns:
+        dict: compact listing::
+
+            {
+                format (str): "columnar"
+                version (int): compact format version
+                count (int): number of files
+                encoding (str): "gzip" if columns are compressed, None otherwise
+                columns (dict): columns if not compressed, None otherwise::
+
+                    {
+                        prefix (str): common path prefix
+                        folders (list): distinct folders relative to prefix
+                        folder (list): folder index of each file
+                        filenames (list): filename of each file
+                        ids (list): identifier of each file (only if ids specified)
+                    }
+
+                data (str): base64 encoded gzipped JSON columns if compressed, None otherwise
+            }
+
+    """
+    prefix = get_common_prefix([file_["path"] for file_ in files])
+    folders = []
+    folder_indexes = {}
+    columns = {"prefix": prefix, "folders": folders, "folder": [], "filenames": []}
+    for file_ in files:
+        path = file_["path"]
+        folder = os.path.dirname(path)[len(prefix) :]
+        folder = folder + os.sep if folder else ""
+        if folder not in folder_indexes:
+            folder_indexes[folder] = len(folders)
+            folders.append(folder)
+        columns["folder"].append(folder_indexes[folder])
+        columns["filenames"].append(file_["filename"])
+    if ids is not None:
+        columns["ids"] = list(ids)
+
+    listing = {
+        "format": COMPACT_FORMAT,
+        "version": COMPACT_VERSION,
+        "count": len(files),
+        "encoding": None,
+        "columns": columns,
+        "data": None,
+    }
+    if not compress:
+        return listing
+
+    payload = json.dumps(columns, separators=(",", ":")).encode("utf-8")
+    if len(payload) < compress_min_size:
+        return listing
+    listing.update(
+        {
+            "encoding": "gzip",
+            "columns": None,
+            "data": base64.b64encode(gzip.compress(payload, mtime=0)).decode("ascii"),
+        }
+    )
+
+    return listing
+
+
+def unpack_files(listing):
+    """
+    Unpack compact listing built by pack_files
+
+    Args:
+        listing (dict): compact listing
+
+    Returns:
+        list: list of files ("id" key is set if listing contains identifiers)::
+
+            [
+                {
+                    filename (str): filename
+                    path (str): absolute path
+                    id (int): file identifier
+                },
+                ...
+            ]
+
+    Raises:
+        ValueError: if listing format is not supported
+    """
+    supported = (COMPACT_FORMAT, COMPACT_VERSION)
+    if (listing.get("format"), listing.get("version")) != supported:
+        raise ValueError("Unsupported listing format")
+    columns = listing["columns"]
+    if listing.get("encoding") == "gzip":
+        columns = json.loads(gzip.decompress(base64.b64decode(listing["data"])))
+
+    files = []
+    prefix, folders = columns["prefix"], columns["folders"]
+    for index, filename in enumerate(columns["filenames"]):
+        file_ = {
+            "filename": filename,
+            "path": prefix + folders[columns["folder"][index]] + filename,
+        }
+        if "ids" in columns:
+            file_["id"] = columns["ids"][index]
+        files.append(file_)
+
+    return files
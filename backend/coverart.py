@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import base64
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+# folder images by priority (lower case)
+FOLDER_IMAGES = [
+    "cover.jpg",
+    "folder.jpg",
+    "front.jpg",
+    "album.jpg",
+    "cover.png",
+    "folder.png",
+    "front.png",
+]
+# max number of bytes read to find embedded picture
+MAX_PICTURE_SIZE = 16777216
+OGG_MAX_PAGES = 512
+PICTURE_TYPE_FRONT = 3
+
+
+def parse_picture_block(data):
+    """
+    Parse FLAC picture block (also used base64 encoded in Ogg comments)
+
+    Args:
+        data (bytes): picture block
+
+    Returns:
+        tuple: picture type and image data. None if block is invalid
+    """
+    try:
+        picture_type, mime_length = struct.unpack_from(">II", data, 0)
+        offset = 8 + mime_length
+        (description_length,) = struct.unpack_from(">I", data, offset)
+        offset += 4 + description_length + 16
+        (data_length,) = struct.unpack_from(">I", data, offset)
+    except struct.error:
+        return None
+    image = data[offset + 4 : offset + 4 + data_length]
+    if len(image) != data_length:
+        return None
+
+    return picture_type, image
+
+
+def get_id3_frame_size(data, major):
+    """
+    Return ID3v2 frame or tag size
+
+    Args:
+        data (bytes): 4 size bytes
+        major (int): ID3v2 major version
+
+    Returns:
+        int: size
+    """
+    if major >= 4:
+        return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+    return struct.unpack(">I", data)[0]
+
+
+def _read_id3_pictures(fdesc):
+    """
+    Read pictures of ID3v2.3/2.4 APIC frames
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        list: list of (picture type, image data)
+    """
+    header = fdesc.read(10)
+    if len(header) < 10 or header[:3] != b"ID3" or header[3] not in (3, 4):
+        return []
+    major, flags = header[3], header[5]
+    tag = fdesc.read(min(get_id3_frame_size(header[6:10], 4), MAX_PICTURE_SIZE))
+
+    offset = 0
+    if flags & 0x40:
+        # skip extended header
+        size = get_id3_frame_size(tag[:4], major)
+        offset = size if major >= 4 else size + 4
+
+    pictures = []
+    while offset + 10 <= len(tag) and tag[offset : offset + 4] != b"\x00\x00\x00\x00":
+        frame_id = tag[offset : offset + 4]
+        size = get_id3_frame_size(tag[offset + 4 : offset + 8], major)
+        frame = tag[offset + 10 : offset + 10 + size]
+        offset += 10 + size
+        if frame_id != b"APIC" or len(frame) < 4:
+            continue
+
+        encoding = frame[0]
+        mime_end = frame.find(b"\x00", 1)
+        if mime_end == -1 or mime_end + 1 >= len(frame):
+            continue
+        picture_type = frame[mime_end + 1]
+        description_start = mime_end + 2
+        if encoding in (1, 2):
+            # utf-16 description ends with an aligned double null byte
+            end = description_start
+            while end + 1 < len(frame) and frame[end : end + 2] != b"\x00\x00":
+                end += 2
+            image_start = end + 2
+        else:
+            image_start = frame.find(b"\x00", description_start) + 1
+        if 0 < image_start < len(frame):
+            pictures.append((picture_type, frame[image_start:]))
+
+    return pictures
+
+
+def _read_flac_pictures(fdesc):
+    """
+    Read pictures of FLAC PICTURE metadata blocks
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        list: list of (picture type, image data)
+    """
+    if fdesc.read(4) != b"fLaC":
+        return []
+
+    pictures = []
+    last = False
+    while not last:
+        header = fdesc.read(4)
+        if len(header) < 4:
+            break
+        last = bool(header[0] & 0x80)
+        block_type = header[0] & 0x7F
+        size = int.from_bytes(header[1:4], "big")
+        if block_type != 6:
+            fdesc.seek(size, os.SEEK_CUR)
+            continue
+        picture = parse_picture_block(fdesc.read(min(size, MAX_PICTURE_SIZE)))
+        if picture:
+            pictures.append(picture)
+
+    return pictures
+
+
+def read_ogg_comment_packet(fdesc):
+    """
+    Read second packet of first Ogg logical stream (Vorbis or Opus comment header)
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        bytes: packet data or None if not found
+    """
+    packets = []
+    packet = b""
+    serial = None
+    for _ in range(OGG_MAX_PAGES):
+        header = fdesc.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            return None
+        page_serial = struct.unpack_from("<I", header, 14)[0]
+        lacing = fdesc.read(header[26])
+        body = fdesc.read(sum(lacing))
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            continue
+
+        offset = 0
+        for value in lacing:
+            packet += body[offset : offset + value]
+            offset += value
+            if value < 255:
+                packets.append(packet)
+                packet = b""
+                if len(packets) == 2:
+                    return packets[1]
+        if len(packet) > MAX_PICTURE_SIZE:
+            return None
+
+    return None
+
+
+def _read_ogg_pictures(fdesc):
+    """
+    Read pictures of METADATA_BLOCK_PICTURE Vorbis comments (Vorbis and Opus streams)
+
+    Args:
+        fdesc (file): file descriptor positioned at file start
+
+    Returns:
+        list: list of (picture type, image data)
+    """
+    packet = read_ogg_comment_packet(fdesc)
+    if not packet:
+        return []
+    if packet.startswith(b"\x03vorbis"):
+        offset = 7
+    elif packet.startswith(b"OpusTags"):
+        offset = 8
+    else:
+        return []
+
+    pictures = []
+    try:
+        (vendor_length,) = struct.unpack_from("<I", packet, offset)
+        offset += 4 + vendor_length
+        (count,) = struct.unpack_from("<I", packet, offset)
+        offset += 4
+        for _ in range(count):
+            (length,) = struct.unpack_from("<I", packet, offset)
+            comment = packet[offset + 4 : offset + 4 + length]
+            offset += 4 + length
+            key, _, value = comment.partition(b"=")
+            if key.upper() != b"METADATA_BLOCK_PICTURE":
+                continue
+            picture = parse_picture_block(base64.b64decode(value, validate=False))
+            if picture:
+                pictures.append(picture)
+    except (struct.error, ValueError):
+        pass
+
+    return pictures
+
+
+def extract_embedded(path):
+    """
+    Extract embedded cover art of specified track (ID3 APIC, FLAC PICTURE or Ogg
+    METADATA_BLOCK_PICTURE). Front cover is preferred over other pictures
+
+    Args:
+        path (str): track path
+
+    Returns:
+        bytes: image data or None if track has no embedded picture
+
+    Raises:
+        OSError: if file cannot be read
+    """
+    with open(path, "rb") as fdesc:
+        pictures = []
+        for reader in (_read_id3_pictures, _read_flac_pictures, _read_ogg_pictures):
+            fdesc.seek(0)
+            pictures = reader(fdesc)
+            if pictures:
+                break
+
+    if not pictures:
+        return None
+    fronts = [
+        image for picture_type, image in pictures if picture_type == PICTURE_TYPE_FRONT
+    ]
+    return fronts[0] if fronts else pictures[0][1]
+
+
+def find_folder_image(filenames):
+    """
+    Return folder image among specified directory filenames
+
+    Args:
+        filenames (list): directory filenames
+
+    Returns:
+        str: folder image filename or None if directory has no folder image
+    """
+    by_name = {filename.lower(): filename for filename in filenames}
+    for name in FOLDER_IMAGES:
+        if name in by_name:
+            return by_name[name]
+
+    return None
+
+
+def make_thumbnail(data, size, path):
+    """
+    Write JPEG thumbnail of specified image. JPEG images are decoded at reduced scale
+
+    Args:
+        data (bytes): image data
+        size (int): max thumbnail width and height
+        path (str): thumbnail path
+
+    Raises:
+        Exception: if image cannot be decoded
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (size, size))
+        image.thumbnail((size, size))
+        image.convert("RGB").save(path, "JPEG", quality=85)
+
+
+class CoverCache:
+    """
+    Cover cache
+
+    Keeps cover thumbnails of a few fixed sizes on disk, keyed by image content hash so tracks
+    sharing the same artwork share thumbnails. Cache size is capped and least recently used
+    thumbnails are evicted first. Thumbnail access time is kept in file modification time so
+    eviction order survives restarts.
+    """
+
+    SIZES = [64, 128, 256, 512]
+    DEFAULT_MAX_SIZE = 33554432
+
+    def __init__(self, logger, cache_path=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            cache_path (str): cache directory
+            max_size (int): max cache size in bytes
+        """
+        self.logger = logger
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.__lock = threading.Lock()
+        # thumbnails sizes by filename, ordered from least to most recently used
+        self.__thumbnails = None
+        self.__size = 0
+
+    @staticmethod
+    def is_available():
+        """
+        Check if thumbnails can be generated (Pillow is installed)
+
+        Returns:
+            bool: True if thumbnails are available
+        """
+        return Image is not None
+
+    @staticmethod
+    def get_key(data):
+        """
+        Return cache key of specified image
+
+        Args:
+            data (bytes): image data
+
+        Returns:
+            str: image key
+        """
+        return hashlib.sha1(data).hexdigest()
+
+    def get_size(self):
+        """
+        Return current cache size
+
+        Returns:
+            int: cache size in bytes
+        """
+        with self.__lock:
+            self.__load()
+            return self.__size
+
+    def get(self, key, size):
+        """
+        Return cached thumbnail
+
+        Args:
+            key (str): image key
+            size (int): thumbnail size
+
+        Returns:
+            str: thumbnail path or None if thumbnail is not cached
+        """
+        filename = f"{key}-{size}.jpg"
+        with self.__lock:
+            self.__load()
+            if filename not in self.__thumbnails:
+                return None
+
+            path = os.path.join(self.cache_path, filename)
+            try:
+                os.utime(path)
+            except OSError:
+                self.__size -= self.__thumbnails.pop(filename)
+                return None
+            self.__thumbnails.move_to_end(filename)
+            return path
+
+    def add(self, data, size):
+        """
+        Add thumbnail of specified image to cache
+
+        Args:
+            data (bytes): image data
+            size (int): thumbnail size
+
+        Returns:
+            str: thumbnail path
+
+        Raises:
+            Exception: if thumbnail cannot be generated
+        """
+        key = self.get_key(data)
+        path = self.get(key, size)
+        if path:
+            return path
+
+        filename = f"{key}-{size}.jpg"
+        path = os.path.join(self.cache_path, filename)
+        tmp_path = path + ".tmp"
+        with self.__lock:
+            os.makedirs(self.cache_path, exist_ok=True)
+            try:
+                make_thumbnail(data, size, tmp_path)
+                os.replace(tmp_path, path)
+            except Exception:
+                self.__remove_file(tmp_path)
+                raise
+
+            thumbnail_size = os.path.getsize(path)
+            self.__thumbnails[filename] = thumbnail_size
+            self.__size += thumbnail_size
+            self.__evict(protected=filename)
+
+        return path
+
+    def __load(self):
+        """
+        Load cached thumbnails from disk on first access
+        """
+        if self.__thumbnails is not None:
+            return
+
+        thumbnails = []
+        if os.path.isdir(self.cache_path):
+            for entry in os.scandir(self.cache_path):
+                if entry.name.endswith(".tmp"):
+                    self.__remove_file(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    thumbnails.append((stat.st_mtime, entry.name, stat.st_size))
+
+        self.__thumbnails = OrderedDict(
+            (name, size) for _, name, size in sorted(thumbnails)
+        )
+        self.__size = sum(self.__thumbnails.values())
+
+    def __evict(self, protected):
+        """
+        Evict least recently used thumbnails until cache fits its max size
+
+        Args:
+            protected (str): thumbnail filename that must not be evicted
+        """
+        for filename in list(self.__thumbnails.keys()):
+            if self.__size <= self.max_size:
+                return
+            if filename == protected:
+                continue
+            self.__size -= self.__thumbnails.pop(filename)
+            self.__remove_file(os.path.join(self.cache_path, filename))
+            self.logger.debug('Thumbnail "%s" evicted from cache', filename)
+
+    def __remove_file(self, path):
+        """
+        Remove file silently
+
+        Args:
+            path (str): file path
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,808 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import bisect
+import threading
+from collections import deque
+
+
+class LibraryIndex:
+    """
+    Library index
+
+    Keeps music files indexed by filename, with a monotonically increasing version and
+    a bounded journal of changes that allows clients to fetch only what changed since
+    the version they already have. Index is thread safe.
+
+    Files are also indexed in a folders tree, with files count and size of each folder
+    (subfolders included) maintained incrementally, so folders can be browsed without walking
+    the filesystem or the whole index. Files having "tags" metadata are indexed by artist and
+    album, and by genre.
+    """
+
+    JOURNAL_SIZE = 2000
+
+    ACTION_ADDED = "added"
+    ACTION_REMOVED = "removed"
+    ACTION_CHANGED = "changed"
+    # version high bits hold index epoch (see set_epoch)
+    EPOCH_SHIFT = 32
+
+    def __init__(self, journal_size=JOURNAL_SIZE):
+        """
+        Constructor
+
+        Args:
+            journal_size (int): max number of changes kept in journal
+        """
+        self.version = 0
+        # sum of indexed files size, maintained incrementally
+        self.total_size = 0
+        self.__lock = threading.RLock()
+        self.__next_id = 1
+        # entries indexed by filename
+        # {
+        #   filename (str): {
+        #       id (int): unique file identifier (stable while file exists)
+        #       filename (str): filename
+        #       path (str): full filepath
+        #       size (int): file size in bytes
+        #       mtime (float): file modification time
+        #       metadata (dict): file metadata computed by analyzers (reset when file changes)
+        #   },
+        #   ...
+        # }
+        self.__entries = {}
+        self.__ids = {}
+        # folders tree by directory path. Every ancestor directory of indexed files is a folder
+        # {
+        #   directory (str): {
+        #       folders (list): sorted subfolders directory paths
+        #       files (list): sorted filenames of files directly in folder
+        #       count (int): number of files in folder and subfolders
+        #       size (int): size of files in folder and subfolders
+        #   },
+        #   ...
+        # }
+        self.__folders = {}
+        # filenames by album by artist (album artist if any) of tagged files
+        # {
+        #   artist (str): {
+        #       album (str): set of filenames
+        #   },
+        #   ...
+        # }
+        self.__artists = {}
+        # filenames by genre {genre (str): set of filenames, ...}
+        self.__genres = {}
+        # journal of changes [(version, action, filename), ...]
+        self.__journal = deque(maxlen=journal_size)
+        # latest version whose changes were (even partially) dropped from journal
+        self.__dropped_version = 0
+
+    def set_epoch(self, epoch):
+        """
+        Set index epoch. Versions and journal are not persisted, so epoch (incremented on each
+        start) is stored in version high bits: versions known by clients from previous epochs are
+        older than journal and they always fall into full reload path
+
+        Args:
+            epoch (int): index epoch
+        """
+        with self.__lock:
+            self.version = epoch << self.EPOCH_SHIFT
+            self.__journal.clear()
+            self.__dropped_version = self.version
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, filename):
+        return filename in self.__entries
+
+    def get_entry(self, filename):
+        """
+        Return index entry
+
+        Args:
+            filename (str): filename
+
+        Returns:
+            dict: index entry or None if file is not indexed
+        """
+        return self.__entries.get(filename)
+
+    def get_entry_by_id(self, file_id):
+        """
+        Return index entry by its identifier
+
+        Args:
+            file_id (int): file identifier
+
+        Returns:
+            dict: index entry or None if identifier is unknown
+        """
+        filename = self.__ids.get(file_id)
+        return self.__entries.get(filename) if filename else None
+
+    def get_entries(self):
+        """
+        Return all index entries
+
+        Returns:
+            list: list of index entries
+        """
+        with self.__lock:
+            return list(self.__entries.values())
+
+    def update(self, files):
+        """
+        Synchronize index with specified files list. Version is bumped only if something changed.
+        Files are indexed by filename: if several files share the same filename (in different
+        folders), only the first one is indexed
+
+        Args:
+            files (list): list of files::
+
+                [
+                    {
+                        filename (str): filename
+                        path (str): full filepath
+                        size (int): file size
+                        mtime (float): file modification time
+                    },
+                    ...
+                ]
+
+        Returns:
+            dict: applied changes (see get_changes)
+        """
+        with self.__lock:
+            changes = {"added": [], "removed": [], "changed": []}
+            seen = set()
+
+            for file_ in files:
+                filename = file_["filename"]
+                if filename in seen:
+                    continue
+                seen.add(filename)
+                entry = self.__entries.get(filename)
+                if entry is None:
+                    changes["added"].append(self.__add_entry(file_))
+                    continue
+
+                size, mtime = file_.get("size"), file_.get("mtime")
+                content_changed = entry["size"] != size or entry["mtime"] != mtime
+                if entry["path"] != file_["path"] or content_changed:
+                    if content_changed:
+                        # content changed, computed metadata is not valid anymore
+                        self.__unindex_tags(entry)
+                        entry["metadata"] = {}
+                    self.total_size += (size or 0) - (entry["size"] or 0)
+                    self.__remove_from_folders(entry)
+                    entry.update(
+                        {
+                            "path": file_["path"],
+                            "size": size,
+                            "mtime": mtime,
+                        }
+                    )
+                    self.__add_to_folders(entry)
+                    changes["changed"].append(entry)
+
+            for filename in [name for name in self.__entries if name not in seen]:
+                changes["removed"].append(self.__remove_entry(filename))
+
+            self.__journalize(changes)
+
+            return self.__format_changes(changes)
+
+    def __add_entry(self, file_):
+        """
+        Add new entry to index
+
+        Args:
+            file_ (dict): file infos
+
+        Returns:
+            dict: new index entry
+        """
+        entry = {
+            "id": self.__next_id,
+            "filename": file_["filename"],
+            "path": file_["path"],
+            "size": file_.get("size"),
+            "mtime": file_.get("mtime"),
+            "metadata": {},
+        }
+        self.__next_id += 1
+        self.total_size += entry["size"] or 0
+        self.__entries[entry["filename"]] = entry
+        self.__ids[entry["id"]] = entry["filename"]
+        self.__add_to_folders(entry)
+
+        return entry
+
+    def __remove_entry(self, filename):
+        """
+        Remove entry from index
+
+        Args:
+            filename (str): filename
+
+        Returns:
+            dict: removed entry
+        """
+        entry = self.__entries.pop(filename)
+        self.__ids.pop(entry["id"], None)
+        self.total_size -= entry["size"] or 0
+        self.__remove_from_folders(entry)
+        self.__unindex_tags(entry)
+
+        return entry
+
+    def __get_folder_node(self, directory):
+        """
+        Return folder of specified directory, created with its missing ancestors
+
+        Args:
+            directory (str): directory path
+
+        Returns:
+            dict: folder
+        """
+        folder = self.__folders.get(directory)
+        if folder is not None:
+            return folder
+
+        folder = {"folders": [], "files": [], "count": 0, "size": 0}
+        self.__folders[directory] = folder
+        parent = os.path.dirname(directory)
+        if parent != directory:
+            bisect.insort(self.__get_folder_node(parent)["folders"], directory)
+
+        return folder
+
+    def __update_folder_totals(self, directory, count, size):
+        """
+        Update files count and size of folder and its ancestors. Folders without files anymore
+        are removed from tree
+
+        Args:
+            directory (str): directory path
+            count (int): files count delta
+            size (int): files size delta
+        """
+        while True:
+            folder = self.__folders[directory]
+            folder["count"] += count
+            folder["size"] += size
+            parent = os.path.dirname(directory)
+            if folder["count"] <= 0:
+                del self.__folders[directory]
+                if parent != directory:
+                    folders = self.__folders[parent]["folders"]
+                    del folders[bisect.bisect_left(folders, directory)]
+            if parent == directory:
+                return
+            directory = parent
+
+    def __add_to_folders(self, entry):
+        """
+        Add entry to folders tree
+
+        Args:
+            entry (dict): index entry
+        """
+        directory = os.path.dirname(entry["path"])
+        bisect.insort(self.__get_folder_node(directory)["files"], entry["filename"])
+        self.__update_folder_totals(directory, 1, entry["size"] or 0)
+
+    def __remove_from_folders(self, entry):
+        """
+        Remove entry from folders tree
+
+        Args:
+            entry (dict): index entry
+        """
+        directory = os.path.dirname(entry["path"])
+        folder = self.__folders.get(directory)
+        if folder is None:
+            return
+
+        files = folder["files"]
+        index = bisect.bisect_left(files, entry["filename"])
+        if index < len(files) and files[index] == entry["filename"]:
+            del files[index]
+            self.__update_folder_totals(directory, -1, -(entry["size"] or 0))
+
+    def get_folder(self, directory, offset=0, limit=None):
+        """
+        Return folder content. Folder files are returned one page at a time
+
+        Args:
+            directory (str): directory path
+            offset (int): index of first file to return
+            limit (int): max number of files to return. All files if None
+
+        Returns:
+            dict: folder content or None if folder contains no indexed file::
+
+                {
+                    path (str): directory path
+                    count (int): number of files in folder and subfolders
+                    size (int): size of files in folder and subfolders
+                    folders (list): subfolders::
+
+                        [
+                            {
+                                path (str): subfolder directory path
+                                count (int): number of files in subfolder
+                                size (int): size of files in subfolder
+                            },
+                            ...
+                        ]
+
+                    files (list): page of files directly in folder (see to_file)
+                    filescount (int): number of files directly in folder
+                }
+
+        """
+        with self.__lock:
+            folder = self.__folders.get(directory)
+            if folder is None:
+                return None
+
+            end = None if limit is None else offset + limit
+            return {
+                "path": directory,
+                "count": folder["count"],
+                "size": folder["size"],
+                "folders": [
+                    {
+                        "path": path,
+                        "count": self.__folders[path]["count"],
+                        "size": self.__folders[path]["size"],
+                    }
+                    for path in folder["folders"]
+                ],
+                "files": [
+                    LibraryIndex.to_file(self.__entries[filename])
+                    for filename in folder["files"][offset:end]
+                ],
+                "filescount": len(folder["files"]),
+            }
+
+    def get_folder_entries(self, directory, recursive=True):
+        """
+        Return entries of files in folder, ordered as browsed (folder files first, then
+        subfolders files)
+
+        Args:
+            directory (str): directory path
+            recursive (bool): True to include subfolders files
+
+        Returns:
+            list: list of index entries. None if folder contains no indexed file
+        """
+        with self.__lock:
+            if directory not in self.__folders:
+                return None
+
+            entries = []
+            directories = [directory]
+            while directories:
+                folder = self.__folders[directories.pop()]
+                entries.extend(self.__entries[filename] for filename in folder["files"])
+                if recursive:
+                    directories.extend(reversed(folder["folders"]))
+
+            return entries
+
+    def __journalize(self, changes):
+        """
+        Store changes in journal bumping index version
+
+        Args:
+            changes (dict): changes
+        """
+        if not any(changes.values()):
+            return
+
+        self.version += 1
+        for action in (self.ACTION_ADDED, self.ACTION_REMOVED, self.ACTION_CHANGED):
+            for entry in changes[action]:
+                if len(self.__journal) == self.__journal.maxlen:
+                    self.__dropped_version = self.__journal[0][0]
+                self.__journal.append((self.version, action, entry["filename"]))
+
+    def __format_changes(self, changes):
+        """
+        Format changes to be returned to clients
+
+        Args:
+            changes (dict): changes
+
+        Returns:
+            dict: formatted changes
+        """
+        return {
+            "version": self.version,
+            "added": [LibraryIndex.to_file(entry) for entry in changes["added"]],
+            "removed": [entry["filename"] for entry in changes["removed"]],
+            "changed": [LibraryIndex.to_file(entry) for entry in changes["changed"]],
+        }
+
+    def set_metadata(self, filename, metadata):
+        """
+        Set file metadata
+
+        Args:
+            filename (str): filename
+            metadata (dict): metadata to merge with existing ones
+
+        Returns:
+            bool: True if metadata set, False if file is not indexed
+        """
+        with self.__lock:
+            entry = self.__entries.get(filename)
+            if entry is None:
+                return False
+
+            if "tags" in metadata:
+                self.__unindex_tags(entry)
+            entry["metadata"].update(metadata)
+            if "tags" in metadata:
+                self.__index_tags(entry)
+            return True
+
+    def delete_metadata(self, filename, key):
+        """
+        Delete file metadata value
+
+        Args:
+            filename (str): filename
+            key (str): metadata key
+
+        Returns:
+            bool: True if metadata deleted, False if file or metadata does not exist
+        """
+        with self.__lock:
+            entry = self.__entries.get(filename)
+            if entry is None or key not in entry["metadata"]:
+                return False
+
+            if key == "tags":
+                self.__unindex_tags(entry)
+            del entry["metadata"][key]
+            return True
+
+    def get_metadata(self, filename, key, default=None):
+        """
+        Return file metadata value
+
+        Args:
+            filename (str): filename
+            key (str): metadata key
+            default (any): value returned if metadata does not exist
+
+        Returns:
+            any: metadata value
+        """
+        entry = self.__entries.get(filename)
+        if entry is None:
+            return default
+
+        return entry["metadata"].get(key, default)
+
+    def export_metadata(self):
+        """
+        Export files metadata to be persisted
+
+        Returns:
+            dict: metadata by filename::
+
+                {
+                    filename (str): {
+                        size (int): file size
+                        mtime (float): file modification time
+                        metadata (dict): file metadata
+                    },
+                    ...
+                }
+
+        """
+        with self.__lock:
+            return {
+                filename: {
+                    "size": entry["size"],
+                    "mtime": entry["mtime"],
+                    "metadata": entry["metadata"],
+                }
+                for filename, entry in self.__entries.items()
+                if entry["metadata"]
+            }
+
+    def import_metadata(self, data):
+        """
+        Import persisted files metadata. Metadata of files modified since export are dropped
+
+        Args:
+            data (dict): metadata as returned by export_metadata
+        """
+        with self.__lock:
+            for filename, item in data.items():
+                entry = self.__entries.get(filename)
+                if (
+                    entry is not None
+                    and entry["size"] == item.get("size")
+                    and entry["mtime"] == item.get("mtime")
+                ):
+                    self.__unindex_tags(entry)
+                    entry["metadata"].update(item.get("metadata", {}))
+                    self.__index_tags(entry)
+
+    @staticmethod
+    def __get_tags_keys(entry):
+        """
+        Return artist, album and genre index keys of entry
+
+        Args:
+            entry (dict): index entry
+
+        Returns:
+            tuple: artist, album and genre (None if no genre). None if entry has no tags
+        """
+        tags = entry["metadata"].get("tags")
+        if tags is None:
+            return None
+
+        artist = tags.get("albumartist") or tags.get("artist") or ""
+        return artist, tags.get("album") or "", tags.get("genre")
+
+    def __index_tags(self, entry):
+        """
+        Add entry to tags indexes
+
+        Args:
+            entry (dict): index entry
+        """
+        keys = self.__get_tags_keys(entry)
+        if keys is None:
+            return
+
+        artist, album, genre = keys
+        self.__artists.setdefault(artist, {}).setdefault(album, set()).add(
+            entry["filename"]
+        )
+        if genre:
+            self.__genres.setdefault(genre, set()).add(entry["filename"])
+
+    def __unindex_tags(self, entry):
+        """
+        Remove entry from tags indexes
+
+        Args:
+            entry (dict): index entry
+        """
+        keys = self.__get_tags_keys(entry)
+        if keys is None:
+            return
+
+        artist, album, genre = keys
+        albums = self.__artists.get(artist, {})
+        albums.get(album, set()).discard(entry["filename"])
+        if album in albums and not albums[album]:
+            del albums[album]
+        if artist in self.__artists and not albums:
+            del self.__artists[artist]
+        if genre in self.__genres:
+            self.__genres[genre].discard(entry["filename"])
+            if not self.__genres[genre]:
+                del self.__genres[genre]
+
+    def get_artists(self, offset=0, limit=None):
+        """
+        Return artists of tagged files, sorted by name
+
+        Args:
+            offset (int): index of first artist to return
+            limit (int): max number of artists to return. All artists if None
+
+        Returns:
+            dict: artists page::
+
+                {
+                    count (int): number of artists
+                    artists (list): [{name (str), albums (int), tracks (int)}, ...]
+                }
+
+        """
+        with self.__lock:
+            names = sorted(self.__artists, key=str.casefold)
+            end = None if limit is None else offset + limit
+            return {
+                "count": len(names),
+                "artists": [
+                    {
+                        "name": name,
+                        "albums": len(self.__artists[name]),
+                        "tracks": sum(map(len, self.__artists[name].values())),
+                    }
+                    for name in names[offset:end]
+                ],
+            }
+
+    def get_albums(self, artist=None, offset=0, limit=None):
+        """
+        Return albums of tagged files, sorted by name
+
+        Args:
+            artist (str): artist to return albums of. All albums if None
+            offset (int): index of first album to return
+            limit (int): max number of albums to return. All albums if None
+
+        Returns:
+            dict: albums page::
+
+                {
+                    count (int): number of albums
+                    albums (list): [{name (str), artist (str), tracks (int)}, ...]
+                }
+
+        """
+        with self.__lock:
+            artists = [artist] if artist is not None else list(self.__artists)
+            albums = sorted(
+                (
+                    (name, artist_name, len(filenames))
+                    for artist_name in artists
+                    for name, filenames in self.__artists.get(artist_name, {}).items()
+                ),
+                key=lambda album: (album[0].casefold(), album[1].casefold()),
+            )
+            end = None if limit is None else offset + limit
+            return {
+                "count": len(albums),
+                "albums": [
+                    {"name": name, "artist": artist_name, "tracks": tracks}
+                    for name, artist_name, tracks in albums[offset:end]
+                ],
+            }
+
+    def get_genres(self, offset=0, limit=None):
+        """
+        Return genres of tagged files, sorted by name
+
+        Args:
+            offset (int): index of first genre to return
+            limit (int): max number of genres to return. All genres if None
+
+        Returns:
+            dict: genres page::
+
+                {
+                    count (int): number of genres
+                    genres (list): [{name (str), tracks (int)}, ...]
+                }
+
+        """
+        with self.__lock:
+            names = sorted(self.__genres, key=str.casefold)
+            end = None if limit is None else offset + limit
+            return {
+                "count": len(names),
+                "genres": [
+                    {"name": name, "tracks": len(self.__genres[name])}
+                    for name in names[offset:end]
+                ],
+            }
+
+    def get_tagged_entries(self, artist=None, album=None, genre=None):
+        """
+        Return entries of tagged files matching all specified criteria, sorted by album, track
+        number and filename
+
+        Args:
+            artist (str): artist (album artist if any). Any artist if None
+            album (str): album. Any album if None
+            genre (str): genre. Any genre if None
+
+        Returns:
+            list: list of index entries
+        """
+        with self.__lock:
+            filenames = None
+            if artist is not None or album is not None:
+                artists = [artist] if artist is not None else list(self.__artists)
+                filenames = set()
+                for artist_name in artists:
+                    albums = self.__artists.get(artist_name, {})
+                    for name, album_filenames in albums.items():
+                        if album is None or name == album:
+                            filenames |= album_filenames
+            if genre is not None:
+                genre_filenames = self.__genres.get(genre, set())
+                if filenames is None:
+                    filenames = genre_filenames
+                else:
+                    filenames = filenames & genre_filenames
+            if filenames is None:
+                filenames = {
+                    filename
+                    for albums in self.__artists.values()
+                    for album_filenames in albums.values()
+                    for filename in album_filenames
+                }
+
+            def sort_key(entry):
+                tags = entry["metadata"]["tags"]
+                return (
+                    (tags.get("album") or "").casefold(),
+                    tags.get("track") or 0,
+                    entry["filename"],
+                )
+
+            return sorted((self.__entries[name] for name in filenames), key=sort_key)
+
+    @staticmethod
+    def to_file(entry):
+        """
+        Convert index entry to file as returned by get_music_files command
+
+        Args:
+            entry (dict): index entry
+
+        Returns:
+            dict: file
+        """
+        return {"filename": entry["filename"], "path": entry["path"]}
+
+    def get_changes(self, since_version):
+        """
+        Return changes that occured since specified version
+
+        Args:
+            since_version (int): version known by client
+
+        Returns:
+            dict: changes or None if journal does not cover specified version and client
+                  must perform a full reload::
+
+                {
+                    version (int): current index version
+                    added (list): list of added files
+                    removed (list): list of removed filenames
+                    changed (list): list of changed files
+                }
+
+        """
+        with self.__lock:
+            if since_version is None or since_version > self.version:
+                return None
+            if since_version < self.__dropped_version:
+                # journal has been truncated, changes are not available anymore
+                return None
+
+            # keep only latest action for each file
+            actions = {}
+            for version, action, filename in self.__journal:
+                if version <= since_version:
+                    continue
+                previous = actions.get(filename)
+                if previous == self.ACTION_ADDED and action == self.ACTION_CHANGED:
+                    continue
+                if previous == self.ACTION_REMOVED and action == self.ACTION_ADDED:
+                    action = self.ACTION_CHANGED
+                actions[filename] = action
+
+            changes = {"added": [], "removed": [], "changed": []}
+            for filename, action in actions.items():
+                entry = self.__entries.get(filename)
+                if action == self.ACTION_REMOVED or entry is None:
+                    changes["removed"].append({"filename": filename})
+                else:
+                    changes[action].append(entry)
+
+            return self.__format_changes(changes)
@@ -2,10 +2,31 @@
 # -*- coding: utf-8 -*-
 
 import os
-from cleep.exception import InvalidParameter, CommandError
+import ssl
+import time
+import base64
+import shutil
+import hashlib
+import threading
+from cleep.exception import InvalidParameter, CommandError, NoResponse
 from cleep.core import CleepRenderer
 from cleep.common import CATEGORIES, RENDERERS
 from cleep.profiles.alarmprofile import AlarmProfile
+from cleep.libs.internals.task import Task
+from .libraryindex import LibraryIndex
+from .trackprefetcher import TrackPrefetcher
+from .alarmcache import AlarmCache
+from .transcoder import Transcoder
+from .audioanalyzer import AudioAnalyzer
+from .smartplaylist import SmartPlaylist
+from .playhistory import PlayHistory
+from .playbackregistry import PlaybackRegistry
+from .shuffleengine import ShuffleEngine
+from .audioplayerclient import AudioplayerClient
+from .playlistfile import PlaylistFile, PlaylistResolver
+from .coverart import CoverCache
+from .previewserver import PreviewServer
+from . import audioanalyzer, audioheader, audiotags, compactlisting, coverart
 
 
 class Localmusic(CleepRenderer):
@@ -32,12 +53,49 @@ class Localmusic(CleepRenderer):
     DEFAULT_CONFIG = {
         "default": None,
         "playlists": {},
+        "smartplaylists": {},
+        "prefetchtracks": 2,
+        "prefetchbudget": TrackPrefetcher.DEFAULT_BUDGET,
+        "alarmcache": False,
+        "alarmcachesize": AlarmCache.DEFAULT_MAX_SIZE,
+        "transcode": False,
+        "transcodejobs": 1,
+        "normalize": False,
+        "trimsilence": False,
+        "storagequota": 0,
+        "quotaeviction": False,
+        "versionepoch": 0,
     }
 
     RENDERER_PROFILES = [AlarmProfile]
     RENDERER_TYPE = RENDERERS.AUDIO
 
     ALLOWED_MUSIC_EXTENSIONS = ["mp3", "flac", "aac", "ogg"]  # supported by audioplayer
+    LIBRARY_EVENT_WINDOW = 1.0  # seconds
+    CACHE_DIR = ".cache"  # hidden dir in storage path, ignored by library
+    CATALOG_FILE = "catalog.json"
+    CATALOG_SAVE_DELAY = 10.0  # seconds
+    HISTORY_FILE = "history.db"
+    POSITION_FILE = "position.json"
+    POSITION_SAVE_DELAY = 30.0  # seconds
+    SHUFFLE_FILE = "shuffle.json"
+    SHUFFLE_SAVE_DELAY = 30.0  # seconds
+    # shuffled tracks queued on player after playing one
+    SHUFFLE_QUEUE_SIZE = 3
+    QUARANTINE_DIR = "quarantine"
+    QUARANTINE_FILE = "quarantine.json"
+    # tone played when alarm playlist cannot be played
+    FALLBACK_TONE = os.path.join(os.path.dirname(__file__), "assets", "fallbacktone.flac")
+    FALLBACK_TONE_FORMAT = "audio/flac"
+    PREFLIGHT_INTERVAL = 600.0  # seconds
+    PREFLIGHT_TRACKS = 3
+    PREFLIGHT_READ_SIZE = 4096
+    PREVIEW_PORT = 9194
+    PREVIEW_SECURE_PORT = 9195
+    # web UI certificate, used to serve previews over https
+    PREVIEW_CERT_FILE = "/etc/cleep/cert/cleep.crt"
+    PREVIEW_KEY_FILE = "/etc/cleep/cert/cleep.key"
+    BROWSE_MAX_LIMIT = 500
 
     def __init__(self, bootstrap, debug_enabled):
         """
@@ -59,26 +117,153 @@ class Localmusic(CleepRenderer):
         #   ...
         # ]
         self.files = []
-        self.playback = {
-            "playeruuid": None,
-            "index": None,
-            "playlistname": None,
-        }
+        # paths of music files ignored because their filename is already in library
+        self.duplicate_files = set()
+        # folder image path by directory
+        self.folder_covers = {}
+        self.library = LibraryIndex()
+        self.smart_playlists = {}
+        self.playlists_version = 0
+        self.playbacks = PlaybackRegistry()
+        # last playback position
+        # {
+        #   playlistname (str): playlist name
+        #   index (int): track index in playlist
+        #   offset (float): track offset (seconds)
+        # }
+        self.playback_position = None
+        self.position_save_timer = None
+        self.shuffler = ShuffleEngine()
+        self.shuffle_save_timer = None
+        self.prefetcher = TrackPrefetcher(self.logger)
+        self.alarm_cache = AlarmCache(self.logger)
+        self.transcoder = Transcoder(self.logger, None, self._on_transcode_update)
+        self.analyzer = AudioAnalyzer(self.logger)
+        # integrity probes run in their own pool to not wait for long analyses
+        self.prober = AudioAnalyzer(self.logger)
+        # tracks whose waveform must be precomputed and track being computed
+        self.waveforms_queue = []
+        self.waveforms_current = None
+        self.waveforms_lock = threading.Lock()
+        self.history = PlayHistory(self.logger)
+        self.cover_cache = CoverCache(self.logger)
+        # started on first preview request, by secure flag
+        self.preview_servers = {}
+        self.audioplayer = AudioplayerClient(
+            self.logger,
+            self._send_audioplayer_command,
+            transport_errors=(NoResponse, OSError),
+        )
+        self.catalog_save_timer = None
+        self.preflight_task = None
+        # last alarm pre-flight check
+        # {
+        #   healthy (bool): True if alarm playlist can be played
+        #   reason (str): degradation reason. None if healthy
+        #   checked (int): check timestamp. None if not checked yet
+        # }
+        self.alarm_health = {"healthy": True, "reason": None, "checked": None}
+
+        self.library_pushed_version = 0
+        self.library_event_timer = None
+        self.library_event_lock = threading.Lock()
+        # protects playlists config read-modify-write and playlists version
+        self.config_lock = threading.RLock()
+        # protects playback state changes (player creation, alarm, player events)
+        self.playback_lock = threading.RLock()
+        # serializes storage quota checks with files addition
+        self.storage_lock = threading.RLock()
 
         self.playback_update_event = self._get_event("audioplayer.playback.update")
+        self.library_update_event = self._get_event("localmusic.library.update")
+        self.transcode_update_event = self._get_event("localmusic.transcode.update")
+        self.alarm_degraded_event = self._get_event("localmusic.alarm.degraded")
 
     def _configure(self):
         """
         Configure module
         """
-        self._refresh_music_files()
+        self._init_versions()
+        self._refresh_music_files(notify=False)
+        self.library_pushed_version = self.library.version
+        self._load_catalog()
+        self._clean_waveforms()
+        self._load_position()
+        self._load_shuffle()
+        self._sniff_tracks()
+        self._read_tracks_tags()
+        self._probe_tracks()
+        self._analyze_tracks()
+        self._load_smart_playlists()
         self._check_playlists()
+        self.prefetcher.budget = self._get_config_field("prefetchbudget")
+        self.alarm_cache.enabled = self._get_config_field("alarmcache")
+        self.alarm_cache.max_size = self._get_config_field("alarmcachesize")
+        self._sync_alarm_cache()
+        self.transcoder.cache_path = self._get_cache_path("transcode")
+        self.transcoder.clear()
+        self.cover_cache.cache_path = self._get_cache_path("covers")
+        self.transcoder.max_jobs = self._get_config_field("transcodejobs")
+        self.history.db_path = self._get_cache_path(self.HISTORY_FILE)
+        try:
+            self.history.open()
+        except Exception:
+            self.logger.exception("Unable to open play history")
+
+    def _get_cache_path(self, name):
+        """
+        Return cache directory path
+
+        Args:
+            name (str): cache name
+
+        Returns:
+            str: cache directory path
+        """
+        return os.path.join(self.APP_STORAGE_PATH, self.CACHE_DIR, name)
 
     def _on_start(self):
         """
         Start module
         """
         self.has_audioplayer = self.is_module_loaded("audioplayer")
+        self.prefetcher.start()
+        self._check_alarm_playlist()
+        self.preflight_task = Task(
+            self.PREFLIGHT_INTERVAL, self._check_alarm_playlist, self.logger
+        )
+        self.preflight_task.start()
+
+    def _on_stop(self):
+        """
+        Stop module
+        """
+        if self.preflight_task:
+            self.preflight_task.stop()
+        self.prefetcher.stop()
+        self.alarm_cache.clear()
+        self.transcoder.stop()
+        self.analyzer.stop()
+        self.prober.stop()
+        for playback in self.playbacks.get_all():
+            self._end_track_play(playback)
+        self.audioplayer.stop()
+        for preview_server in self.preview_servers.values():
+            preview_server.stop()
+        self.history.close()
+        if self.position_save_timer:
+            self.position_save_timer.cancel()
+            self._save_position()
+        if self.shuffle_save_timer:
+            self.shuffle_save_timer.cancel()
+            self._save_shuffle()
+        if self.catalog_save_timer:
+            self.catalog_save_timer.cancel()
+            self._save_catalog()
+        with self.library_event_lock:
+            if self.library_event_timer:
+                self.library_event_timer.cancel()
+                self.library_event_timer = None
 
     def on_event(self, event):
         """
@@ -87,17 +272,100 @@ class Localmusic(CleepRenderer):
         Args:
             event (MessageRequest): event data
         """
-        if event["event"] == "audioplayer.playback.update":
-            if event["params"]["playeruuid"] != self.playback["playeruuid"]:
-                return
+        with self.playback_lock:
+            if event["event"] == "audioplayer.playback.update":
+                playback = self.playbacks.get(event["params"]["playeruuid"])
+                if not playback:
+                    return
+
+                if event["params"]["state"] == "stopped":
+                    # player stopped, delete its reference
+                    self.playbacks.remove(playback["playeruuid"])
+                    self._update_position(playback)
+                    self._end_track_play(playback)
+                    self._restore_shuffled_tracks(playback)
+
+                if event["params"]["state"] == "paused":
+                    self._pause_track_play(playback)
+                    self._update_position(playback)
+
+                if event["params"]["state"] == "playing":
+                    # store current index
+                    track_changed = playback["index"] != event["params"]["index"]
+                    playback["index"] = event["params"]["index"]
+                    if track_changed and playback["shuffle"]:
+                        self._queue_shuffled_tracks(playback)
+                    if track_changed:
+                        self._prefetch_tracks(playback, event["params"]["index"] + 1)
+                        self._apply_track_gain(playback)
+                    self._start_track_play(playback, event["params"]["index"])
+                    if track_changed:
+                        self._update_position(playback)
+
+    def _start_track_play(self, playback, index):
+        """
+        Start or resume recording of playing track listening time
+
+        Args:
+            playback (dict): playback
+            index (int): playing track index
+        """
+        playing_track = playback["playingtrack"]
+        if playing_track and playing_track["index"] == index:
+            if playing_track["resumed"] is None:
+                playing_track["resumed"] = time.monotonic()
+            return
+
+        self._end_track_play(playback)
+        if index is None or index >= len(playback["tracks"]):
+            return
+        if not playback["playlistname"]:
+            # fallback tone is not part of library
+            return
+        # {
+        #   filename (str): track filename
+        #   index (int): track index in playback
+        #   listened (float): listening duration (seconds)
+        #   resumed (float): monotonic time playback resumed. None if paused
+        # }
+        playback["playingtrack"] = {
+            "filename": os.path.basename(playback["tracks"][index]),
+            "index": index,
+            "listened": 0.0,
+            "resumed": time.monotonic(),
+        }
+
+    def _pause_track_play(self, playback):
+        """
+        Pause recording of playing track listening time
+
+        Args:
+            playback (dict): playback
+        """
+        playing_track = playback["playingtrack"]
+        if not playing_track or playing_track["resumed"] is None:
+            return
+
+        playing_track["listened"] += time.monotonic() - playing_track["resumed"]
+        playing_track["resumed"] = None
 
-            if event["params"]["state"] == "stopped":
-                # player stopped, delete its reference
-                self.playback["playeruuid"] = None
+    def _end_track_play(self, playback):
+        """
+        End playing track and record it in play history
+
+        Args:
+            playback (dict): playback
+        """
+        if not playback["playingtrack"]:
+            return
 
-            if event["params"]["state"] == "playing":
-                # store current index
-                self.playback["index"] = event["params"]["index"]
+        self._pause_track_play(playback)
+        playing_track, playback["playingtrack"] = playback["playingtrack"], None
+        self.history.record(
+            playing_track["filename"],
+            playback["playlistname"],
+            playing_track["listened"],
+        )
 
     def on_render(self, profile_name, profile_values):
         """
@@ -124,289 +392,2676 @@ class Localmusic(CleepRenderer):
             snoozed = profile_values["status"] == AlarmProfile.STATUS_SNOOZED
             self._stop_alarm(snoozed)
 
-    def _refresh_music_files(self):
+    def _refresh_music_files(self, notify=True):
         """
-        Load all music files from filesystem
+        Load all music files from filesystem. Library is indexed by filename, so a file with the
+        same filename as a previously scanned one (folders and files are scanned in sorted order)
+        is not part of library
+
+        Args:
+            notify (bool): send library update event and analyze new files if library changed
+
+        Returns:
+            dict: library changes (see LibraryIndex.update)
         """
         musics = []
-
-        for root, _, files in os.walk(self.APP_STORAGE_PATH):
-            for filename in files:
-                musics.append(
-                    {"filename": filename, "path": os.path.join(root, filename)}
+        entries = []
+        folder_covers = {}
+        filenames = set()
+        duplicates = set()
+
+        for root, dirs, files in os.walk(self.APP_STORAGE_PATH):
+            dirs.sort()
+            if self._is_hidden_path(root):
+                continue
+            folder_image = coverart.find_folder_image(files)
+            if folder_image:
+                folder_covers[root] = os.path.join(root, folder_image)
+            for filename in sorted(files):
+                extension = os.path.splitext(filename)[1][1:].lower()
+                if extension not in Localmusic.ALLOWED_MUSIC_EXTENSIONS:
+                    continue
+                path = os.path.join(root, filename)
+                musics.append({"filename": filename, "path": path})
+                if filename in filenames:
+                    duplicates.add(path)
+                    continue
+                filenames.add(filename)
+                entries.append(self._get_file_entry(filename, path))
+
+        if duplicates != self.duplicate_files:
+            for path in sorted(duplicates - self.duplicate_files):
+                self.logger.warning(
+                    'Music file "%s" ignored, same filename already exists in library', path
                 )
-
+            self.duplicate_files = duplicates
         self.files = musics
+        changes = self.library.update(entries)
+        self._update_folder_covers(folder_covers)
+        self._update_smart_playlists(changes)
+        if notify:
+            self._process_library_changes()
 
-    def _check_playlists(self, playlists=None):
+        return changes
+
+    def _process_library_changes(self):
         """
-        Keep in sync saved playlist tracks with local files
+        Send library changes and process new files (headers, tags, integrity and analyses)
+        """
+        self._push_library_changes()
+        self._sniff_tracks()
+        self._read_tracks_tags()
+        self._probe_tracks()
+        self._analyze_tracks()
+
+    def _update_folder_covers(self, folder_covers):
+        """
+        Update folder images. Cached covers of tracks whose folder image changed are dropped so
+        they are extracted again on next request
 
         Args:
-            playlists (dict): if specified check its content. If not specified load playlists from config
+            folder_covers (dict): folder image path by directory
         """
-        playlists = self._get_config_field("playlists") if not playlists else playlists
-        for playlist_name, playlist_tracks in playlists.copy().items():
-            for playlist_track in playlist_tracks[:]:
-                found = next(
-                    (
-                        track
-                        for track in self.files
-                        if track["filename"] == playlist_track
-                    ),
-                    None,
-                )
-                if not found:
-                    self.logger.warning(
-                        'Playlist "%s" has track "%s" that does not exists. Track deleted.',
-                        playlist_name,
-                        playlist_track,
-                    )
-                    playlist_tracks.remove(playlist_track)
-            if len(playlist_tracks) == 0:
-                self.logger.warning(
-                    'Playlist "%s" is deleted because there is no track inside',
-                    playlist_name,
-                )
-                del playlists[playlist_name]
+        changed_dirs = {
+            directory
+            for directory in set(folder_covers) | set(self.folder_covers)
+            if folder_covers.get(directory) != self.folder_covers.get(directory)
+        }
+        self.folder_covers = folder_covers
+        if not changed_dirs:
+            return
 
-        self._set_config_field("playlists", playlists)
+        for entry in self.library.get_entries():
+            if os.path.dirname(entry["path"]) in changed_dirs:
+                self.library.delete_metadata(entry["filename"], "cover")
 
-    def get_music_files(self):
+    def _push_library_changes(self):
         """
-        Get all music files stored in device
+        Schedule library update event. Changes occuring during LIBRARY_EVENT_WINDOW are batched
+        into a single event to avoid flooding frontend during bulk operations
+        """
+        with self.library_event_lock:
+            if self.library.version == self.library_pushed_version:
+                return
+            if self.library_event_timer:
+                # event already scheduled, changes will be sent with it
+                return
 
-        Returns:
-            list: list of files::
+            self.library_event_timer = threading.Timer(
+                self.LIBRARY_EVENT_WINDOW, self._send_library_changes
+            )
+            self.library_event_timer.daemon = True
+            self.library_event_timer.start()
 
-                [
-                    {
-                        filename (str): filename,
-                        path (str): path
-                    },
-                    ...
-                ]
+    def _send_library_changes(self):
+        """
+        Send library update event with all changes since last sent event
+        """
+        with self.library_event_lock:
+            self.library_event_timer = None
+            since = self.library_pushed_version
+            changes = self.library.get_changes(since)
+            self.library_pushed_version = self.library.version
+
+        if changes is None:
+            params = {
+                "version": self.library.version,
+                "since": since,
+                "reload": True,
+                "added": [],
+                "removed": [],
+                "changed": [],
+            }
+        else:
+            params = {**changes, "since": since, "reload": False}
+        self.library_update_event.send(params=params)
 
+    def _load_catalog(self):
+        """
+        Load library catalog (files metadata) from filesystem
         """
-        return self.files
+        path = self._get_cache_path(self.CATALOG_FILE)
+        if not os.path.exists(path):
+            return
+
+        catalog = self.cleep_filesystem.read_json(path)
+        if catalog:
+            self.library.import_metadata(catalog)
 
-    def get_playback(self):
+    def _schedule_catalog_save(self):
         """
-        Return playback
+        Schedule library catalog saving. Saving is delayed to group writes on filesystem
+        """
+        if self.catalog_save_timer:
+            return
 
-        Returns:
-            dict: current playback information::
+        self.catalog_save_timer = threading.Timer(
+            self.CATALOG_SAVE_DELAY, self._save_catalog
+        )
+        self.catalog_save_timer.daemon = True
+        self.catalog_save_timer.start()
 
-                {
-                    playeruuid (str): player uuid if running. None if not running
-                    playlistname (str): current played playlist. None if no playlist played
-                    index (number): current played playlist track. None if no playlist played
-                }
+    def _save_catalog(self):
+        """
+        Save library catalog (files metadata) to filesystem
+        """
+        self.catalog_save_timer = None
+        path = self._get_cache_path(self.CATALOG_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not self.cleep_filesystem.write_json(path, self.library.export_metadata()):
+            self.logger.error("Unable to save library catalog")
 
+    def _load_position(self):
+        """
+        Load last playback position from filesystem
         """
-        return self.playback
+        path = self._get_cache_path(self.POSITION_FILE)
+        if not os.path.exists(path):
+            return
 
-    def add_music_file(self, filepath):
+        self.playback_position = self.cleep_filesystem.read_json(path) or None
+
+    def _update_position(self, playback):
         """
-        Add music file to device filesystem
+        Update playback position with playing track. Position is saved after a delay to limit
+        writes on filesystem
 
         Args:
-            filepath (str): uploaded track filepath
+            playback (dict): playback
+        """
+        playing_track = playback["playingtrack"]
+        if not playing_track or not playback["playlistname"] or playback["shuffle"]:
+            # shuffled playbacks are resumed by shuffle engine
+            return
+
+        offset = playing_track["listened"]
+        if playing_track["resumed"] is not None:
+            offset += time.monotonic() - playing_track["resumed"]
+        self.playback_position = {
+            "playlistname": playback["playlistname"],
+            "index": playback["startindex"] + playing_track["index"],
+            "offset": round(offset, 1),
+        }
+
+        if self.position_save_timer:
+            return
+        self.position_save_timer = threading.Timer(
+            self.POSITION_SAVE_DELAY, self._save_position
+        )
+        self.position_save_timer.daemon = True
+        self.position_save_timer.start()
+
+    def _save_position(self):
+        """
+        Save playback position to filesystem
+        """
+        self.position_save_timer = None
+        path = self._get_cache_path(self.POSITION_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not self.cleep_filesystem.write_json(path, self.playback_position):
+            self.logger.error("Unable to save playback position")
+
+    def _load_shuffle(self):
+        """
+        Load shuffle engine state from filesystem
+        """
+        path = self._get_cache_path(self.SHUFFLE_FILE)
+        if not os.path.exists(path):
+            return
+
+        state = self.cleep_filesystem.read_json(path)
+        if state:
+            self.shuffler.import_state(state)
+
+    def _schedule_shuffle_save(self):
+        """
+        Schedule shuffle engine state saving. Saving is delayed to group writes on filesystem
+        """
+        if self.shuffle_save_timer:
+            return
+
+        self.shuffle_save_timer = threading.Timer(
+            self.SHUFFLE_SAVE_DELAY, self._save_shuffle
+        )
+        self.shuffle_save_timer.daemon = True
+        self.shuffle_save_timer.start()
+
+    def _save_shuffle(self):
+        """
+        Save shuffle engine state to filesystem
+        """
+        self.shuffle_save_timer = None
+        path = self._get_cache_path(self.SHUFFLE_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not self.cleep_filesystem.write_json(path, self.shuffler.export_state()):
+            self.logger.error("Unable to save shuffle state")
+
+    def _sniff_tracks(self):
+        """
+        Parse headers of library files not parsed yet to cache their audio format (codec, sample
+        rate, channels, bitrate and duration)
+        """
+        changed = []
+        for entry in self.library.get_entries():
+            if "codec" in entry["metadata"]:
+                continue
+            try:
+                infos = audioheader.sniff(entry["path"])
+            except OSError:
+                self.logger.debug('Unable to read "%s" headers', entry["path"])
+                continue
+            if not infos:
+                self.logger.warning('Audio format of "%s" not recognized', entry["path"])
+            # codec is cached even if unknown so file is parsed only once
+            self.library.set_metadata(entry["filename"], infos or {"codec": None})
+            changed.append({"filename": entry["filename"]})
+
+        if changed:
+            self._update_smart_playlists({"changed": changed})
+            self._schedule_catalog_save()
+
+    def _read_tracks_tags(self):
+        """
+        Read tags of library files not read yet. Tags are indexed by library to browse tracks
+        by artist, album and genre
+        """
+        changed = []
+        for entry in self.library.get_entries():
+            if "tags" in entry["metadata"]:
+                continue
+            try:
+                tags = audiotags.read_tags(entry["path"])
+            except OSError:
+                self.logger.debug('Unable to read "%s" tags', entry["path"])
+                continue
+            # tags are cached even if empty so file is read only once
+            self.library.set_metadata(entry["filename"], {"tags": tags})
+            changed.append({"filename": entry["filename"]})
+
+        if changed:
+            self._update_smart_playlists({"changed": changed})
+            self._schedule_catalog_save()
+
+    def _get_audio_format(self, path):
+        """
+        Return cached audio format of specified track
+
+        Args:
+            path (str): track path
 
         Returns:
-            bool: True if upload succeed
+            str: audio mime type or None if unknown
+        """
+        return self.library.get_metadata(os.path.basename(path), "audioformat")
 
-        Raises:
-            InvalidParameter: if file extension is not supported
-            CommandError: if adding file failed
+    def _probe_tracks(self):
         """
-        file_ext = os.path.splitext(filepath)
-        if file_ext[1][1:] not in Localmusic.ALLOWED_MUSIC_EXTENSIONS:
-            raise InvalidParameter(
-                f"Invalid file extension (only {','.join(Localmusic.ALLOWED_MUSIC_EXTENSIONS)} allowed)"
-            )
+        Queue integrity probe of music files that were not probed yet. Successful probes are cached
+        in catalog so files are probed once
+        """
+        for entry in self.library.get_entries():
+            if "valid" not in entry["metadata"]:
+                self.prober.submit(
+                    entry["path"],
+                    ("integrity",),
+                    self._on_track_probed,
+                    analysis=audioheader.probe,
+                )
 
-        filename = os.path.basename(filepath)
-        new_path = os.path.join(self.APP_STORAGE_PATH, filename)
-        if os.path.exists(new_path):
-            raise CommandError(f'Music file "{filename}" already exists')
-        if not self.cleep_filesystem.move(filepath, new_path):
-            raise CommandError(f'Unable to save "{filename}"')
+    def _on_track_probed(self, path, result):
+        """
+        Called when track integrity probe is done. Probe is a heuristic so corrupt tracks are
+        only flagged, they are quarantined on user request (see quarantine_music_file)
 
-        self._refresh_music_files()
+        Args:
+            path (str): track path
+            result (dict): probe result (integrityerror)
+        """
+        error = result["integrityerror"]
+        if error is not None:
+            self.logger.warning('Music file "%s" looks corrupt: %s', path, error)
+        metadata = {"valid": error is None, "integrityerror": error}
+        if not self.library.set_metadata(os.path.basename(path), metadata):
+            return
+        self._schedule_catalog_save()
+        if error is not None and self._get_config_field("default"):
+            # corrupt track is now excluded from alarm playlist, preflight and cache
+            self._check_alarm_playlist()
+
+    def _quarantine_track(self, path, reason):
+        """
+        Move specified track to quarantine directory. Quarantined tracks are not part of library
+        anymore so they are excluded from playlists until they are restored or deleted
+
+        Args:
+            path (str): track path
+            reason (str): quarantine reason
+
+        Returns:
+            bool: True if track was quarantined
+        """
+        filename = os.path.basename(path)
+        quarantine_path = self._get_cache_path(self.QUARANTINE_DIR)
+        os.makedirs(quarantine_path, exist_ok=True)
+        with self.storage_lock:
+            if not os.path.exists(path):
+                return False
+            if not self.cleep_filesystem.move(
+                path, os.path.join(quarantine_path, filename)
+            ):
+                self.logger.error('Unable to quarantine "%s"', path)
+                return False
+
+            reasons = self._load_quarantine_reasons()
+            reasons[filename] = reason
+            self._save_quarantine_reasons(reasons)
+
+            default_tracks = self._get_default_playlist_tracks()
+            self._refresh_music_files()
+            if path in default_tracks:
+                self._sync_alarm_cache()
 
         return True
 
-    def delete_music_file(self, filename):
+    def _load_quarantine_reasons(self):
         """
-        Delete music file from device filesystem
+        Load quarantine reasons from filesystem
+
+        Returns:
+            dict: quarantine reason by filename
+        """
+        path = self._get_cache_path(self.QUARANTINE_FILE)
+        if not os.path.exists(path):
+            return {}
+
+        return self.cleep_filesystem.read_json(path) or {}
+
+    def _save_quarantine_reasons(self, reasons):
+        """
+        Save quarantine reasons to filesystem
 
         Args:
-            filename (str): filename of file to delete
+            reasons (dict): quarantine reason by filename
+        """
+        path = self._get_cache_path(self.QUARANTINE_FILE)
+        if not self.cleep_filesystem.write_json(path, reasons):
+            self.logger.error("Unable to save quarantine reasons")
 
-        Raises:
-            CommandError: if file deletion failed
+    def get_quarantined_files(self):
         """
-        for root, _, files in os.walk(self.APP_STORAGE_PATH):
-            for filename_ in files:
-                filepath = os.path.join(root, filename_)
-                if filename_ == filename:
-                    if not self.cleep_filesystem.rm(filepath):
-                        raise CommandError(f'Unable to delete "{filename}"')
+        Return music files quarantined because they are corrupt
 
-                    self._refresh_music_files()
-                    return
+        Returns:
+            list: list of files::
 
-        raise InvalidParameter(f'File "{filename}" was not found')
+                [
+                    {
+                        filename (str): filename
+                        reason (str): quarantine reason
+                    },
+                    ...
+                ]
 
-    def add_playlist(self, playlist_name, files):
         """
-        Add new playlist using specified tracks
+        quarantine_path = self._get_cache_path(self.QUARANTINE_DIR)
+        if not os.path.isdir(quarantine_path):
+            return []
 
-        Args:
-            playlist_name (str): playlist name
-            files (list): list of files to add into playlist::
+        reasons = self._load_quarantine_reasons()
+        return [
+            {"filename": filename, "reason": reasons.get(filename)}
+            for filename in sorted(os.listdir(quarantine_path))
+        ]
+
+    def get_corrupt_files(self):
+        """
+        Return library music files flagged as corrupt by integrity probe. They are still
+        playable and part of library until they are quarantined or deleted
+
+        Returns:
+            list: list of files sorted by filename::
 
                 [
-                    filename1 (str),
-                    filenale2 (str),
+                    {
+                        filename (str): filename
+                        path (str): path
+                        reason (str): integrity error
+                    },
                     ...
                 ]
 
+        """
+        return sorted(
+            (
+                {
+                    "filename": entry["filename"],
+                    "path": entry["path"],
+                    "reason": entry["metadata"].get("integrityerror"),
+                }
+                for entry in self.library.get_entries()
+                if entry["metadata"].get("valid") is False
+            ),
+            key=lambda file_: file_["filename"],
+        )
+
+    def quarantine_music_file(self, filename):
+        """
+        Move music file to quarantine. It leaves library and playlists until it is restored
+
+        Args:
+            filename (str): filename of file to quarantine
+
         Raises:
-            InvalidParameter: if playlist already exist
+            InvalidParameter: if file is not in library
+            CommandError: if file cannot be moved
         """
         self._check_parameters(
             [
-                {"name": "playlist_name", "value": playlist_name, "type": str},
                 {
-                    "name": "files",
-                    "value": files,
-                    "type": list,
-                    "validator": lambda v: len(v) > 0,
-                    "message": "Playlist must not be empty",
+                    "name": "filename",
+                    "value": filename,
+                    "type": str,
+                    "validator": lambda val: val in self.library,
+                    "message": f'File "{filename}" was not found',
                 },
             ]
         )
-        playlists = self._get_config_field("playlists")
-        self.logger.debug("playlists = %s", playlists)
-        if playlist_name in playlists:
-            raise InvalidParameter(f'Playlist "{playlist_name}" already exists')
 
-        playlists[playlist_name] = files
-        self._check_playlists(playlists)
-        self._set_config_field("playlists", playlists)
+        entry = self.library.get_entry(filename)
+        reason = entry["metadata"].get("integrityerror") or "Quarantined by user"
+        if not self._quarantine_track(entry["path"], reason):
+            raise CommandError(f'Unable to quarantine "{filename}"')
+
+    def restore_quarantined_file(self, filename):
+        """
+        Restore quarantined music file into library storage root. Restored file is trusted so
+        it is not flagged again by integrity probe
 
-        if len(playlists) == 1:
-            # set unique playlist as default one
-            self.set_default_playlist(playlist_name)
+        Args:
+            filename (str): filename of file to restore
 
-    def update_playlist(self, playlist_name, new_playlist_name, files):
+        Raises:
+            InvalidParameter: if file is not quarantined
+            CommandError: if a file with same name exists in library or file cannot be moved
         """
-        Update playlist content
-        Set new_playlist_name to the same value as playlist_name if you don't want to rename it
+        path = os.path.join(self._get_cache_path(self.QUARANTINE_DIR), filename)
+        self._check_parameters(
+            [
+                {
+                    "name": "filename",
+                    "value": filename,
+                    "type": str,
+                    "validator": lambda val: os.path.basename(val) == val
+                    and os.path.isfile(path),
+                    "message": f'File "{filename}" is not quarantined',
+                },
+            ]
+        )
+
+        with self.storage_lock:
+            if filename in self.library:
+                raise CommandError(f'File "{filename}" already exists in library')
+            if not self.cleep_filesystem.move(
+                path, os.path.join(self.APP_STORAGE_PATH, filename)
+            ):
+                raise CommandError(f'Unable to restore "{filename}"')
+
+            reasons = self._load_quarantine_reasons()
+            if reasons.pop(filename, None) is not None:
+                self._save_quarantine_reasons(reasons)
+
+            self._refresh_music_files(notify=False)
+            self.library.set_metadata(filename, {"valid": True, "integrityerror": None})
+            self._schedule_catalog_save()
+            self._process_library_changes()
+            self._check_alarm_playlist()
+
+    def delete_quarantined_file(self, filename):
+        """
+        Delete quarantined music file
 
         Args:
-            playlist_name (str): playlist name
-            new_playlist_name (str): new playlist name
-            files (list): list of files to add into playlist::
+            filename (str): filename of file to delete
 
-                [
-                    filename1 (str),
-                    filename2 (str),
-                    ...
-                ]
+        Raises:
+            InvalidParameter: if file is not quarantined
+            CommandError: if file deletion failed
+        """
+        path = os.path.join(self._get_cache_path(self.QUARANTINE_DIR), filename)
+        self._check_parameters(
+            [
+                {
+                    "name": "filename",
+                    "value": filename,
+                    "type": str,
+                    "validator": lambda val: os.path.basename(val) == val
+                    and os.path.isfile(path),
+                    "message": f'File "{filename}" is not quarantined',
+                },
+            ]
+        )
+
+        if not self.cleep_filesystem.rm(path):
+            raise CommandError(f'Unable to delete "{filename}"')
+
+        reasons = self._load_quarantine_reasons()
+        if reasons.pop(filename, None) is not None:
+            self._save_quarantine_reasons(reasons)
+
+    def _analyze_tracks(self):
+        """
+        Queue analyses of library files that were not analyzed yet. Files whose analysis failed
+        are not queued again until their content changes
+        """
+        if not AudioAnalyzer.is_available():
+            return
+        normalize = self._get_config_field("normalize")
+        trim_silence = self._get_config_field("trimsilence")
+
+        for entry in self.library.get_entries():
+            if "analysiserror" in entry["metadata"]:
+                continue
+            analyses = []
+            if normalize and "gain" not in entry["metadata"]:
+                analyses.append("loudness")
+            if trim_silence and "soundstart" not in entry["metadata"]:
+                analyses.append("silence")
+            if analyses:
+                self._submit_analysis(entry["path"], analyses)
+
+        self._precompute_waveforms()
+
+    def _precompute_waveforms(self):
+        """
+        Queue waveform precomputation of library files without waveform. Waveforms are submitted
+        to analyzer one track at a time once previously queued analyses are done, so they never
+        flood analyzer pool and requested waveforms (see get_waveform) are not delayed much
+        """
+        with self.waveforms_lock:
+            self.waveforms_queue = [
+                entry["path"]
+                for entry in self.library.get_entries()
+                if "waveform" not in entry["metadata"]
+                and "analysiserror" not in entry["metadata"]
+                and entry["path"] != self.waveforms_current
+            ]
+            if self.waveforms_current:
+                return
+        self._precompute_next_waveform()
+
+    def _precompute_next_waveform(self, done_path=None):
+        """
+        Submit next waveform precomputation
+
+        Args:
+            done_path (str): path of track whose analysis ended. Next waveform is submitted only
+                             if it is the track being precomputed
+        """
+        with self.waveforms_lock:
+            if done_path != self.waveforms_current:
+                return
+            self.waveforms_current = (
+                self.waveforms_queue.pop(0) if self.waveforms_queue else None
+            )
+            path = self.waveforms_current
+        if path:
+            self._submit_analysis(path, ["waveform"])
+
+    def _submit_analysis(self, path, analyses):
+        """
+        Queue analyses of specified track
+
+        Args:
+            path (str): track path
+            analyses (list): analyses names (see audioanalyzer.ANALYSES)
+        """
+        self.analyzer.submit(
+            path,
+            analyses,
+            self._on_track_analyzed,
+            on_error=self._on_track_analysis_failed,
+        )
+
+    def _on_track_analysis_failed(self, path, error):
+        """
+        Called when track analysis failed. Error is stored in catalog so track is not analyzed
+        again on each library refresh (metadata is reset when file content changes)
+
+        Args:
+            path (str): track path
+            error (Exception): analysis error
+        """
+        if self.library.set_metadata(
+            os.path.basename(path), {"analysiserror": str(error)}
+        ):
+            self._schedule_catalog_save()
+        self._precompute_next_waveform(path)
+
+    def _on_track_analyzed(self, path, result):
+        """
+        Called when track analysis is done
+
+        Args:
+            path (str): track path
+            result (dict): analysis result (loudness, peak, gain, soundstart, soundend,
+                           waveform)
+        """
+        if "waveform" in result:
+            # peaks are stored aside, catalog only keeps their key
+            key = self._save_waveform(result.pop("waveform"))
+            if key:
+                result["waveform"] = key
+            self._precompute_next_waveform(path)
+        self.logger.debug('Analysis of "%s": %s', path, result)
+        filename = os.path.basename(path)
+        if not self.library.set_metadata(filename, result):
+            return
+        self._update_smart_playlists({"changed": [{"filename": filename}]})
+
+        self._schedule_catalog_save()
+        if "soundstart" in result and path in self._get_default_playlist_tracks()[
+            : self.alarm_cache.max_tracks
+        ]:
+            # alarm track head changed
+            self._sync_alarm_cache()
+
+    def _get_waveform_path(self, key):
+        """
+        Return waveform peaks file path
+
+        Args:
+            key (str): waveform key (peaks content hash)
+
+        Returns:
+            str: waveform file path
+        """
+        return os.path.join(self._get_cache_path("waveforms"), f"{key}.bin")
+
+    def _save_waveform(self, waveform):
+        """
+        Save waveform peaks in cache. Peaks are keyed by their content hash so identical tracks
+        share the same file
+
+        Args:
+            waveform (bytes): waveform peaks
+
+        Returns:
+            str: waveform key or None if saving failed
+        """
+        key = hashlib.sha1(waveform).hexdigest()
+        path = self._get_waveform_path(key)
+        if os.path.exists(path):
+            return key
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as fdesc:
+                fdesc.write(waveform)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            self.logger.exception("Unable to save waveform")
+            return None
+
+        return key
+
+    def _clean_waveforms(self):
+        """
+        Remove cached waveforms not used by library tracks anymore
+        """
+        waveforms_path = self._get_cache_path("waveforms")
+        if not os.path.isdir(waveforms_path):
+            return
+
+        used = {
+            f"{entry['metadata']['waveform']}.bin"
+            for entry in self.library.get_entries()
+            if "waveform" in entry["metadata"]
+        }
+        for filename in os.listdir(waveforms_path):
+            if filename not in used:
+                try:
+                    os.remove(os.path.join(waveforms_path, filename))
+                except OSError:
+                    pass
+
+    def get_waveform(self, filename, resolution=512):
+        """
+        Return waveform peaks of specified track. Peaks are precomputed in background after other
+        tracks analyses. If track waveform is requested before, its computation is queued at once
+
+        Args:
+            filename (str): track filename
+            resolution (int): number of peaks (see audioanalyzer.WAVEFORM_RESOLUTIONS)
+
+        Returns:
+            dict: waveform or None if it is not computed yet (computation is queued unless
+                  track analysis failed)::
+
+                {
+                    waveform (str): waveform identifier (peaks content hash)
+                    resolution (int): number of peaks
+                    peaks (str): base64 encoded interleaved min and max peaks as signed bytes
+                                 (-127 to 127)
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if analysis dependencies are not installed
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "filename",
+                    "value": filename,
+                    "type": str,
+                    "validator": lambda val: val in self.library,
+                    "message": f'File "{filename}" was not found',
+                },
+                {
+                    "name": "resolution",
+                    "value": resolution,
+                    "type": int,
+                    "validator": lambda val: val in audioanalyzer.WAVEFORM_RESOLUTIONS,
+                    "message": "Resolution must be one of "
+                    + ",".join(map(str, audioanalyzer.WAVEFORM_RESOLUTIONS)),
+                },
+            ]
+        )
+        if not AudioAnalyzer.is_available():
+            raise CommandError("Waveform requires numpy and ffmpeg")
+
+        entry = self.library.get_entry(filename)
+        key = entry["metadata"].get("waveform")
+        waveform = None
+        if key:
+            try:
+                with open(self._get_waveform_path(key), "rb") as fdesc:
+                    waveform = fdesc.read()
+            except OSError:
+                self.logger.debug('Waveform of "%s" is not available', filename)
+        if not waveform:
+            if key:
+                self.library.delete_metadata(filename, "waveform")
+            if "analysiserror" not in entry["metadata"]:
+                self._submit_analysis(entry["path"], ["waveform"])
+            return None
+
+        peaks = audioanalyzer.downsample_waveform(waveform, resolution)
+        return {
+            "waveform": key,
+            "resolution": resolution,
+            "peaks": base64.b64encode(peaks).decode("ascii"),
+        }
+
+    def set_normalization(self, enabled):
+        """
+        Enable or disable loudness normalization between tracks
+
+        Args:
+            enabled (bool): True to enable normalization
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if analysis dependencies are not installed
+        """
+        self._check_parameters([{"name": "enabled", "value": enabled, "type": bool}])
+        if enabled and not AudioAnalyzer.is_available():
+            raise CommandError("Loudness analysis requires numpy and ffmpeg")
+
+        self._set_config_field("normalize", enabled)
+        self._analyze_tracks()
+
+    def set_silence_trimming(self, enabled):
+        """
+        Enable or disable leading silence trimming of alarm tracks. Silence is trimmed from
+        tracks cached in RAM for alarm, so alarm cache must be enabled. Tracks are cut without
+        reencoding, so cut happens on the frame (or packet) boundary preceding sound start, not
+        on exact sample
+
+        Args:
+            enabled (bool): True to enable silence trimming
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if analysis dependencies are not installed or alarm cache is disabled
+        """
+        self._check_parameters([{"name": "enabled", "value": enabled, "type": bool}])
+        if enabled and not AudioAnalyzer.is_available():
+            raise CommandError("Silence analysis requires numpy and ffmpeg")
+        if enabled and not self.alarm_cache.enabled:
+            raise CommandError("Silence trimming requires alarm cache to be enabled")
+
+        self._set_config_field("trimsilence", enabled)
+        self._analyze_tracks()
+        self._sync_alarm_cache()
+
+    def _load_smart_playlists(self):
+        """
+        Load smart playlists from config and evaluate them against library
+        """
+        with self.config_lock:
+            self.smart_playlists = {}
+            entries = self.library.get_entries()
+            for playlist_name, rules in self._get_config_field("smartplaylists").items():
+                try:
+                    smart_playlist = SmartPlaylist(rules, self.APP_STORAGE_PATH)
+                except ValueError as error:
+                    self.logger.warning(
+                        'Smart playlist "%s" is invalid: %s', playlist_name, error
+                    )
+                    continue
+                smart_playlist.evaluate(entries)
+                self.smart_playlists[playlist_name] = smart_playlist
+
+    def _update_smart_playlists(self, changes):
+        """
+        Update smart playlists incrementally with library changes
+
+        Args:
+            changes (dict): library changes (added, removed, changed)
+        """
+        with self.config_lock:
+            if not self.smart_playlists:
+                return
+
+            entries = [
+                self.library.get_entry(file_["filename"])
+                for file_ in changes.get("added", []) + changes.get("changed", [])
+            ]
+            entries = [entry for entry in entries if entry]
+            removed = changes.get("removed", [])
+            for smart_playlist in self.smart_playlists.values():
+                smart_playlist.update(entries, removed)
+
+    def _get_track_play_stats(self, filename):
+        """
+        Return track play statistics used to sort tracks by least played
+
+        Args:
+            filename (str): track filename
+
+        Returns:
+            tuple: play count and last played timestamp
+        """
+        stats = self.history.get_track_stats(filename)
+        return (stats["playcount"], stats["lastplayed"])
+
+    def _is_hidden_path(self, path):
+        """
+        Check if specified storage path is hidden (cache directories)
+
+        Args:
+            path (str): path
+
+        Returns:
+            bool: True if path is hidden
+        """
+        parts = os.path.relpath(path, self.APP_STORAGE_PATH).split(os.sep)
+        return any(part.startswith(".") and part not in (".", "..") for part in parts)
+
+    def _get_file_entry(self, filename, path):
+        """
+        Build library index entry for specified file
+
+        Args:
+            filename (str): filename
+            path (str): full filepath
+
+        Returns:
+            dict: library index entry
+        """
+        try:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = None, None
+
+        return {"filename": filename, "path": path, "size": size, "mtime": mtime}
+
+    def _save_playlists(self, playlists):
+        """
+        Save playlists to config and bump playlists version
+
+        Args:
+            playlists (dict): playlists to save
+        """
+        with self.config_lock:
+            self._set_config_field("playlists", playlists)
+            self.playlists_version += 1
+
+    def _init_versions(self):
+        """
+        Start new versions epoch. Library and playlists versions are kept in memory only, so
+        they are seeded from an epoch incremented on each start: versions known by clients
+        before restart never match and clients perform a full reload
+        """
+        epoch = self._get_config_field("versionepoch") + 1
+        self._set_config_field("versionepoch", epoch)
+        self.library.set_epoch(epoch)
+        self.playlists_version = epoch << LibraryIndex.EPOCH_SHIFT
+
+    def _check_playlists_version(self, if_version):
+        """
+        Compare playlists version with the one known by caller. Must be called with config lock
+        held so the check and the following config update are atomic
+
+        Args:
+            if_version (int): playlists version known by caller. None to skip check
+
+        Raises:
+            CommandError: if playlists changed since specified version
+        """
+        if if_version is not None and if_version != self.playlists_version:
+            raise CommandError("Playlists have been modified meanwhile, please reload them")
+
+    def _check_playlists(self, playlists=None):
+        """
+        Keep in sync saved playlist tracks with local files
+
+        Args:
+            playlists (dict): if specified check its content. If not specified load playlists from config
+        """
+        with self.config_lock:
+            playlists = (
+                self._get_config_field("playlists") if not playlists else playlists
+            )
+            for playlist_name, playlist_tracks in playlists.copy().items():
+                for playlist_track in playlist_tracks[:]:
+                    found = next(
+                        (
+                            track
+                            for track in self.files
+                            if track["filename"] == playlist_track
+                        ),
+                        None,
+                    )
+                    if not found:
+                        self.logger.warning(
+                            'Playlist "%s" has track "%s" that does not exists. Track deleted.',
+                            playlist_name,
+                            playlist_track,
+                        )
+                        playlist_tracks.remove(playlist_track)
+                if len(playlist_tracks) == 0:
+                    self.logger.warning(
+                        'Playlist "%s" is deleted because there is no track inside',
+                        playlist_name,
+                    )
+                    del playlists[playlist_name]
+
+            self._save_playlists(playlists)
+
+    def get_music_files(self, if_version=None, compact=False, ids=False, compress=False):
+        """
+        Get all music files stored in device
+
+        Args:
+            if_version (int): library version known by caller. If specified, files are returned
+                              only if library changed since this version
+            compact (bool): return files as compact columnar listing (see
+                            compactlisting.pack_files) instead of list of dicts
+            ids (bool): add library file identifiers to compact listing
+            compress (bool): gzip compact listing if it is large
+
+        Returns:
+            list: list of files if if_version is not specified::
+
+                [
+                    {
+                        filename (str): filename,
+                        path (str): path
+                    },
+                    ...
+                ]
+
+            dict: compact listing instead of list of files if compact is True
+
+            dict: if if_version is specified::
+
+                {
+                    version (int): current library version
+                    modified (bool): False if library did not change since if_version
+                    files (list|dict): list of files or compact listing as above. None if
+                                       not modified
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {"name": "compact", "value": compact, "type": bool},
+                {"name": "ids", "value": ids, "type": bool},
+                {"name": "compress", "value": compress, "type": bool},
+            ]
+        )
+
+        if if_version is None:
+            return self._get_files_listing(compact, ids, compress)
+
+        modified = if_version != self.library.version
+        return {
+            "version": self.library.version,
+            "modified": modified,
+            "files": self._get_files_listing(compact, ids, compress) if modified else None,
+        }
+
+    def _get_files_listing(self, compact, ids, compress):
+        """
+        Return music files in requested format
+
+        Args:
+            compact (bool): return compact columnar listing
+            ids (bool): add file identifiers to compact listing
+            compress (bool): gzip compact listing if it is large
+
+        Returns:
+            list|dict: list of files or compact listing
+        """
+        files = self.files
+        if not compact:
+            return files
+
+        file_ids = None
+        if ids:
+            file_ids = [
+                (self.library.get_entry(file_["filename"]) or {}).get("id")
+                for file_ in files
+            ]
+        return compactlisting.pack_files(files, file_ids, compress)
+
+    def get_cover(self, filename, size=128):
+        """
+        Return cover art thumbnail of specified track. Cover is extracted from track embedded
+        artwork or from its folder image on first request, then served from thumbnails cache
+
+        Args:
+            filename (str): track filename
+            size (int): thumbnail size (see CoverCache.SIZES)
+
+        Returns:
+            dict: cover thumbnail or None if track has no cover::
+
+                {
+                    cover (str): cover identifier (image content hash)
+                    size (int): thumbnail size
+                    mimetype (str): thumbnail mime type
+                    data (str): base64 encoded thumbnail
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if thumbnails are not available or cover cannot be decoded
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "filename",
+                    "value": filename,
+                    "type": str,
+                    "validator": lambda val: val in self.library,
+                    "message": f'File "{filename}" was not found',
+                },
+                {
+                    "name": "size",
+                    "value": size,
+                    "type": int,
+                    "validator": lambda val: val in CoverCache.SIZES,
+                    "message": f"Size must be one of {','.join(map(str, CoverCache.SIZES))}",
+                },
+            ]
+        )
+        if not CoverCache.is_available():
+            raise CommandError("Cover art requires Pillow")
+
+        entry = self.library.get_entry(filename)
+        key = entry["metadata"].get("cover")
+        if "cover" in entry["metadata"] and key is None:
+            # track has no cover
+            return None
+
+        path = self.cover_cache.get(key, size) if key else None
+        if not path:
+            data = self._extract_cover(entry["path"])
+            key = CoverCache.get_key(data) if data else None
+            self.library.set_metadata(filename, {"cover": key})
+            self._schedule_catalog_save()
+            if not data:
+                return None
+            try:
+                path = self.cover_cache.add(data, size)
+            except Exception as error:
+                self.logger.warning('Unable to decode cover of "%s": %s', filename, error)
+                raise CommandError(f'Unable to decode cover of "{filename}"') from error
+
+        with open(path, "rb") as fdesc:
+            thumbnail = base64.b64encode(fdesc.read()).decode("ascii")
+
+        return {
+            "cover": key,
+            "size": size,
+            "mimetype": "image/jpeg",
+            "data": thumbnail,
+        }
+
+    def _extract_cover(self, path):
+        """
+        Extract cover art of specified track. Embedded artwork is preferred over folder image
+
+        Args:
+            path (str): track path
+
+        Returns:
+            bytes: image data or None if track has no cover
+        """
+        try:
+            data = coverart.extract_embedded(path)
+            if data:
+                return data
+
+            folder_image = self.folder_covers.get(os.path.dirname(path))
+            if not folder_image:
+                return None
+            with open(folder_image, "rb") as fdesc:
+                return fdesc.read()
+        except OSError:
+            self.logger.debug('Unable to read cover of "%s"', path)
+            return None
+
+    def get_track_preview(self, filename, secure=False):
+        """
+        Return url path to stream specified track from web UI. Url is valid one hour
+
+        Web UI served over https must request a secure preview, otherwise browser blocks
+        it as mixed content. Secure previews are served with web UI certificate.
+
+        Args:
+            filename (str): track filename
+            secure (bool): True to stream track over https
+
+        Returns:
+            dict: preview infos. Url is built with device hostname, port and path::
+
+                {
+                    port (int): preview server port
+                    path (str): track url path
+                    mimetype (str): track mime type
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if preview server cannot be started
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "filename",
+                    "value": filename,
+                    "type": str,
+                    "validator": lambda val: val in self.library,
+                    "message": f'File "{filename}" was not found',
+                },
+                {
+                    "name": "secure",
+                    "value": secure,
+                    "type": bool,
+                },
+            ]
+        )
+
+        preview_server = self.preview_servers.get(secure)
+        if not preview_server:
+            preview_server = self._start_preview_server(secure)
+            self.preview_servers[secure] = preview_server
+
+        path = self.library.get_entry(filename)["path"]
+        mimetype = self._get_audio_format(path) or "application/octet-stream"
+        return {
+            "port": preview_server.port,
+            "path": preview_server.register(path, mimetype),
+            "mimetype": mimetype,
+        }
+
+    def _start_preview_server(self, secure):
+        """
+        Start preview server
+
+        Args:
+            secure (bool): True to start https server
+
+        Returns:
+            PreviewServer: started preview server
+
+        Raises:
+            CommandError: if server cannot be started
+        """
+        ssl_context = None
+        if secure:
+            try:
+                ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                ssl_context.load_cert_chain(
+                    self.PREVIEW_CERT_FILE, self.PREVIEW_KEY_FILE
+                )
+            except (ssl.SSLError, OSError) as error:
+                self.logger.error("Unable to load preview certificate: %s", error)
+                raise CommandError(
+                    "Unable to load certificate for secure preview"
+                ) from error
+
+        try:
+            preview_server = PreviewServer(
+                self.logger,
+                self.PREVIEW_SECURE_PORT if secure else self.PREVIEW_PORT,
+                ssl_context=ssl_context,
+            )
+        except OSError as error:
+            self.logger.error("Unable to start preview server: %s", error)
+            raise CommandError("Unable to start preview server") from error
+        preview_server.start()
+
+        return preview_server
+
+    def get_library_changes(self, since_version):
+        """
+        Get library changes occured since specified version
+
+        Args:
+            since_version (int): library version known by caller
+
+        Returns:
+            dict: library changes. Reload is True if changes are not available anymore
+                  and full list of files must be fetched again with get_music_files::
+
+                {
+                    version (int): current library version
+                    reload (bool): True if caller must reload all files
+                    added (list): list of added files ({filename, path})
+                    removed (list): list of removed filenames
+                    changed (list): list of changed files ({filename, path})
+                }
+
+        """
+        self._check_parameters(
+            [{"name": "since_version", "value": since_version, "type": int}]
+        )
+
+        changes = self.library.get_changes(since_version)
+        if changes is None:
+            return {
+                "version": self.library.version,
+                "reload": True,
+                "added": [],
+                "removed": [],
+                "changed": [],
+            }
+
+        changes["reload"] = False
+        return changes
+
+    def _get_page_parameters(self, offset, limit):
+        """
+        Return paging parameters to check
+
+        Args:
+            offset (int): index of first item to return
+            limit (int): max number of items to return
+
+        Returns:
+            list: offset and limit parameters (see _check_parameters)
+        """
+        return [
+            {
+                "name": "offset",
+                "value": offset,
+                "type": int,
+                "validator": lambda val: val >= 0,
+                "message": "Offset must be positive",
+            },
+            {
+                "name": "limit",
+                "value": limit,
+                "type": int,
+                "validator": lambda val: 0 < val <= self.BROWSE_MAX_LIMIT,
+                "message": f"Limit must be between 1 and {self.BROWSE_MAX_LIMIT}",
+            },
+        ]
+
+    def _get_folder_directory(self, path):
+        """
+        Return directory of library folder
+
+        Args:
+            path (str): folder path relative to music storage. None for root folder
+
+        Returns:
+            str: directory path or None if path is outside music storage
+        """
+        root = os.path.normpath(self.APP_STORAGE_PATH)
+        directory = os.path.normpath(os.path.join(root, path or ""))
+        if directory != root and not directory.startswith(root + os.sep):
+            return None
+
+        return directory
+
+    def _get_folder_path(self, directory):
+        """
+        Return library folder path relative to music storage
+
+        Args:
+            directory (str): directory path
+
+        Returns:
+            str: folder path. Empty string for root folder
+        """
+        path = os.path.relpath(directory, self.APP_STORAGE_PATH)
+        return "" if path == os.curdir else path
+
+    def browse(self, path=None, offset=0, limit=100):
+        """
+        Browse library folders. Subfolders are returned with their tracks count and size, and
+        folder tracks are returned one page at a time
+
+        Args:
+            path (str): folder path relative to music storage. None for root folder
+            offset (int): index of first track to return
+            limit (int): max number of tracks to return
+
+        Returns:
+            dict: folder content::
+
+                {
+                    path (str): folder path
+                    count (int): number of tracks in folder and subfolders
+                    size (int): size of tracks in folder and subfolders
+                    folders (list): subfolders::
+
+                        [
+                            {
+                                path (str): subfolder path
+                                name (str): subfolder name
+                                count (int): number of tracks in subfolder
+                                size (int): size of tracks in subfolder
+                            },
+                            ...
+                        ]
+
+                    files (list): page of tracks directly in folder [{filename, path}, ...]
+                    filescount (int): number of tracks directly in folder
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "path",
+                    "value": path,
+                    "type": str,
+                    "none": True,
+                    "validator": lambda val: self._get_folder_directory(val) is not None,
+                    "message": f'Folder "{path}" was not found',
+                },
+                *self._get_page_parameters(offset, limit),
+            ]
+        )
+
+        directory = self._get_folder_directory(path)
+        folder = self.library.get_folder(directory, offset, limit)
+        if folder is None:
+            if path:
+                raise InvalidParameter(f'Folder "{path}" was not found')
+            # empty library
+            folder = {
+                "count": 0,
+                "size": 0,
+                "folders": [],
+                "files": [],
+                "filescount": 0,
+            }
+
+        folder["path"] = self._get_folder_path(directory)
+        for subfolder in folder["folders"]:
+            subfolder["name"] = os.path.basename(subfolder["path"])
+            subfolder["path"] = self._get_folder_path(subfolder["path"])
+
+        return folder
+
+    def get_artists(self, offset=0, limit=100):
+        """
+        Browse library artists. Album artist is used when tracks have one
+
+        Args:
+            offset (int): index of first artist to return
+            limit (int): max number of artists to return
+
+        Returns:
+            dict: artists page::
+
+                {
+                    count (int): number of artists
+                    artists (list): artists sorted by name::
+
+                        [
+                            {
+                                name (str): artist name (empty for untagged artist)
+                                albums (int): number of albums
+                                tracks (int): number of tracks
+                            },
+                            ...
+                        ]
+
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(self._get_page_parameters(offset, limit))
+
+        return self.library.get_artists(offset, limit)
+
+    def get_albums(self, artist=None, offset=0, limit=100):
+        """
+        Browse library albums
+
+        Args:
+            artist (str): artist to return albums of. All albums if None
+            offset (int): index of first album to return
+            limit (int): max number of albums to return
+
+        Returns:
+            dict: albums page::
+
+                {
+                    count (int): number of albums
+                    albums (list): albums sorted by name::
+
+                        [
+                            {
+                                name (str): album name (empty for untagged album)
+                                artist (str): album artist
+                                tracks (int): number of tracks
+                            },
+                            ...
+                        ]
+
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {"name": "artist", "value": artist, "type": str, "none": True},
+                *self._get_page_parameters(offset, limit),
+            ]
+        )
+
+        return self.library.get_albums(artist, offset, limit)
+
+    def get_genres(self, offset=0, limit=100):
+        """
+        Browse library genres
+
+        Args:
+            offset (int): index of first genre to return
+            limit (int): max number of genres to return
+
+        Returns:
+            dict: genres page::
+
+                {
+                    count (int): number of genres
+                    genres (list): genres sorted by name [{name (str), tracks (int)}, ...]
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(self._get_page_parameters(offset, limit))
+
+        return self.library.get_genres(offset, limit)
+
+    def get_tracks(self, artist=None, album=None, genre=None, offset=0, limit=100):
+        """
+        Browse library tracks by artist, album and genre. Tracks are sorted by album and track
+        number
+
+        Args:
+            artist (str): artist. Any artist if None
+            album (str): album. Any album if None
+            genre (str): genre. Any genre if None
+            offset (int): index of first track to return
+            limit (int): max number of tracks to return
+
+        Returns:
+            dict: tracks page::
+
+                {
+                    count (int): number of matching tracks
+                    files (list): tracks [{filename (str), path (str), tags (dict)}, ...]
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {"name": "artist", "value": artist, "type": str, "none": True},
+                {"name": "album", "value": album, "type": str, "none": True},
+                {"name": "genre", "value": genre, "type": str, "none": True},
+                *self._get_page_parameters(offset, limit),
+            ]
+        )
+
+        entries = self.library.get_tagged_entries(artist, album, genre)
+        return {
+            "count": len(entries),
+            "files": [
+                {**LibraryIndex.to_file(entry), "tags": entry["metadata"]["tags"]}
+                for entry in entries[offset : offset + limit]
+            ],
+        }
+
+    def get_playlists(self, if_version=None):
+        """
+        Get playlists
+
+        Args:
+            if_version (int): playlists version known by caller. If specified, playlists are
+                              returned only if they changed since this version
+
+        Returns:
+            dict: playlists::
+
+                {
+                    version (int): current playlists version
+                    modified (bool): False if playlists did not change since if_version
+                    default (str): default playlist name. None if not modified
+                    playlists (dict): playlists. None if not modified
+                }
+
+        """
+        with self.config_lock:
+            modified = if_version != self.playlists_version
+            return {
+                "version": self.playlists_version,
+                "modified": modified,
+                "default": self._get_config_field("default") if modified else None,
+                "playlists": self._get_config_field("playlists") if modified else None,
+            }
+
+    def get_playback(self, player_uuid=None):
+        """
+        Return playback
+
+        Args:
+            player_uuid (str): player uuid. If not specified all playbacks are returned
+
+        Returns:
+            dict: playback information of specified player (list of dicts if no player specified)::
+
+                {
+                    playeruuid (str): player uuid
+                    playlistname (str): played playlist
+                    index (number): played playlist track. None if playback not started yet
+                    alarm (bool): True if player is the alarm player
+                }
+
+        Raises:
+            InvalidParameter: if player does not exist
+        """
+        if player_uuid is None:
+            return [
+                PlaybackRegistry.get_infos(playback)
+                for playback in self.playbacks.get_all()
+            ]
+
+        playback = self.playbacks.get(player_uuid)
+        if not playback:
+            raise InvalidParameter(f'Player "{player_uuid}" does not exist')
+        return PlaybackRegistry.get_infos(playback)
+
+    def add_music_file(self, filepath):
+        """
+        Add music file to device filesystem
+
+        Args:
+            filepath (str): uploaded track filepath
+
+        Returns:
+            bool: True if upload succeed
+
+        Note:
+            If transcoding is enabled, files with unsupported format are converted in background.
+            Conversion progress is reported by localmusic.transcode.update events
+
+        Raises:
+            InvalidParameter: if file extension is not supported or file content does not match it
+            CommandError: if adding file failed
+        """
+        file_ext = os.path.splitext(filepath)
+        if file_ext[1][1:] not in Localmusic.ALLOWED_MUSIC_EXTENSIONS:
+            if self._can_transcode(filepath):
+                return self._transcode_music_file(filepath)
+            raise InvalidParameter(
+                f"Invalid file extension (only {','.join(Localmusic.ALLOWED_MUSIC_EXTENSIONS)} allowed)"
+            )
+
+        filename = os.path.basename(filepath)
+        try:
+            infos = audioheader.sniff(filepath)
+        except OSError:
+            infos = None
+        if not audioheader.matches_extension(infos, filepath):
+            raise InvalidParameter(
+                f'File "{filename}" content is not a valid {file_ext[1][1:]} file'
+            )
+        new_path = os.path.join(self.APP_STORAGE_PATH, filename)
+        if os.path.exists(new_path) or filename in self.library:
+            raise CommandError(f'Music file "{filename}" already exists')
+        with self.storage_lock:
+            self._check_storage_quota(filepath)
+            if not self.cleep_filesystem.move(filepath, new_path):
+                raise CommandError(f'Unable to save "{filename}"')
+
+            self._refresh_music_files()
+
+        return True
+
+    def _check_storage_quota(self, filepath):
+        """
+        Check specified file fits in storage quota. Least recently played tracks are evicted to
+        make room if eviction is enabled. Used storage is the running total kept by library index
+
+        Args:
+            filepath (str): path of file to add to storage
+
+        Raises:
+            CommandError: if file does not fit in storage quota
+        """
+        quota = self._get_config_field("storagequota")
+        if not quota:
+            return
+
+        size = os.path.getsize(filepath)
+        exceeding = self.library.total_size + size - quota
+        if exceeding <= 0:
+            return
+        if size > quota or not self._get_config_field("quotaeviction"):
+            raise CommandError(
+                f"Storage quota exceeded ({self.library.total_size} of {quota} bytes used)"
+            )
+
+        self._evict_tracks(exceeding)
+
+    def _can_transcode(self, filepath):
+        """
+        Check if specified file can be transcoded
+
+        Args:
+            filepath (str): file path
+
+        Returns:
+            bool: True if file can be transcoded
+        """
+        return (
+            self._get_config_field("transcode")
+            and Transcoder.get_output_extension(filepath) is not None
+            and Transcoder.is_available()
+        )
+
+    def _transcode_music_file(self, filepath):
+        """
+        Queue transcoding of specified music file
+
+        Args:
+            filepath (str): uploaded track filepath
+
+        Returns:
+            bool: True if transcoding is queued
+
+        Raises:
+            CommandError: if queuing file failed
+        """
+        filename = os.path.basename(filepath)
+        new_filename = (
+            os.path.splitext(filename)[0]
+            + "."
+            + Transcoder.get_output_extension(filepath)
+        )
+        new_path = os.path.join(self.APP_STORAGE_PATH, new_filename)
+        if os.path.exists(new_path) or new_filename in self.library:
+            raise CommandError(f'Music file "{new_filename}" already exists')
+
+        incoming_path = os.path.join(self._get_cache_path("incoming"), filename)
+        os.makedirs(os.path.dirname(incoming_path), exist_ok=True)
+        if not self.cleep_filesystem.move(filepath, incoming_path):
+            raise CommandError(f'Unable to save "{filename}"')
+
+        self.transcoder.submit(
+            incoming_path,
+            lambda _, output_path: self._on_transcode_done(output_path, new_path),
+        )
+
+        return True
+
+    def _on_transcode_done(self, output_path, new_path):
+        """
+        Called when transcoding job is done. Transcoded file (job own link to cached output) is
+        moved to storage
+
+        It runs in transcoder worker, so failure is not raised but returned to transcoder
+        that reports it to user in job status (localmusic.transcode.update event)
+
+        Args:
+            output_path (str): transcoded file path (in cache)
+            new_path (str): music file path in storage
+
+        Returns:
+            str: error message if saving transcoded file failed, None otherwise
+        """
+        with self.storage_lock:
+            try:
+                self._check_storage_quota(output_path)
+            except CommandError as error:
+                return str(error)
+            if not self.cleep_filesystem.move(output_path, new_path):
+                return f'Unable to save "{os.path.basename(new_path)}"'
+
+            self._refresh_music_files()
+
+        return None
+
+    def _on_transcode_update(self, job):
+        """
+        Called when transcoding job is updated
+
+        Args:
+            job (dict): transcoding job
+        """
+        self.transcode_update_event.send(params=job)
+
+    def get_transcode_jobs(self):
+        """
+        Return running transcoding jobs
+
+        Returns:
+            list: list of jobs::
+
+                [
+                    {
+                        jobid (str): job identifier
+                        filename (str): source filename
+                        status (str): job status (queued, running)
+                        progress (int): job progress (percent)
+                        error (str): failure reason (None until job failed)
+                    },
+                    ...
+                ]
+
+        """
+        return self.transcoder.get_jobs()
+
+    def set_transcode(self, enabled):
+        """
+        Enable or disable transcoding of unsupported music formats
+
+        Args:
+            enabled (bool): True to enable transcoding
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if encoder is not installed
+        """
+        self._check_parameters([{"name": "enabled", "value": enabled, "type": bool}])
+        if enabled and not Transcoder.is_available():
+            raise CommandError("Encoder (ffmpeg) is not installed")
+
+        self._set_config_field("transcode", enabled)
+
+    def delete_music_file(self, filename):
+        """
+        Delete music file from device filesystem
+
+        Args:
+            filename (str): filename of file to delete
+
+        Raises:
+            CommandError: if file deletion failed
+        """
+        for root, _, files in os.walk(self.APP_STORAGE_PATH):
+            if self._is_hidden_path(root):
+                continue
+            for filename_ in files:
+                filepath = os.path.join(root, filename_)
+                if filename_ == filename:
+                    if not self.cleep_filesystem.rm(filepath):
+                        raise CommandError(f'Unable to delete "{filename}"')
+
+                    self._refresh_music_files()
+                    return
+
+        raise InvalidParameter(f'File "{filename}" was not found')
+
+    def set_storage_quota(self, quota, eviction):
+        """
+        Configure storage quota
+
+        Args:
+            quota (int): max size of music files in bytes (0 to disable quota)
+            eviction (bool): True to delete least recently played tracks when quota is exceeded
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "quota",
+                    "value": quota,
+                    "type": int,
+                    "validator": lambda val: val >= 0,
+                    "message": "Quota must be positive",
+                },
+                {"name": "eviction", "value": eviction, "type": bool},
+            ]
+        )
+
+        self._update_config({"storagequota": quota, "quotaeviction": eviction})
+
+    def get_storage_usage(self):
+        """
+        Return storage usage
+
+        Returns:
+            dict: storage usage::
+
+                {
+                    used (int): size of music files (bytes)
+                    quota (int): storage quota (bytes). 0 if no quota
+                    eviction (bool): True if least recently played tracks are evicted
+                    free (int): free space on storage filesystem (bytes)
+                }
+
+        """
+        try:
+            free = shutil.disk_usage(self.APP_STORAGE_PATH).free
+        except OSError:
+            free = None
+
+        return {
+            "used": self.library.total_size,
+            "quota": self._get_config_field("storagequota"),
+            "eviction": self._get_config_field("quotaeviction"),
+            "free": free,
+        }
+
+    def evict_tracks(self, size, dry_run=False):
+        """
+        Delete least recently played tracks to free storage. Tracks of default playlist (played
+        by alarm) and of running playbacks are never evicted
+
+        Args:
+            size (int): size to free (bytes)
+            dry_run (bool): True to only return tracks that would be deleted
+
+        Returns:
+            dict: eviction result::
+
+                {
+                    tracks (list): evicted (or evictable if dry run) filenames
+                    freedsize (int): freed (or freeable if dry run) size (bytes)
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+            CommandError: if not enough tracks can be evicted
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "size",
+                    "value": size,
+                    "type": int,
+                    "validator": lambda val: val > 0,
+                    "message": "Size must be greater than 0",
+                },
+                {"name": "dry_run", "value": dry_run, "type": bool},
+            ]
+        )
+
+        with self.storage_lock:
+            return self._evict_tracks(size, dry_run)
+
+    def _evict_tracks(self, size, dry_run=False):
+        """
+        Delete least recently played tracks until specified size is freed
+
+        Args:
+            size (int): size to free (bytes)
+            dry_run (bool): True to only return tracks that would be deleted
+
+        Returns:
+            dict: eviction result (see evict_tracks)
+
+        Raises:
+            CommandError: if not enough tracks can be evicted
+        """
+        protected = {
+            os.path.basename(path) for path in self._get_default_playlist_tracks()
+        }
+        for playback in self.playbacks.get_all():
+            protected.update(os.path.basename(path) for path in playback["tracks"])
+
+        entries = [
+            entry
+            for entry in self.library.get_entries()
+            if entry["size"] and entry["filename"] not in protected
+        ]
+        entries.sort(
+            key=lambda entry: (
+                self.history.get_track_stats(entry["filename"])["lastplayed"],
+                entry["mtime"] or 0,
+            )
+        )
+
+        evicted = []
+        freed_size = 0
+        for entry in entries:
+            if freed_size >= size:
+                break
+            evicted.append(entry)
+            freed_size += entry["size"]
+
+        result = {
+            "tracks": [entry["filename"] for entry in evicted],
+            "freedsize": freed_size,
+        }
+        if dry_run:
+            return result
+        if freed_size < size:
+            raise CommandError("Not enough evictable tracks to free storage")
+
+        for entry in evicted:
+            self.logger.info('Evict track "%s" to free storage', entry["filename"])
+            if not self.cleep_filesystem.rm(entry["path"]):
+                self.logger.error('Unable to evict track "%s"', entry["filename"])
+        self._refresh_music_files()
+        self._check_playlists()
+
+        return result
+
+    def add_playlist(
+        self, playlist_name, files=None, if_version=None, artist=None, album=None
+    ):
+        """
+        Add new playlist using specified tracks, or tracks of specified artist or album
+
+        Args:
+            playlist_name (str): playlist name
+            files (list): list of files to add into playlist. None to use artist or album::
+
+                [
+                    filename1 (str),
+                    filenale2 (str),
+                    ...
+                ]
+
+            if_version (int): playlists version known by caller. If specified, playlist is added
+                              only if playlists did not change since this version
+            artist (str): add tracks of this artist (all its albums if album is not specified)
+            album (str): add tracks of this album
+
+        Raises:
+            InvalidParameter: if playlist already exist or is empty
+            CommandError: if playlists changed since specified version
+        """
+        self._check_parameters(
+            [
+                {"name": "playlist_name", "value": playlist_name, "type": str},
+                {
+                    "name": "files",
+                    "value": files,
+                    "type": list,
+                    "none": True,
+                    "validator": lambda v: len(v) > 0,
+                    "message": "Playlist must not be empty",
+                },
+                {"name": "artist", "value": artist, "type": str, "none": True},
+                {"name": "album", "value": album, "type": str, "none": True},
+            ]
+        )
+        if files is None:
+            if artist is None and album is None:
+                raise InvalidParameter("Playlist must not be empty")
+            entries = self.library.get_tagged_entries(artist, album)
+            if not entries:
+                raise InvalidParameter("No track found for specified artist and album")
+            files = [entry["filename"] for entry in entries]
+
+        with self.config_lock:
+            self._check_playlists_version(if_version)
+            playlists = self._get_config_field("playlists")
+            self.logger.debug("playlists = %s", playlists)
+            if playlist_name in playlists or playlist_name in self.smart_playlists:
+                raise InvalidParameter(f'Playlist "{playlist_name}" already exists')
+
+            playlists[playlist_name] = files
+            self._check_playlists(playlists)
+            self._save_playlists(playlists)
+
+            if len(playlists) == 1:
+                # set unique playlist as default one
+                self.set_default_playlist(playlist_name)
+
+    def add_folder_playlist(self, path, playlist_name, recursive=True, if_version=None):
+        """
+        Add new playlist with tracks of library folder
+
+        Args:
+            path (str): folder path relative to music storage. None for root folder
+            playlist_name (str): playlist name
+            recursive (bool): True to add tracks of subfolders too
+            if_version (int): playlists version known by caller. If specified, playlist is added
+                              only if playlists did not change since this version
+
+        Returns:
+            int: number of tracks in playlist
+
+        Raises:
+            InvalidParameter: if parameter is invalid or playlist already exists
+            CommandError: if playlists changed since specified version
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "path",
+                    "value": path,
+                    "type": str,
+                    "none": True,
+                    "validator": lambda val: self._get_folder_directory(val) is not None,
+                    "message": f'Folder "{path}" was not found',
+                },
+                {"name": "playlist_name", "value": playlist_name, "type": str},
+                {"name": "recursive", "value": recursive, "type": bool},
+            ]
+        )
+
+        entries = self.library.get_folder_entries(
+            self._get_folder_directory(path), recursive
+        )
+        if not entries:
+            raise InvalidParameter(
+                f'Folder "{path}" was not found' if path else "Library has no track"
+            )
+
+        files = [entry["filename"] for entry in entries]
+        self.add_playlist(playlist_name, files, if_version)
+        return len(files)
+
+    def update_playlist(self, playlist_name, new_playlist_name, files, if_version=None):
+        """
+        Update playlist content
+        Set new_playlist_name to the same value as playlist_name if you don't want to rename it
+
+        Args:
+            playlist_name (str): playlist name
+            new_playlist_name (str): new playlist name
+            files (list): list of files to add into playlist::
+
+                [
+                    filename1 (str),
+                    filename2 (str),
+                    ...
+                ]
+
+            if_version (int): playlists version known by caller. If specified, playlist is updated
+                              only if playlists did not change since this version
+
+        Raises:
+            InvalidParameter: if playlist does not exist
+            CommandError: if playlists changed since specified version
+        """
+        self._check_parameters(
+            [
+                {"name": "playlist_name", "value": playlist_name, "type": str},
+                {"name": "new_playlist_name", "value": new_playlist_name, "type": str},
+                {
+                    "name": "files",
+                    "value": files,
+                    "type": list,
+                    "validator": lambda v: len(v) > 0,
+                    "message": "Playlist must not be empty",
+                },
+            ]
+        )
+        with self.config_lock:
+            self._check_playlists_version(if_version)
+            playlists = self._get_config_field("playlists")
+            if playlist_name not in playlists:
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+
+            new_playlist_name = (
+                playlist_name if not new_playlist_name else new_playlist_name
+            )
+
+            playlists[new_playlist_name] = files
+            if playlist_name != new_playlist_name:
+                del playlists[playlist_name]
+                self.shuffler.rename(playlist_name, new_playlist_name)
+                self._schedule_shuffle_save()
+            self._check_playlists(playlists)
+            self._save_playlists(playlists)
+
+            default_playlist = self._get_config_field("default")
+            if playlist_name == default_playlist:
+                self.set_default_playlist(new_playlist_name)
+
+    def delete_playlist(self, playlist_name, if_version=None):
+        """
+        Delete playlist
+
+        Args:
+            playlist_name (str): playlist name
+            if_version (int): playlists version known by caller. If specified, playlist is deleted
+                              only if playlists did not change since this version
+
+        Raises:
+            InvalidParameter: if playlist name does not exist
+            CommandError: if playlists changed since specified version
+        """
+        with self.config_lock:
+            self._check_playlists_version(if_version)
+            playlists = self._get_config_field("playlists")
+            if playlist_name not in playlists:
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+
+            del playlists[playlist_name]
+            self._save_playlists(playlists)
+            self.shuffler.remove(playlist_name)
+            self._schedule_shuffle_save()
+
+    def add_smart_playlist(self, playlist_name, rules):
+        """
+        Add new smart playlist whose tracks are selected by rules
+
+        Args:
+            playlist_name (str): playlist name
+            rules (dict): playlist rules::
+
+                {
+                    folder (str): files in this folder (relative to storage path)
+                    tag (dict): files with tag {name (str), value (str)}
+                    addedsince (float): files added after this timestamp
+                    minduration (float): files lasting at least this duration (seconds)
+                    maxduration (float): files lasting at most this duration (seconds)
+                    order (str): tracks order (name, random, leastplayed)
+                    limit (int): max number of tracks
+                }
+
+        Raises:
+            InvalidParameter: if playlist already exists or rules are invalid
+        """
+        with self.config_lock:
+            self._check_parameters(
+                [
+                    {"name": "playlist_name", "value": playlist_name, "type": str},
+                    {"name": "rules", "value": rules, "type": dict},
+                ]
+            )
+            if (
+                playlist_name in self.smart_playlists
+                or playlist_name in self._get_config_field("playlists")
+            ):
+                raise InvalidParameter(f'Playlist "{playlist_name}" already exists')
+
+            self._save_smart_playlist(playlist_name, rules)
+
+    def update_smart_playlist(self, playlist_name, rules):
+        """
+        Update smart playlist rules
+
+        Args:
+            playlist_name (str): playlist name
+            rules (dict): playlist rules (see add_smart_playlist)
+
+        Raises:
+            InvalidParameter: if playlist does not exist or rules are invalid
+        """
+        with self.config_lock:
+            self._check_parameters(
+                [
+                    {"name": "playlist_name", "value": playlist_name, "type": str},
+                    {"name": "rules", "value": rules, "type": dict},
+                ]
+            )
+            if playlist_name not in self.smart_playlists:
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+
+            self._save_smart_playlist(playlist_name, rules)
+            if playlist_name == self._get_config_field("default"):
+                self._sync_alarm_cache()
+
+    def _save_smart_playlist(self, playlist_name, rules):
+        """
+        Evaluate and save smart playlist
+
+        Args:
+            playlist_name (str): playlist name
+            rules (dict): playlist rules
+
+        Raises:
+            InvalidParameter: if rules are invalid
+        """
+        try:
+            smart_playlist = SmartPlaylist(rules, self.APP_STORAGE_PATH)
+        except ValueError as error:
+            raise InvalidParameter(str(error)) from error
+        smart_playlist.evaluate(self.library.get_entries())
+
+        smart_playlists = self._get_config_field("smartplaylists")
+        smart_playlists[playlist_name] = rules
+        self._set_config_field("smartplaylists", smart_playlists)
+        self.smart_playlists[playlist_name] = smart_playlist
+        self.playlists_version += 1
+
+    def delete_smart_playlist(self, playlist_name):
+        """
+        Delete smart playlist
+
+        Args:
+            playlist_name (str): playlist name
+
+        Raises:
+            InvalidParameter: if playlist does not exist
+        """
+        with self.config_lock:
+            if playlist_name not in self.smart_playlists:
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+
+            smart_playlists = self._get_config_field("smartplaylists")
+            smart_playlists.pop(playlist_name, None)
+            self._set_config_field("smartplaylists", smart_playlists)
+            del self.smart_playlists[playlist_name]
+            self.playlists_version += 1
+            self.shuffler.remove(playlist_name)
+            self._schedule_shuffle_save()
+
+    def get_smart_playlists(self):
+        """
+        Get smart playlists
+
+        Returns:
+            dict: smart playlists::
+
+                {
+                    playlist name (str): {
+                        rules (dict): playlist rules
+                        count (int): number of tracks matching filtering rules (before limit)
+                    },
+                    ...
+                }
+
+        """
+        with self.config_lock:
+            return {
+                playlist_name: {
+                    "rules": smart_playlist.rules,
+                    "count": len(smart_playlist),
+                }
+                for playlist_name, smart_playlist in self.smart_playlists.items()
+            }
+
+    def set_default_playlist(self, playlist_name):
+        """
+        Set default playlist. This is the playlist used to be played
+
+        Args:
+            playlist_name (str): playlist name to rename
+
+        Raises:
+            InvalidParameter: if playlist name does not exist
+        """
+        with self.config_lock:
+            playlists = self._get_config_field("playlists")
+            if (
+                playlist_name not in playlists
+                and playlist_name not in self.smart_playlists
+            ):
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+
+            self._set_config_field("default", playlist_name)
+            self.playlists_version += 1
+            self._sync_alarm_cache()
+
+    def import_playlist(self, filepath, playlist_name=None):
+        """
+        Import playlist from M3U, M3U8 or PLS file. Playlist entries are resolved against library
+        files, entries not found in library are skipped
+
+        Args:
+            filepath (str): uploaded playlist filepath
+            playlist_name (str): playlist name. Playlist filename (without extension) if not specified
+
+        Returns:
+            dict: import result::
+
+                {
+                    playlistname (str): created playlist name
+                    tracks (int): number of imported tracks
+                    unresolved (int): number of entries not found in library
+                    unresolvedsamples (list): first unresolved entries [{line (int), entry (str)}, ...]
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid or playlist already exists
+            CommandError: if no playlist entry was found in library
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "filepath",
+                    "value": filepath,
+                    "type": str,
+                    "validator": lambda val: PlaylistFile.get_format(val) is not None,
+                    "message": f"Invalid playlist format (only {','.join(PlaylistFile.FORMATS)} allowed)",
+                },
+                {
+                    "name": "playlist_name",
+                    "value": playlist_name,
+                    "type": str,
+                    "none": True,
+                },
+            ]
+        )
+        playlist_name = (
+            playlist_name or os.path.splitext(os.path.basename(filepath))[0]
+        )
+
+        resolver = PlaylistResolver(self.library.get_entries(), self.APP_STORAGE_PATH)
+        try:
+            tracks = [
+                filename
+                for filename in (
+                    resolver.resolve(line_number, location)
+                    for line_number, location in PlaylistFile.read(filepath)
+                )
+                if filename
+            ]
+        except OSError as error:
+            raise CommandError(f'Unable to read playlist "{playlist_name}"') from error
+
+        if resolver.unresolved_count:
+            self.logger.warning(
+                'Playlist "%s" import: %s entries not found in library (first ones: %s)',
+                playlist_name,
+                resolver.unresolved_count,
+                ", ".join(sample["entry"] for sample in resolver.unresolved_samples),
+            )
+        if not tracks:
+            raise CommandError(f'No track of playlist "{playlist_name}" found in library')
+
+        with self.config_lock:
+            playlists = self._get_config_field("playlists")
+            if playlist_name in playlists or playlist_name in self.smart_playlists:
+                raise InvalidParameter(f'Playlist "{playlist_name}" already exists')
+
+            playlists[playlist_name] = tracks
+            self._save_playlists(playlists)
+            if len(playlists) == 1:
+                self.set_default_playlist(playlist_name)
+
+        return {
+            "playlistname": playlist_name,
+            "tracks": len(tracks),
+            "unresolved": resolver.unresolved_count,
+            "unresolvedsamples": resolver.unresolved_samples,
+        }
+
+    def export_playlist(self, playlist_name, playlist_format=PlaylistFile.FORMAT_M3U8):
+        """
+        Export playlist to M3U, M3U8 or PLS file. Tracks paths are relative to library root
+
+        Args:
+            playlist_name (str): playlist name
+            playlist_format (str): playlist file format (m3u, m3u8 or pls)
+
+        Returns:
+            dict: exported file::
+
+                {
+                    filepath (str): exported playlist filepath
+                    filename (str): exported playlist filename
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid or playlist does not exist
+            CommandError: if export failed
+        """
+        self._check_parameters(
+            [
+                {"name": "playlist_name", "value": playlist_name, "type": str},
+                {
+                    "name": "playlist_format",
+                    "value": playlist_format,
+                    "type": str,
+                    "validator": lambda val: val in PlaylistFile.FORMATS,
+                    "message": f"Playlist format must be one of {','.join(PlaylistFile.FORMATS)}",
+                },
+            ]
+        )
+        with self.config_lock:
+            if (
+                playlist_name not in self._get_config_field("playlists")
+                and playlist_name not in self.smart_playlists
+            ):
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+            paths = self._get_playlist_tracks(playlist_name)
+
+        def get_tracks():
+            for path in paths:
+                filename = os.path.basename(path)
+                location = os.path.relpath(path, self.APP_STORAGE_PATH)
+                yield (
+                    location.replace(os.sep, "/"),
+                    os.path.splitext(filename)[0],
+                    self.library.get_metadata(filename, "duration"),
+                )
+
+        filename = f"{playlist_name.replace(os.sep, '_')}.{playlist_format}"
+        filepath = os.path.join(self._get_cache_path("export"), filename)
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            PlaylistFile.write(filepath, get_tracks())
+        except OSError as error:
+            raise CommandError(f'Unable to export playlist "{playlist_name}"') from error
+
+        return {"filepath": filepath, "filename": filename}
+
+    def set_alarm_cache(self, enabled, size):
+        """
+        Configure alarm cache that mirrors first tracks of default playlist in RAM. Disabling
+        cache also disables silence trimming that is applied on cached tracks
+
+        Args:
+            enabled (bool): True to enable alarm cache
+            size (int): max cache size in bytes
 
         Raises:
-            InvalidParameter: if playlist does not exist
+            InvalidParameter: if parameter is invalid
         """
         self._check_parameters(
             [
-                {"name": "playlist_name", "value": playlist_name, "type": str},
-                {"name": "new_playlist_name", "value": new_playlist_name, "type": str},
+                {"name": "enabled", "value": enabled, "type": bool},
                 {
-                    "name": "files",
-                    "value": files,
-                    "type": list,
-                    "validator": lambda v: len(v) > 0,
-                    "message": "Playlist must not be empty",
+                    "name": "size",
+                    "value": size,
+                    "type": int,
+                    "validator": lambda val: val > 0,
+                    "message": "Cache size must be greater than 0",
                 },
             ]
         )
-        playlists = self._get_config_field("playlists")
-        if playlist_name not in playlists:
-            raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
-
-        new_playlist_name = (
-            playlist_name if not new_playlist_name else new_playlist_name
-        )
 
-        playlists[new_playlist_name] = files
-        if playlist_name != new_playlist_name:
-            del playlists[playlist_name]
-        self._check_playlists(playlists)
-        self._set_config_field("playlists", playlists)
+        config = {"alarmcache": enabled, "alarmcachesize": size}
+        if not enabled:
+            config["trimsilence"] = False
+        self._update_config(config)
+        self.alarm_cache.enabled = enabled
+        self.alarm_cache.max_size = size
+        if enabled:
+            self._sync_alarm_cache()
+        else:
+            self.alarm_cache.clear()
 
-        default_playlist = self._get_config_field("default")
-        if playlist_name == default_playlist:
-            self.set_default_playlist(new_playlist_name)
+    def _sync_alarm_cache(self):
+        """
+        Synchronize alarm cache with default playlist in background
+        """
+        if not self.alarm_cache.enabled:
+            return
 
-    def delete_playlist(self, playlist_name):
+        tracks = self._get_default_playlist_tracks()
+        start_offsets = {}
+        if self._get_config_field("trimsilence"):
+            start_offsets = {
+                track: self.library.get_metadata(os.path.basename(track), "soundstart")
+                for track in tracks[: self.alarm_cache.max_tracks]
+            }
+        threading.Thread(
+            target=self.alarm_cache.sync,
+            args=(tracks, start_offsets),
+            name="localmusic-alarmcache",
+            daemon=True,
+        ).start()
+
+    def play_playlist(self, playlist_name, player_uuid=None):
         """
-        Delete playlist
+        Start playback on specified playlist
 
         Args:
             playlist_name (str): playlist name
+            player_uuid (str): player to replace. If not specified or not running anymore, a new
+                               player is created alongside running ones
+
+        Returns:
+            str: player uuid or None if player was not created
 
         Raises:
-            InvalidParameter: if playlist name does not exist
+            InvalidParameter: if playlist does not exist or player is the alarm player
         """
-        playlists = self._get_config_field("playlists")
-        if playlist_name not in playlists:
-            raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+        with self.playback_lock:
+            playlists = self._get_config_field("playlists")
+            if (
+                playlist_name not in playlists
+                and playlist_name not in self.smart_playlists
+            ):
+                raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+            target = self._get_target_playback(player_uuid)
+
+            playback = self._create_audio_player(
+                playlist_name, replaced_uuid=target["playeruuid"] if target else None
+            )
+            self._change_audio_player_status(playback, pause=False, volume=70)
 
-        del playlists[playlist_name]
-        self._set_config_field("playlists", playlists)
+            return playback["playeruuid"] if playback else None
 
-    def set_default_playlist(self, playlist_name):
+    def _get_target_playback(self, player_uuid):
         """
-        Set default playlist. This is the playlist used to be played
+        Return playback of player targeted by a command
 
         Args:
-            playlist_name (str): playlist name to rename
+            player_uuid (str): player uuid. None if no player targeted
+
+        Returns:
+            dict: playback or None if player is not running
 
         Raises:
-            InvalidParameter: if playlist name does not exist
+            InvalidParameter: if player is the alarm player
+        """
+        playback = self.playbacks.get(player_uuid)
+        if playback and playback["alarm"]:
+            raise InvalidParameter("Alarm player cannot be used")
+        return playback
+
+    def get_playback_position(self):
         """
-        playlists = self._get_config_field("playlists")
-        if playlist_name not in playlists:
-            raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+        Return last playback position
+
+        Returns:
+            dict: playback position or None if nothing played yet::
 
-        self._set_config_field("default", playlist_name)
+                {
+                    playlistname (str): playlist name
+                    index (int): track index in playlist
+                    offset (float): track offset (seconds)
+                }
 
-    def play_playlist(self, playlist_name):
         """
-        Start playback on specified playlist
+        return self.playback_position
 
-        Args:
-            playlist_name (str): playlist name
+    def resume_playback(self, player_uuid=None):
         """
-        playlists = self._get_config_field("playlists")
-        if playlist_name not in playlists:
-            raise InvalidParameter(f'Playlist "{playlist_name}" does not exist')
+        Resume playback of last played playlist from last played track
+
+        Args:
+            player_uuid (str): player to replace. If not specified or not running anymore, a new
+                               player is created alongside running ones
 
-        self._destroy_audio_player()
-        self._create_audio_player(playlist_name)
-        self._change_audio_player_status(pause=False, volume=70)
+        Returns:
+            str: player uuid or None if player was not created
 
-    def _create_audio_player(self, playlist_name=None, repeat=False, shuffle=False):
+        Raises:
+            CommandError: if there is no playback to resume
+            InvalidParameter: if player is the alarm player
+        """
+        with self.playback_lock:
+            if not self.playback_position:
+                raise CommandError("No playback to resume")
+            playlist_name = self.playback_position["playlistname"]
+            if (
+                playlist_name not in self._get_config_field("playlists")
+                and playlist_name not in self.smart_playlists
+            ):
+                raise CommandError(f'Playlist "{playlist_name}" does not exist anymore')
+            target = self._get_target_playback(player_uuid)
+
+            volume = (target["volume"] if target else None) or 70
+            playback = self._create_audio_player(
+                playlist_name,
+                start_index=self.playback_position["index"],
+                replaced_uuid=target["playeruuid"] if target else None,
+            )
+            self._change_audio_player_status(playback, pause=False, volume=volume)
+
+            return playback["playeruuid"] if playback else None
+
+    def _create_audio_player(
+        self,
+        playlist_name=None,
+        repeat=False,
+        shuffle=False,
+        start_index=0,
+        replaced_uuid=None,
+    ):
         """
         Create audio player on audioplayer application. New player is always paused. Please start playback manually
 
+        Replaced player is stopped while new player is prepared and created.
+
         Args:
-            playlist_name (str): create player based on specified playlist. If None specified, default playlist is used
+            playlist_name (str): create player based on specified playlist. If None specified, default playlist is
+                                 used on alarm player (previous alarm player is stopped)
             repeat (bool): if True playlist will repeat indefinitely
-            shuffle (bool): if True playlist will be shuffled when end of it is reached
+            shuffle (bool): if True tracks are dealt by shuffle engine, continuing permutation of
+                            previous shuffled playbacks, and queued on player while playing
+            start_index (int): index of first playlist track to play. Previous tracks are not sent to player.
+                               Ignored if shuffle is enabled
+            replaced_uuid (str): player to stop
+
+        Returns:
+            dict: created playback or None if player was not created
         """
         self.logger.debug(
             "Create audio player playlist=%s repeat=%s shuffle=%s",
@@ -418,8 +3073,34 @@ class Localmusic(CleepRenderer):
             self.logger.warning(
                 "Audioplayer application not installed. Unable to play music"
             )
-            return
+            return None
 
+        alarm = not playlist_name
+        alarm_playback = self.playbacks.get_alarm()
+        if alarm and alarm_playback:
+            replaced_uuid = alarm_playback["playeruuid"]
+        stopping = self._destroy_audio_player(replaced_uuid, wait=False)
+
+        try:
+            return self._prepare_audio_player(
+                playlist_name, repeat, shuffle, start_index
+            )
+        finally:
+            self.audioplayer.wait([stopping])
+
+    def _prepare_audio_player(self, playlist_name, repeat, shuffle, start_index):
+        """
+        Prepare playlist tracks and create audio player
+
+        Args:
+            playlist_name (str): playlist name. None for alarm player
+            repeat (bool): if True playlist will repeat indefinitely
+            shuffle (bool): if True tracks are dealt by shuffle engine
+            start_index (int): index of first playlist track to play
+
+        Returns:
+            dict: created playback or None if player was not created
+        """
         tracks = (
             self._get_playlist_tracks(playlist_name)
             if playlist_name
@@ -430,66 +3111,302 @@ class Localmusic(CleepRenderer):
             self.logger.warning(
                 "Unable to create player because there is no default playlist or it is empty"
             )
-            return
-
-        if self.playback["playeruuid"]:
-            self.send_command_advanced(
-                "stop_playback",
-                "audioplayer",
-                {
-                    "player_uuid": self.playback["playeruuid"],
-                },
+            return None
+
+        alarm = not playlist_name
+        playlist_name = playlist_name or self._get_config_field("default")
+        if shuffle:
+            # first track and queued ones, player is fed while playing
+            count = self.SHUFFLE_QUEUE_SIZE + 1
+            tracks = self.shuffler.deal(
+                playlist_name, tracks, count if repeat else min(count, len(tracks))
             )
+            start_index = 0
+            self._schedule_shuffle_save()
+        if start_index >= len(tracks):
+            start_index = 0
+        tracks = tracks[start_index:]
+        playback = PlaybackRegistry.new_playback(
+            None,
+            playlist_name,
+            tracks,
+            start_index=start_index,
+            alarm=alarm,
+            shuffle=shuffle,
+            repeat=repeat,
+        )
+        self._prefetch_tracks(playback, 1)
+        audioplayer_tracks = self._get_audioplayer_tracks(tracks, alarm)
 
-        # create player sending first track
-        track = tracks.pop(0)
-        self.playback["playeruuid"] = self.send_command_advanced(
+        # create player sending first track. Shuffled playback is repeated by feeding player
+        track = audioplayer_tracks.pop(0)
+        playback["playeruuid"] = self.audioplayer.call(
             "start_playback",
-            "audioplayer",
             {
-                "resource": track,
+                **track,
                 "paused": True,
-                "repeat": repeat,
-                "shuffle": shuffle,
+                "repeat": repeat and not shuffle,
+                "shuffle": False,
             },
+            bypass_breaker=alarm,
         )
-        if not self.playback["playeruuid"]:
+        if not playback["playeruuid"]:
             self.logger.warning(
                 "No audio player created. It won't be able to play music"
             )
-            return
-        self.playback["playlistname"] = (
-            playlist_name if playlist_name else self._get_config_field("default")
-        )
+            return None
+        self.playbacks.add(playback)
+        if playlist_name in self.smart_playlists:
+            # next playback of random smart playlist plays other tracks
+            self.smart_playlists[playlist_name].reseed()
 
         # fill playlist
-        audioplayer_tracks = [
-            {"resource": track, "audio_format": None} for track in tracks
-        ]
-        self.send_command_advanced(
+        self.audioplayer.call(
             "add_tracks",
-            "audioplayer",
             {
-                "player_uuid": self.playback["playeruuid"],
+                "player_uuid": playback["playeruuid"],
                 "tracks": audioplayer_tracks,
             },
+            bypass_breaker=alarm,
+        )
+
+        return playback
+
+    def _get_audioplayer_tracks(self, tracks, alarm):
+        """
+        Return audioplayer tracks of specified track paths
+
+        Args:
+            tracks (list): track paths
+            alarm (bool): True if tracks are played by alarm player
+
+        Returns:
+            list: audioplayer tracks::
+
+                [
+                    {
+                        resource (str): track path
+                        audio_format (str): track audio format. None if unknown
+                    },
+                    ...
+                ]
+
+        """
+        # audio format detected at scan time saves audioplayer from probing each track
+        return [
+            {
+                # alarm playback, use tracks cached in RAM if available
+                "resource": self.alarm_cache.get_path(track) if alarm else track,
+                "audio_format": self._get_audio_format(track),
+            }
+            for track in tracks
+        ]
+
+    def _queue_shuffled_tracks(self, playback):
+        """
+        Deal next shuffled tracks and queue them on player, so a few tracks are always queued
+        after playing one. Not repeated playback ends once as many tracks as playlist ones
+        have been played
+
+        Args:
+            playback (dict): shuffled playback
+        """
+        queued = len(playback["tracks"]) - playback["index"] - 1
+        count = self.SHUFFLE_QUEUE_SIZE - queued
+        if count <= 0:
+            return
+        playlist_tracks = self._get_playlist_tracks(playback["playlistname"])
+        if not playback["repeat"]:
+            count = min(count, len(playlist_tracks) - len(playback["tracks"]))
+            if count <= 0:
+                return
+
+        tracks = self.shuffler.deal(playback["playlistname"], playlist_tracks, count)
+        if not tracks:
+            return
+        self._schedule_shuffle_save()
+        playback["tracks"].extend(tracks)
+        self.audioplayer.call(
+            "add_tracks",
+            {
+                "player_uuid": playback["playeruuid"],
+                "tracks": self._get_audioplayer_tracks(tracks, playback["alarm"]),
+            },
+            bypass_breaker=playback["alarm"],
         )
 
-    def _destroy_audio_player(self):
+    def _restore_shuffled_tracks(self, playback):
         """
-        Destroy current audio player if any
+        Give back to shuffle engine tracks queued on stopped player but not played, so next
+        shuffled playback starts with them
+
+        Args:
+            playback (dict): shuffled playback
         """
-        self.logger.debug("Destroy audio player")
-        if not self.playback["playeruuid"]:
+        if not playback["shuffle"]:
             return
 
-        self.send_command_advanced(
+        index = playback["index"]
+        unplayed = playback["tracks"][index + 1 if index is not None else 0 :]
+        if unplayed:
+            self.shuffler.restore(playback["playlistname"], unplayed)
+            self._schedule_shuffle_save()
+
+    def _destroy_audio_player(self, player_uuid, wait=True):
+        """
+        Destroy specified audio player
+
+        Args:
+            player_uuid (str): player uuid
+            wait (bool): False to return without waiting for player to be stopped
+
+        Returns:
+            Future: stop command future if not waited, None otherwise
+        """
+        self.logger.debug("Destroy audio player %s", player_uuid)
+        if not player_uuid:
+            return None
+
+        future = self.audioplayer.submit(
             "stop_playback",
-            "audioplayer",
             {
-                "player_uuid": self.playback["playeruuid"],
+                "player_uuid": player_uuid,
             },
         )
+        if not wait:
+            return future
+        self.audioplayer.wait([future])
+        return None
+
+    def _send_audioplayer_command(self, command, params, timeout):
+        """
+        Send command to audioplayer application
+
+        Args:
+            command (str): command name
+            params (dict): command parameters
+            timeout (float): command timeout (seconds)
+
+        Returns:
+            any: command result
+
+        Raises:
+            TimeoutError: if command timed out (audioplayer did not respond)
+            Exception: if command failed
+        """
+        start = time.monotonic()
+        try:
+            return self.send_command_advanced(
+                command, "audioplayer", params, timeout=timeout
+            )
+        except (NoResponse, OSError):
+            raise
+        except Exception as error:
+            # bus reports missing response as a generic error
+            if time.monotonic() - start >= timeout:
+                raise TimeoutError(f"Audioplayer {command} timed out") from error
+            raise
+
+    def _prefetch_tracks(self, playback, start_index):
+        """
+        Prefetch next playback tracks into page cache
+
+        Args:
+            playback (dict): playback
+            start_index (int): index of first track to prefetch
+        """
+        count = self._get_config_field("prefetchtracks")
+        if not count or start_index is None:
+            return
+
+        paths = playback["tracks"][start_index : start_index + count]
+        if paths:
+            self.prefetcher.prefetch(paths)
+
+    def set_prefetch(self, tracks, budget):
+        """
+        Configure tracks prefetch
+
+        Args:
+            tracks (int): number of upcoming tracks to prefetch (0 to disable prefetch)
+            budget (int): max number of bytes to read ahead
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "tracks",
+                    "value": tracks,
+                    "type": int,
+                    "validator": lambda val: val >= 0,
+                    "message": "Number of tracks must be positive",
+                },
+                {
+                    "name": "budget",
+                    "value": budget,
+                    "type": int,
+                    "validator": lambda val: val > 0,
+                    "message": "Budget must be greater than 0",
+                },
+            ]
+        )
+
+        self._update_config({"prefetchtracks": tracks, "prefetchbudget": budget})
+        self.prefetcher.budget = budget
+
+    def get_prefetch_stats(self):
+        """
+        Return prefetch statistics
+
+        Returns:
+            dict: prefetch statistics::
+
+                {
+                    prefetchedtracks (int): number of prefetched tracks
+                    prefetchedbytes (int): number of bytes read ahead
+                    readtimesaved (float): time spent reading tracks ahead of playback (seconds)
+                }
+
+        """
+        return self.prefetcher.get_stats()
+
+    def get_stats(self, limit=10):
+        """
+        Return library play statistics
+
+        Args:
+            limit (int): max number of tracks in lists
+
+        Returns:
+            dict: play statistics::
+
+                {
+                    totalplays (int): number of plays (skips excluded)
+                    totalplaytime (float): total listening time (seconds)
+                    mostplayed (list): most played tracks [{filename, playcount, skipcount, lastplayed, playtime}, ...]
+                    mostskipped (list): most skipped tracks (same format as mostplayed)
+                    neverplayed (list): filenames of tracks never played
+                }
+
+        Raises:
+            InvalidParameter: if parameter is invalid
+        """
+        self._check_parameters(
+            [
+                {
+                    "name": "limit",
+                    "value": limit,
+                    "type": int,
+                    "validator": lambda val: val > 0,
+                    "message": "Limit must be greater than 0",
+                },
+            ]
+        )
+
+        filenames = [file_["filename"] for file_ in self.files]
+        return self.history.get_stats(filenames, limit)
 
     def _get_default_playlist_tracks(self):
         """
@@ -501,15 +3418,17 @@ class Localmusic(CleepRenderer):
                 [ path1 (str), path2 (str), ... ]
 
         """
-        playlist_name = self._get_config_field("default")
-        if not playlist_name:
-            return []
+        with self.config_lock:
+            playlist_name = self._get_config_field("default")
+            if not playlist_name:
+                return []
 
-        return self._get_playlist_tracks(playlist_name)
+            return self._get_playlist_tracks(playlist_name)
 
     def _get_playlist_tracks(self, playlist_name):
         """
-        Get playlist tracks or empty list if playlist not found
+        Get playlist tracks or empty list if playlist not found. Tracks flagged as corrupt by
+        integrity probe are excluded
 
         Args:
             playlist_name (str): playlist name
@@ -520,34 +3439,173 @@ class Localmusic(CleepRenderer):
                 [ path1 (str), path2 (str), ... ]
 
         """
-        playlists = self._get_config_field("playlists")
-        if not playlist_name in playlists:
-            self.logger.debug('Playlist "%s" not found', playlist_name)
-            return []
+        with self.config_lock:
+            if playlist_name in self.smart_playlists:
+                tracks = self.smart_playlists[playlist_name].materialize(
+                    self._get_track_play_stats
+                )
+            else:
+                playlists = self._get_config_field("playlists")
+                if not playlist_name in playlists:
+                    self.logger.debug('Playlist "%s" not found', playlist_name)
+                    return []
+                tracks = [
+                    file_["path"]
+                    for file_ in self.files
+                    for playlist_filename in playlists[playlist_name]
+                    if playlist_filename == file_["filename"]
+                ]
 
-        return [
-            file_["path"]
-            for file_ in self.files
-            for playlist_filename in playlists[playlist_name]
-            if playlist_filename == file_["filename"]
-        ]
+            return [track for track in tracks if not self._is_track_corrupt(track)]
+
+    def _is_track_corrupt(self, path):
+        """
+        Check if specified track was flagged as corrupt by integrity probe
+
+        Args:
+            path (str): track path
+
+        Returns:
+            bool: True if track is corrupt
+        """
+        return self.library.get_metadata(os.path.basename(path), "valid") is False
 
     def _start_alarm(self, volume, repeat, shuffle):
         """
-        Start alarm event launching default playlist playback
+        Start alarm event launching default playlist playback on alarm player
 
         Args:
             volume (int): player volume
             repeat (bool): True to create player with playlist repeat option
             shuffle (bool): True to create player with playlist shuffle option
         """
-        self.logger.debug(
-            "Start alarm vol=%s repeat=%s shuffle=%s", volume, repeat, shuffle
+        with self.playback_lock:
+            self.logger.debug(
+                "Start alarm vol=%s repeat=%s shuffle=%s", volume, repeat, shuffle
+            )
+            playback = self.playbacks.get_alarm()
+            if not playback:
+                reason = self._check_alarm_playlist(warm=False)
+                if not reason:
+                    playback = self._create_audio_player(repeat=repeat, shuffle=shuffle)
+                if not playback:
+                    playback = self._create_fallback_player(
+                        reason or "Unable to create alarm player"
+                    )
+
+            self._change_audio_player_status(playback, pause=False, volume=volume)
+
+    def _create_fallback_player(self, reason):
+        """
+        Create alarm player playing bundled fallback tone, so alarm is never silent
+
+        Args:
+            reason (str): reason why alarm playlist cannot be played
+
+        Returns:
+            dict: created playback or None if player was not created
+        """
+        self.logger.warning("Alarm uses fallback tone: %s", reason)
+        self.alarm_degraded_event.send(params={"reason": reason, "fallback": True})
+        if not self.has_audioplayer:
+            return None
+
+        playback = PlaybackRegistry.new_playback(
+            None, None, [self.FALLBACK_TONE], alarm=True
+        )
+        playback["playeruuid"] = self.audioplayer.call(
+            "start_playback",
+            {
+                "resource": self.FALLBACK_TONE,
+                "audio_format": self.FALLBACK_TONE_FORMAT,
+                "paused": True,
+                "repeat": True,
+                "shuffle": False,
+            },
+            bypass_breaker=True,
         )
-        if not self.playback["playeruuid"]:
-            self._create_audio_player(repeat=repeat, shuffle=shuffle)
+        if not playback["playeruuid"]:
+            self.logger.error("Unable to create fallback alarm player")
+            return None
+        self.playbacks.add(playback)
+
+        return playback
+
+    def _check_alarm_playlist(self, warm=True):
+        """
+        Pre-flight check of alarm playlist. Default playlist is resolved against library and its
+        first tracks must be readable. Checked tracks are then warmed into cache. A degradation
+        event is sent when alarm playlist becomes unplayable
+
+        Args:
+            warm (bool): True to load first tracks into cache
+
+        Returns:
+            str: degradation reason or None if alarm playlist can be played
+        """
+        playlist_name = self._get_config_field("default")
+        tracks = self._get_default_playlist_tracks()[: self.PREFLIGHT_TRACKS]
+        reason = None
+        if playlist_name and not tracks:
+            reason = f'Default playlist "{playlist_name}" has no track in library'
+        elif tracks:
+            unreadable = [
+                os.path.basename(track)
+                for track in tracks
+                if not self._is_track_readable(track)
+            ]
+            if unreadable:
+                reason = f"Alarm tracks are not readable: {', '.join(unreadable)}"
+
+        previous_reason = self.alarm_health["reason"]
+        self.alarm_health = {
+            "healthy": reason is None,
+            "reason": reason,
+            "checked": int(time.time()),
+        }
+        if reason and reason != previous_reason:
+            self.logger.warning("Alarm playlist is degraded: %s", reason)
+            self.alarm_degraded_event.send(params={"reason": reason, "fallback": False})
+
+        if warm and tracks and not reason:
+            if self.alarm_cache.enabled:
+                self._sync_alarm_cache()
+            else:
+                self.prefetcher.prefetch(tracks)
+
+        return reason
+
+    def _is_track_readable(self, path):
+        """
+        Check specified track can be read
+
+        Args:
+            path (str): track path
+
+        Returns:
+            bool: True if track is readable
+        """
+        try:
+            with open(path, "rb") as fdesc:
+                return len(fdesc.read(self.PREFLIGHT_READ_SIZE)) > 0
+        except OSError:
+            return False
+
+    def get_alarm_health(self):
+        """
+        Return last alarm pre-flight check result
+
+        Returns:
+            dict: alarm health::
 
-        self._change_audio_player_status(pause=False, volume=volume)
+                {
+                    healthy (bool): True if alarm playlist can be played
+                    reason (str): degradation reason. None if healthy
+                    checked (int): check timestamp. None if not checked yet
+                }
+
+        """
+        return dict(self.alarm_health)
 
     def _stop_alarm(self, snoozed=False):
         """
@@ -556,43 +3614,97 @@ class Localmusic(CleepRenderer):
         Args:
             snoozed (bool): True if snoozed was triggered and player must be paused instead of stopped
         """
-        self.logger.debug("Stop alarm snoozed=%s", snoozed)
-        if not self.playback["playeruuid"]:
-            self.logger.warning(
-                "Unable to stop alarm for non exiting or deleted player"
-            )
-            return
+        with self.playback_lock:
+            self.logger.debug("Stop alarm snoozed=%s", snoozed)
+            playback = self.playbacks.get_alarm()
+            if not playback:
+                self.logger.warning(
+                    "Unable to stop alarm for non exiting or deleted player"
+                )
+                return
 
-        if snoozed:
-            self._change_audio_player_status(pause=True)
-        else:
-            self._destroy_audio_player()
+            if snoozed:
+                self._change_audio_player_status(playback, pause=True)
+            else:
+                self._destroy_audio_player(playback["playeruuid"])
 
-    def _change_audio_player_status(self, pause, volume=None):
+    def _change_audio_player_status(self, playback, pause, volume=None):
         """
         Change audio player playback. A player must have been created before!
-        If previous playlist name match with latest played, track will be restored
 
         Args:
+            playback (dict): playback
             pause (bool): True to pause playback, False to start playback
             volume (int): if specified set volume
         """
         self.logger.debug("Change audio player status pause=%s vol=%s", pause, volume)
-        if not self.playback["playeruuid"]:
+        if not playback:
             self.logger.warning(
                 "Unable to change audio player status because no player has been created"
             )
             return
 
-        self.logger.debug("playback: %s", self.playback)
+        self.logger.debug("playback: %s", PlaybackRegistry.get_infos(playback))
         params = {
-            "player_uuid": self.playback["playeruuid"],
+            "player_uuid": playback["playeruuid"],
             "force_pause": pause,
             "force_play": not pause,
         }
         if volume is not None:
-            params["volume"] = volume
-        player_status = self.send_command_advanced(
-            "pause_playback", "audioplayer", params
+            playback["volume"] = volume
+            params["volume"] = self._get_track_volume(playback, volume)
+        player_status = self.audioplayer.call(
+            "pause_playback", params, bypass_breaker=playback["alarm"]
         )
         self.logger.info("Audio player playback is now %s", player_status)
+
+    def _get_track_volume(self, playback, volume):
+        """
+        Return volume adjusted with current track gain if normalization is enabled. Adjusted
+        volume is clamped to 100, so positive gain is limited by volume headroom
+
+        Args:
+            playback (dict): playback
+            volume (int): player volume
+
+        Returns:
+            int: volume to apply for current track
+        """
+        index = playback["index"] or 0
+        if not self._get_config_field("normalize") or index >= len(playback["tracks"]):
+            return volume
+
+        filename = os.path.basename(playback["tracks"][index])
+        gain = self.library.get_metadata(filename, "gain")
+        if gain is None:
+            return volume
+
+        return int(max(0, min(100, round(volume * 10 ** (gain / 20.0)))))
+
+    def _apply_track_gain(self, playback):
+        """
+        Apply current track gain on player volume. Audioplayer only handles player volume, so
+        volume is updated when player reports a new track is playing: first track gain is applied
+        when playback starts, next tracks start with previous track volume for a short moment.
+        Command is sent asynchronously so caller (holding playback lock) is not blocked.
+
+        Note:
+            Volume cannot exceed 100, so gain is attenuate only when player volume is already
+            100: positive gain is applied only within player volume headroom
+
+        Args:
+            playback (dict): playback
+        """
+        if playback["volume"] is None or not self._get_config_field("normalize"):
+            return
+
+        self.audioplayer.submit(
+            "pause_playback",
+            {
+                "player_uuid": playback["playeruuid"],
+                "force_pause": False,
+                "force_play": True,
+                "volume": self._get_track_volume(playback, playback["volume"]),
+            },
+            bypass_breaker=playback["alarm"],
+        )
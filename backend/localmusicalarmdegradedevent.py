@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from cleep.libs.internals.event import Event
+
+
+class LocalmusicAlarmDegradedEvent(Event):
+    """
+    Localmusic alarm degraded event
+    """
+
+    EVENT_NAME = "localmusic.alarm.degraded"
+    EVENT_PROPAGATE = False
+    EVENT_PARAMS = ["reason", "fallback"]
+
+    def __init__(self, params):
+        """
+        Constructor
+
+        Args:
+            params (dict): event parameters
+        """
+        Event.__init__(self, params)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from cleep.libs.internals.event import Event
+
+
+class LocalmusicLibraryUpdateEvent(Event):
+    """
+    Localmusic library update event
+    """
+
+    EVENT_NAME = "localmusic.library.update"
+    EVENT_PROPAGATE = False
+    EVENT_PARAMS = ["version", "since", "reload", "added", "removed", "changed"]
+
+    def __init__(self, params):
+        """
+        Constructor
+
+        Args:
+            params (dict): event parameters
+        """
+        Event.__init__(self, params)
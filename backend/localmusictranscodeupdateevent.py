@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from cleep.libs.internals.event import Event
+
+
+class LocalmusicTranscodeUpdateEvent(Event):
+    """
+    Localmusic transcode update event
+    """
+
+    EVENT_NAME = "localmusic.transcode.update"
+    EVENT_PROPAGATE = False
+    EVENT_PARAMS = ["jobid", "filename", "status", "progress", "error"]
+
+    def __init__(self, params):
+        """
+        Constructor
+
+        Args:
+            params (dict): event parameters
+        """
+        Event.__init__(self, params)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+class PlaybackRegistry:
+    """
+    Playback registry
+
+    Thread safe registry of running playbacks keyed by audioplayer player uuid, so player events
+    are routed in constant time. Alarm playback is flagged and always runs on its own player.
+
+    Playback::
+
+        {
+            playeruuid (str): audioplayer player uuid
+            playlistname (str): played playlist name
+            alarm (bool): True if playback is the alarm playback
+            index (int): playing track index in player tracks. None if not started yet
+            tracks (list): player track paths
+            startindex (int): index in playlist of first player track
+            shuffle (bool): True if tracks are dealt by shuffle engine and queued while playing
+            repeat (bool): True if shuffled playback never ends
+            volume (int): player volume. None if not set yet
+            playingtrack (dict): playing track listening infos. None if no track playing
+        }
+
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.__lock = threading.RLock()
+        self.__playbacks = {}
+        self.__alarm_uuid = None
+
+    @staticmethod
+    def new_playback(
+        player_uuid,
+        playlist_name,
+        tracks,
+        start_index=0,
+        alarm=False,
+        shuffle=False,
+        repeat=False,
+    ):
+        """
+        Create new playback
+
+        Args:
+            player_uuid (str): audioplayer player uuid
+            playlist_name (str): playlist name
+            tracks (list): player track paths
+            start_index (int): index in playlist of first player track
+            alarm (bool): True if playback is the alarm playback
+            shuffle (bool): True if tracks are dealt by shuffle engine
+            repeat (bool): True if shuffled playback never ends
+
+        Returns:
+            dict: playback
+        """
+        return {
+            "playeruuid": player_uuid,
+            "playlistname": playlist_name,
+            "alarm": alarm,
+            "index": None,
+            "tracks": list(tracks),
+            "startindex": start_index,
+            "shuffle": shuffle,
+            "repeat": repeat,
+            "volume": None,
+            "playingtrack": None,
+        }
+
+    @staticmethod
+    def get_infos(playback):
+        """
+        Return public playback infos
+
+        Args:
+            playback (dict): playback
+
+        Returns:
+            dict: playback infos::
+
+                {
+                    playeruuid (str): player uuid
+                    playlistname (str): played playlist
+                    index (int): played playlist track index. None if not started yet
+                    alarm (bool): True if playback is the alarm playback
+                }
+
+        """
+        index = playback["index"]
+        return {
+            "playeruuid": playback["playeruuid"],
+            "playlistname": playback["playlistname"],
+            "index": None if index is None else playback["startindex"] + index,
+            "alarm": playback["alarm"],
+        }
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__playbacks)
+
+    def __contains__(self, player_uuid):
+        with self.__lock:
+            return player_uuid in self.__playbacks
+
+    def add(self, playback):
+        """
+        Register playback
+
+        Args:
+            playback (dict): playback
+        """
+        with self.__lock:
+            self.__playbacks[playback["playeruuid"]] = playback
+            if playback["alarm"]:
+                self.__alarm_uuid = playback["playeruuid"]
+
+    def get(self, player_uuid):
+        """
+        Return playback of specified player
+
+        Args:
+            player_uuid (str): player uuid
+
+        Returns:
+            dict: playback or None if player is not registered
+        """
+        with self.__lock:
+            return self.__playbacks.get(player_uuid)
+
+    def get_alarm(self):
+        """
+        Return alarm playback
+
+        Returns:
+            dict: alarm playback or None if no alarm is playing
+        """
+        with self.__lock:
+            return self.__playbacks.get(self.__alarm_uuid)
+
+    def get_all(self):
+        """
+        Return all playbacks
+
+        Returns:
+            list: list of playbacks
+        """
+        with self.__lock:
+            return list(self.__playbacks.values())
+
+    def remove(self, player_uuid):
+        """
+        Unregister playback
+
+        Args:
+            player_uuid (str): player uuid
+
+        Returns:
+            dict: removed playback or None if player was not registered
+        """
+        with self.__lock:
+            if player_uuid == self.__alarm_uuid:
+                self.__alarm_uuid = None
+            return self.__playbacks.pop(player_uuid, None)
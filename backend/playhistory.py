@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import threading
+from contextlib import closing
+
+
+class PlayHistory:
+    """
+    Play history
+
+    Records played tracks into a SQLite database. Plays are buffered in memory and written in a
+    single transaction when buffer is full or after a delay, to limit writes on SD card. Per track
+    aggregates are kept in memory so statistics never hit the database. Oldest plays beyond
+    MAX_RECORDS are rolled into a per track summary table, so aggregates loaded from database
+    always match the in-memory ones.
+    """
+
+    DEFAULT_BUFFER_SIZE = 50
+    DEFAULT_FLUSH_DELAY = 300.0  # seconds
+    MAX_RECORDS = 50000
+    SKIP_DURATION = 30.0  # seconds
+
+    def __init__(
+        self,
+        logger,
+        db_path=None,
+        buffer_size=DEFAULT_BUFFER_SIZE,
+        flush_delay=DEFAULT_FLUSH_DELAY,
+    ):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            db_path (str): database file path
+            buffer_size (int): max number of plays kept in memory before flushing
+            flush_delay (float): max delay plays are kept in memory before flushing (seconds)
+        """
+        self.logger = logger
+        self.db_path = db_path
+        self.buffer_size = buffer_size
+        self.flush_delay = flush_delay
+        self.__lock = threading.RLock()
+        self.__buffer = []
+        self.__flush_timer = None
+        # aggregates by filename
+        # {
+        #   filename (str): {
+        #       playcount (int): number of plays
+        #       skipcount (int): number of plays shorter than SKIP_DURATION
+        #       lastplayed (int): last play timestamp
+        #       playtime (float): total listening time (seconds)
+        #   },
+        #   ...
+        # }
+        self.__tracks = {}
+
+    def open(self):
+        """
+        Create database if necessary and load aggregates (trimmed plays summaries and plays)
+        """
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with self.__lock, closing(sqlite3.connect(self.db_path)) as connection:
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS plays "
+                    "(timestamp INTEGER, filename TEXT, playlist TEXT, duration REAL)"
+                )
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS summaries "
+                    "(filename TEXT PRIMARY KEY, playcount INTEGER, skipcount INTEGER, "
+                    "lastplayed INTEGER, playtime REAL)"
+                )
+            rows = connection.execute(
+                "SELECT filename, SUM(playcount), SUM(skipcount), MAX(lastplayed), "
+                "SUM(playtime) FROM ("
+                "SELECT filename, playcount, skipcount, lastplayed, playtime FROM summaries "
+                "UNION ALL SELECT filename, duration >= ?, duration < ?, timestamp, duration "
+                "FROM plays) GROUP BY filename",
+                (self.SKIP_DURATION, self.SKIP_DURATION),
+            ).fetchall()
+
+            self.__tracks = {
+                filename: {
+                    "playcount": playcount,
+                    "skipcount": skipcount,
+                    "lastplayed": lastplayed,
+                    "playtime": playtime,
+                }
+                for filename, playcount, skipcount, lastplayed, playtime in rows
+            }
+
+    def close(self):
+        """
+        Flush pending plays
+        """
+        self.flush()
+
+    def record(self, filename, playlist_name, duration, timestamp=None):
+        """
+        Record track play
+
+        Args:
+            filename (str): track filename
+            playlist_name (str): playlist name (None for alarm)
+            duration (float): listening duration (seconds)
+            timestamp (int): play timestamp. Now if not specified
+        """
+        timestamp = int(timestamp or time.time())
+        with self.__lock:
+            self.__buffer.append((timestamp, filename, playlist_name, round(duration, 1)))
+
+            track = self.__tracks.setdefault(
+                filename,
+                {"playcount": 0, "skipcount": 0, "lastplayed": 0, "playtime": 0.0},
+            )
+            if duration < self.SKIP_DURATION:
+                track["skipcount"] += 1
+            else:
+                track["playcount"] += 1
+            track["lastplayed"] = max(track["lastplayed"], timestamp)
+            track["playtime"] += duration
+
+            if len(self.__buffer) >= self.buffer_size:
+                self.flush()
+            elif not self.__flush_timer:
+                self.__flush_timer = threading.Timer(self.flush_delay, self.flush)
+                self.__flush_timer.daemon = True
+                self.__flush_timer.start()
+
+    def flush(self):
+        """
+        Write buffered plays to database in a single transaction. Plays beyond MAX_RECORDS are
+        rolled into summaries before being deleted
+        """
+        with self.__lock:
+            if self.__flush_timer:
+                self.__flush_timer.cancel()
+                self.__flush_timer = None
+            plays, self.__buffer = self.__buffer, []
+            if not plays or not self.db_path:
+                return
+
+            try:
+                with closing(sqlite3.connect(self.db_path)) as connection, connection:
+                    connection.executemany(
+                        "INSERT INTO plays VALUES (?, ?, ?, ?)", plays
+                    )
+                    self.__trim(connection)
+                self.logger.debug("%s plays written to history", len(plays))
+            except sqlite3.Error:
+                self.logger.exception("Unable to write play history")
+
+    def __trim(self, connection):
+        """
+        Roll oldest plays beyond MAX_RECORDS into per track summaries
+
+        Args:
+            connection (Connection): database connection (in transaction)
+        """
+        (max_rowid,) = connection.execute("SELECT MAX(rowid) FROM plays").fetchone()
+        if max_rowid is None or max_rowid <= self.MAX_RECORDS:
+            return
+
+        last_rowid = max_rowid - self.MAX_RECORDS
+        connection.execute(
+            "INSERT INTO summaries SELECT filename, SUM(duration >= ?), SUM(duration < ?), "
+            "MAX(timestamp), SUM(duration) FROM plays WHERE rowid <= ? GROUP BY filename "
+            "ON CONFLICT(filename) DO UPDATE SET "
+            "playcount = playcount + excluded.playcount, "
+            "skipcount = skipcount + excluded.skipcount, "
+            "lastplayed = MAX(lastplayed, excluded.lastplayed), "
+            "playtime = playtime + excluded.playtime",
+            (self.SKIP_DURATION, self.SKIP_DURATION, last_rowid),
+        )
+        connection.execute("DELETE FROM plays WHERE rowid <= ?", (last_rowid,))
+
+    def get_track_stats(self, filename):
+        """
+        Return track statistics
+
+        Args:
+            filename (str): track filename
+
+        Returns:
+            dict: track statistics (see get_stats)
+        """
+        with self.__lock:
+            track = self.__tracks.get(filename)
+            if not track:
+                return {"playcount": 0, "skipcount": 0, "lastplayed": 0, "playtime": 0.0}
+            return dict(track)
+
+    def get_stats(self, filenames, limit=10):
+        """
+        Return play statistics of specified library files
+
+        Args:
+            filenames (list): library filenames
+            limit (int): max number of tracks in lists
+
+        Returns:
+            dict: statistics::
+
+                {
+                    totalplays (int): number of plays (skips excluded)
+                    totalplaytime (float): total listening time (seconds)
+                    mostplayed (list): most played tracks [{filename, playcount, skipcount, lastplayed, playtime}, ...]
+                    mostskipped (list): most skipped tracks [{filename, playcount, skipcount, lastplayed, playtime}, ...]
+                    neverplayed (list): filenames of tracks never played
+                }
+
+        """
+        with self.__lock:
+            tracks = [
+                {"filename": filename, **self.__tracks[filename]}
+                for filename in filenames
+                if filename in self.__tracks
+            ]
+            never_played = [
+                filename for filename in filenames if filename not in self.__tracks
+            ]
+
+        most_played = sorted(
+            (track for track in tracks if track["playcount"]),
+            key=lambda track: (-track["playcount"], -track["lastplayed"]),
+        )
+        most_skipped = sorted(
+            (track for track in tracks if track["skipcount"]),
+            key=lambda track: (-track["skipcount"], track["playcount"]),
+        )
+
+        return {
+            "totalplays": sum(track["playcount"] for track in tracks),
+            "totalplaytime": round(sum(track["playtime"] for track in tracks), 1),
+            "mostplayed": most_played[:limit],
+            "mostskipped": most_skipped[:limit],
+            "neverplayed": sorted(never_played)[:limit],
+        }
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+from urllib.parse import unquote, urlparse
+
+
+class PlaylistFile:
+    """
+    Playlist file
+
+    Reads and writes M3U, M3U8 and PLS playlist files. Files are streamed line by line so memory
+    usage does not depend on playlist length.
+    """
+
+    FORMAT_M3U = "m3u"
+    FORMAT_M3U8 = "m3u8"
+    FORMAT_PLS = "pls"
+    FORMATS = [FORMAT_M3U, FORMAT_M3U8, FORMAT_PLS]
+
+    @staticmethod
+    def get_format(path):
+        """
+        Return playlist format from file extension
+
+        Args:
+            path (str): playlist file path
+
+        Returns:
+            str: playlist format or None if format is not supported
+        """
+        extension = os.path.splitext(path)[1][1:].lower()
+        return extension if extension in PlaylistFile.FORMATS else None
+
+    @staticmethod
+    def read(path):
+        """
+        Read playlist entries
+
+        Args:
+            path (str): playlist file path
+
+        Yields:
+            tuple: line number and entry location as written in playlist (path or url)
+
+        Raises:
+            ValueError: if playlist format is not supported
+        """
+        playlist_format = PlaylistFile.get_format(path)
+        if not playlist_format:
+            raise ValueError("Unsupported playlist format")
+
+        # m3u has no defined encoding, utf-8 is the most common nowadays
+        with open(path, "r", encoding="utf-8-sig", errors="replace") as fdesc:
+            for line_number, line in enumerate(fdesc, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                if playlist_format == PlaylistFile.FORMAT_PLS:
+                    key, _, value = line.partition("=")
+                    if key.lower().startswith("file") and value.strip():
+                        yield line_number, value.strip()
+                elif not line.startswith("#"):
+                    yield line_number, line
+
+    @staticmethod
+    def write(path, tracks):
+        """
+        Write playlist file. Format is deduced from file extension
+
+        Args:
+            path (str): playlist file path
+            tracks (iterable): tracks as (location, title, duration in seconds or None) tuples
+
+        Raises:
+            ValueError: if playlist format is not supported
+        """
+        playlist_format = PlaylistFile.get_format(path)
+        if not playlist_format:
+            raise ValueError("Unsupported playlist format")
+
+        with open(path, "w", encoding="utf-8", newline="\n") as fdesc:
+            if playlist_format == PlaylistFile.FORMAT_PLS:
+                fdesc.write("[playlist]\n")
+            else:
+                fdesc.write("#EXTM3U\n")
+
+            count = 0
+            for count, (location, title, duration) in enumerate(tracks, start=1):
+                length = int(round(duration)) if duration is not None else -1
+                if playlist_format == PlaylistFile.FORMAT_PLS:
+                    fdesc.write(f"File{count}={location}\n")
+                    fdesc.write(f"Title{count}={title}\n")
+                    fdesc.write(f"Length{count}={length}\n")
+                else:
+                    fdesc.write(f"#EXTINF:{length},{title}\n{location}\n")
+
+            if playlist_format == PlaylistFile.FORMAT_PLS:
+                fdesc.write(f"NumberOfEntries={count}\nVersion=2\n")
+
+
+class PlaylistResolver:
+    """
+    Playlist resolver
+
+    Resolves playlist entries against library index entries. Entries are matched on their
+    longest path suffix relative to library root, then on filename only.
+    """
+
+    MAX_UNRESOLVED_SAMPLES = 10
+
+    def __init__(self, entries, root_path):
+        """
+        Constructor
+
+        Args:
+            entries (list): library index entries
+            root_path (str): library root path
+        """
+        self.__by_relative_path = {}
+        self.__by_filename = {}
+        for entry in entries:
+            relative = os.path.relpath(entry["path"], root_path).replace(os.sep, "/")
+            self.__by_relative_path[relative.lower()] = entry["filename"]
+            self.__by_filename.setdefault(entry["filename"].lower(), entry["filename"])
+        self.unresolved_count = 0
+        self.unresolved_samples = []
+
+    def resolve(self, line_number, location):
+        """
+        Resolve playlist entry
+
+        Args:
+            line_number (int): playlist line number
+            location (str): entry location
+
+        Returns:
+            str: library filename or None if entry is not in library
+        """
+        filename = self.__resolve(location)
+        if filename is None:
+            self.unresolved_count += 1
+            if len(self.unresolved_samples) < self.MAX_UNRESOLVED_SAMPLES:
+                self.unresolved_samples.append({"line": line_number, "entry": location})
+        return filename
+
+    def __resolve(self, location):
+        """
+        Resolve location
+
+        Args:
+            location (str): entry location
+
+        Returns:
+            str: library filename or None if entry is not in library
+        """
+        url = urlparse(location)
+        if url.scheme == "file":
+            location = unquote(url.path)
+        elif len(url.scheme) > 1:
+            # streams are not supported (single letter scheme is a windows drive)
+            return None
+
+        parts = [part for part in location.replace("\\", "/").split("/") if part]
+        for start in range(len(parts)):
+            filename = self.__by_relative_path.get("/".join(parts[start:]).lower())
+            if filename:
+                return filename
+
+        return self.__by_filename.get(parts[-1].lower()) if parts else None
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import mmap
+import errno
+import ssl
+import time
+import secrets
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header, size):
+    """
+    Parse single HTTP Range header
+
+    Args:
+        header (str): Range header value. None if request has no range
+        size (int): file size
+
+    Returns:
+        tuple: first and last byte positions (inclusive). None if range is not satisfiable
+
+    Raises:
+        ValueError: if header is invalid or contains multiple ranges (whole file must be sent)
+    """
+    if header is None:
+        return (0, size - 1) if size else None
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        raise ValueError("Unsupported range")
+
+    start, end = match.groups()
+    if not start:
+        # suffix range: last bytes
+        length = int(end)
+        return (max(0, size - length), size - 1) if length and size else None
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or end < start:
+        return None
+
+    return start, end
+
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    """
+    Preview request handler serving registered tracks with HTTP Range support
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "LocalmusicPreview"
+
+    def do_HEAD(self):
+        """
+        Handle HEAD request
+        """
+        self.__handle(send_body=False)
+
+    def do_GET(self):
+        """
+        Handle GET request
+        """
+        self.__handle(send_body=True)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """
+        Log requests with server logger instead of stderr
+        """
+        self.server.logger.debug("Preview %s: %s", self.address_string(), format % args)
+
+    def __handle(self, send_body):
+        """
+        Handle request
+
+        Args:
+            send_body (bool): True to send file content
+        """
+        track = self.server.get_track(self.path)
+        if not track:
+            self.send_error(404)
+            return
+        if not self.server.streams.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        try:
+            with open(track["path"], "rb") as fdesc:
+                self.__send_file(fdesc, track["mimetype"], send_body)
+        except OSError:
+            self.server.logger.debug('Unable to stream "%s"', track["path"])
+            self.close_connection = True
+        finally:
+            self.server.streams.release()
+
+    def __send_file(self, fdesc, mimetype, send_body):
+        """
+        Send file (or requested range of it)
+
+        Args:
+            fdesc (file): file descriptor
+            mimetype (str): file mime type
+            send_body (bool): True to send file content
+        """
+        size = os.fstat(fdesc.fileno()).st_size
+        header = self.headers.get("Range")
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            header = None
+            byte_range = parse_range(None, size)
+        if header is not None and byte_range is None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = byte_range if byte_range else (0, -1)
+        length = end - start + 1
+        self.send_response(206 if header is not None else 200)
+        self.send_header("Content-Type", mimetype)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Cache-Control", "no-store")
+        if header is not None:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if send_body and length > 0:
+            self.wfile.flush()
+            self.server.send_range(self.connection, fdesc, start, length)
+
+
+class PreviewServer(ThreadingHTTPServer):
+    """
+    Preview server
+
+    Small HTTP(S) server streaming library tracks to web UI for preview. Only tracks registered
+    through an expiring random token are served, with HTTP Range support so browsers can seek.
+    It must use TLS when web UI is served over https, otherwise browsers block previews as
+    mixed content.
+    File content is sent with zero-copy sendfile (memory mapped reads as fallback), never
+    loaded in Python memory, and the number of concurrent streams is limited to protect
+    audioplayer disk reads.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    URL_PREFIX = "/preview/"
+    TOKEN_TTL = 3600.0  # seconds
+    MAX_STREAMS = 2
+    CHUNK_SIZE = 262144
+
+    def __init__(self, logger, port, max_streams=MAX_STREAMS, ssl_context=None):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            port (int): listening port (0 for any free port)
+            max_streams (int): max number of concurrent streams
+            ssl_context (SSLContext): server TLS context. None to serve plain HTTP
+
+        Raises:
+            OSError: if port cannot be bound
+        """
+        ThreadingHTTPServer.__init__(self, ("", port), PreviewRequestHandler)
+        self.logger = logger
+        self.ssl_context = ssl_context
+        self.streams = threading.BoundedSemaphore(max_streams)
+        self.__lock = threading.Lock()
+        self.__thread = None
+        # registered tracks by token
+        # {
+        #   token (str): {
+        #       path (str): track path
+        #       mimetype (str): track mime type
+        #       expiration (float): monotonic time token expires
+        #   },
+        #   ...
+        # }
+        self.__tracks = {}
+
+    @property
+    def port(self):
+        """
+        Listening port
+        """
+        return self.server_address[1]
+
+    @property
+    def secure(self):
+        """
+        True if server uses TLS
+        """
+        return self.ssl_context is not None
+
+    def finish_request(self, request, client_address):
+        """
+        Handle request in its own thread. TLS handshake is performed here and not on
+        accepting connection, so a slow client cannot block other ones
+
+        Args:
+            request (socket): client socket
+            client_address (tuple): client address
+        """
+        if not self.ssl_context:
+            ThreadingHTTPServer.finish_request(self, request, client_address)
+            return
+
+        try:
+            request = self.ssl_context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError) as error:
+            self.logger.debug("Preview TLS handshake failed: %s", error)
+            return
+        try:
+            ThreadingHTTPServer.finish_request(self, request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def start(self):
+        """
+        Start serving in background thread
+        """
+        self.__thread = threading.Thread(
+            target=self.serve_forever, name="localmusic-preview", daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop server. Running streams are not waited
+        """
+        if self.__thread:
+            self.shutdown()
+            self.__thread = None
+        self.server_close()
+
+    def register(self, path, mimetype):
+        """
+        Register track to serve
+
+        Args:
+            path (str): track path
+            mimetype (str): track mime type
+
+        Returns:
+            str: track url path
+        """
+        now = time.monotonic()
+        token = secrets.token_urlsafe(16)
+        with self.__lock:
+            self.__tracks = {
+                key: track
+                for key, track in self.__tracks.items()
+                if track["expiration"] > now
+            }
+            self.__tracks[token] = {
+                "path": path,
+                "mimetype": mimetype,
+                "expiration": now + self.TOKEN_TTL,
+            }
+
+        return self.URL_PREFIX + token
+
+    def get_track(self, url_path):
+        """
+        Return track registered for specified url path
+
+        Args:
+            url_path (str): request path
+
+        Returns:
+            dict: registered track or None if token is unknown or expired
+        """
+        if not url_path.startswith(self.URL_PREFIX):
+            return None
+        token = url_path[len(self.URL_PREFIX) :].split("?", 1)[0]
+        with self.__lock:
+            track = self.__tracks.get(token)
+            if not track or track["expiration"] <= time.monotonic():
+                return None
+            return track
+
+    def send_range(self, connection, fdesc, offset, length):
+        """
+        Send file range to client socket without copying it in Python memory when possible
+        (zero-copy is not available on TLS connection)
+
+        Args:
+            connection (socket): client socket
+            fdesc (file): file descriptor
+            offset (int): first byte to send
+            length (int): number of bytes to send
+
+        Raises:
+            OSError: if sending failed
+        """
+        # sendfile would bypass TLS layer and send clear data on secure connection
+        if hasattr(os, "sendfile") and not isinstance(connection, ssl.SSLSocket):
+            try:
+                while length > 0:
+                    sent = os.sendfile(
+                        connection.fileno(),
+                        fdesc.fileno(),
+                        offset,
+                        min(length, self.CHUNK_SIZE),
+                    )
+                    if sent == 0:
+                        return
+                    offset += sent
+                    length -= sent
+                return
+            except OSError as error:
+                if error.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                # sendfile not supported for this file or socket, use mmap
+
+        with mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while length > 0:
+                chunk = data[offset : offset + min(length, self.CHUNK_SIZE)]
+                connection.sendall(chunk)
+                offset += len(chunk)
+                length -= len(chunk)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+
+
+class ShuffleEngine:
+    """
+    Shuffle engine
+
+    Keeps one random permutation of tracks per playlist with a cursor on next track to deal.
+    Tracks are dealt a few at a time, so players only receive a window of upcoming tracks,
+    and a new permutation is generated only once every track of playlist has been dealt. State
+    is exported to be persisted, so no track is repeated across playbacks (alarm sessions)
+    until whole playlist has been played.
+
+    Playlist content changes are merged into current permutation: removed tracks are dropped
+    and added tracks are inserted at random positions among not dealt tracks.
+    """
+
+    def __init__(self, rand=None):
+        """
+        Constructor
+
+        Args:
+            rand (Random): random generator. Default one is used if not specified
+        """
+        self.__rand = rand or random.Random()
+        self.__lock = threading.Lock()
+        # shuffle states by playlist name
+        # {
+        #   playlist name (str): {
+        #       permutation (list): shuffled tracks
+        #       cursor (int): index of next track to deal
+        #   },
+        #   ...
+        # }
+        self.__states = {}
+
+    def deal(self, playlist_name, tracks, count):
+        """
+        Deal next tracks of playlist permutation. When all tracks have been dealt, a new
+        permutation is generated that does not start with last dealt track
+
+        Args:
+            playlist_name (str): playlist name
+            tracks (list): current playlist tracks
+            count (int): number of tracks to deal
+
+        Returns:
+            list: dealt tracks. Empty list if playlist is empty
+        """
+        with self.__lock:
+            state = self.__get_state(playlist_name, tracks)
+            dealt = []
+            while len(dealt) < count and state["permutation"]:
+                if state["cursor"] >= len(state["permutation"]):
+                    self.__reshuffle(state)
+                dealt.append(state["permutation"][state["cursor"]])
+                state["cursor"] += 1
+
+            return dealt
+
+    def restore(self, playlist_name, tracks):
+        """
+        Give back dealt tracks that were not played. They will be dealt first next time, in
+        the same order
+
+        Args:
+            playlist_name (str): playlist name
+            tracks (list): dealt tracks not played
+        """
+        with self.__lock:
+            state = self.__states.get(playlist_name)
+            if not state:
+                return
+
+            permutation = state["permutation"]
+            for track in reversed(tracks):
+                if track not in permutation:
+                    continue
+                if permutation.index(track) < state["cursor"]:
+                    state["cursor"] -= 1
+                permutation.remove(track)
+                permutation.insert(state["cursor"], track)
+
+    def rename(self, playlist_name, new_playlist_name):
+        """
+        Rename playlist shuffle state
+
+        Args:
+            playlist_name (str): playlist name
+            new_playlist_name (str): new playlist name
+        """
+        with self.__lock:
+            if playlist_name in self.__states:
+                self.__states[new_playlist_name] = self.__states.pop(playlist_name)
+
+    def remove(self, playlist_name):
+        """
+        Remove playlist shuffle state
+
+        Args:
+            playlist_name (str): playlist name
+        """
+        with self.__lock:
+            self.__states.pop(playlist_name, None)
+
+    def export_state(self):
+        """
+        Export shuffle states
+
+        Returns:
+            dict: shuffle states by playlist name
+        """
+        with self.__lock:
+            return {
+                playlist_name: {
+                    "permutation": list(state["permutation"]),
+                    "cursor": state["cursor"],
+                }
+                for playlist_name, state in self.__states.items()
+            }
+
+    def import_state(self, data):
+        """
+        Import shuffle states previously exported. Invalid states are dropped
+
+        Args:
+            data (dict): shuffle states by playlist name
+        """
+        with self.__lock:
+            self.__states = {}
+            for playlist_name, state in data.items():
+                try:
+                    permutation = list(state["permutation"])
+                    cursor = max(0, min(int(state["cursor"]), len(permutation)))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                self.__states[playlist_name] = {
+                    "permutation": permutation,
+                    "cursor": cursor,
+                }
+
+    def __get_state(self, playlist_name, tracks):
+        """
+        Return playlist shuffle state, created or merged with current playlist tracks
+
+        Args:
+            playlist_name (str): playlist name
+            tracks (list): current playlist tracks
+
+        Returns:
+            dict: shuffle state
+        """
+        state = self.__states.get(playlist_name)
+        if not state:
+            permutation = list(dict.fromkeys(tracks))
+            self.__rand.shuffle(permutation)
+            state = {"permutation": permutation, "cursor": 0}
+            self.__states[playlist_name] = state
+            return state
+
+        current = set(tracks)
+        known = set(state["permutation"])
+        if current == known:
+            return state
+
+        # drop removed tracks, keeping cursor on same next track
+        cursor = state["cursor"]
+        dealt = [track for track in state["permutation"][:cursor] if track in current]
+        pending = [track for track in state["permutation"][cursor:] if track in current]
+        # added tracks will be played during current permutation
+        for track in dict.fromkeys(tracks):
+            if track not in known:
+                pending.insert(self.__rand.randint(0, len(pending)), track)
+        state["permutation"] = dealt + pending
+        state["cursor"] = len(dealt)
+
+        return state
+
+    def __reshuffle(self, state):
+        """
+        Generate new permutation. Last dealt track is not dealt first to avoid playing it twice
+        in a row
+
+        Args:
+            state (dict): shuffle state
+        """
+        permutation = state["permutation"]
+        last = permutation[-1] if permutation else None
+        permutation = list(permutation)
+        self.__rand.shuffle(permutation)
+        if len(permutation) > 1 and permutation[0] == last:
+            swap = self.__rand.randint(1, len(permutation) - 1)
+            permutation[0], permutation[swap] = permutation[swap], permutation[0]
+        state["permutation"] = permutation
+        state["cursor"] = 0
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import random
+
+
+class SmartPlaylist:
+    """
+    Smart playlist
+
+    Playlist defined by rules evaluated against library index entries. Filtering rules are
+    evaluated incrementally when library changes, ordering and limit are applied lazily when
+    playlist is materialized. Random order is drawn from playlist seed, so playlist is
+    materialized the same way (for alarm cache, preflight, playback...) until it is reseeded.
+
+    Rules::
+
+        {
+            folder (str): files in this folder (relative to storage path, subfolders included)
+            tag (dict): files with tag {name (str), value (str)} (case insensitive)
+            addedsince (float): files added (modified) after this timestamp
+            minduration (float): files lasting at least this duration (seconds)
+            maxduration (float): files lasting at most this duration (seconds)
+            order (str): tracks order (name, random, leastplayed). Default name
+            limit (int): max number of tracks
+        }
+
+    """
+
+    ORDER_NAME = "name"
+    ORDER_RANDOM = "random"
+    ORDER_LEAST_PLAYED = "leastplayed"
+    ORDERS = [ORDER_NAME, ORDER_RANDOM, ORDER_LEAST_PLAYED]
+
+    RULES = {
+        "folder": str,
+        "tag": dict,
+        "addedsince": (int, float),
+        "minduration": (int, float),
+        "maxduration": (int, float),
+        "order": str,
+        "limit": int,
+    }
+
+    def __init__(self, rules, root_path):
+        """
+        Constructor
+
+        Args:
+            rules (dict): playlist rules
+            root_path (str): library root path (used by folder rule)
+
+        Raises:
+            ValueError: if rules are invalid
+        """
+        SmartPlaylist.check_rules(rules)
+        self.rules = rules
+        self.root_path = root_path
+        self.seed = random.getrandbits(32)
+        # matching entries by filename
+        self.__matches = {}
+
+    @staticmethod
+    def check_rules(rules):
+        """
+        Check rules validity
+
+        Args:
+            rules (dict): playlist rules
+
+        Raises:
+            ValueError: if rules are invalid
+        """
+        if not isinstance(rules, dict) or not rules:
+            raise ValueError("Rules must be a non empty dict")
+        for name, value in rules.items():
+            if name not in SmartPlaylist.RULES:
+                raise ValueError(f'Unknown rule "{name}"')
+            if not isinstance(value, SmartPlaylist.RULES[name]) or isinstance(
+                value, bool
+            ):
+                raise ValueError(f'Rule "{name}" has invalid value')
+        if "tag" in rules and not (
+            isinstance(rules["tag"].get("name"), str)
+            and isinstance(rules["tag"].get("value"), str)
+        ):
+            raise ValueError('Rule "tag" must contain name and value')
+        if rules.get("order", SmartPlaylist.ORDER_NAME) not in SmartPlaylist.ORDERS:
+            raise ValueError(
+                f'Rule "order" must be one of {", ".join(SmartPlaylist.ORDERS)}'
+            )
+        if rules.get("limit", 1) <= 0:
+            raise ValueError('Rule "limit" must be greater than 0')
+
+    def __len__(self):
+        return len(self.__matches)
+
+    def matches(self, entry):
+        """
+        Check if library entry matches playlist filtering rules
+
+        Args:
+            entry (dict): library index entry
+
+        Returns:
+            bool: True if entry matches
+        """
+        rules = self.rules
+        metadata = entry.get("metadata") or {}
+
+        if "folder" in rules:
+            folder = rules["folder"].strip("/")
+            relative = os.path.relpath(os.path.dirname(entry["path"]), self.root_path)
+            relative = "" if relative == "." else relative
+            if folder and relative != folder and not relative.startswith(folder + "/"):
+                return False
+
+        if "tag" in rules:
+            tags = metadata.get("tags") or {}
+            value = tags.get(rules["tag"]["name"].lower())
+            if value is None or str(value).lower() != rules["tag"]["value"].lower():
+                return False
+
+        if "addedsince" in rules and (entry.get("mtime") or 0) < rules["addedsince"]:
+            return False
+
+        if "minduration" in rules or "maxduration" in rules:
+            duration = metadata.get("duration")
+            if duration is None:
+                return False
+            if duration < rules.get("minduration", 0):
+                return False
+            if "maxduration" in rules and duration > rules["maxduration"]:
+                return False
+
+        return True
+
+    def evaluate(self, entries):
+        """
+        Evaluate playlist against all library entries
+
+        Args:
+            entries (list): library index entries
+        """
+        self.__matches = {
+            entry["filename"]: entry for entry in entries if self.matches(entry)
+        }
+
+    def update(self, entries, removed):
+        """
+        Update playlist incrementally
+
+        Args:
+            entries (list): added or changed library index entries
+            removed (list): removed filenames
+        """
+        for filename in removed:
+            self.__matches.pop(filename, None)
+        for entry in entries:
+            if self.matches(entry):
+                self.__matches[entry["filename"]] = entry
+            else:
+                self.__matches.pop(entry["filename"], None)
+
+    def reseed(self):
+        """
+        Draw new seed, next materialization of random playlist returns other tracks
+        """
+        self.seed = random.getrandbits(32)
+
+    def materialize(self, get_play_stats=None):
+        """
+        Build playlist tracks
+
+        Args:
+            get_play_stats (function): function returning (play count, last played timestamp) of a
+                                       filename. Used by leastplayed order
+
+        Returns:
+            list: list of track paths
+        """
+        entries = list(self.__matches.values())
+        order = self.rules.get("order", self.ORDER_NAME)
+        limit = self.rules.get("limit")
+
+        if order == self.ORDER_RANDOM:
+            entries.sort(key=lambda entry: entry["filename"])
+            entries = random.Random(self.seed).sample(
+                entries, min(limit or len(entries), len(entries))
+            )
+        elif order == self.ORDER_LEAST_PLAYED and get_play_stats:
+            entries.sort(
+                key=lambda entry: (get_play_stats(entry["filename"]), entry["filename"])
+            )
+        else:
+            entries.sort(key=lambda entry: entry["filename"])
+
+        if limit:
+            entries = entries[:limit]
+
+        return [entry["path"] for entry in entries]
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+
+
+class TrackPrefetcher:
+    """
+    Track prefetcher
+
+    Reads ahead upcoming tracks in a background thread to load them into kernel page cache, so
+    audioplayer does not wait for a spun down or busy disk at track boundaries.
+    """
+
+    CHUNK_SIZE = 1048576
+    DEFAULT_BUDGET = 52428800
+
+    def __init__(self, logger, budget=DEFAULT_BUDGET):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            budget (int): max number of bytes read ahead for each prefetch request
+        """
+        self.logger = logger
+        self.budget = budget
+        self.__pending = None
+        self.__condition = threading.Condition()
+        self.__running = False
+        self.__thread = None
+        self.__stats = {
+            "prefetchedtracks": 0,
+            "prefetchedbytes": 0,
+            "readtimesaved": 0.0,
+        }
+
+    def start(self):
+        """
+        Start prefetcher thread
+        """
+        with self.__condition:
+            if self.__running:
+                return
+            self.__running = True
+
+        self.__thread = threading.Thread(
+            target=self.__run, name="localmusic-prefetcher", daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stop prefetcher thread
+        """
+        with self.__condition:
+            self.__running = False
+            self.__pending = None
+            self.__condition.notify()
+
+        if self.__thread:
+            self.__thread.join(timeout=2.0)
+            self.__thread = None
+
+    def prefetch(self, paths):
+        """
+        Request prefetch of specified tracks. Any pending request not processed yet is replaced
+
+        Args:
+            paths (list): list of track paths ordered by play order
+        """
+        with self.__condition:
+            self.__pending = list(paths)
+            self.__condition.notify()
+
+    def get_stats(self):
+        """
+        Return prefetcher statistics
+
+        Returns:
+            dict: statistics::
+
+                {
+                    prefetchedtracks (int): number of prefetched tracks
+                    prefetchedbytes (int): number of bytes read ahead
+                    readtimesaved (float): time spent reading tracks ahead of playback (seconds)
+                }
+
+        """
+        with self.__condition:
+            return dict(self.__stats)
+
+    def __run(self):
+        """
+        Prefetcher thread process
+        """
+        while True:
+            with self.__condition:
+                while self.__running and self.__pending is None:
+                    self.__condition.wait()
+                if not self.__running:
+                    return
+                paths, self.__pending = self.__pending, None
+
+            remaining = self.budget
+            for path in paths:
+                if remaining <= 0 or self.__is_preempted():
+                    break
+                remaining -= self.__prefetch_track(path, remaining)
+
+    def __is_preempted(self):
+        """
+        Check if current request must be abandoned
+
+        Returns:
+            bool: True if a newer request is pending or prefetcher stopped
+        """
+        with self.__condition:
+            return not self.__running or self.__pending is not None
+
+    def __prefetch_track(self, path, max_bytes):
+        """
+        Read ahead specified track
+
+        Args:
+            path (str): track path
+            max_bytes (int): max number of bytes to read
+
+        Returns:
+            int: number of bytes read
+        """
+        read_bytes = 0
+        start = time.monotonic()
+        try:
+            with open(path, "rb", buffering=0) as fd:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(
+                        fd.fileno(), 0, max_bytes, os.POSIX_FADV_WILLNEED
+                    )
+                while read_bytes < max_bytes:
+                    chunk = fd.read(min(self.CHUNK_SIZE, max_bytes - read_bytes))
+                    if not chunk:
+                        break
+                    read_bytes += len(chunk)
+        except OSError as error:
+            self.logger.debug('Unable to prefetch track "%s": %s', path, error)
+            return 0
+        duration = time.monotonic() - start
+
+        self.logger.debug(
+            'Prefetched %s bytes of "%s" in %.3fs', read_bytes, path, duration
+        )
+        with self.__condition:
+            self.__stats["prefetchedtracks"] += 1
+            self.__stats["prefetchedbytes"] += read_bytes
+            self.__stats["readtimesaved"] += duration
+
+        return read_bytes
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Transcoder:
+    """
+    Transcoder
+
+    Converts audio files not supported by audioplayer using locally installed ffmpeg. Each job runs
+    in a low priority (nice/ionice) process and the number of concurrent jobs is capped to protect
+    playback. Outputs are cached by source content hash, so the same content is converted once.
+    Cache size is bounded, least recently used outputs are removed first. Job callback receives
+    its own link (or copy) of cached output, so it can move it without emptying cache.
+    """
+
+    # source extension: output extension
+    TRANSCODABLE_EXTENSIONS = {
+        "wav": "flac",
+        "m4a": "ogg",
+        "opus": "ogg",
+    }
+    CODECS = {
+        "flac": ["-c:a", "flac"],
+        "ogg": ["-c:a", "libvorbis", "-q:a", "5"],
+    }
+
+    STATUS_QUEUED = "queued"
+    STATUS_RUNNING = "running"
+    STATUS_DONE = "done"
+    STATUS_FAILED = "failed"
+
+    HASH_CHUNK_SIZE = 1048576
+    PROGRESS_STEP = 10
+    DEFAULT_MAX_CACHE_SIZE = 104857600  # bytes
+    # suffixes of job temporary files in cache
+    TMP_SUFFIXES = (".part", ".handoff")
+
+    def __init__(
+        self,
+        logger,
+        cache_path,
+        on_update,
+        max_jobs=1,
+        max_cache_size=DEFAULT_MAX_CACHE_SIZE,
+    ):
+        """
+        Constructor
+
+        Args:
+            logger (Logger): logger instance
+            cache_path (str): directory to store transcoded files
+            on_update (function): function called on job update with job dict as parameter
+            max_jobs (int): max number of concurrent transcoding jobs
+            max_cache_size (int): max size of cached transcoded files (bytes)
+        """
+        self.logger = logger
+        self.cache_path = cache_path
+        self.on_update = on_update
+        self.max_jobs = max_jobs
+        self.max_cache_size = max_cache_size
+        self.__executor = None
+        self.__lock = threading.Lock()
+        self.__jobs = {}
+        # cached outputs used by running jobs, never evicted
+        self.__outputs_in_use = set()
+
+    @staticmethod
+    def is_available():
+        """
+        Check if encoder is installed
+
+        Returns:
+            bool: True if encoder is available
+        """
+        return shutil.which("ffmpeg") is not None
+
+    @staticmethod
+    def get_output_extension(filepath):
+        """
+        Return output extension of specified file
+
+        Args:
+            filepath (str): file path
+
+        Returns:
+            str: output extension or None if file cannot be transcoded
+        """
+        extension = os.path.splitext(filepath)[1][1:].lower()
+        return Transcoder.TRANSCODABLE_EXTENSIONS.get(extension)
+
+    def stop(self):
+        """
+        Stop transcoder. Running jobs are completed
+        """
+        with self.__lock:
+            executor, self.__executor = self.__executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_jobs(self):
+        """
+        Return transcoding jobs
+
+        Returns:
+            list: list of jobs
+        """
+        with self.__lock:
+            return [dict(job) for job in self.__jobs.values()]
+
+    def submit(self, filepath, on_done):
+        """
+        Submit new transcoding job
+
+        Args:
+            filepath (str): file to transcode. It is deleted once job is done
+            on_done (function): function called when transcoding succeed with source and
+                                transcoded file paths as parameters. Transcoded file is
+                                deleted after call, so it must be moved by callback. It
+                                returns an error message if transcoded file cannot be
+                                saved, None otherwise
+
+        Returns:
+            str: job identifier
+        """
+        job = {
+            "jobid": str(uuid.uuid4()),
+            "filename": os.path.basename(filepath),
+            "status": self.STATUS_QUEUED,
+            "progress": 0,
+            "error": None,
+        }
+        with self.__lock:
+            if not self.__executor:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.max_jobs, thread_name_prefix="localmusic-transcode"
+                )
+            self.__jobs[job["jobid"]] = job
+            self.__executor.submit(self.__run_job, job, filepath, on_done)
+        self.__update_job(job)
+
+        return job["jobid"]
+
+    def __update_job(self, job, **changes):
+        """
+        Update job and notify changes
+
+        Args:
+            job (dict): job to update
+            changes (dict): job changes
+        """
+        with self.__lock:
+            job.update(changes)
+            if job["status"] in (self.STATUS_DONE, self.STATUS_FAILED):
+                self.__jobs.pop(job["jobid"], None)
+        self.on_update(dict(job))
+
+    def __run_job(self, job, filepath, on_done):
+        """
+        Run transcoding job
+
+        Args:
+            job (dict): job
+            filepath (str): file to transcode
+            on_done (function): function called when transcoding succeed
+        """
+        self.__update_job(job, status=self.STATUS_RUNNING)
+        changes = {"status": self.STATUS_FAILED, "error": "Transcoding failed"}
+        output_path = None
+        handoff_path = None
+        try:
+            output_ext = Transcoder.get_output_extension(filepath)
+            output_path = os.path.join(
+                self.cache_path, f"{self.get_content_hash(filepath)}.{output_ext}"
+            )
+            with self.__lock:
+                self.__outputs_in_use.add(output_path)
+            if os.path.exists(output_path):
+                self.logger.debug('Using cached transcoded file for "%s"', filepath)
+                # refresh output in cache LRU
+                os.utime(output_path)
+            else:
+                self.__transcode(job, filepath, output_path)
+            handoff_path = os.path.join(
+                self.cache_path, f"{job['jobid']}.handoff.{output_ext}"
+            )
+            self.__handoff(output_path, handoff_path)
+            error = on_done(filepath, handoff_path)
+            if error:
+                self.logger.error('Unable to save transcoded "%s": %s', filepath, error)
+                changes["error"] = error
+            else:
+                changes = {"status": self.STATUS_DONE, "progress": 100}
+        except Exception:
+            self.logger.exception('Unable to transcode "%s"', filepath)
+
+        for path in (filepath, handoff_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+        with self.__lock:
+            self.__outputs_in_use.discard(output_path)
+        self.trim_cache()
+        self.__update_job(job, **changes)
+
+    def __handoff(self, output_path, handoff_path):
+        """
+        Create job own version of cached output. Hardlink is used when possible so cached output
+        does not use more space
+
+        Args:
+            output_path (str): cached output path
+            handoff_path (str): job output path
+        """
+        try:
+            os.link(output_path, handoff_path)
+        except OSError:
+            shutil.copyfile(output_path, handoff_path)
+
+    def trim_cache(self):
+        """
+        Remove least recently used transcoded files until cache fits max cache size
+        """
+        if not self.cache_path or not os.path.isdir(self.cache_path):
+            return
+        with self.__lock:
+            outputs = []
+            for filename in os.listdir(self.cache_path):
+                path = os.path.join(self.cache_path, filename)
+                if path in self.__outputs_in_use or any(
+                    suffix + "." in filename for suffix in self.TMP_SUFFIXES
+                ):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                outputs.append((stat.st_mtime, stat.st_size, path))
+
+            cache_size = sum(size for _, size, _ in outputs)
+            for _, size, path in sorted(outputs):
+                if cache_size <= self.max_cache_size:
+                    break
+                try:
+                    os.remove(path)
+                    cache_size -= size
+                except OSError:
+                    self.logger.warning('Unable to remove transcoded file "%s"', path)
+
+    def clear(self):
+        """
+        Remove temporary files left in cache by interrupted jobs and trim cache
+        """
+        if not self.cache_path or not os.path.isdir(self.cache_path):
+            return
+        with self.__lock:
+            if self.__jobs:
+                return
+            for filename in os.listdir(self.cache_path):
+                if not any(suffix + "." in filename for suffix in self.TMP_SUFFIXES):
+                    continue
+                try:
+                    os.remove(os.path.join(self.cache_path, filename))
+                except OSError:
+                    self.logger.warning('Unable to remove transcoded file "%s"', filename)
+        self.trim_cache()
+
+    def get_content_hash(self, filepath):
+        """
+        Compute file content hash
+
+        Args:
+            filepath (str): file path
+
+        Returns:
+            str: content hash
+        """
+        content_hash = hashlib.sha256()
+        with open(filepath, "rb") as fd:
+            for chunk in iter(lambda: fd.read(self.HASH_CHUNK_SIZE), b""):
+                content_hash.update(chunk)
+
+        return content_hash.hexdigest()
+
+    def __get_duration(self, filepath):
+        """
+        Get audio duration using ffprobe
+
+        Args:
+            filepath (str): file path
+
+        Returns:
+            float: duration in seconds or None if not available
+        """
+        if not shutil.which("ffprobe"):
+            return None
+        try:
+            output = subprocess.run(
+                [
+                    "ffprobe",
+                    "-v",
+                    "error",
+                    "-show_entries",
+                    "format=duration",
+                    "-of",
+                    "csv=p=0",
+                    filepath,
+                ],
+                capture_output=True,
+                text=True,
+                timeout=30,
+                check=True,
+            ).stdout
+            return float(output.strip())
+        except (subprocess.SubprocessError, ValueError):
+            return None
+
+    def __get_command(self, filepath, output_path):
+        """
+        Build low priority transcoding command
+
+        Args:
+            filepath (str): source file path
+            output_path (str): output file path
+
+        Returns:
+            list: command
+        """
+        command = []
+        if shutil.which("ionice"):
+            command += ["ionice", "-c", "3"]
+        command += ["nice", "-n", "19"]
+        command += ["ffmpeg", "-nostdin", "-y", "-loglevel", "error"]
+        command += ["-i", filepath, "-vn", "-map_metadata", "0"]
+        command += self.CODECS[os.path.splitext(output_path)[1][1:]]
+        command += ["-progress", "pipe:1", "-nostats", output_path]
+
+        return command
+
+    def __transcode(self, job, filepath, output_path):
+        """
+        Transcode file reporting progress
+
+        Args:
+            job (dict): job
+            filepath (str): source file path
+            output_path (str): output file path
+
+        Raises:
+            Exception: if transcoding failed
+        """
+        os.makedirs(self.cache_path, exist_ok=True)
+        duration = self.__get_duration(filepath)
+        tmp_path = output_path + ".part" + os.path.splitext(output_path)[1]
+
+        with subprocess.Popen(
+            self.__get_command(filepath, tmp_path),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        ) as process:
+            for line in process.stdout:
+                key, _, value = line.strip().partition("=")
+                if key != "out_time_us" or not duration or not value.isdigit():
+                    continue
+                progress = min(99, int(int(value) / 10000 / duration))
+                if progress >= job["progress"] + self.PROGRESS_STEP:
+                    self.__update_job(job, progress=progress)
+            stderr = process.stderr.read()
+
+        if process.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise Exception(f"ffmpeg failed ({process.returncode}): {stderr.strip()}")
+
+        os.replace(tmp_path, output_path)
@@ -21,37 +21,95 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
         self.playlistName = '';
         self.oldPlaylistName = '';
         self.playlistUpdate = false;
+        self.libraryVersion = undefined;
+        self.playlistsVersion = undefined;
+        self.playerUuid = null;
 
         self.$onInit = function() {
-            cleepService.getModuleConfig('localmusic');
             self.getMusicFiles();
+            self.getPlaylists();
         };
 
         self.getMusicFiles = function() {
-            localmusicService.getMusicFiles()
+            const options = { compact: true, compress: true };
+            localmusicService.getMusicFiles(self.libraryVersion ?? -1, options)
                 .then(resp => {
-                    self.setFiles(resp.data);
+                    if (resp.data.modified) {
+                        self.libraryVersion = resp.data.version;
+                        self.setFiles(resp.data.files);
+                    }
+                });
+        };
+
+        self.refreshMusicFiles = function() {
+            if (angular.isUndefined(self.libraryVersion)) {
+                self.getMusicFiles();
+                return;
+            }
+
+            localmusicService.getLibraryChanges(self.libraryVersion)
+                .then(resp => {
+                    if (resp.data.reload) {
+                        self.getMusicFiles();
+                        return;
+                    }
+                    self.applyLibraryChanges(resp.data);
                 });
         };
 
+        self.applyLibraryChanges = function(changes) {
+            for (const filename of changes.removed) {
+                const fileIndex = self.files.findIndex((file) => file.title === filename);
+                if (fileIndex >= 0) {
+                    self.files.splice(fileIndex, 1);
+                }
+            }
+            for (const file of changes.added) {
+                if (!self.files.some((item) => item.title === file.filename)) {
+                    self.files.push(self._makeFileItem(file));
+                }
+            }
+            if (changes.added.length) {
+                self.files.sort(self._sortItems);
+            }
+            self.libraryVersion = changes.version;
+        };
+
         self.setFiles = function (files) {
             self.files = [];
             for (const file of files.sort(self._sortFiles)) {
-                self.files.push({
-                    title: file.filename,
-                    icon: 'music-circle-outline',
-                    clicks: [
-                        { icon: 'delete', style: 'md-accent', tooltip: 'Delete file', click: self.deleteMusicFile, meta: { filename: file.filename }},
-                    ],
-                });
+                self.files.push(self._makeFileItem(file));
             }
         };
 
+        self._makeFileItem = function(file) {
+            return {
+                title: file.filename,
+                icon: 'music-circle-outline',
+                clicks: [
+                    { icon: 'delete', style: 'md-accent', tooltip: 'Delete file', click: self.deleteMusicFile, meta: { filename: file.filename }},
+                ],
+            };
+        };
+
+        self.getPlaylists = function() {
+            localmusicService.getPlaylists(self.playlistsVersion ?? -1)
+                .then(resp => {
+                    if (resp.data.modified) {
+                        self.playlistsVersion = resp.data.version;
+                        self.setPlaylists(resp.data.playlists, resp.data.default);
+                        self.config.playlists = resp.data.playlists;
+                        self.config.default = resp.data.default;
+                        self.hasPlaylists = self.playlists.length > 0;
+                    }
+                });
+        };
+
         self.deleteMusicFile = function(filename) {
             localmusicService.deleteMusicFile(filename)
                 .then(resp => {
                     toastService.success('File deleted');
-                    self.getMusicFiles();
+                    self.getPlaylists();
                 });
         };
 
@@ -65,11 +123,34 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
                 .then((resp) => {
                     if (resp.data) {
                         toastService.success('Music file added');
-                        self.getMusicFiles();
                     }
                 });
         };
 
+        self.importPlaylist = function (file) {
+            if (!file) {
+                return;
+            }
+
+            toastService.loading('Importing playlist...');
+            localmusicService.importPlaylist(file)
+                .then((resp) => {
+                    if (resp.error) {
+                        return;
+                    }
+                    if (resp.data.unresolved) {
+                        toastService.warning(resp.data.unresolved + ' tracks not found in library were skipped');
+                    } else {
+                        toastService.success('Playlist imported');
+                    }
+                    self.getPlaylists();
+                });
+        };
+
+        self.exportPlaylist = function(playlistName) {
+            localmusicService.exportPlaylist(playlistName);
+        };
+
         self.openPlaylistDialog = function(playlistName, playlistTracks) {
             self.availableFiles = self.files.slice();
             if (angular.isUndefined(playlistName)) {
@@ -108,6 +189,12 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
     		return 0;
         };
 
+        self._sortItems = function(a, b) {
+            if (a.title > b.title) return 1;
+            if (b.title > a.title) return -1;
+            return 0;
+        };
+
         self.moveRight = function(file) {
             self.playlistTracks.push(file);
             const fileIndex = self.availableFiles.findIndex((item) => item.title === file.title);
@@ -153,18 +240,19 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
                 .then((resp) => {
                     if (!resp.error) {
                         self.cancelDialog();
-                        cleepService.reloadModuleConfig('localmusic');
+                        self.getPlaylists();
                     }
                 })
         };
 
         self.deletePlaylist = function(playlistName) {
-            localmusicService.deletePlaylist(playlistName)
+            // playlist is not deleted if playlists changed meanwhile
+            localmusicService.deletePlaylist(playlistName, self.playlistsVersion)
                 .then((resp) => {
                     if (!resp.error) {
                         toastService.success('Playlist deleted');
-                        cleepService.reloadModuleConfig('localmusic');
                     }
+                    self.getPlaylists();
                 });
         };
 
@@ -175,12 +263,12 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
             }
 
             const playlistTracks = self.playlistTracks.map((track) => track.title);
-            localmusicService.updatePlaylist(self.oldPlaylistName, self.playlistName, playlistTracks)
+            localmusicService.updatePlaylist(self.oldPlaylistName, self.playlistName, playlistTracks, self.playlistsVersion)
                 .then((resp) => {
                     if (!resp.error) {
                         self.cancelDialog();
-                        cleepService.reloadModuleConfig('localmusic');
                     }
+                    self.getPlaylists();
                 });
         };
 
@@ -189,16 +277,19 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
                 .then((resp) => {
                     if (!resp.error) {
                         toastService.success('Default playlist saved');
-                        cleepService.reloadModuleConfig('localmusic');
+                        self.getPlaylists();
                     }
                 });
         };
 
         self.playPlaylist = function(playlistName) {
-            localmusicService.playPlaylist(playlistName)
+            // replace player previously started from this page
+            localmusicService.playPlaylist(playlistName, self.playerUuid)
                 .then((resp) => {
                     if (resp.error) {
                         toastService.error('Error occured starting playback');
+                    } else {
+                        self.playerUuid = resp.data;
                     }
                 });
         };
@@ -218,22 +309,29 @@ function($rootScope, cleepService, toastService, localmusicService, $mdDialog) {
                         { icon: 'play', tooltip: 'Play tracks', click: self.playPlaylist, meta: { playlistName } },
                         { icon: 'playlist-edit', tooltip: 'Edit playlist', click: self.openPlaylistDialog, meta: { playlistName, playlistTracks } },
                         { icon: 'playlist-star', tooltip: 'Set playlist as default', click: self.setDefaultPlaylist, meta: { playlistName } },
+                        { icon: 'download', tooltip: 'Export playlist', click: self.exportPlaylist, meta: { playlistName } },
                         { icon: 'delete', tooltip: 'Delete playlist', style: 'md-accent', click: self.deletePlaylist, meta: { playlistName } },
                     ],
                 });
             }
         };
 
-        $rootScope.$watchCollection(
-            () => cleepService.modules['localmusic'].config,
-            (config) => {
-                if (config && Object.keys(config).length) {
-                    self.setPlaylists(config.playlists, config.default);
-                    Object.assign(self.config, config);
-                    self.hasPlaylists = self.playlists.length > 0;
-                }
-            },
-        );
+        $scope.$on('localmusic.library.update', function(event, uuid, params) {
+            if (params.reload) {
+                self.getMusicFiles();
+            } else if (params.since === self.libraryVersion) {
+                self.applyLibraryChanges(params);
+            } else {
+                // some changes were missed, fetch them
+                self.refreshMusicFiles();
+            }
+        });
+
+        $scope.$on('localmusic.transcode.update', function(event, uuid, params) {
+            if (params.status === 'failed') {
+                toastService.error('Unable to convert "' + params.filename + '": ' + params.error);
+            }
+        });
     };
 
     return {
@@ -6,13 +6,153 @@
  */
 angular
 .module('Cleep')
-.service('localmusicService', ['$rootScope', 'rpcService',
-function($rootScope, rpcService) {
+.service('localmusicService', ['$rootScope', '$q', 'rpcService',
+function($rootScope, $q, rpcService) {
     var self = this;
 
-    self.getMusicFiles = function() {
-        return rpcService.sendCommand('get_music_files', 'localmusic');
-    };  
+    /**
+     * Get music files. If options.compact is set, files are requested as compact columnar
+     * listing (optionally gzipped with options.compress, with library identifiers with
+     * options.ids) and decoded to the usual list of files
+     */
+    self.getMusicFiles = function(ifVersion, options) {
+        const params = angular.isDefined(ifVersion) ? { if_version: ifVersion } : {};
+        if (!options || !options.compact) {
+            return rpcService.sendCommand('get_music_files', 'localmusic', params);
+        }
+
+        params.compact = true;
+        params.ids = !!options.ids;
+        params.compress = !!options.compress;
+        return rpcService.sendCommand('get_music_files', 'localmusic', params)
+            .then(resp => {
+                const listing = angular.isDefined(ifVersion) ? resp.data.files : resp.data;
+                if (!listing) {
+                    return resp;
+                }
+                return self.unpackFiles(listing).then(files => {
+                    if (angular.isDefined(ifVersion)) {
+                        resp.data.files = files;
+                    } else {
+                        resp.data = files;
+                    }
+                    return resp;
+                });
+            });
+    };
+
+    /**
+     * Decode compact columnar listing (see backend compactlisting.pack_files)
+     */
+    self.unpackFiles = function(listing) {
+        let columns = $q.when(listing.columns);
+        if (listing.encoding === 'gzip') {
+            const bytes = Uint8Array.from(atob(listing.data), char => char.charCodeAt(0));
+            const stream = new Blob([bytes]).stream()
+                .pipeThrough(new DecompressionStream('gzip'));
+            columns = $q.when(new Response(stream).text()).then(text => JSON.parse(text));
+        }
+
+        return columns.then(columns => columns.filenames.map((filename, index) => {
+            const file = {
+                filename: filename,
+                path: columns.prefix + columns.folders[columns.folder[index]] + filename,
+            };
+            if (columns.ids) {
+                file.id = columns.ids[index];
+            }
+            return file;
+        }));
+    };
+
+    self.browse = function(path, offset, limit) {
+        return rpcService.sendCommand('browse', 'localmusic', {
+            path: path || null,
+            offset: offset || 0,
+            limit: limit || 100,
+        });
+    };
+
+    self.getArtists = function(offset, limit) {
+        return rpcService.sendCommand('get_artists', 'localmusic', {
+            offset: offset || 0,
+            limit: limit || 100,
+        });
+    };
+
+    self.getAlbums = function(artist, offset, limit) {
+        return rpcService.sendCommand('get_albums', 'localmusic', {
+            artist: angular.isDefined(artist) ? artist : null,
+            offset: offset || 0,
+            limit: limit || 100,
+        });
+    };
+
+    self.getGenres = function(offset, limit) {
+        return rpcService.sendCommand('get_genres', 'localmusic', {
+            offset: offset || 0,
+            limit: limit || 100,
+        });
+    };
+
+    self.getTracks = function(artist, album, genre, offset, limit) {
+        return rpcService.sendCommand('get_tracks', 'localmusic', {
+            artist: angular.isDefined(artist) ? artist : null,
+            album: angular.isDefined(album) ? album : null,
+            genre: angular.isDefined(genre) ? genre : null,
+            offset: offset || 0,
+            limit: limit || 100,
+        });
+    };
+
+    self.getLibraryChanges = function(sinceVersion) {
+        return rpcService.sendCommand('get_library_changes', 'localmusic', {
+            since_version: sinceVersion,
+        });
+    };
+
+    self.getPlaylists = function(ifVersion) {
+        const params = angular.isDefined(ifVersion) ? { if_version: ifVersion } : {};
+        return rpcService.sendCommand('get_playlists', 'localmusic', params);
+    };
+
+    self.getCover = function(filename, size) {
+        return rpcService.sendCommand('get_cover', 'localmusic', {
+            filename: filename,
+            size: size,
+        });
+    };
+
+    /**
+     * Get track waveform. Peaks are decoded to an Int8Array of interleaved min and max values
+     * (-127 to 127). Response data is null if waveform is not computed yet
+     */
+    self.getWaveform = function(filename, resolution) {
+        return rpcService.sendCommand('get_waveform', 'localmusic', {
+            filename: filename,
+            resolution: resolution,
+        })
+        .then(resp => {
+            if (resp.data) {
+                const binary = atob(resp.data.peaks);
+                resp.data.peaks = Int8Array.from(binary, char => char.charCodeAt(0) << 24 >> 24);
+            }
+            return resp;
+        });
+    };
+
+    self.getTrackPreview = function(filename) {
+        // preview must use page protocol, browser blocks http media on https page
+        return rpcService.sendCommand('get_track_preview', 'localmusic', {
+            filename: filename,
+            secure: window.location.protocol === 'https:',
+        })
+        .then(resp => {
+            const preview = resp.data;
+            preview.url = window.location.protocol + '//' + window.location.hostname + ':' + preview.port + preview.path;
+            return resp;
+        });
+    };
 
     self.addMusicFile = function(file) {
         return rpcService.upload('add_music_file', 'localmusic', file);
@@ -31,29 +171,58 @@ function($rootScope, rpcService) {
         }); 
     };
 
-    self.deletePlaylist = function(playlistName) {
+    self.addAlbumPlaylist = function(playlistName, artist, album) {
+        return rpcService.sendCommand('add_playlist', 'localmusic', {
+            playlist_name: playlistName,
+            artist: angular.isDefined(artist) ? artist : null,
+            album: angular.isDefined(album) ? album : null,
+        });
+    };
+
+    self.addFolderPlaylist = function(path, playlistName, recursive) {
+        return rpcService.sendCommand('add_folder_playlist', 'localmusic', {
+            path: path || null,
+            playlist_name: playlistName,
+            recursive: recursive !== false,
+        });
+    };
+
+    self.deletePlaylist = function(playlistName, ifVersion) {
         return rpcService.sendCommand('delete_playlist', 'localmusic', {
             playlist_name: playlistName,
+            if_version: ifVersion,
         }); 
     };
 
-    self.updatePlaylist = function(playlistName, newPlaylistName, files) {
+    self.updatePlaylist = function(playlistName, newPlaylistName, files, ifVersion) {
         return rpcService.sendCommand('update_playlist', 'localmusic', {
             playlist_name: playlistName,
             new_playlist_name: newPlaylistName,
             files: files,
+            if_version: ifVersion,
         }); 
     };
 
+    self.importPlaylist = function(file) {
+        return rpcService.upload('import_playlist', 'localmusic', file);
+    };
+
+    self.exportPlaylist = function(playlistName) {
+        return rpcService.download('export_playlist', 'localmusic', {
+            playlist_name: playlistName,
+        });
+    };
+
     self.setDefaultPlaylist = function(playlistName) {
         return rpcService.sendCommand('set_default_playlist', 'localmusic', {
             playlist_name: playlistName,
         });
     };
 
-    self.playPlaylist = function(playlistName) {
+    self.playPlaylist = function(playlistName, playerUuid) {
         return rpcService.sendCommand('play_playlist', 'localmusic', {
             playlist_name: playlistName,
+            player_uuid: playerUuid,
         });
     };
 
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import os
+import sys
+import shutil
+import tempfile
+import threading
+from unittest.mock import patch
+
+sys.path.append("../")
+from backend.alarmcache import AlarmCache
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+class TestAlarmCache(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, "cache")
+        self.tracks = [self.make_track(f"file{index}.mp3", 100) for index in range(4)]
+        self.cache = AlarmCache(
+            logging.getLogger("test"),
+            cache_path=self.cache_path,
+            max_size=250,
+            max_tracks=3,
+        )
+        self.cache.enabled = True
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_track(self, filename, size):
+        path = os.path.join(self.tmpdir.name, filename)
+        with open(path, "wb") as fd:
+            fd.write(b"\x01" * size)
+        return path
+
+    def test_sync(self):
+        self.cache.sync(self.tracks)
+
+        self.assertEqual(self.cache.get_size(), 200)
+        self.assertListEqual(self.cache.get_cached_tracks(), self.tracks[1::-1])
+        cached_path = self.cache.get_path(self.tracks[0])
+        self.assertTrue(cached_path.startswith(self.cache_path))
+        self.assertTrue(cached_path.endswith(".mp3"))
+        with open(cached_path, "rb") as fd:
+            self.assertEqual(len(fd.read()), 100)
+
+    def test_sync_disabled(self):
+        self.cache.enabled = False
+
+        self.cache.sync(self.tracks)
+
+        self.assertEqual(self.cache.get_size(), 0)
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_sync_evicts_least_recently_used(self):
+        self.cache.sync([self.tracks[2], self.tracks[3]])
+        self.cache.get_path(self.tracks[2])
+
+        self.cache.sync([self.tracks[0]])
+
+        self.assertLessEqual(self.cache.get_size(), 250)
+        self.assertListEqual(
+            self.cache.get_cached_tracks(), [self.tracks[2], self.tracks[0]]
+        )
+
+    def test_sync_updates_modified_track(self):
+        self.cache.sync(self.tracks[:1])
+        with open(self.tracks[0], "wb") as fd:
+            fd.write(b"\x02" * 50)
+        os.utime(self.tracks[0], (0, 0))
+
+        self.cache.sync(self.tracks[:1])
+
+        with open(self.cache.get_path(self.tracks[0]), "rb") as fd:
+            self.assertEqual(fd.read(), b"\x02" * 50)
+
+    def test_sync_skips_missing_track(self):
+        self.cache.sync(["/dummy/file.mp3", self.tracks[0]])
+
+        self.assertListEqual(self.cache.get_cached_tracks(), [self.tracks[0]])
+
+    @patch("backend.alarmcache.shutil.which")
+    @patch("backend.alarmcache.subprocess.run")
+    def test_sync_trims_leading_silence(self, run_mock, which_mock):
+        which_mock.return_value = "/usr/bin/ffmpeg"
+
+        def trim(command, **kwargs):
+            with open(command[-1], "wb") as fd:
+                fd.write(b"\x01" * 60)
+
+        run_mock.side_effect = trim
+
+        self.cache.sync(self.tracks[:2], {self.tracks[0]: 2.5, self.tracks[1]: 0.1})
+
+        self.assertEqual(run_mock.call_count, 1)
+        command = run_mock.call_args.args[0]
+        self.assertEqual(command[command.index("-ss") + 1], "2.5")
+        self.assertEqual(command[command.index("-i") + 1], self.tracks[0])
+        self.assertEqual(self.cache.get_size(), 160)
+
+        # already trimmed with same offset
+        self.cache.sync(self.tracks[:1], {self.tracks[0]: 2.5})
+        self.assertEqual(run_mock.call_count, 1)
+
+    @patch("backend.alarmcache.shutil.which")
+    def test_sync_trim_without_ffmpeg_copies_track(self, which_mock):
+        which_mock.return_value = None
+
+        self.cache.sync(self.tracks[:1], {self.tracks[0]: 2.5})
+
+        with open(self.cache.get_path(self.tracks[0]), "rb") as fd:
+            self.assertEqual(len(fd.read()), 100)
+
+    def test_get_path_not_blocked_by_sync(self):
+        self.cache.sync(self.tracks[:1])
+        cached_path = self.cache.get_path(self.tracks[0])
+        copyfile = shutil.copyfile
+        paths = []
+
+        def slow_copyfile(source, destination):
+            # track is played from another thread while next track is copied
+            thread = threading.Thread(
+                target=lambda: paths.append(self.cache.get_path(self.tracks[0]))
+            )
+            thread.start()
+            thread.join(1.0)
+            return copyfile(source, destination)
+
+        with patch("backend.alarmcache.shutil.copyfile", side_effect=slow_copyfile):
+            self.cache.sync(self.tracks[:2])
+
+        self.assertListEqual(paths, [cached_path])
+        self.assertListEqual(self.cache.get_cached_tracks(), self.tracks[1::-1])
+        self.assertEqual(len(os.listdir(self.cache_path)), 2)
+
+    def test_sync_copy_failure_leaves_no_file(self):
+        with patch("backend.alarmcache.shutil.copyfile", side_effect=OSError("full")):
+            self.cache.sync(self.tracks[:1])
+
+        self.assertListEqual(self.cache.get_cached_tracks(), [])
+        self.assertListEqual(os.listdir(self.cache_path), [])
+
+    def test_get_path_not_cached(self):
+        self.assertEqual(self.cache.get_path(self.tracks[0]), self.tracks[0])
+
+    def test_get_path_disabled(self):
+        self.cache.sync(self.tracks[:1])
+        self.cache.enabled = False
+
+        self.assertEqual(self.cache.get_path(self.tracks[0]), self.tracks[0])
+
+    def test_clear(self):
+        self.cache.sync(self.tracks)
+
+        self.cache.clear()
+
+        self.assertEqual(self.cache.get_size(), 0)
+        self.assertListEqual(os.listdir(self.cache_path), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
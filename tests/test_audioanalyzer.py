@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import io
+import time
+import numpy
+
+sys.path.append("../")
+from backend import audioanalyzer
+from backend.audioanalyzer import (
+    AudioAnalyzer,
+    WaveformBuilder,
+    analyze,
+    compute_loudness,
+    compute_silence,
+    compute_waveform,
+    downsample_waveform,
+    decode_pcm,
+)
+from cleep.libs.tests.common import get_log_level
+from unittest.mock import Mock, patch
+
+LOG_LEVEL = get_log_level()
+SAMPLE_RATE = 22050
+
+
+def sine(amplitude, duration, sample_rate=SAMPLE_RATE, frequency=440.0):
+    times = numpy.arange(int(duration * sample_rate)) / sample_rate
+    return (amplitude * numpy.sin(2 * numpy.pi * frequency * times)).astype(
+        numpy.float32
+    )
+
+
+def analysis_ok(path, analyses):
+    return {"path": path, "analyses": analyses}
+
+
+def analysis_ko(path, analyses):
+    raise Exception("analysis failed")
+
+
+class TestAudioAnalysis(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+
+    def test_compute_loudness_full_scale_sine(self):
+        result = compute_loudness(sine(1.0, 3.0))
+
+        # full scale sine mean square is 0.5 (-3.01 dB)
+        self.assertAlmostEqual(result["loudness"], -3.7, delta=0.1)
+        self.assertAlmostEqual(result["peak"], 1.0, delta=0.001)
+        self.assertAlmostEqual(result["gain"], -14.3, delta=0.1)
+
+    def test_compute_loudness_quiet_track_is_amplified(self):
+        result = compute_loudness(sine(0.05, 3.0))
+
+        self.assertAlmostEqual(result["loudness"], -29.7, delta=0.1)
+        self.assertAlmostEqual(result["gain"], 11.7, delta=0.1)
+
+    def test_compute_loudness_gates_silence(self):
+        samples = numpy.concatenate(
+            (sine(0.05, 3.0), numpy.zeros(SAMPLE_RATE * 10, dtype=numpy.float32))
+        )
+
+        result = compute_loudness(samples)
+
+        self.assertAlmostEqual(result["loudness"], -29.7, delta=0.5)
+
+    def test_compute_loudness_gain_limited_by_peak(self):
+        samples = sine(0.05, 3.0)
+        samples[100] = 0.9
+
+        result = compute_loudness(samples)
+
+        self.assertAlmostEqual(result["gain"], 0.92, delta=0.01)
+
+    def test_compute_loudness_silent_track(self):
+        result = compute_loudness(numpy.zeros(SAMPLE_RATE, dtype=numpy.float32))
+
+        self.assertDictEqual(result, {"loudness": None, "peak": 0.0, "gain": 0.0})
+
+    def test_compute_loudness_too_short(self):
+        result = compute_loudness(sine(0.5, 0.1))
+
+        self.assertIsNone(result["loudness"])
+        self.assertEqual(result["gain"], 0.0)
+
+    def test_compute_silence(self):
+        silence = numpy.zeros(SAMPLE_RATE * 2, dtype=numpy.float32)
+        samples = numpy.concatenate((silence, sine(0.5, 3.0), silence[:SAMPLE_RATE]))
+
+        result = compute_silence(samples)
+
+        self.assertAlmostEqual(result["soundstart"], 2.0, delta=0.02)
+        self.assertAlmostEqual(result["soundend"], 5.0, delta=0.02)
+
+    def test_compute_silence_low_noise_is_silence(self):
+        samples = numpy.concatenate((sine(0.001, 1.0), sine(0.5, 1.0)))
+
+        result = compute_silence(samples)
+
+        self.assertAlmostEqual(result["soundstart"], 1.0, delta=0.02)
+
+    def test_compute_waveform(self):
+        samples = numpy.concatenate(
+            (sine(1.0, 1.0), numpy.zeros(SAMPLE_RATE, dtype=numpy.float32))
+        )
+
+        waveform = compute_waveform(samples, resolution=4)["waveform"]
+
+        peaks = numpy.frombuffer(waveform, dtype=numpy.int8).reshape(4, 2)
+        self.assertListEqual(peaks.tolist(), [[-127, 127], [-127, 127], [0, 0], [0, 0]])
+
+    def test_compute_waveform_short_track(self):
+        samples = numpy.array([0.5, -0.5], dtype=numpy.float32)
+
+        waveform = compute_waveform(samples, resolution=4)["waveform"]
+
+        self.assertEqual(len(waveform), 8)
+        self.assertListEqual(list(waveform[:2]), [64, 64])
+
+    def test_downsample_waveform(self):
+        waveform = numpy.array(
+            [-10, 10, -20, 5, 0, 0, -1, 30], dtype=numpy.int8
+        ).tobytes()
+
+        peaks = numpy.frombuffer(downsample_waveform(waveform, 2), dtype=numpy.int8)
+
+        self.assertListEqual(peaks.tolist(), [-20, 10, -1, 30])
+
+    def test_compute_silence_silent_track(self):
+        result = compute_silence(numpy.zeros(SAMPLE_RATE, dtype=numpy.float32))
+
+        self.assertDictEqual(result, {"soundstart": 0.0, "soundend": 0.0})
+
+    @patch("backend.audioanalyzer.decode_pcm")
+    def test_analyze(self, decode_pcm_mock):
+        decode_pcm_mock.return_value = iter([sine(0.5, 2.0)])
+
+        result = analyze("/dummy/file.mp3", ("loudness", "silence"))
+
+        decode_pcm_mock.assert_called_once_with("/dummy/file.mp3")
+        self.assertListEqual(
+            sorted(result.keys()), ["gain", "loudness", "peak", "soundend", "soundstart"]
+        )
+
+    @patch("backend.audioanalyzer.decode_pcm")
+    def test_analyze_by_chunks_same_as_whole_track(self, decode_pcm_mock):
+        samples = numpy.concatenate(
+            (
+                numpy.zeros(SAMPLE_RATE, dtype=numpy.float32),
+                sine(0.5, 3.0),
+                sine(0.1, 2.5),
+                numpy.zeros(SAMPLE_RATE // 3, dtype=numpy.float32),
+            )
+        )
+        chunks = numpy.split(samples, [1000, 1001, 30000, 77777, 100000])
+        decode_pcm_mock.return_value = iter(chunks)
+        analyses = ("loudness", "silence", "waveform")
+
+        result = analyze("/dummy/file.mp3", analyses)
+
+        expected = {**compute_loudness(samples), **compute_silence(samples)}
+        self.assertDictEqual(
+            {key: result[key] for key in expected.keys()}, expected
+        )
+        expected = numpy.frombuffer(compute_waveform(samples)["waveform"], numpy.int8)
+        peaks = numpy.frombuffer(result["waveform"], dtype=numpy.int8)
+        self.assertEqual(peaks.size, expected.size)
+        self.assertLessEqual(numpy.abs(peaks - expected).max(), 2)
+
+    def test_compute_waveform_long_track_memory_is_bounded(self):
+        builder = WaveformBuilder(resolution=8)
+        chunk = sine(1.0, 1.0)
+        for _ in range(30):
+            builder.update(chunk)
+        builder.update(numpy.zeros(30 * SAMPLE_RATE, dtype=numpy.float32))
+
+        peaks = numpy.frombuffer(builder.result()["waveform"], numpy.int8).reshape(8, 2)
+
+        self.assertLessEqual(builder.block_size * 8 * 16, 60 * SAMPLE_RATE)
+        self.assertListEqual(peaks[:4].tolist(), [[-127, 127]] * 4)
+        self.assertListEqual(peaks[4:].tolist(), [[0, 0]] * 4)
+
+    def _mock_popen(self, popen_mock, stdout, returncode=0, stderr=b""):
+        def popen(command, **kwargs):
+            kwargs["stderr"].write(stderr)
+            return process
+
+        process = popen_mock.return_value
+        process.stdout = io.BytesIO(stdout)
+        process.wait.return_value = returncode
+        process.poll.return_value = returncode
+        popen_mock.side_effect = popen
+
+    @patch("backend.audioanalyzer.subprocess.Popen")
+    def test_decode_pcm(self, popen_mock):
+        self._mock_popen(
+            popen_mock, numpy.array([0, 16384, -32768], dtype="<i2").tobytes() + b"\x01"
+        )
+
+        chunks = list(decode_pcm("/dummy/file.mp3", chunk_size=2))
+
+        self.assertListEqual([chunk.tolist() for chunk in chunks], [[0.0, 0.5], [-1.0]])
+        command = popen_mock.call_args.args[0]
+        self.assertIn("/dummy/file.mp3", command)
+        self.assertEqual(command[-3:], ["-f", "s16le", "-"])
+
+    @patch("backend.audioanalyzer.subprocess.Popen")
+    def test_decode_pcm_failed(self, popen_mock):
+        self._mock_popen(popen_mock, b"", returncode=1, stderr=b"invalid data\n")
+
+        with self.assertRaises(Exception) as cm:
+            list(decode_pcm("/dummy/file.mp3"))
+        self.assertEqual(
+            str(cm.exception), "Unable to decode /dummy/file.mp3: invalid data"
+        )
+
+    @patch("backend.audioanalyzer.subprocess.Popen")
+    def test_decode_pcm_stopped_kills_process(self, popen_mock):
+        self._mock_popen(popen_mock, b"\x00\x00" * 10, returncode=None)
+
+        chunks = decode_pcm("/dummy/file.mp3", chunk_size=2)
+        next(chunks)
+        chunks.close()
+
+        popen_mock.return_value.kill.assert_called_once()
+
+
+class TestAudioAnalyzer(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.analyzer = AudioAnalyzer(logging.getLogger("test"))
+
+    def tearDown(self):
+        self.analyzer.stop()
+
+    def wait_calls(self, mock_, count=1, timeout=5.0):
+        end = time.time() + timeout
+        while time.time() < end and mock_.call_count < count:
+            time.sleep(0.01)
+
+    @patch("backend.audioanalyzer.shutil.which")
+    def test_is_available(self, which_mock):
+        which_mock.return_value = "/usr/bin/ffmpeg"
+        self.assertTrue(AudioAnalyzer.is_available())
+
+        which_mock.return_value = None
+        self.assertFalse(AudioAnalyzer.is_available())
+
+    def test_submit(self):
+        on_result = Mock()
+
+        self.analyzer.submit(
+            "/dummy/file.mp3", ["silence"], on_result, analysis=analysis_ok
+        )
+        self.wait_calls(on_result)
+
+        on_result.assert_called_with(
+            "/dummy/file.mp3", {"path": "/dummy/file.mp3", "analyses": ("silence",)}
+        )
+
+    def test_submit_failed(self):
+        on_result = Mock()
+        self.analyzer.logger = Mock()
+
+        self.analyzer.submit(
+            "/dummy/file.mp3", ["silence"], on_result, analysis=analysis_ko
+        )
+        self.wait_calls(self.analyzer.logger.warning)
+
+        on_result.assert_not_called()
+        self.analyzer.logger.warning.assert_called()
+
+    def test_submit_failed_on_error(self):
+        on_result = Mock()
+        on_error = Mock()
+
+        self.analyzer.submit(
+            "/dummy/file.mp3",
+            ["silence"],
+            on_result,
+            analysis=analysis_ko,
+            on_error=on_error,
+        )
+        self.wait_calls(on_error)
+
+        on_result.assert_not_called()
+        on_error.assert_called_once()
+        self.assertEqual(on_error.call_args.args[0], "/dummy/file.mp3")
+        self.assertIsInstance(on_error.call_args.args[1], Exception)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import os
+import shutil
+import struct
+import tempfile
+
+sys.path.append("../")
+from backend import audioheader
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+# MPEG 1 layer III, 128kbps, 44100Hz, joint stereo
+MP3_HEADER = b"\xff\xfb\x90\x64"
+MP3_FRAME_LENGTH = 417
+
+
+def make_mp3(frames=10, id3=False, xing_frames=None):
+    data = b""
+    if id3:
+        data += b"ID3\x03\x00\x00\x00\x00\x00\x14" + b"\x00" * 20
+    first_frame = bytearray(MP3_HEADER + b"\x00" * (MP3_FRAME_LENGTH - 4))
+    if xing_frames:
+        first_frame[36:48] = b"Xing" + struct.pack(">II", 1, xing_frames)
+    data += bytes(first_frame)
+    data += (MP3_HEADER + b"\x00" * (MP3_FRAME_LENGTH - 4)) * (frames - 1)
+    return data
+
+
+def make_adts(frames=10, length=372):
+    header = bytes(
+        [
+            0xFF,
+            0xF1,
+            0x50,
+            0x80 | ((length >> 11) & 0x03),
+            (length >> 3) & 0xFF,
+            ((length & 0x07) << 5) | 0x1F,
+            0xFC,
+        ]
+    )
+    return (header + b"\x00" * (length - 7)) * frames
+
+
+def make_flac(samplerate=44100, channels=2, total_samples=441000, picture_size=0):
+    value = (samplerate << 44) | ((channels - 1) << 41) | (15 << 36) | total_samples
+    streaminfo = b"\x10\x00\x10\x00" + b"\x00" * 6 + value.to_bytes(8, "big")
+    if not picture_size:
+        return b"fLaC" + b"\x80\x00\x00\x22" + streaminfo + b"\x00" * 1016
+    # last metadata block is a PICTURE block
+    picture = b"\x86" + picture_size.to_bytes(3, "big") + b"\x00" * picture_size
+    return b"fLaC" + b"\x00\x00\x00\x22" + streaminfo + b"\x00" * 16 + picture
+
+
+def make_ogg_page(packet, granule):
+    return make_ogg_pages(packet, granule)
+
+
+def make_ogg_pages(packet, granule):
+    # packet is split over as many pages as needed (255 segments per page)
+    lacing = [255] * (len(packet) // 255) + [len(packet) % 255]
+    data = b""
+    position = 0
+    for start in range(0, len(lacing), 255):
+        segments = lacing[start : start + 255]
+        size = sum(segments)
+        data += (
+            b"OggS\x00\x02"
+            + struct.pack("<qII", granule, 1, 0)
+            + b"\x00\x00\x00\x00"
+            + bytes([len(segments)])
+            + bytes(segments)
+            + packet[position : position + size]
+        )
+        position += size
+    return data
+
+
+def make_audio_pages(pages, page_size, granule):
+    return b"".join(
+        make_ogg_pages(b"\x55" * page_size, granule * (index + 1) // pages)
+        for index in range(pages)
+    )
+
+
+def make_vorbis(samplerate=44100, duration=10, comment_size=0, pages=1, page_size=10):
+    packet = (
+        b"\x01vorbis"
+        + struct.pack("<IBIiIi", 0, 2, samplerate, 0, 128000, 0)
+        + b"\xb8\x01"
+    )
+    return (
+        make_ogg_page(packet, 0)
+        + make_ogg_pages(b"\x03vorbis" + b"\x00" * comment_size, 0)
+        + make_ogg_pages(b"\x05vorbis" + b"\x00" * 1000, 0)
+        + make_audio_pages(pages, page_size, samplerate * duration)
+    )
+
+
+def make_opus(duration=10, comment_size=0, pages=1, page_size=10):
+    packet = b"OpusHead" + struct.pack("<BBHIhB", 1, 2, 312, 48000, 0, 0)
+    return (
+        make_ogg_page(packet, 0)
+        + make_ogg_pages(b"OpusTags" + b"\x00" * comment_size, 0)
+        + make_audio_pages(pages, page_size, 48000 * duration + 312)
+    )
+
+
+def set_end_of_stream(data):
+    data = bytearray(data)
+    data[data.rfind(b"OggS") + 5] = 0x04
+    return bytes(data)
+
+
+class TestAudioHeader(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write(self, filename, data):
+        path = os.path.join(self.path, filename)
+        with open(path, "wb") as fdesc:
+            fdesc.write(data)
+        return path
+
+    def test_get_id3_size(self):
+        tag = b"ID3\x03\x00\x00\x00\x00\x01\x7f"
+        self.assertEqual(audioheader.get_id3_size(tag), 265)
+        tag_with_footer = b"ID3\x04\x00\x10\x00\x00\x00\x0a"
+        self.assertEqual(audioheader.get_id3_size(tag_with_footer), 30)
+        self.assertEqual(audioheader.get_id3_size(MP3_HEADER * 3), 0)
+
+    def test_parse_mpeg_header(self):
+        frame = audioheader.parse_mpeg_header(MP3_HEADER)
+
+        self.assertDictEqual(
+            frame,
+            {
+                "version": audioheader.MPEG_VERSION_1,
+                "layer": audioheader.MPEG_LAYER_3,
+                "bitrate": 128000,
+                "samplerate": 44100,
+                "channels": 2,
+                "length": MP3_FRAME_LENGTH,
+                "samples": 1152,
+            },
+        )
+
+    def test_parse_mpeg_header_invalid(self):
+        self.assertIsNone(audioheader.parse_mpeg_header(b"\xff\xfb\xf0\x64"))
+        self.assertIsNone(audioheader.parse_mpeg_header(b"\xff\xf1\x50\x80"))
+        self.assertIsNone(audioheader.parse_mpeg_header(b"ID3\x03"))
+        self.assertIsNone(audioheader.parse_mpeg_header(b"\xff\xfb"))
+
+    def test_parse_adts_header(self):
+        frame = audioheader.parse_adts_header(make_adts(1))
+
+        self.assertDictEqual(
+            frame,
+            {"samplerate": 44100, "channels": 2, "length": 372, "samples": 1024},
+        )
+
+    def test_find_frame_skips_garbage(self):
+        data = b"\x00\xff\xfb\x00" + make_mp3(3)
+
+        offset, frame = audioheader.find_frame(data, audioheader.parse_mpeg_header)
+
+        self.assertEqual(offset, 4)
+        self.assertEqual(frame["bitrate"], 128000)
+
+    def test_find_frame_not_found(self):
+        self.assertEqual(
+            audioheader.find_frame(b"\x00" * 100, audioheader.parse_mpeg_header),
+            (None, None),
+        )
+
+    def test_sniff_mp3(self):
+        path = self._write("track.mp3", make_mp3(frames=100, id3=True))
+
+        infos = audioheader.sniff(path)
+
+        self.assertDictEqual(
+            infos,
+            {
+                "codec": "mp3",
+                "audioformat": "audio/mpeg",
+                "samplerate": 44100,
+                "channels": 2,
+                "bitrate": 128000,
+                "duration": 2.61,
+            },
+        )
+
+    def test_sniff_mp3_vbr(self):
+        path = self._write("track.mp3", make_mp3(frames=100, xing_frames=1000))
+
+        infos = audioheader.sniff(path)
+
+        self.assertEqual(infos["duration"], 26.12)
+        self.assertEqual(infos["bitrate"], 12770)
+
+    def test_sniff_aac(self):
+        path = self._write("track.aac", make_adts(frames=100))
+
+        infos = audioheader.sniff(path)
+
+        self.assertEqual(infos["codec"], "aac")
+        self.assertEqual(infos["audioformat"], "audio/aac")
+        self.assertEqual(infos["samplerate"], 44100)
+        self.assertEqual(infos["channels"], 2)
+        self.assertEqual(infos["bitrate"], 128165)
+        self.assertEqual(infos["duration"], 2.32)
+
+    def test_sniff_flac(self):
+        path = self._write("track.flac", make_flac())
+
+        infos = audioheader.sniff(path)
+
+        self.assertEqual(infos["codec"], "flac")
+        self.assertEqual(infos["audioformat"], "audio/flac")
+        self.assertEqual(infos["samplerate"], 44100)
+        self.assertEqual(infos["channels"], 2)
+        self.assertEqual(infos["duration"], 10.0)
+
+    def test_sniff_vorbis(self):
+        path = self._write("track.ogg", make_vorbis())
+
+        infos = audioheader.sniff(path)
+
+        self.assertEqual(infos["codec"], "vorbis")
+        self.assertEqual(infos["audioformat"], "audio/ogg")
+        self.assertEqual(infos["samplerate"], 44100)
+        self.assertEqual(infos["channels"], 2)
+        self.assertEqual(infos["duration"], 10.0)
+
+    def test_sniff_opus(self):
+        path = self._write("track.ogg", make_opus())
+
+        infos = audioheader.sniff(path)
+
+        self.assertEqual(infos["codec"], "opus")
+        self.assertEqual(infos["samplerate"], 48000)
+        self.assertEqual(infos["duration"], 10.0)
+
+    def test_sniff_unknown(self):
+        path = self._write("track.mp3", b"<html>not a track</html>" * 100)
+
+        self.assertIsNone(audioheader.sniff(path))
+
+    def test_sniff_missing_file(self):
+        with self.assertRaises(OSError):
+            audioheader.sniff(os.path.join(self.path, "missing.mp3"))
+
+    def test_matches_extension(self):
+        self.assertTrue(audioheader.matches_extension({"codec": "mp3"}, "/a/b.MP3"))
+        self.assertTrue(audioheader.matches_extension({"codec": "opus"}, "/a/b.ogg"))
+        self.assertFalse(audioheader.matches_extension({"codec": "aac"}, "/a/b.mp3"))
+        self.assertFalse(audioheader.matches_extension(None, "/a/b.mp3"))
+
+    def test_check_integrity_mp3(self):
+        path = self._write("track.mp3", make_mp3(frames=500, id3=True))
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_mp3_zero_filled(self):
+        data = make_mp3(frames=500)
+        # partially uploaded file: end of file filled with zeros
+        data = data[:40000] + b"\x00" * (len(data) - 40000)
+        path = self._write("track.mp3", data)
+
+        self.assertRegex(
+            audioheader.check_integrity(path), r"^No audio frame found at offset \d+$"
+        )
+
+    def test_check_integrity_aac(self):
+        path = self._write("track.aac", make_adts(frames=500))
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_flac(self):
+        frame = b"\xff\xf8\x69\x08\x00" + b"\x55" * 4000
+        path = self._write("track.flac", make_flac() + frame * 50)
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_flac_garbage(self):
+        path = self._write("track.flac", make_flac() + b"\x00" * 200000)
+
+        self.assertIsNotNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_vorbis_truncated(self):
+        path = self._write("track.ogg", make_vorbis())
+
+        self.assertEqual(audioheader.check_integrity(path), "Stream is truncated")
+
+    def test_check_integrity_vorbis(self):
+        path = self._write("track.ogg", set_end_of_stream(make_vorbis()))
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_flac_large_picture(self):
+        frame = b"\xff\xf8\x69\x08\x00" + b"\x55" * 4000
+        data = make_flac(picture_size=3000000) + frame * 2000
+        path = self._write("track.flac", data)
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_flac_truncated_metadata(self):
+        path = self._write("track.flac", make_flac(picture_size=3000000)[:100000])
+
+        self.assertEqual(
+            audioheader.check_integrity(path), "Audio headers are truncated"
+        )
+
+    def test_check_integrity_vorbis_large_comment(self):
+        data = make_vorbis(comment_size=3000000, pages=100, page_size=50000)
+        path = self._write("track.ogg", set_end_of_stream(data))
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_opus_large_comment(self):
+        data = make_opus(comment_size=3000000, pages=100, page_size=50000)
+        path = self._write("track.ogg", set_end_of_stream(data))
+
+        self.assertIsNone(audioheader.check_integrity(path))
+
+    def test_check_integrity_vorbis_zero_filled(self):
+        data = make_vorbis(pages=100, page_size=50000)
+        data = set_end_of_stream(data[:1000000] + b"\x00" * 3000000 + data[-100:])
+        path = self._write("track.ogg", data)
+
+        self.assertRegex(
+            audioheader.check_integrity(path), r"^No audio frame found at offset \d+$"
+        )
+
+    def test_check_integrity_vorbis_invalid_headers(self):
+        data = make_vorbis()
+        # setup header page is corrupt
+        setup_page = data.find(b"OggS", data.find(b"\x03vorbis"))
+        data = data[:setup_page] + b"\x00" * 4 + data[setup_page + 4 :]
+        path = self._write("track.ogg", set_end_of_stream(data))
+
+        self.assertEqual(
+            audioheader.check_integrity(path), "Audio headers are truncated"
+        )
+
+    def test_check_integrity_unknown(self):
+        path = self._write("track.mp3", b"<html>not a track</html>" * 100)
+
+        self.assertEqual(
+            audioheader.check_integrity(path), "Audio format not recognized"
+        )
+
+    def test_probe(self):
+        path = self._write("track.mp3", make_mp3(frames=100))
+
+        self.assertDictEqual(audioheader.probe(path), {"integrityerror": None})
+
+
+if __name__ == "__main__":
+    unittest.main()
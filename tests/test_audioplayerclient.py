@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import time
+import threading
+from unittest.mock import Mock
+
+sys.path.append("../")
+from backend.audioplayerclient import AudioplayerClient, CircuitOpenError
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+class TestAudioplayerClient(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.send_command = Mock(return_value="result")
+        self.client = AudioplayerClient(
+            logging.getLogger(self.__class__.__name__),
+            self.send_command,
+            breaker_threshold=2,
+        )
+        self.client.RETRY_DELAY = 0.0
+
+    def tearDown(self):
+        self.client.stop()
+
+    def test_call(self):
+        result = self.client.call("start_playback", {"resource": "/file1.mp3"})
+
+        self.assertEqual(result, "result")
+        self.send_command.assert_called_once_with(
+            "start_playback", {"resource": "/file1.mp3"}, 5.0
+        )
+
+    def test_call_default_timeout(self):
+        self.client.call("pause_playback", {})
+
+        self.send_command.assert_called_once_with("pause_playback", {}, 3.0)
+
+    def test_call_retries_idempotent_command(self):
+        self.send_command.side_effect = [TimeoutError("Test timeout"), "result"]
+
+        result = self.client.call("stop_playback", {"player_uuid": "uuid"})
+
+        self.assertEqual(result, "result")
+        self.assertEqual(self.send_command.call_count, 2)
+
+    def test_call_retries_are_bounded(self):
+        self.send_command.side_effect = TimeoutError("Test timeout")
+
+        result = self.client.call("stop_playback", {"player_uuid": "uuid"})
+
+        self.assertIsNone(result)
+        self.assertEqual(self.send_command.call_count, 3)
+
+    def test_call_does_not_retry_other_commands(self):
+        self.send_command.side_effect = TimeoutError("Test timeout")
+
+        result = self.client.call("start_playback", {})
+
+        self.assertIsNone(result)
+        self.assertEqual(self.send_command.call_count, 1)
+
+    def test_call_timeout(self):
+        release = threading.Event()
+        self.send_command.side_effect = lambda *args: release.wait()
+        self.client.TIMEOUTS = {"start_playback": 0.1}
+
+        start = time.monotonic()
+        result = self.client.call("start_playback", {})
+
+        self.assertIsNone(result)
+        self.assertLess(time.monotonic() - start, 2.0)
+        release.set()
+
+    def test_circuit_breaker(self):
+        self.send_command.side_effect = TimeoutError("Test timeout")
+        self.client.call("start_playback", {})
+        self.assertTrue(self.client.is_available())
+
+        self.client.call("start_playback", {})
+
+        self.assertFalse(self.client.is_available())
+        future = self.client.submit("start_playback", {})
+        with self.assertRaises(CircuitOpenError):
+            future.result()
+        self.assertEqual(self.send_command.call_count, 2)
+
+    def test_circuit_breaker_cooldown(self):
+        self.client.breaker_cooldown = 0.1
+        self.send_command.side_effect = TimeoutError("Test timeout")
+        self.client.call("start_playback", {})
+        self.client.call("start_playback", {})
+        self.assertFalse(self.client.is_available())
+
+        time.sleep(0.15)
+        self.send_command.side_effect = None
+
+        self.assertTrue(self.client.is_available())
+        self.assertEqual(self.client.call("start_playback", {}), "result")
+
+    def test_circuit_breaker_reset_by_success(self):
+        self.send_command.side_effect = [
+            TimeoutError("Test timeout"),
+            "result",
+            TimeoutError("Test timeout"),
+        ]
+
+        self.client.call("start_playback", {})
+        self.client.call("start_playback", {})
+        self.client.call("start_playback", {})
+
+        self.assertTrue(self.client.is_available())
+
+    def test_command_errors_do_not_open_circuit(self):
+        self.send_command.side_effect = Exception("Test exception")
+
+        for _ in range(3):
+            result = self.client.call("stop_playback", {"player_uuid": "uuid"})
+            self.assertIsNone(result)
+
+        self.assertTrue(self.client.is_available())
+        # audioplayer responded, command is not retried
+        self.assertEqual(self.send_command.call_count, 3)
+
+    def test_command_error_resets_failures(self):
+        self.send_command.side_effect = [
+            TimeoutError("Test timeout"),
+            Exception("Test exception"),
+            TimeoutError("Test timeout"),
+        ]
+
+        for _ in range(3):
+            self.client.call("start_playback", {})
+
+        self.assertTrue(self.client.is_available())
+
+    def test_bypass_breaker_when_circuit_is_open(self):
+        self.send_command.side_effect = TimeoutError("Test timeout")
+        self.client.call("start_playback", {})
+        self.client.call("start_playback", {})
+        self.assertFalse(self.client.is_available())
+        self.send_command.side_effect = None
+
+        result = self.client.call("start_playback", {}, bypass_breaker=True)
+
+        self.assertEqual(result, "result")
+        self.assertEqual(self.send_command.call_count, 3)
+        self.assertTrue(self.client.is_available())
+
+    def test_bypass_breaker_single_attempt(self):
+        self.send_command.side_effect = TimeoutError("Test timeout")
+
+        result = self.client.call("pause_playback", {}, bypass_breaker=True)
+
+        self.assertIsNone(result)
+        self.assertEqual(self.send_command.call_count, 1)
+
+    def test_bypass_breaker_not_queued_behind_stalled_commands(self):
+        release = threading.Event()
+        self.send_command.side_effect = lambda command, *args: (
+            release.wait() if command == "add_tracks" else "result"
+        )
+        self.client.max_workers = 1
+        self.client.submit("add_tracks", {})
+
+        result = self.client.call("start_playback", {}, bypass_breaker=True)
+
+        self.assertEqual(result, "result")
+        release.set()
+
+    def test_submit_runs_commands_concurrently(self):
+        barrier = threading.Barrier(2, timeout=2.0)
+        self.send_command.side_effect = lambda *args: barrier.wait()
+
+        futures = [
+            self.client.submit("stop_playback", {"player_uuid": "uuid1"}),
+            self.client.submit("start_playback", {"resource": "/file1.mp3"}),
+        ]
+        results = self.client.wait(futures)
+
+        self.assertEqual(self.send_command.call_count, 2)
+        self.assertCountEqual(results, [0, 1])
+
+    def test_wait_ignores_none(self):
+        self.assertListEqual(self.client.wait([None]), [None])
+
+    def test_get_timeout(self):
+        self.assertEqual(self.client.get_timeout("start_playback"), 5.0)
+        self.assertAlmostEqual(self.client.get_timeout("stop_playback"), 9.0)
+        self.assertEqual(self.client.get_timeout("stop_playback", True), 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
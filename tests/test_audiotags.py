@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import os
+import shutil
+import struct
+import tempfile
+
+sys.path.append("../")
+from backend import audiotags
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+def syncsafe(size):
+    return bytes(
+        [(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F]
+    )
+
+
+def make_id3(frames, major=3):
+    data = b""
+    for frame_id, frame in frames:
+        if major == 2:
+            data += frame_id + len(frame).to_bytes(3, "big") + frame
+            continue
+        size = syncsafe(len(frame)) if major == 4 else struct.pack(">I", len(frame))
+        data += frame_id + size + b"\x00\x00" + frame
+    data += b"\x00" * 10
+    return b"ID3" + bytes([major, 0, 0]) + syncsafe(len(data)) + data
+
+
+def make_text(text, encoding=0):
+    codec = audiotags.ID3_ENCODINGS[encoding]
+    return bytes([encoding]) + text.encode(codec)
+
+
+def make_vorbis_comment(comments, prefix=b""):
+    data = prefix + struct.pack("<I", 6) + b"vendor" + struct.pack("<I", len(comments))
+    for comment in comments:
+        data += struct.pack("<I", len(comment)) + comment
+    return data
+
+
+def make_ogg_pages(packets):
+    data = b""
+    for sequence, packet in enumerate(packets):
+        lacing = [255] * (len(packet) // 255) + [len(packet) % 255]
+        data += (
+            b"OggS\x00\x00"
+            + struct.pack("<qIII", 0, 1, sequence, 0)
+            + bytes([len(lacing)])
+            + bytes(lacing)
+            + packet
+        )
+    return data
+
+
+class TestAudioTags(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write(self, filename, data):
+        path = os.path.join(self.path, filename)
+        with open(path, "wb") as fdesc:
+            fdesc.write(data)
+        return path
+
+    def test_read_tags_id3v23(self):
+        tag = make_id3(
+            [
+                (b"APIC", b"\x00image/jpeg\x00\x03\x00" + b"\xff" * 1000),
+                (b"TPE1", make_text("Artist")),
+                (b"TPE2", make_text("Album artist")),
+                (b"TALB", make_text("Album", encoding=1)),
+                (b"TCON", make_text("(17)")),
+                (b"TIT2", make_text("Title\x00Other title")),
+                (b"TRCK", make_text("3/12")),
+            ]
+        )
+        path = self._write("track.mp3", tag + b"\xff\xfb\x90\x64" * 100)
+
+        self.assertDictEqual(
+            audiotags.read_tags(path),
+            {
+                "artist": "Artist",
+                "albumartist": "Album artist",
+                "album": "Album",
+                "genre": "Rock",
+                "title": "Title",
+                "track": 3,
+            },
+        )
+
+    def test_read_tags_id3v24_utf8(self):
+        tag = make_id3(
+            [(b"TPE1", make_text("Björk", encoding=3)), (b"TRCK", make_text("x"))],
+            major=4,
+        )
+        path = self._write("track.mp3", tag)
+
+        self.assertDictEqual(audiotags.read_tags(path), {"artist": "Björk"})
+
+    def test_read_tags_id3v22(self):
+        tag = make_id3([(b"TP1", make_text("Artist")), (b"TAL", make_text("Album"))], 2)
+        path = self._write("track.mp3", tag)
+
+        self.assertDictEqual(
+            audiotags.read_tags(path), {"artist": "Artist", "album": "Album"}
+        )
+
+    def test_read_tags_id3v1(self):
+        tag = (
+            b"TAG"
+            + b"Title".ljust(30, b"\x00")
+            + b"Artist".ljust(30, b"\x00")
+            + b"Album".ljust(30, b"\x00")
+            + b"2001"
+            + b"\x00" * 29
+            + b"\x05"
+            + b"\x08"
+        )
+        path = self._write("track.mp3", b"\xff\xfb\x90\x64" * 100 + tag)
+
+        self.assertDictEqual(
+            audiotags.read_tags(path),
+            {
+                "title": "Title",
+                "artist": "Artist",
+                "album": "Album",
+                "track": 5,
+                "genre": "Jazz",
+            },
+        )
+
+    def test_read_tags_flac(self):
+        streaminfo = b"\x00\x00\x00\x22" + b"\x00" * 34
+        comment = make_vorbis_comment(
+            [b"artist=Artist", b"ALBUM ARTIST=Various", b"TRACKNUMBER=07", b"EMPTY="]
+        )
+        path = self._write(
+            "track.flac",
+            b"fLaC" + streaminfo + b"\x84" + len(comment).to_bytes(3, "big") + comment,
+        )
+
+        self.assertDictEqual(
+            audiotags.read_tags(path),
+            {"artist": "Artist", "albumartist": "Various", "track": 7},
+        )
+
+    def test_read_tags_ogg_vorbis(self):
+        comment = make_vorbis_comment([b"GENRE=Jazz"], prefix=b"\x03vorbis") + b"\x01"
+        path = self._write(
+            "track.ogg", make_ogg_pages([b"\x01vorbis" + b"\x00" * 23, comment])
+        )
+
+        self.assertDictEqual(audiotags.read_tags(path), {"genre": "Jazz"})
+
+    def test_read_tags_ogg_opus(self):
+        comment = make_vorbis_comment([b"TITLE=Title"], prefix=b"OpusTags")
+        path = self._write(
+            "track.opus", make_ogg_pages([b"OpusHead" + b"\x00" * 11, comment])
+        )
+
+        self.assertDictEqual(audiotags.read_tags(path), {"title": "Title"})
+
+    def test_read_tags_none(self):
+        path = self._write("track.mp3", b"\xff\xfb\x90\x64" * 100)
+
+        self.assertDictEqual(audiotags.read_tags(path), {})
+
+    def test_read_tags_truncated_comments(self):
+        comment = make_vorbis_comment([b"ARTIST=Artist", b"TITLE=Title"])
+
+        self.assertDictEqual(
+            audiotags.parse_vorbis_comments(comment[:-8]), {"artist": "Artist"}
+        )
+
+    def test_read_tags_missing_file(self):
+        with self.assertRaises(OSError):
+            audiotags.read_tags(os.path.join(self.path, "missing.mp3"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import json
+
+sys.path.append("../")
+from backend import compactlisting
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+FILES = [
+    {"filename": "file1.mp3", "path": "/opt/cleep/modules/localmusic/file1.mp3"},
+    {"filename": "file2.mp3", "path": "/opt/cleep/modules/localmusic/rock/file2.mp3"},
+    {"filename": "file3.mp3", "path": "/opt/cleep/modules/localmusic/rock/file3.mp3"},
+    {"filename": "file4.ogg", "path": "/opt/cleep/modules/localmusic/jazz/a/file4.ogg"},
+]
+
+
+class TestCompactListing(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+
+    def test_get_common_prefix(self):
+        self.assertEqual(
+            compactlisting.get_common_prefix([file_["path"] for file_ in FILES]),
+            "/opt/cleep/modules/localmusic/",
+        )
+        self.assertEqual(
+            compactlisting.get_common_prefix(["/music/a/file1.mp3"]), "/music/a/"
+        )
+        self.assertEqual(compactlisting.get_common_prefix(["/file1.mp3"]), "/")
+        self.assertEqual(compactlisting.get_common_prefix([]), "")
+
+    def test_pack_files(self):
+        listing = compactlisting.pack_files(FILES)
+
+        self.assertDictEqual(
+            listing,
+            {
+                "format": "columnar",
+                "version": 1,
+                "count": 4,
+                "encoding": None,
+                "columns": {
+                    "prefix": "/opt/cleep/modules/localmusic/",
+                    "folders": ["", "rock/", "jazz/a/"],
+                    "folder": [0, 1, 1, 2],
+                    "filenames": ["file1.mp3", "file2.mp3", "file3.mp3", "file4.ogg"],
+                },
+                "data": None,
+            },
+        )
+        self.assertListEqual(compactlisting.unpack_files(listing), FILES)
+
+    def test_pack_files_with_ids(self):
+        listing = compactlisting.pack_files(FILES, ids=[4, 2, 3, 1])
+
+        self.assertListEqual(listing["columns"]["ids"], [4, 2, 3, 1])
+        files = compactlisting.unpack_files(listing)
+        self.assertListEqual([file_["id"] for file_ in files], [4, 2, 3, 1])
+        self.assertEqual(files[3]["path"], FILES[3]["path"])
+
+    def test_pack_files_empty(self):
+        listing = compactlisting.pack_files([], compress=True, compress_min_size=0)
+
+        self.assertEqual(listing["count"], 0)
+        self.assertListEqual(compactlisting.unpack_files(listing), [])
+
+    def test_pack_files_compressed(self):
+        files = [
+            {"filename": f"file{index}.mp3", "path": f"/music/album/file{index}.mp3"}
+            for index in range(2000)
+        ]
+
+        listing = compactlisting.pack_files(files, compress=True)
+
+        self.assertEqual(listing["encoding"], "gzip")
+        self.assertIsNone(listing["columns"])
+        self.assertLess(len(listing["data"]), len(json.dumps(files)) / 10)
+        self.assertListEqual(compactlisting.unpack_files(listing), files)
+
+    def test_pack_files_small_payload_not_compressed(self):
+        listing = compactlisting.pack_files(FILES, compress=True)
+
+        self.assertIsNone(listing["encoding"])
+        self.assertIsNone(listing["data"])
+        self.assertListEqual(compactlisting.unpack_files(listing), FILES)
+
+    def test_unpack_files_unsupported_format(self):
+        listing = compactlisting.pack_files(FILES)
+        listing["version"] = 2
+
+        with self.assertRaises(ValueError):
+            compactlisting.unpack_files(listing)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import os
+import time
+import base64
+import shutil
+import struct
+import tempfile
+from unittest.mock import patch
+
+sys.path.append("../")
+from backend import coverart
+from backend.coverart import CoverCache
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+IMAGE = b"\xff\xd8\xff\xe0" + b"\x01" * 100
+
+
+def syncsafe(size):
+    return bytes(
+        [(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F]
+    )
+
+
+def make_id3(frames, major=3):
+    data = b""
+    for frame_id, frame in frames:
+        size = syncsafe(len(frame)) if major == 4 else struct.pack(">I", len(frame))
+        data += frame_id + size + b"\x00\x00" + frame
+    data += b"\x00" * 10
+    return b"ID3" + bytes([major, 0, 0]) + syncsafe(len(data)) + data
+
+
+def make_apic(image, picture_type=3, encoding=0, description=b"desc"):
+    if encoding in (1, 2):
+        description = description.decode().encode("utf-16-le") + b"\x00\x00"
+    else:
+        description += b"\x00"
+    return (
+        bytes([encoding])
+        + b"image/jpeg\x00"
+        + bytes([picture_type])
+        + description
+        + image
+    )
+
+
+def make_picture_block(image, picture_type=3):
+    mime = b"image/jpeg"
+    return (
+        struct.pack(">II", picture_type, len(mime))
+        + mime
+        + struct.pack(">I", 0)
+        + b"\x00" * 16
+        + struct.pack(">I", len(image))
+        + image
+    )
+
+
+def make_ogg_pages(packets):
+    """
+    Build Ogg pages with one packet per page (packets may be longer than 255 bytes)
+    """
+    data = b""
+    for sequence, packet in enumerate(packets):
+        lacing = [255] * (len(packet) // 255) + [len(packet) % 255]
+        data += (
+            b"OggS\x00\x00"
+            + struct.pack("<qIII", 0, 1, sequence, 0)
+            + bytes([len(lacing)])
+            + bytes(lacing)
+            + packet
+        )
+    return data
+
+
+def make_vorbis_comment(comments):
+    data = b"\x03vorbis" + struct.pack("<I", 6) + b"vendor"
+    data += struct.pack("<I", len(comments))
+    for comment in comments:
+        data += struct.pack("<I", len(comment)) + comment
+    return data + b"\x01"
+
+
+def fake_thumbnail(data, size, path):
+    with open(path, "wb") as fdesc:
+        fdesc.write(b"x" * size)
+
+
+class TestCoverArt(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write(self, filename, data):
+        path = os.path.join(self.path, filename)
+        with open(path, "wb") as fdesc:
+            fdesc.write(data)
+        return path
+
+    def test_extract_embedded_id3v23(self):
+        tag = make_id3(
+            [
+                (b"TIT2", b"\x00title"),
+                (b"APIC", make_apic(b"back", picture_type=4)),
+                (b"APIC", make_apic(IMAGE)),
+            ]
+        )
+        path = self._write("track.mp3", tag + b"\xff\xfb\x90\x64" * 100)
+
+        self.assertEqual(coverart.extract_embedded(path), IMAGE)
+
+    def test_extract_embedded_id3v24_utf16(self):
+        tag = make_id3([(b"APIC", make_apic(IMAGE, encoding=1))], major=4)
+        path = self._write("track.mp3", tag)
+
+        self.assertEqual(coverart.extract_embedded(path), IMAGE)
+
+    def test_extract_embedded_id3_without_picture(self):
+        path = self._write("track.mp3", make_id3([(b"TIT2", b"\x00title")]))
+
+        self.assertIsNone(coverart.extract_embedded(path))
+
+    def test_extract_embedded_flac(self):
+        streaminfo = b"\x00\x00\x00\x22" + b"\x00" * 34
+        picture = make_picture_block(IMAGE)
+        path = self._write(
+            "track.flac",
+            b"fLaC" + streaminfo + b"\x86" + len(picture).to_bytes(3, "big") + picture,
+        )
+
+        self.assertEqual(coverart.extract_embedded(path), IMAGE)
+
+    def test_extract_embedded_ogg(self):
+        image = IMAGE * 5
+        picture = base64.b64encode(make_picture_block(image))
+        comment = make_vorbis_comment(
+            [b"TITLE=title", b"METADATA_BLOCK_PICTURE=" + picture]
+        )
+        path = self._write(
+            "track.ogg", make_ogg_pages([b"\x01vorbis" + b"\x00" * 23, comment])
+        )
+
+        self.assertEqual(coverart.extract_embedded(path), image)
+
+    def test_extract_embedded_none(self):
+        path = self._write("track.mp3", b"\xff\xfb\x90\x64" * 100)
+
+        self.assertIsNone(coverart.extract_embedded(path))
+
+    def test_extract_embedded_missing_file(self):
+        with self.assertRaises(OSError):
+            coverart.extract_embedded(os.path.join(self.path, "missing.mp3"))
+
+    def test_parse_picture_block_truncated(self):
+        self.assertIsNone(
+            coverart.parse_picture_block(make_picture_block(IMAGE)[:-10])
+        )
+
+    def test_find_folder_image(self):
+        self.assertEqual(
+            coverart.find_folder_image(["track.mp3", "Folder.JPG", "cover.png"]),
+            "Folder.JPG",
+        )
+        self.assertIsNone(coverart.find_folder_image(["track.mp3", "photo.jpg"]))
+
+
+@patch("backend.coverart.make_thumbnail", fake_thumbnail)
+class TestCoverCache(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, "covers")
+        self.cache = CoverCache(
+            logging.getLogger("test"), cache_path=self.cache_path, max_size=300
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add(self):
+        path = self.cache.add(IMAGE, 128)
+
+        self.assertTrue(path.startswith(self.cache_path))
+        self.assertEqual(os.path.getsize(path), 128)
+        self.assertEqual(self.cache.get(CoverCache.get_key(IMAGE), 128), path)
+        self.assertIsNone(self.cache.get(CoverCache.get_key(IMAGE), 64))
+        self.assertEqual(self.cache.get_size(), 128)
+
+    def test_add_same_content_once(self):
+        with patch("backend.coverart.make_thumbnail") as make_thumbnail_mock:
+            make_thumbnail_mock.side_effect = fake_thumbnail
+
+            self.cache.add(IMAGE, 64)
+            self.cache.add(IMAGE, 64)
+
+        self.assertEqual(make_thumbnail_mock.call_count, 1)
+
+    def test_add_evicts_least_recently_used(self):
+        first_key = CoverCache.get_key(b"image1")
+        self.cache.add(b"image1", 128)
+        self.cache.add(b"image2", 128)
+        # image1 is used, image2 becomes least recently used
+        self.cache.get(first_key, 128)
+
+        self.cache.add(b"image3", 128)
+
+        self.assertEqual(self.cache.get_size(), 256)
+        self.assertIsNotNone(self.cache.get(first_key, 128))
+        self.assertIsNone(self.cache.get(CoverCache.get_key(b"image2"), 128))
+        self.assertEqual(len(os.listdir(self.cache_path)), 2)
+
+    def test_add_failed(self):
+        with patch("backend.coverart.make_thumbnail") as make_thumbnail_mock:
+            make_thumbnail_mock.side_effect = Exception("Test exception")
+
+            with self.assertRaises(Exception):
+                self.cache.add(IMAGE, 64)
+
+        self.assertListEqual(os.listdir(self.cache_path), [])
+        self.assertEqual(self.cache.get_size(), 0)
+
+    def test_load_existing_thumbnails(self):
+        self.cache.add(b"image1", 128)
+        self.cache.add(b"image2", 128)
+        old_path = self.cache.get(CoverCache.get_key(b"image1"), 128)
+        os.utime(old_path, (time.time() - 100, time.time() - 100))
+
+        cache = CoverCache(
+            logging.getLogger("test"), cache_path=self.cache_path, max_size=300
+        )
+        cache.add(b"image3", 128)
+
+        self.assertEqual(cache.get_size(), 256)
+        self.assertFalse(os.path.exists(old_path))
+
+    def test_get_missing_thumbnail_file(self):
+        path = self.cache.add(IMAGE, 64)
+        os.remove(path)
+
+        self.assertIsNone(self.cache.get(CoverCache.get_key(IMAGE), 64))
+        self.assertEqual(self.cache.get_size(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+
+sys.path.append("../")
+from backend.libraryindex import LibraryIndex
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+def make_file(filename, size=10, mtime=1.0, folder="/opt/module/localmusic"):
+    return {
+        "filename": filename,
+        "path": f"{folder}/{filename}",
+        "size": size,
+        "mtime": mtime,
+    }
+
+
+class TestLibraryIndex(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.index = LibraryIndex()
+
+    def test_update_first_time(self):
+        changes = self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+
+        self.assertEqual(self.index.version, 1)
+        self.assertEqual(len(self.index), 2)
+        self.assertListEqual(
+            changes["added"],
+            [
+                {"filename": "file1.mp3", "path": "/opt/module/localmusic/file1.mp3"},
+                {"filename": "file2.mp3", "path": "/opt/module/localmusic/file2.mp3"},
+            ],
+        )
+        self.assertListEqual(changes["removed"], [])
+        self.assertListEqual(changes["changed"], [])
+
+    def test_update_without_change_keeps_version(self):
+        self.index.update([make_file("file1.mp3")])
+
+        changes = self.index.update([make_file("file1.mp3")])
+
+        self.assertEqual(self.index.version, 1)
+        self.assertEqual(changes["added"] + changes["removed"] + changes["changed"], [])
+
+    def test_update_detects_changes(self):
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+
+        changes = self.index.update(
+            [make_file("file1.mp3", size=20), make_file("file3.mp3")]
+        )
+
+        self.assertEqual(self.index.version, 2)
+        self.assertEqual([file_["filename"] for file_ in changes["added"]], ["file3.mp3"])
+        self.assertEqual(changes["removed"], ["file2.mp3"])
+        self.assertEqual(
+            [file_["filename"] for file_ in changes["changed"]], ["file1.mp3"]
+        )
+
+    def test_update_duplicate_filenames(self):
+        files = [
+            make_file("01.mp3", size=10, folder="/music/album1"),
+            make_file("01.mp3", size=20, folder="/music/album2"),
+            make_file("02.mp3", size=20, folder="/music/album2"),
+        ]
+        self.index.update(files)
+        self.index.set_metadata("01.mp3", {"gain": 1.0})
+        version = self.index.version
+
+        changes = self.index.update(files)
+
+        self.assertEqual(changes["added"] + changes["removed"] + changes["changed"], [])
+        self.assertEqual(self.index.version, version)
+        self.assertEqual(self.index.get_entry("01.mp3")["path"], "/music/album1/01.mp3")
+        self.assertEqual(self.index.get_metadata("01.mp3", "gain"), 1.0)
+        self.assertEqual(self.index.total_size, 30)
+
+    def test_total_size(self):
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3", size=None)])
+        self.assertEqual(self.index.total_size, 10)
+
+        self.index.update(
+            [make_file("file1.mp3", size=25), make_file("file3.mp3", size=5)]
+        )
+
+        self.assertEqual(self.index.total_size, 30)
+
+    def test_ids_are_stable(self):
+        self.index.update([make_file("file1.mp3")])
+        file_id = self.index.get_entry("file1.mp3")["id"]
+
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+
+        self.assertEqual(self.index.get_entry("file1.mp3")["id"], file_id)
+        self.assertEqual(self.index.get_entry_by_id(file_id)["filename"], "file1.mp3")
+        self.assertNotEqual(self.index.get_entry("file2.mp3")["id"], file_id)
+
+    def test_get_changes(self):
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+        self.index.update([make_file("file1.mp3"), make_file("file3.mp3")])
+        self.index.update(
+            [make_file("file1.mp3", mtime=2.0), make_file("file3.mp3", size=5)]
+        )
+
+        changes = self.index.get_changes(1)
+        logging.debug("Changes: %s", changes)
+
+        self.assertEqual(changes["version"], 3)
+        self.assertEqual([file_["filename"] for file_ in changes["added"]], ["file3.mp3"])
+        self.assertEqual(changes["removed"], ["file2.mp3"])
+        self.assertEqual(
+            [file_["filename"] for file_ in changes["changed"]], ["file1.mp3"]
+        )
+
+    def test_get_changes_up_to_date(self):
+        self.index.update([make_file("file1.mp3")])
+
+        changes = self.index.get_changes(1)
+
+        self.assertEqual(changes["added"] + changes["removed"] + changes["changed"], [])
+
+    def test_get_changes_removed_then_added(self):
+        self.index.update([make_file("file1.mp3")])
+        self.index.update([])
+        self.index.update([make_file("file1.mp3")])
+
+        changes = self.index.get_changes(1)
+
+        self.assertEqual(changes["added"], [])
+        self.assertEqual(changes["removed"], [])
+        self.assertEqual(
+            [file_["filename"] for file_ in changes["changed"]], ["file1.mp3"]
+        )
+
+    def test_get_changes_unknown_version(self):
+        self.index.update([make_file("file1.mp3")])
+
+        self.assertIsNone(self.index.get_changes(5))
+        self.assertIsNone(self.index.get_changes(None))
+
+    def test_get_changes_journal_truncated(self):
+        self.index = LibraryIndex(journal_size=2)
+        self.index.update([make_file("file1.mp3")])
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+        self.index.update(
+            [make_file("file1.mp3"), make_file("file2.mp3"), make_file("file3.mp3")]
+        )
+
+        self.assertIsNone(self.index.get_changes(0))
+        self.assertIsNotNone(self.index.get_changes(2))
+
+    def test_get_changes_previous_epoch(self):
+        self.index.set_epoch(1)
+        self.index.update([make_file("file1.mp3")])
+        known_version = self.index.version
+
+        # restart: index is rebuilt from scratch in new epoch
+        self.index = LibraryIndex()
+        self.index.set_epoch(2)
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+
+        self.assertEqual(self.index.version, (2 << LibraryIndex.EPOCH_SHIFT) + 1)
+        self.assertGreater(self.index.version, known_version)
+        self.assertIsNone(self.index.get_changes(known_version))
+        self.assertIsNone(self.index.get_changes(1))
+        changes = self.index.get_changes(2 << LibraryIndex.EPOCH_SHIFT)
+        self.assertEqual(len(changes["added"]), 2)
+
+    def test_get_folder(self):
+        root = "/opt/module/localmusic"
+        self.index.update(
+            [
+                make_file("file2.mp3", size=5),
+                make_file("file1.mp3", size=5),
+                make_file("a1.mp3", size=10, folder=f"{root}/rock/album"),
+                make_file("a2.mp3", size=10, folder=f"{root}/rock/album"),
+                make_file("b1.mp3", size=20, folder=f"{root}/jazz"),
+            ]
+        )
+
+        folder = self.index.get_folder(root)
+
+        self.assertDictEqual(
+            folder,
+            {
+                "path": root,
+                "count": 5,
+                "size": 50,
+                "folders": [
+                    {"path": f"{root}/jazz", "count": 1, "size": 20},
+                    {"path": f"{root}/rock", "count": 2, "size": 20},
+                ],
+                "files": [
+                    {"filename": "file1.mp3", "path": f"{root}/file1.mp3"},
+                    {"filename": "file2.mp3", "path": f"{root}/file2.mp3"},
+                ],
+                "filescount": 2,
+            },
+        )
+        self.assertEqual(self.index.get_folder("/opt")["count"], 5)
+        self.assertIsNone(self.index.get_folder(f"{root}/pop"))
+
+    def test_get_folder_paginated(self):
+        self.index.update([make_file(f"file{index}.mp3") for index in range(5)])
+
+        folder = self.index.get_folder("/opt/module/localmusic", offset=3, limit=10)
+
+        self.assertListEqual(
+            [file_["filename"] for file_ in folder["files"]], ["file3.mp3", "file4.mp3"]
+        )
+        self.assertEqual(folder["filescount"], 5)
+
+    def test_get_folder_updated_incrementally(self):
+        root = "/opt/module/localmusic"
+        self.index.update(
+            [
+                make_file("file1.mp3", size=5),
+                make_file("a1.mp3", size=10, folder=f"{root}/rock"),
+            ]
+        )
+
+        # file moved and resized, last file of rock folder removed
+        self.index.update(
+            [
+                make_file("file1.mp3", size=5),
+                make_file("a1.mp3", size=30, mtime=2.0, folder=f"{root}/jazz"),
+            ]
+        )
+        self.assertIsNone(self.index.get_folder(f"{root}/rock"))
+        self.assertEqual(self.index.get_folder(f"{root}/jazz")["size"], 30)
+        self.assertEqual(self.index.get_folder(root)["size"], 35)
+
+        self.index.update([])
+        self.assertIsNone(self.index.get_folder(root))
+        self.assertIsNone(self.index.get_folder("/"))
+
+    def test_get_folder_entries(self):
+        root = "/opt/module/localmusic"
+        self.index.update(
+            [
+                make_file("b1.mp3", folder=f"{root}/rock/b"),
+                make_file("a1.mp3", folder=f"{root}/rock/a"),
+                make_file("r1.mp3", folder=f"{root}/rock"),
+                make_file("j1.mp3", folder=f"{root}/jazz"),
+            ]
+        )
+
+        entries = self.index.get_folder_entries(f"{root}/rock")
+        self.assertListEqual(
+            [entry["filename"] for entry in entries], ["r1.mp3", "a1.mp3", "b1.mp3"]
+        )
+
+        entries = self.index.get_folder_entries(f"{root}/rock", recursive=False)
+        self.assertListEqual([entry["filename"] for entry in entries], ["r1.mp3"])
+
+        self.assertIsNone(self.index.get_folder_entries(f"{root}/pop"))
+
+    def _update_tagged_files(self):
+        self.index.update([make_file(f"file{index}.mp3") for index in range(1, 6)])
+        tags = {
+            "file1.mp3": {"artist": "Band", "album": "First", "track": 2, "genre": "Rock"},
+            "file2.mp3": {"artist": "Band", "album": "First", "track": 1, "genre": "Rock"},
+            "file3.mp3": {"artist": "Band", "album": "second", "genre": "Pop"},
+            "file4.mp3": {
+                "artist": "Guest",
+                "albumartist": "Various",
+                "album": "Compilation",
+                "genre": "Rock",
+            },
+            "file5.mp3": {},
+        }
+        for filename, file_tags in tags.items():
+            self.index.set_metadata(filename, {"tags": file_tags})
+
+    def test_get_artists(self):
+        self._update_tagged_files()
+
+        self.assertDictEqual(
+            self.index.get_artists(),
+            {
+                "count": 3,
+                "artists": [
+                    {"name": "", "albums": 1, "tracks": 1},
+                    {"name": "Band", "albums": 2, "tracks": 3},
+                    {"name": "Various", "albums": 1, "tracks": 1},
+                ],
+            },
+        )
+        self.assertListEqual(
+            self.index.get_artists(offset=1, limit=1)["artists"],
+            [{"name": "Band", "albums": 2, "tracks": 3}],
+        )
+
+    def test_get_albums(self):
+        self._update_tagged_files()
+
+        self.assertDictEqual(
+            self.index.get_albums("Band"),
+            {
+                "count": 2,
+                "albums": [
+                    {"name": "First", "artist": "Band", "tracks": 2},
+                    {"name": "second", "artist": "Band", "tracks": 1},
+                ],
+            },
+        )
+        self.assertEqual(self.index.get_albums()["count"], 4)
+        self.assertEqual(self.index.get_albums("Unknown")["count"], 0)
+
+    def test_get_genres(self):
+        self._update_tagged_files()
+
+        self.assertDictEqual(
+            self.index.get_genres(),
+            {
+                "count": 2,
+                "genres": [
+                    {"name": "Pop", "tracks": 1},
+                    {"name": "Rock", "tracks": 3},
+                ],
+            },
+        )
+
+    def test_get_tagged_entries(self):
+        self._update_tagged_files()
+
+        def get_filenames(**kwargs):
+            entries = self.index.get_tagged_entries(**kwargs)
+            return [entry["filename"] for entry in entries]
+
+        self.assertListEqual(
+            get_filenames(artist="Band"), ["file2.mp3", "file1.mp3", "file3.mp3"]
+        )
+        self.assertListEqual(
+            get_filenames(artist="Band", album="First"), ["file2.mp3", "file1.mp3"]
+        )
+        self.assertListEqual(get_filenames(album="Compilation"), ["file4.mp3"])
+        self.assertListEqual(
+            get_filenames(genre="Rock"), ["file4.mp3", "file2.mp3", "file1.mp3"]
+        )
+        self.assertListEqual(get_filenames(artist="Band", genre="Pop"), ["file3.mp3"])
+        self.assertListEqual(get_filenames(artist="Unknown"), [])
+        self.assertEqual(len(get_filenames()), 5)
+
+    def test_tags_indexes_updated_incrementally(self):
+        self._update_tagged_files()
+
+        # retagged
+        self.index.set_metadata("file3.mp3", {"tags": {"artist": "Other"}})
+        self.assertListEqual(
+            [album["name"] for album in self.index.get_albums("Band")["albums"]],
+            ["First"],
+        )
+        genres = self.index.get_genres()["genres"]
+        self.assertNotIn("Pop", [genre["name"] for genre in genres])
+
+        # tags deleted
+        self.index.delete_metadata("file4.mp3", "tags")
+        self.assertEqual(self.index.get_albums("Various")["count"], 0)
+
+        # content changed and file removed
+        self.index.update(
+            [make_file(f"file{index}.mp3", mtime=2.0) for index in range(2, 6)]
+        )
+        self.assertEqual(self.index.get_artists()["count"], 0)
+        self.assertEqual(self.index.get_genres()["count"], 0)
+
+    def test_tags_indexed_on_import(self):
+        self.index.update([make_file("file1.mp3")])
+        data = {
+            "file1.mp3": {
+                "size": 10,
+                "mtime": 1.0,
+                "metadata": {"tags": {"artist": "Band", "album": "First"}},
+            }
+        }
+
+        self.index.import_metadata(data)
+
+        self.assertEqual(self.index.get_albums("Band")["count"], 1)
+
+    def test_metadata(self):
+        self.index.update([make_file("file1.mp3")])
+
+        self.assertTrue(self.index.set_metadata("file1.mp3", {"gain": 1.5}))
+        self.assertFalse(self.index.set_metadata("file2.mp3", {"gain": 1.5}))
+
+        self.assertEqual(self.index.get_metadata("file1.mp3", "gain"), 1.5)
+        self.assertEqual(self.index.get_metadata("file1.mp3", "peak", 1.0), 1.0)
+        self.assertIsNone(self.index.get_metadata("file2.mp3", "gain"))
+
+    def test_delete_metadata(self):
+        self.index.update([make_file("file1.mp3")])
+        self.index.set_metadata("file1.mp3", {"gain": 1.5, "peak": 0.5})
+
+        self.assertTrue(self.index.delete_metadata("file1.mp3", "gain"))
+        self.assertFalse(self.index.delete_metadata("file1.mp3", "gain"))
+        self.assertFalse(self.index.delete_metadata("file2.mp3", "gain"))
+
+        self.assertIsNone(self.index.get_metadata("file1.mp3", "gain"))
+        self.assertEqual(self.index.get_metadata("file1.mp3", "peak"), 0.5)
+
+    def test_metadata_reset_when_content_changed(self):
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+        self.index.set_metadata("file1.mp3", {"gain": 1.5})
+        self.index.set_metadata("file2.mp3", {"gain": 2.5})
+
+        self.index.update(
+            [make_file("file1.mp3", size=20), make_file("file2.mp3", folder="/other")]
+        )
+
+        self.assertIsNone(self.index.get_metadata("file1.mp3", "gain"))
+        self.assertEqual(self.index.get_metadata("file2.mp3", "gain"), 2.5)
+
+    def test_export_import_metadata(self):
+        self.index.update([make_file("file1.mp3"), make_file("file2.mp3")])
+        self.index.set_metadata("file1.mp3", {"gain": 1.5})
+        self.index.set_metadata("file2.mp3", {"gain": 2.5})
+        data = self.index.export_metadata()
+
+        index = LibraryIndex()
+        index.update([make_file("file1.mp3"), make_file("file2.mp3", mtime=2.0)])
+        index.import_metadata(data)
+
+        self.assertEqual(
+            data["file1.mp3"], {"size": 10, "mtime": 1.0, "metadata": {"gain": 1.5}}
+        )
+        self.assertEqual(index.get_metadata("file1.mp3", "gain"), 1.5)
+        self.assertIsNone(index.get_metadata("file2.mp3", "gain"))
+
+
+if __name__ == "__main__":
+    unittest.main()
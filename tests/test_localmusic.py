@@ -3,10 +3,20 @@
 from cleep.libs.tests import session
 import unittest
 import logging
+import os
 import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+import base64
 
 sys.path.append("../")
 from backend.localmusic import Localmusic
+from backend.playbackregistry import PlaybackRegistry
+from backend.coverart import CoverCache
+from backend import audioheader, compactlisting
 from cleep.exception import (
     InvalidParameter,
     MissingParameter,
@@ -29,6 +39,65 @@ FILES = [
 LOG_LEVEL = get_log_level()
 
 
+def make_playback(
+    player_uuid="uuid", playlist_name="playlist1", tracks=None, index=None, alarm=False
+):
+    playback = PlaybackRegistry.new_playback(
+        player_uuid, playlist_name, tracks or [], alarm=alarm
+    )
+    playback["index"] = index
+    return playback
+
+
+class FakeAudioplayer:
+    """
+    Stand-in audioplayer answering localmusic commands from concurrent threads. Stopped players
+    are notified asynchronously like real audioplayer does
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.players = set()
+        self.stopped = []
+        self.counter = 0
+
+    def send_command_advanced(self, command, to, params=None, *args, **kwargs):
+        time.sleep(0.0001)
+        with self.lock:
+            if command == "start_playback":
+                self.counter += 1
+                player_uuid = f"player{self.counter}"
+                self.players.add(player_uuid)
+                return player_uuid
+            if command == "stop_playback" and params["player_uuid"] in self.players:
+                self.players.discard(params["player_uuid"])
+                self.stopped.append(params["player_uuid"])
+            return None
+
+    def pop_stopped(self):
+        with self.lock:
+            stopped, self.stopped = self.stopped, []
+            return stopped
+
+
+class FakeConfig:
+    """
+    Config store returning copies, like module config, so read-modify-write races are visible
+    """
+
+    def __init__(self, config):
+        self.config = deepcopy(config)
+
+    def get(self, field):
+        value = deepcopy(self.config[field])
+        time.sleep(0.0001)
+        return value
+
+    def set(self, field, value):
+        self.config[field] = deepcopy(value)
+        return True
+
+
 class TestLocalmusic(unittest.TestCase):
     def setUp(self):
         logging.basicConfig(
@@ -64,6 +133,21 @@ class TestLocalmusic(unittest.TestCase):
         self.module._refresh_music_files.assert_called()
         self.module._check_playlists.assert_called()
 
+    def test__init_versions(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=3)
+        self.module._set_config_field = Mock()
+        self.module.library = Mock()
+
+        self.module._init_versions()
+
+        self.module._set_config_field.assert_called_with("versionepoch", 4)
+        self.module.library.set_epoch.assert_called_with(4)
+        self.assertEqual(self.module.playlists_version, 4 << 32)
+        # playlists version known before restart is rejected
+        with self.assertRaises(CommandError):
+            self.module._check_playlists_version(5)
+
     def test__on_start(self):
         self.init(False, False)
         self.module.is_module_loaded = Mock()
@@ -74,10 +158,30 @@ class TestLocalmusic(unittest.TestCase):
 
     def test_on_event_update_playing_track(self):
         self.init()
-        self.module.playback = {
-            "playeruuid": "uuid",
-            "index": 0,
+        playback = make_playback(index=0)
+        self.module.playbacks.add(playback)
+        event = {
+            "event": "audioplayer.playback.update",
+            "params": {
+                "playeruuid": "uuid",
+                "state": "playing",
+                "index": 1,
+            },
         }
+
+        self.module.on_event(event)
+
+        self.assertEqual(playback["index"], 1)
+
+    def test_on_event_prefetch_next_tracks(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        self.module.playbacks.add(
+            make_playback(
+                tracks=["/file1.mp3", "/file2.mp3", "/file3.mp3", "/file4.mp3"],
+                index=0,
+            )
+        )
         event = {
             "event": "audioplayer.playback.update",
             "params": {
@@ -87,16 +191,16 @@ class TestLocalmusic(unittest.TestCase):
             },
         }
 
+        self.module.on_event(event)
         self.module.on_event(event)
 
-        self.assertEqual(self.module.playback.get("index"), 1)
+        self.module.prefetcher.prefetch.assert_called_once_with(
+            ["/file3.mp3", "/file4.mp3"]
+        )
 
     def test_on_event_playback_stopped(self):
         self.init()
-        self.module.playback = {
-            "playeruuid": "uuid",
-            "index": 0,
-        }
+        self.module.playbacks.add(make_playback(index=0))
         event = {
             "event": "audioplayer.playback.update",
             "params": {
@@ -108,14 +212,195 @@ class TestLocalmusic(unittest.TestCase):
 
         self.module.on_event(event)
 
-        self.assertEqual(self.module.playback.get("playeruuid"), None)
+        self.assertNotIn("uuid", self.module.playbacks)
+
+    def test_on_event_queue_shuffled_tracks(self):
+        self.init()
+        self.module.has_audioplayer = True
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        self.module.prefetcher = Mock()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+        self.module.shuffler.deal.return_value = ["/file3.mp3", "/file4.mp3"]
+        playlist_tracks = ["/file1.mp3", "/file2.mp3", "/file3.mp3", "/file4.mp3"]
+        self.module._get_playlist_tracks = Mock(return_value=playlist_tracks)
+        playback = make_playback(tracks=["/file2.mp3", "/file1.mp3"], index=0)
+        playback["shuffle"] = True
+        self.module.playbacks.add(playback)
+
+        self.module.on_event(
+            {
+                "event": "audioplayer.playback.update",
+                "params": {"playeruuid": "uuid", "state": "playing", "index": 1},
+            }
+        )
+
+        # not repeated playback ends after as many tracks as playlist ones
+        self.module.shuffler.deal.assert_called_once_with(
+            "playlist1", playlist_tracks, 2
+        )
+        self.assertListEqual(
+            playback["tracks"], ["/file2.mp3", "/file1.mp3", "/file3.mp3", "/file4.mp3"]
+        )
+        self.session.assert_command_called_with(
+            "add_tracks",
+            {
+                "player_uuid": "uuid",
+                "tracks": [
+                    {"resource": "/file3.mp3", "audio_format": None},
+                    {"resource": "/file4.mp3", "audio_format": None},
+                ],
+            },
+            "audioplayer",
+        )
+        self.module._schedule_shuffle_save.assert_called()
+
+    def test_on_event_queue_shuffled_tracks_repeated(self):
+        self.init()
+        self.module.audioplayer = Mock()
+        self.module.prefetcher = Mock()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+        self.module.shuffler.deal.return_value = ["/file1.mp3"]
+        self.module._get_playlist_tracks = Mock(
+            return_value=["/file1.mp3", "/file2.mp3"]
+        )
+        playback = make_playback(
+            tracks=["/file2.mp3", "/file1.mp3", "/file2.mp3"], index=1
+        )
+        playback["shuffle"] = True
+        playback["repeat"] = True
+        self.module.playbacks.add(playback)
+
+        self.module.on_event(
+            {
+                "event": "audioplayer.playback.update",
+                "params": {"playeruuid": "uuid", "state": "playing", "index": 2},
+            }
+        )
+
+        self.module.shuffler.deal.assert_called_once_with(
+            "playlist1", ["/file1.mp3", "/file2.mp3"], 3
+        )
+
+    def test_on_event_queue_shuffled_tracks_enough_queued(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        self.module.shuffler = Mock()
+        playback = make_playback(tracks=["/file1.mp3"] * 5, index=0)
+        playback["shuffle"] = True
+        self.module.playbacks.add(playback)
+
+        self.module.on_event(
+            {
+                "event": "audioplayer.playback.update",
+                "params": {"playeruuid": "uuid", "state": "playing", "index": 1},
+            }
+        )
+
+        self.module.shuffler.deal.assert_not_called()
+
+    def test_on_event_playback_stopped_restores_shuffled_tracks(self):
+        self.init()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+        playback = make_playback(
+            tracks=["/file2.mp3", "/file1.mp3", "/file3.mp3"], index=0
+        )
+        playback["shuffle"] = True
+        self.module.playbacks.add(playback)
+
+        self.module.on_event(
+            {
+                "event": "audioplayer.playback.update",
+                "params": {"playeruuid": "uuid", "state": "stopped", "index": 0},
+            }
+        )
+
+        self.module.shuffler.restore.assert_called_with(
+            "playlist1", ["/file1.mp3", "/file3.mp3"]
+        )
+        self.module._schedule_shuffle_save.assert_called()
+
+    @patch("backend.localmusic.time.monotonic")
+    def test_on_event_record_track_play(self, monotonic_mock):
+        self.init()
+        self.module.history = Mock()
+        self.module.prefetcher = Mock()
+        playback = make_playback(tracks=["/file1.mp3", "/file2.mp3"])
+        self.module.playbacks.add(playback)
+        monotonic_mock.side_effect = [10.0, 70.0, 100.0, 140.0, 150.0]
+
+        def send(state, index):
+            self.module.on_event(
+                {
+                    "event": "audioplayer.playback.update",
+                    "params": {"playeruuid": "uuid", "state": state, "index": index},
+                }
+            )
+
+        send("playing", 0)
+        send("paused", 0)
+        send("playing", 0)
+        send("playing", 1)
+        self.module.history.record.assert_called_once_with(
+            "file1.mp3", "playlist1", 100.0
+        )
+        send("stopped", 1)
+        self.module.history.record.assert_called_with("file2.mp3", "playlist1", 10.0)
+        self.assertIsNone(playback["playingtrack"])
+
+    def test_on_event_route_to_player(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        playback1 = make_playback("uuid1", tracks=["/file1.mp3", "/file2.mp3"], index=0)
+        playback2 = make_playback("uuid2", tracks=["/file3.mp3", "/file4.mp3"], index=0)
+        self.module.playbacks.add(playback1)
+        self.module.playbacks.add(playback2)
+
+        self.module.on_event(
+            {
+                "event": "audioplayer.playback.update",
+                "params": {"playeruuid": "uuid2", "state": "playing", "index": 1},
+            }
+        )
+
+        self.assertEqual(playback1["index"], 0)
+        self.assertEqual(playback2["index"], 1)
+
+    def test__end_track_play_no_playing_track(self):
+        self.init()
+        self.module.history = Mock()
+
+        self.module._end_track_play(make_playback())
+
+        self.module.history.record.assert_not_called()
+
+    def test_get_stats(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module.history = Mock()
+        self.module.history.get_stats.return_value = {"totalplays": 0}
+
+        stats = self.module.get_stats(5)
+
+        self.assertDictEqual(stats, {"totalplays": 0})
+        self.module.history.get_stats.assert_called_with(
+            ["file1.mp3", "file2.mp3", "file3.mp3"], 5
+        )
+
+    def test_get_stats_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_stats(0)
+        self.assertEqual(str(cm.exception), "Limit must be greater than 0")
 
     def test_on_event_not_player(self):
         self.init()
-        self.module.playback = {
-            "playeruuid": "uuid",
-            "index": 4,
-        }
+        playback = make_playback(index=4)
+        self.module.playbacks.add(playback)
         event = {
             "event": "audioplayer.playback.update",
             "params": {
@@ -127,8 +412,8 @@ class TestLocalmusic(unittest.TestCase):
 
         self.module.on_event(event)
 
-        self.assertEqual(self.module.playback.get("playeruuid"), "uuid")
-        self.assertEqual(self.module.playback.get("index"), 4)
+        self.assertIn("uuid", self.module.playbacks)
+        self.assertEqual(playback["index"], 4)
 
     def test_on_render_with_alarmprofile_triggered(self):
         self.init()
@@ -207,10 +492,11 @@ class TestLocalmusic(unittest.TestCase):
 
     def test__refresh_music_files(self):
         self.init()
+        self.module._push_library_changes = Mock()
 
         with patch("backend.localmusic.os.walk") as walk_mock:
             walk_mock.return_value = [
-                ("/opt/module/localmusic", (), ("file1.mp3", "file2.mp3")),
+                ("/opt/module/localmusic", [], ("file1.mp3", "file2.mp3")),
             ]
             self.module._refresh_music_files()
             logging.debug("Files: %s", self.module.files)
@@ -229,195 +515,2103 @@ class TestLocalmusic(unittest.TestCase):
                 ],
             )
 
-    def test__check_playlists(self):
+    def test__refresh_music_files_duplicate_filenames(self):
         self.init()
-        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
-        files = deepcopy(FILES)
-        files.pop(1)
-        self.module.files = files
-        self.module._set_config_field = Mock()
+        self.module._push_library_changes = Mock()
+        self.module._get_file_entry = lambda filename, path: {
+            "filename": filename,
+            "path": path,
+            "size": 10,
+            "mtime": 1.0,
+        }
+        self.module.logger = Mock()
 
-        self.module._check_playlists()
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", ["b", "a"], ["01.mp3"]),
+                ("/opt/module/localmusic/a", [], ["02.mp3", "01.mp3"]),
+            ]
+            self.module._refresh_music_files()
+            version = self.module.library.version
+            self.module._refresh_music_files()
 
-        self.module._set_config_field.assert_called_with(
-            "playlists", {"playlist1": ["file1.mp3", "file3.mp3"]}
+        self.assertEqual(self.module.library.version, version)
+        self.assertEqual(len(self.module.library), 2)
+        self.assertEqual(
+            self.module.library.get_entry("01.mp3")["path"],
+            "/opt/module/localmusic/01.mp3",
+        )
+        self.assertSetEqual(
+            self.module.duplicate_files, {"/opt/module/localmusic/a/01.mp3"}
         )
+        self.module.logger.warning.assert_called_once()
+        self.assertEqual(len(self.module.files), 3)
 
-    def test__check_playlists_with_parameters(self):
+    def test__refresh_music_files_notify(self):
         self.init()
-        files = deepcopy(FILES)
-        files.pop(1)
-        self.module.files = files
-        self.module._set_config_field = Mock()
+        self.module._push_library_changes = Mock()
 
-        self.module._check_playlists(deepcopy(PLAYLISTS))
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", [], ("file1.mp3",)),
+            ]
+            self.module._refresh_music_files()
+            self.module._push_library_changes.assert_called()
 
-        self.module._set_config_field.assert_called_with(
-            "playlists", {"playlist1": ["file1.mp3", "file3.mp3"]}
-        )
+            self.module._push_library_changes.reset_mock()
+            self.module._refresh_music_files(notify=False)
+            self.module._push_library_changes.assert_not_called()
 
-    def test_get_music_files(self):
+    def test__refresh_music_files_ignores_images(self):
         self.init()
-        self.module.files = deepcopy(FILES)
+        self.module._push_library_changes = Mock()
 
-        files = self.module.get_music_files()
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic/album", [], ("file1.mp3", "Folder.jpg")),
+            ]
+            self.module._refresh_music_files()
 
-        self.assertListEqual(files, FILES)
+        self.assertListEqual(
+            self.module.files,
+            [{"filename": "file1.mp3", "path": "/opt/module/localmusic/album/file1.mp3"}],
+        )
+        self.assertDictEqual(
+            self.module.folder_covers,
+            {"/opt/module/localmusic/album": "/opt/module/localmusic/album/Folder.jpg"},
+        )
 
-    def test_get_playback(self):
+    def test__update_folder_covers(self):
         self.init()
+        self.module.library.update(
+            [
+                {"filename": "file1.mp3", "path": "/music/album1/file1.mp3"},
+                {"filename": "file2.mp3", "path": "/music/album2/file2.mp3"},
+            ]
+        )
+        self.module.library.set_metadata("file1.mp3", {"cover": None})
+        self.module.library.set_metadata("file2.mp3", {"cover": "key"})
+        self.module.folder_covers = {"/music/album2": "/music/album2/cover.jpg"}
 
-        playback = self.module.get_playback()
-
-        self.assertEqual(
-            playback,
+        self.module._update_folder_covers(
             {
-                "index": None,
-                "playeruuid": None,
-                "playlistname": None,
-            },
+                "/music/album1": "/music/album1/cover.jpg",
+                "/music/album2": "/music/album2/cover.jpg",
+            }
         )
 
-    def test_add_music_file(self):
+        self.assertNotIn("cover", self.module.library.get_entry("file1.mp3")["metadata"])
+        self.assertEqual(self.module.library.get_metadata("file2.mp3", "cover"), "key")
+
+    @patch("backend.localmusic.threading.Timer")
+    def test__push_library_changes_batches_events(self, timer_mock):
         self.init()
-        self.module._refresh_music_files = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/opt/module/localmusic/file1.mp3"}]
+        )
 
-        with patch("backend.localmusic.os.path.exists") as exists_mock:
-            exists_mock.return_value = False
-            result = self.module.add_music_file("dummy.mp3")
+        self.module._push_library_changes()
+        self.module._push_library_changes()
 
-            self.assertTrue(result)
-            self.module._refresh_music_files.assert_called()
+        self.assertEqual(timer_mock.call_count, 1)
+        timer_mock.return_value.start.assert_called_once()
 
-    @patch("backend.localmusic.Localmusic.ALLOWED_MUSIC_EXTENSIONS", ["mp3", "ogg"])
-    def test_add_music_file_invalid_extension(self):
+    @patch("backend.localmusic.threading.Timer")
+    def test__push_library_changes_nothing_changed(self, timer_mock):
         self.init()
 
-        with self.assertRaises(InvalidParameter) as cm:
-            result = self.module.add_music_file("dummy.wav")
-        self.assertEqual(
-            str(cm.exception), "Invalid file extension (only mp3,ogg allowed)"
+        self.module._push_library_changes()
+
+        timer_mock.assert_not_called()
+
+    def test__send_library_changes(self):
+        self.init()
+        self.module.library_update_event = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/opt/module/localmusic/file1.mp3"}]
+        )
+        self.module.library_pushed_version = self.module.library.version
+        self.module.library.update(
+            [{"filename": "file2.mp3", "path": "/opt/module/localmusic/file2.mp3"}]
         )
 
-    def test_add_music_file_already_exists(self):
+        self.module._send_library_changes()
+
+        self.module.library_update_event.send.assert_called_with(
+            params={
+                "version": 2,
+                "since": 1,
+                "reload": False,
+                "added": [
+                    {"filename": "file2.mp3", "path": "/opt/module/localmusic/file2.mp3"}
+                ],
+                "removed": ["file1.mp3"],
+                "changed": [],
+            }
+        )
+        self.assertEqual(self.module.library_pushed_version, 2)
+
+    def test__send_library_changes_reload(self):
+        self.init()
+        self.module.library_update_event = Mock()
+        self.module.library.get_changes = Mock(return_value=None)
+
+        self.module._send_library_changes()
+
+        params = self.module.library_update_event.send.call_args.kwargs["params"]
+        self.assertTrue(params["reload"])
+
+    def test__load_catalog(self):
         self.init()
+        self.module.library = Mock()
+        self.module.cleep_filesystem.read_json.return_value = {"file1.mp3": {}}
 
         with patch("backend.localmusic.os.path.exists") as exists_mock:
             exists_mock.return_value = True
-            with self.assertRaises(CommandError) as cm:
-                result = self.module.add_music_file("dummy.mp3")
-            self.assertEqual(str(cm.exception), 'Music file "dummy.mp3" already exists')
+            self.module._load_catalog()
 
-    def test_add_music_file_unable_to_save(self):
+        self.module.library.import_metadata.assert_called_with({"file1.mp3": {}})
+
+    def test__load_catalog_no_catalog(self):
         self.init()
+        self.module.library = Mock()
 
         with patch("backend.localmusic.os.path.exists") as exists_mock:
             exists_mock.return_value = False
-            self.module.cleep_filesystem.move.return_value = False
-            with self.assertRaises(CommandError) as cm:
-                result = self.module.add_music_file("dummy.mp3")
-            self.assertEqual(str(cm.exception), 'Unable to save "dummy.mp3"')
+            self.module._load_catalog()
 
-    def test_delete_music_file(self):
+        self.module.cleep_filesystem.read_json.assert_not_called()
+        self.module.library.import_metadata.assert_not_called()
+
+    @patch("backend.localmusic.os.makedirs", Mock())
+    def test__save_catalog(self):
         self.init()
-        self.module._refresh_music_file = Mock()
-        self.module.cleep_filesystem.rm.return_value = True
+        self.module.library = Mock()
+        self.module.library.export_metadata.return_value = {"file1.mp3": {}}
+        self.module.cleep_filesystem.write_json.return_value = True
 
-        with patch("backend.localmusic.os.walk") as walk_mock:
-            walk_mock.return_value = [
-                ("/opt/module/localmusic", (), ("file1.mp3", "file2.mp3", "file3.mp3")),
-            ]
+        self.module._save_catalog()
 
-            self.module.delete_music_file("file2.mp3")
+        self.module.cleep_filesystem.write_json.assert_called_with(
+            os.path.join(self.module.APP_STORAGE_PATH, ".cache", "catalog.json"),
+            {"file1.mp3": {}},
+        )
 
-            self.module.cleep_filesystem.rm.assert_called_with(
-                "/opt/module/localmusic/file2.mp3"
-            )
-            self.module._refresh_music_file.assert_not_called()
+    @patch("backend.localmusic.threading.Timer")
+    def test__schedule_catalog_save(self, timer_mock):
+        self.init()
 
-    def test_delete_music_file_file_not_found(self):
+        self.module._schedule_catalog_save()
+        self.module._schedule_catalog_save()
+
+        timer_mock.assert_called_once_with(10.0, self.module._save_catalog)
+
+    def test__load_position(self):
         self.init()
-        self.module._refresh_music_file = Mock()
-        self.module.cleep_filesystem.rm.return_value = True
+        position = {"playlistname": "playlist1", "index": 2, "offset": 12.0}
+        self.module.cleep_filesystem.read_json.return_value = position
 
-        with patch("backend.localmusic.os.walk") as walk_mock:
-            walk_mock.return_value = [
-                ("/opt/module/localmusic", (), ("file1.mp3", "file2.mp3", "file3.mp3")),
-            ]
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = True
+            self.module._load_position()
 
-            with self.assertRaises(InvalidParameter) as cm:
-                self.module.delete_music_file("file4.mp3")
-            self.assertEqual(str(cm.exception), 'File "file4.mp3" was not found')
+        self.assertDictEqual(self.module.playback_position, position)
 
-    def test_delete_music_file_unable_to_delete(self):
+    @patch("backend.localmusic.threading.Timer")
+    @patch("backend.localmusic.time.monotonic", Mock(return_value=30.0))
+    def test__update_position(self, timer_mock):
         self.init()
-        self.module._refresh_music_file = Mock()
-        self.module.cleep_filesystem.rm.return_value = False
+        playback = make_playback()
+        playback["startindex"] = 2
+        playback["playingtrack"] = {
+            "filename": "file2.mp3",
+            "index": 1,
+            "listened": 5.0,
+            "resumed": 20.0,
+        }
 
-        with patch("backend.localmusic.os.walk") as walk_mock:
-            walk_mock.return_value = [
-                ("/opt/module/localmusic", (), ("file1.mp3", "file2.mp3", "file3.mp3")),
-            ]
+        self.module._update_position(playback)
+        self.module._update_position(playback)
 
-            with self.assertRaises(CommandError) as cm:
-                self.module.delete_music_file("file2.mp3")
-            self.assertEqual(str(cm.exception), 'Unable to delete "file2.mp3"')
+        self.assertDictEqual(
+            self.module.playback_position,
+            {"playlistname": "playlist1", "index": 3, "offset": 15.0},
+        )
+        timer_mock.assert_called_once_with(30.0, self.module._save_position)
 
-    def test_add_playlist(self):
+    def test__update_position_shuffled_playback(self):
         self.init()
-        self.module.files = deepcopy(FILES)
-        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
-        self.module._set_config_field = Mock()
-        self.module._check_playlists = Mock()
+        playback = make_playback()
+        playback["shuffle"] = True
+        playback["playingtrack"] = {
+            "filename": "file2.mp3",
+            "index": 1,
+            "listened": 5.0,
+            "resumed": None,
+        }
 
-        files = ["file1.mp3", "file2.mp3"]
-        self.module.add_playlist("playlist3", files)
+        self.module._update_position(playback)
 
-        playlists = deepcopy(PLAYLISTS)
-        playlists["playlist3"] = files
-        self.module._set_config_field.assert_called_with("playlists", playlists)
-        self.module._check_playlists.assert_called()
+        self.assertIsNone(self.module.playback_position)
 
-    def test_add_playlist_first_add_set_default_playlist(self):
+    def test__update_position_no_playing_track(self):
         self.init()
-        self.module.files = deepcopy(FILES)
-        self.module._get_config_field = Mock(return_value={})
-        self.module._check_playlists = Mock()
-        files = ["file1.mp3", "file2.mp3"]
-        self.module.set_default_playlist = Mock()
 
-        self.module.add_playlist("playlist3", files)
+        self.module._update_position(make_playback())
 
-        self.module.set_default_playlist.assert_called_with("playlist3")
+        self.assertIsNone(self.module.playback_position)
 
-    def test_add_playlist_invalid_parameters(self):
+    @patch("backend.localmusic.os.makedirs", Mock())
+    def test__save_position(self):
         self.init()
-        self.module.files = deepcopy(FILES)
-        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        position = {"playlistname": "playlist1", "index": 2, "offset": 12.0}
+        self.module.playback_position = position
+        self.module.cleep_filesystem.write_json.return_value = True
 
-        with self.assertRaises(InvalidParameter) as cm:
-            self.module.add_playlist("playlist3", [])
-        self.assertEqual(str(cm.exception), "Playlist must not be empty")
+        self.module._save_position()
 
-        with self.assertRaises(InvalidParameter) as cm:
-            self.module.add_playlist("", ["file1.mp3"])
-        self.assertEqual(
-            str(cm.exception), 'Parameter "playlist_name" is invalid (specified="")'
+        self.module.cleep_filesystem.write_json.assert_called_with(
+            os.path.join(self.module.APP_STORAGE_PATH, ".cache", "position.json"),
+            position,
         )
 
-        with self.assertRaises(InvalidParameter) as cm:
-            self.module.add_playlist("playlist2", ["file1.mp3"])
-        self.assertEqual(str(cm.exception), 'Playlist "playlist2" already exists')
-
-    def test_update_playlist_update_files_only(self):
+    def test__load_shuffle(self):
         self.init()
-        self.module.files = deepcopy(FILES)
-        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
-        self.module._set_config_field = Mock()
-        self.module._check_playlists = Mock()
-
-        files = ["file1.mp3", "file3.mp3"]
-        self.module.update_playlist("playlist2", "playlist2", files)
+        state = {
+            "playlist1": {"permutation": ["/file2.mp3", "/file1.mp3"], "cursor": 1}
+        }
+        self.module.cleep_filesystem.read_json.return_value = state
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = True
+            self.module._load_shuffle()
+
+        self.assertDictEqual(self.module.shuffler.export_state(), state)
+
+    @patch("backend.localmusic.os.makedirs", Mock())
+    def test__save_shuffle(self):
+        self.init()
+        self.module.shuffler.deal("playlist1", ["/file1.mp3"], 1)
+        self.module.cleep_filesystem.write_json.return_value = True
+
+        self.module._save_shuffle()
+
+        self.module.cleep_filesystem.write_json.assert_called_with(
+            os.path.join(self.module.APP_STORAGE_PATH, ".cache", "shuffle.json"),
+            {"playlist1": {"permutation": ["/file1.mp3"], "cursor": 1}},
+        )
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test__analyze_tracks(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [
+                {"filename": "file1.mp3", "path": "/music/file1.mp3"},
+                {"filename": "file2.mp3", "path": "/music/file2.mp3"},
+            ]
+        )
+        self.module.library.set_metadata("file1.mp3", {"gain": 1.0})
+
+        self.module._analyze_tracks()
+
+        self.module.analyzer.submit.assert_any_call(
+            "/music/file1.mp3",
+            ["silence"],
+            self.module._on_track_analyzed,
+            on_error=self.module._on_track_analysis_failed,
+        )
+        self.module.analyzer.submit.assert_any_call(
+            "/music/file2.mp3",
+            ["loudness", "silence"],
+            self.module._on_track_analyzed,
+            on_error=self.module._on_track_analysis_failed,
+        )
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test__precompute_waveforms(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=False)
+        self.module._schedule_catalog_save = Mock()
+        self.module._save_waveform = Mock(return_value="key")
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [
+                {"filename": "file1.mp3", "path": "/music/file1.mp3"},
+                {"filename": "file2.mp3", "path": "/music/file2.mp3"},
+                {"filename": "file3.mp3", "path": "/music/file3.mp3"},
+            ]
+        )
+        self.module.library.set_metadata("file2.mp3", {"waveform": "key"})
+
+        self.module._analyze_tracks()
+        # library refresh while waveform is computed does not queue it again
+        self.module._analyze_tracks()
+
+        # one waveform is computed at a time
+        self.module.analyzer.submit.assert_called_once_with(
+            "/music/file1.mp3",
+            ["waveform"],
+            self.module._on_track_analyzed,
+            on_error=self.module._on_track_analysis_failed,
+        )
+        self.module._on_track_analyzed("/music/file1.mp3", {"waveform": b"\x01\x02"})
+        self.assertEqual(
+            self.module.analyzer.submit.call_args.args[0], "/music/file3.mp3"
+        )
+        self.module._on_track_analysis_failed("/music/file3.mp3", Exception("error"))
+        self.assertEqual(self.module.analyzer.submit.call_count, 2)
+        self.assertIsNone(self.module.waveforms_current)
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test__analyze_tracks_skip_failed_analysis(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        self.module._schedule_catalog_save = Mock()
+        self.module._on_track_analysis_failed(
+            "/music/file1.mp3", Exception("Unable to decode")
+        )
+
+        self.module._analyze_tracks()
+
+        self.assertEqual(
+            self.module.library.get_metadata("file1.mp3", "analysiserror"),
+            "Unable to decode",
+        )
+        self.module._schedule_catalog_save.assert_called_once()
+        self.module.analyzer.submit.assert_not_called()
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test__analyze_tracks_normalization_disabled(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=False)
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._analyze_tracks()
+
+        # only waveform is precomputed
+        self.module.analyzer.submit.assert_called_once_with(
+            "/music/file1.mp3",
+            ["waveform"],
+            self.module._on_track_analyzed,
+            on_error=self.module._on_track_analysis_failed,
+        )
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=False))
+    def test__analyze_tracks_not_available(self):
+        self.init()
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._analyze_tracks()
+
+        self.module.analyzer.submit.assert_not_called()
+
+    @patch("backend.localmusic.audioheader.sniff")
+    def test__sniff_tracks(self, sniff_mock):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._update_smart_playlists = Mock()
+        self.module.library.update(deepcopy(FILES))
+        self.module.library.set_metadata("file1.mp3", {"codec": "mp3"})
+        infos = {"codec": "mp3", "audioformat": "audio/mpeg", "duration": 12.0}
+        sniff_mock.side_effect = [infos, None]
+
+        self.module._sniff_tracks()
+
+        self.assertEqual(sniff_mock.call_count, 2)
+        self.assertEqual(
+            self.module.library.get_metadata("file2.mp3", "audioformat"), "audio/mpeg"
+        )
+        self.assertEqual(self.module.library.get_metadata("file2.mp3", "duration"), 12.0)
+        # unknown format is cached too
+        self.assertIn("codec", self.module.library.get_entry("file3.mp3")["metadata"])
+        self.module._update_smart_playlists.assert_called_with(
+            {"changed": [{"filename": "file2.mp3"}, {"filename": "file3.mp3"}]}
+        )
+        self.module._schedule_catalog_save.assert_called()
+
+    @patch("backend.localmusic.audioheader.sniff")
+    def test__sniff_tracks_unreadable_file(self, sniff_mock):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module.library.update(deepcopy(FILES[:1]))
+        sniff_mock.side_effect = OSError()
+
+        self.module._sniff_tracks()
+
+        self.assertNotIn("codec", self.module.library.get_entry("file1.mp3")["metadata"])
+        self.module._schedule_catalog_save.assert_not_called()
+
+    @patch("backend.localmusic.audiotags.read_tags")
+    def test__read_tracks_tags(self, read_tags_mock):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._update_smart_playlists = Mock()
+        self.module.library.update(deepcopy(FILES))
+        self.module.library.set_metadata("file1.mp3", {"tags": {}})
+        read_tags_mock.side_effect = [{"artist": "Band", "album": "First"}, OSError()]
+
+        self.module._read_tracks_tags()
+
+        self.assertEqual(read_tags_mock.call_count, 2)
+        self.assertDictEqual(
+            self.module.library.get_metadata("file2.mp3", "tags"),
+            {"artist": "Band", "album": "First"},
+        )
+        self.assertIsNone(self.module.library.get_metadata("file3.mp3", "tags"))
+        self.assertEqual(self.module.library.get_albums("Band")["count"], 1)
+        self.module._update_smart_playlists.assert_called_once_with(
+            {"changed": [{"filename": "file2.mp3"}]}
+        )
+        self.module._schedule_catalog_save.assert_called()
+
+    def test__on_track_analyzed(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._sync_alarm_cache = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        loudness = {"loudness": -20.0, "peak": 0.5, "gain": 2.0}
+
+        self.module._on_track_analyzed("/music/file1.mp3", loudness)
+
+        self.assertEqual(self.module.library.get_metadata("file1.mp3", "gain"), 2.0)
+        self.module._schedule_catalog_save.assert_called()
+        self.module._sync_alarm_cache.assert_not_called()
+
+    def test__on_track_analyzed_alarm_track_silence(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._sync_alarm_cache = Mock()
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=["/music/file1.mp3"]
+        )
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._on_track_analyzed(
+            "/music/file1.mp3", {"soundstart": 1.5, "soundend": 100.0}
+        )
+
+        self.module._sync_alarm_cache.assert_called()
+    def test__on_track_analyzed_waveform(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._save_waveform = Mock(return_value="key")
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._on_track_analyzed("/music/file1.mp3", {"waveform": b"\x01\x02"})
+
+        self.module._save_waveform.assert_called_with(b"\x01\x02")
+        self.assertEqual(self.module.library.get_metadata("file1.mp3", "waveform"), "key")
+
+    def test__save_waveform(self):
+        self.init()
+        tmpdir = tempfile.mkdtemp()
+        self.module._get_cache_path = Mock(return_value=tmpdir)
+        try:
+            key = self.module._save_waveform(b"\x01\x02")
+
+            with open(os.path.join(tmpdir, f"{key}.bin"), "rb") as fdesc:
+                self.assertEqual(fdesc.read(), b"\x01\x02")
+            self.assertEqual(self.module._save_waveform(b"\x01\x02"), key)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test__clean_waveforms(self):
+        self.init()
+        tmpdir = tempfile.mkdtemp()
+        self.module._get_cache_path = Mock(return_value=tmpdir)
+        for filename in ("used.bin", "unused.bin"):
+            with open(os.path.join(tmpdir, filename), "wb") as fdesc:
+                fdesc.write(b"\x00")
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        self.module.library.set_metadata("file1.mp3", {"waveform": "used"})
+        try:
+            self.module._clean_waveforms()
+
+            self.assertListEqual(os.listdir(tmpdir), ["used.bin"])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test_get_waveform(self):
+        self.init()
+        tmpdir = tempfile.mkdtemp()
+        self.module._get_cache_path = Mock(return_value=tmpdir)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        waveform = bytes([0xF6, 10, 0xEC, 5] * 1024)
+        key = self.module._save_waveform(waveform)
+        self.module.library.set_metadata("file1.mp3", {"waveform": key})
+        try:
+            result = self.module.get_waveform("file1.mp3", 128)
+
+            self.assertEqual(result["waveform"], key)
+            self.assertEqual(result["resolution"], 128)
+            self.assertEqual(
+                base64.b64decode(result["peaks"]), bytes([0xEC, 10] * 128)
+            )
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test_get_waveform_not_computed(self):
+        self.init()
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        self.module.library.set_metadata("file1.mp3", {"waveform": "missing"})
+
+        self.assertIsNone(self.module.get_waveform("file1.mp3"))
+
+        self.assertIsNone(self.module.library.get_metadata("file1.mp3", "waveform"))
+        self.module.analyzer.submit.assert_called_with(
+            "/music/file1.mp3",
+            ["waveform"],
+            self.module._on_track_analyzed,
+            on_error=self.module._on_track_analysis_failed,
+        )
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test_get_waveform_analysis_failed(self):
+        self.init()
+        self.module.analyzer = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        self.module.library.set_metadata("file1.mp3", {"analysiserror": "error"})
+
+        self.assertIsNone(self.module.get_waveform("file1.mp3"))
+
+        self.module.analyzer.submit.assert_not_called()
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=False))
+    def test_get_waveform_not_available(self):
+        self.init()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.get_waveform("file1.mp3")
+        self.assertEqual(str(cm.exception), "Waveform requires numpy and ffmpeg")
+
+    def test_get_waveform_invalid_params(self):
+        self.init()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_waveform("file2.mp3")
+        self.assertEqual(str(cm.exception), 'File "file2.mp3" was not found')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_waveform("file1.mp3", 100)
+        self.assertEqual(
+            str(cm.exception), "Resolution must be one of 128,256,512,1024,2048"
+        )
+
+    def test__on_track_analyzed_file_deleted(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+
+        self.module._on_track_analyzed("/music/file1.mp3", {"gain": 2.0})
+
+        self.module._schedule_catalog_save.assert_not_called()
+
+    def test__probe_tracks(self):
+        self.init()
+        self.module.prober = Mock()
+        self.module.library.update(
+            [
+                {"filename": "file1.mp3", "path": "/music/file1.mp3"},
+                {"filename": "file2.mp3", "path": "/music/file2.mp3"},
+            ]
+        )
+        self.module.library.set_metadata("file1.mp3", {"valid": True})
+
+        self.module._probe_tracks()
+
+        self.module.prober.submit.assert_called_once_with(
+            "/music/file2.mp3",
+            ("integrity",),
+            self.module._on_track_probed,
+            analysis=audioheader.probe,
+        )
+
+    def test__on_track_probed_valid(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._quarantine_track = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._on_track_probed("/music/file1.mp3", {"integrityerror": None})
+
+        self.assertTrue(self.module.library.get_metadata("file1.mp3", "valid"))
+        self.module._schedule_catalog_save.assert_called()
+        self.module._quarantine_track.assert_not_called()
+
+    def test__on_track_probed_corrupt_is_only_flagged(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._quarantine_track = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._on_track_probed(
+            "/music/file1.mp3", {"integrityerror": "Stream is truncated"}
+        )
+
+        self.module._quarantine_track.assert_not_called()
+        self.assertFalse(self.module.library.get_metadata("file1.mp3", "valid"))
+        self.assertEqual(
+            self.module.library.get_metadata("file1.mp3", "integrityerror"),
+            "Stream is truncated",
+        )
+        self.assertIn("file1.mp3", self.module.library)
+
+    def test__on_track_probed_corrupt_checks_alarm_playlist(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._check_alarm_playlist = Mock()
+        self.module._get_config_field = Mock(return_value="playlist1")
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.module._on_track_probed("/music/file1.mp3", {"integrityerror": None})
+        self.module._check_alarm_playlist.assert_not_called()
+
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3", "size": 1}]
+        )
+        self.module._on_track_probed(
+            "/music/file1.mp3", {"integrityerror": "Stream is truncated"}
+        )
+        self.module._check_alarm_playlist.assert_called_once_with()
+
+    def test_get_corrupt_files(self):
+        self.init()
+        self.module.library.update(
+            [
+                {"filename": "file2.mp3", "path": "/music/file2.mp3"},
+                {"filename": "file1.mp3", "path": "/music/file1.mp3"},
+                {"filename": "file3.mp3", "path": "/music/file3.mp3"},
+            ]
+        )
+        self.module.library.set_metadata(
+            "file2.mp3", {"valid": False, "integrityerror": "Stream is truncated"}
+        )
+        self.module.library.set_metadata("file1.mp3", {"valid": True})
+
+        files = self.module.get_corrupt_files()
+
+        self.assertListEqual(
+            files,
+            [
+                {
+                    "filename": "file2.mp3",
+                    "path": "/music/file2.mp3",
+                    "reason": "Stream is truncated",
+                }
+            ],
+        )
+
+    def test_quarantine_music_file(self):
+        self.init()
+        self.module._quarantine_track = Mock(return_value=True)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        self.module.library.set_metadata(
+            "file1.mp3", {"valid": False, "integrityerror": "Stream is truncated"}
+        )
+
+        self.module.quarantine_music_file("file1.mp3")
+
+        self.module._quarantine_track.assert_called_with(
+            "/music/file1.mp3", "Stream is truncated"
+        )
+
+    def test_quarantine_music_file_failed(self):
+        self.init()
+        self.module._quarantine_track = Mock(return_value=False)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.quarantine_music_file("file1.mp3")
+        self.assertEqual(str(cm.exception), 'Unable to quarantine "file1.mp3"')
+        self.module._quarantine_track.assert_called_with(
+            "/music/file1.mp3", "Quarantined by user"
+        )
+
+    def test_quarantine_music_file_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.quarantine_music_file("file1.mp3")
+        self.assertEqual(str(cm.exception), 'File "file1.mp3" was not found')
+
+    @patch("backend.localmusic.os.path.isfile", Mock(return_value=True))
+    def test_restore_quarantined_file(self):
+        self.init()
+        self.module._load_quarantine_reasons = Mock(return_value={"a.mp3": "error"})
+        self.module._save_quarantine_reasons = Mock()
+        self.module._schedule_catalog_save = Mock()
+        self.module._process_library_changes = Mock()
+        self.module._check_alarm_playlist = Mock()
+        self.module.cleep_filesystem.move.return_value = True
+
+        def refresh(notify=True):
+            self.module.library.update([{"filename": "a.mp3", "path": "/music/a.mp3"}])
+
+        self.module._refresh_music_files = Mock(side_effect=refresh)
+
+        self.module.restore_quarantined_file("a.mp3")
+
+        self.module.cleep_filesystem.move.assert_called_with(
+            os.path.join(self.module.APP_STORAGE_PATH, ".cache", "quarantine", "a.mp3"),
+            os.path.join(self.module.APP_STORAGE_PATH, "a.mp3"),
+        )
+        self.module._save_quarantine_reasons.assert_called_with({})
+        self.module._refresh_music_files.assert_called_with(notify=False)
+        self.assertTrue(self.module.library.get_metadata("a.mp3", "valid"))
+        self.module._process_library_changes.assert_called()
+        self.module._check_alarm_playlist.assert_called()
+
+    @patch("backend.localmusic.os.path.isfile", Mock(return_value=True))
+    def test_restore_quarantined_file_already_in_library(self):
+        self.init()
+        self.module.library.update([{"filename": "a.mp3", "path": "/music/a.mp3"}])
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.restore_quarantined_file("a.mp3")
+        self.assertEqual(str(cm.exception), 'File "a.mp3" already exists in library')
+        self.module.cleep_filesystem.move.assert_not_called()
+
+    @patch("backend.localmusic.os.path.isfile", Mock(return_value=True))
+    def test_restore_quarantined_file_move_failed(self):
+        self.init()
+        self.module._save_quarantine_reasons = Mock()
+        self.module.cleep_filesystem.move.return_value = False
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.restore_quarantined_file("a.mp3")
+        self.assertEqual(str(cm.exception), 'Unable to restore "a.mp3"')
+        self.module._save_quarantine_reasons.assert_not_called()
+
+    def test_restore_quarantined_file_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.restore_quarantined_file("../file1.mp3")
+        self.assertEqual(
+            str(cm.exception), 'File "../file1.mp3" is not quarantined'
+        )
+
+    @patch("backend.localmusic.os.makedirs", Mock())
+    @patch("backend.localmusic.os.path.exists", Mock(return_value=True))
+    def test__quarantine_track(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+        self.module._sync_alarm_cache = Mock()
+        self.module._load_quarantine_reasons = Mock(return_value={})
+        self.module._save_quarantine_reasons = Mock()
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=["/music/file1.mp3"]
+        )
+        self.module.cleep_filesystem.move.return_value = True
+
+        result = self.module._quarantine_track("/music/file1.mp3", "Stream is truncated")
+
+        self.assertTrue(result)
+        self.module.cleep_filesystem.move.assert_called_with(
+            "/music/file1.mp3",
+            os.path.join(
+                self.module.APP_STORAGE_PATH, ".cache", "quarantine", "file1.mp3"
+            ),
+        )
+        self.module._save_quarantine_reasons.assert_called_with(
+            {"file1.mp3": "Stream is truncated"}
+        )
+        self.module._refresh_music_files.assert_called()
+        self.module._sync_alarm_cache.assert_called()
+
+    @patch("backend.localmusic.os.makedirs", Mock())
+    @patch("backend.localmusic.os.path.exists", Mock(return_value=True))
+    def test__quarantine_track_move_failed(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+        self.module._save_quarantine_reasons = Mock()
+        self.module.cleep_filesystem.move.return_value = False
+
+        result = self.module._quarantine_track("/music/file1.mp3", "Stream is truncated")
+
+        self.assertFalse(result)
+        self.module._save_quarantine_reasons.assert_not_called()
+        self.module._refresh_music_files.assert_not_called()
+
+    @patch("backend.localmusic.os.path.isdir", Mock(return_value=True))
+    @patch("backend.localmusic.os.listdir", Mock(return_value=["b.mp3", "a.ogg"]))
+    def test_get_quarantined_files(self):
+        self.init()
+        self.module._load_quarantine_reasons = Mock(
+            return_value={"b.mp3": "Audio format not recognized"}
+        )
+
+        files = self.module.get_quarantined_files()
+
+        self.assertListEqual(
+            files,
+            [
+                {"filename": "a.ogg", "reason": None},
+                {"filename": "b.mp3", "reason": "Audio format not recognized"},
+            ],
+        )
+
+    @patch("backend.localmusic.os.path.isfile", Mock(return_value=True))
+    def test_delete_quarantined_file(self):
+        self.init()
+        self.module._load_quarantine_reasons = Mock(return_value={"a.mp3": "error"})
+        self.module._save_quarantine_reasons = Mock()
+        self.module.cleep_filesystem.rm.return_value = True
+
+        self.module.delete_quarantined_file("a.mp3")
+
+        self.module.cleep_filesystem.rm.assert_called_with(
+            os.path.join(self.module.APP_STORAGE_PATH, ".cache", "quarantine", "a.mp3")
+        )
+        self.module._save_quarantine_reasons.assert_called_with({})
+
+    def test_delete_quarantined_file_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.delete_quarantined_file("../file1.mp3")
+        self.assertEqual(
+            str(cm.exception), 'File "../file1.mp3" is not quarantined'
+        )
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available")
+    def test_set_normalization(self, is_available_mock):
+        self.init()
+        is_available_mock.return_value = True
+        self.module._set_config_field = Mock()
+        self.module._analyze_tracks = Mock()
+
+        self.module.set_normalization(True)
+
+        self.module._set_config_field.assert_called_with("normalize", True)
+        self.module._analyze_tracks.assert_called()
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available")
+    def test_set_normalization_not_available(self, is_available_mock):
+        self.init()
+        is_available_mock.return_value = False
+        self.module._set_config_field = Mock()
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.set_normalization(True)
+        self.assertEqual(
+            str(cm.exception), "Loudness analysis requires numpy and ffmpeg"
+        )
+        self.module._set_config_field.assert_not_called()
+
+    def test__check_playlists(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        files = deepcopy(FILES)
+        files.pop(1)
+        self.module.files = files
+        self.module._set_config_field = Mock()
+
+        self.module._check_playlists()
+
+        self.module._set_config_field.assert_called_with(
+            "playlists", {"playlist1": ["file1.mp3", "file3.mp3"]}
+        )
+
+    def test__check_playlists_with_parameters(self):
+        self.init()
+        files = deepcopy(FILES)
+        files.pop(1)
+        self.module.files = files
+        self.module._set_config_field = Mock()
+
+        self.module._check_playlists(deepcopy(PLAYLISTS))
+
+        self.module._set_config_field.assert_called_with(
+            "playlists", {"playlist1": ["file1.mp3", "file3.mp3"]}
+        )
+
+    def test_get_music_files(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+
+        files = self.module.get_music_files()
+
+        self.assertListEqual(files, FILES)
+
+    def test_get_music_files_if_version_not_modified(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module.library.version = 3
+
+        result = self.module.get_music_files(if_version=3)
+
+        self.assertDictEqual(
+            result, {"version": 3, "modified": False, "files": None}
+        )
+
+    def test_get_music_files_if_version_modified(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module.library.version = 4
+
+        result = self.module.get_music_files(if_version=3)
+
+        self.assertDictEqual(result, {"version": 4, "modified": True, "files": FILES})
+
+    def test_get_music_files_compact(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+
+        listing = self.module.get_music_files(compact=True)
+
+        self.assertEqual(listing["format"], "columnar")
+        self.assertEqual(listing["columns"]["prefix"], "/opt/module/localmusic/")
+        self.assertListEqual(
+            listing["columns"]["filenames"], ["file1.mp3", "file2.mp3", "file3.mp3"]
+        )
+        self.assertNotIn("ids", listing["columns"])
+        self.assertListEqual(compactlisting.unpack_files(listing), FILES)
+
+    def test_get_music_files_compact_with_ids(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module.library.update(deepcopy(FILES[1:]) + deepcopy(FILES[:1]))
+        self.module.files = deepcopy(FILES)
+
+        listing = self.module.get_music_files(compact=True, ids=True)
+
+        entries = [self.module.library.get_entry(file_["filename"]) for file_ in FILES]
+        self.assertListEqual(
+            listing["columns"]["ids"], [entry["id"] for entry in entries]
+        )
+
+    def test_get_music_files_compact_compressed(self):
+        self.init()
+        files = [
+            {"filename": f"file{index}.mp3", "path": f"/music/file{index}.mp3"}
+            for index in range(2000)
+        ]
+        self.module.files = deepcopy(files)
+
+        listing = self.module.get_music_files(compact=True, compress=True)
+
+        self.assertEqual(listing["encoding"], "gzip")
+        self.assertListEqual(compactlisting.unpack_files(listing), files)
+
+    def test_get_music_files_compact_if_version_modified(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module.library.version = 4
+
+        result = self.module.get_music_files(if_version=3, compact=True)
+
+        self.assertTrue(result["modified"])
+        self.assertListEqual(compactlisting.unpack_files(result["files"]), FILES)
+
+    def test_get_music_files_compact_if_version_not_modified(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module.library.version = 3
+
+        result = self.module.get_music_files(if_version=3, compact=True)
+
+        self.assertDictEqual(
+            result, {"version": 3, "modified": False, "files": None}
+        )
+
+    def test_get_music_files_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter):
+            self.module.get_music_files(compact="yes")
+        with self.assertRaises(InvalidParameter):
+            self.module.get_music_files(compact=True, ids=1)
+        with self.assertRaises(InvalidParameter):
+            self.module.get_music_files(compact=True, compress=None)
+
+    @patch("backend.localmusic.CoverCache.is_available", Mock(return_value=True))
+    def test_get_cover(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._extract_cover = Mock(return_value=b"image")
+        self.module.cover_cache = Mock()
+        self.module.cover_cache.add.return_value = Localmusic.FALLBACK_TONE
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        cover = self.module.get_cover("file1.mp3", 64)
+
+        self.module._extract_cover.assert_called_with("/music/file1.mp3")
+        self.module.cover_cache.add.assert_called_with(b"image", 64)
+        key = CoverCache.get_key(b"image")
+        self.assertEqual(self.module.library.get_metadata("file1.mp3", "cover"), key)
+        self.assertEqual(cover["cover"], key)
+        self.assertEqual(cover["size"], 64)
+        self.assertEqual(cover["mimetype"], "image/jpeg")
+        with open(Localmusic.FALLBACK_TONE, "rb") as fdesc:
+            self.assertEqual(base64.b64decode(cover["data"]), fdesc.read())
+
+    @patch("backend.localmusic.CoverCache.is_available", Mock(return_value=True))
+    def test_get_cover_cached(self):
+        self.init()
+        self.module._extract_cover = Mock()
+        self.module.cover_cache = Mock()
+        self.module.cover_cache.get.return_value = Localmusic.FALLBACK_TONE
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        self.module.library.set_metadata("file1.mp3", {"cover": "key"})
+
+        cover = self.module.get_cover("file1.mp3", 128)
+
+        self.module.cover_cache.get.assert_called_with("key", 128)
+        self.module._extract_cover.assert_not_called()
+        self.assertEqual(cover["cover"], "key")
+
+    @patch("backend.localmusic.CoverCache.is_available", Mock(return_value=True))
+    def test_get_cover_no_cover(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._extract_cover = Mock(return_value=None)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.assertIsNone(self.module.get_cover("file1.mp3"))
+        self.assertIsNone(self.module.get_cover("file1.mp3"))
+
+        # missing cover is cached
+        self.module._extract_cover.assert_called_once()
+
+    @patch("backend.localmusic.CoverCache.is_available", Mock(return_value=True))
+    def test_get_cover_decode_failed(self):
+        self.init()
+        self.module._schedule_catalog_save = Mock()
+        self.module._extract_cover = Mock(return_value=b"image")
+        self.module.cover_cache = Mock()
+        self.module.cover_cache.add.side_effect = Exception("Test exception")
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.get_cover("file1.mp3")
+        self.assertEqual(str(cm.exception), 'Unable to decode cover of "file1.mp3"')
+
+    @patch("backend.localmusic.CoverCache.is_available", Mock(return_value=False))
+    def test_get_cover_not_available(self):
+        self.init()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.get_cover("file1.mp3")
+        self.assertEqual(str(cm.exception), "Cover art requires Pillow")
+
+    def test_get_cover_invalid_params(self):
+        self.init()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_cover("file2.mp3")
+        self.assertEqual(str(cm.exception), 'File "file2.mp3" was not found')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_cover("file1.mp3", 100)
+        self.assertEqual(str(cm.exception), "Size must be one of 64,128,256,512")
+
+    @patch("backend.localmusic.coverart.extract_embedded", Mock(return_value=None))
+    def test__extract_cover_folder_image(self):
+        self.init()
+        self.module.folder_covers = {"/music": Localmusic.FALLBACK_TONE}
+
+        data = self.module._extract_cover("/music/file1.mp3")
+
+        with open(Localmusic.FALLBACK_TONE, "rb") as fdesc:
+            self.assertEqual(data, fdesc.read())
+
+    @patch("backend.localmusic.coverart.extract_embedded", Mock(return_value=b"image"))
+    def test__extract_cover_embedded(self):
+        self.init()
+        self.module.folder_covers = {"/music": Localmusic.FALLBACK_TONE}
+
+        self.assertEqual(self.module._extract_cover("/music/file1.mp3"), b"image")
+
+    @patch("backend.localmusic.coverart.extract_embedded", Mock(side_effect=OSError()))
+    def test__extract_cover_unreadable(self):
+        self.init()
+
+        self.assertIsNone(self.module._extract_cover("/music/file1.mp3"))
+
+    @patch("backend.localmusic.PreviewServer")
+    def test_get_track_preview(self, preview_server_mock):
+        self.init()
+        preview_server_mock.return_value.port = 9194
+        preview_server_mock.return_value.register.return_value = "/preview/token"
+        self.module._get_audio_format = Mock(return_value="audio/mpeg")
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        preview = self.module.get_track_preview("file1.mp3")
+        self.module.get_track_preview("file1.mp3")
+
+        self.assertDictEqual(
+            preview, {"port": 9194, "path": "/preview/token", "mimetype": "audio/mpeg"}
+        )
+        preview_server_mock.assert_called_once_with(
+            self.module.logger, Localmusic.PREVIEW_PORT, ssl_context=None
+        )
+        preview_server_mock.return_value.start.assert_called_once()
+        preview_server_mock.return_value.register.assert_called_with(
+            "/music/file1.mp3", "audio/mpeg"
+        )
+
+    @patch("backend.localmusic.PreviewServer")
+    def test_get_track_preview_unknown_format(self, preview_server_mock):
+        self.init()
+        self.module._get_audio_format = Mock(return_value=None)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        preview = self.module.get_track_preview("file1.mp3")
+
+        self.assertEqual(preview["mimetype"], "application/octet-stream")
+
+    @patch("backend.localmusic.PreviewServer")
+    def test_get_track_preview_server_failed(self, preview_server_mock):
+        self.init()
+        preview_server_mock.side_effect = OSError("Address already in use")
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.get_track_preview("file1.mp3")
+        self.assertEqual(str(cm.exception), "Unable to start preview server")
+        self.assertDictEqual(self.module.preview_servers, {})
+
+    @patch("backend.localmusic.ssl.SSLContext")
+    @patch("backend.localmusic.PreviewServer")
+    def test_get_track_preview_secure(self, preview_server_mock, ssl_context_mock):
+        self.init()
+        preview_server_mock.side_effect = [Mock(port=9194), Mock(port=9195)]
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        preview = self.module.get_track_preview("file1.mp3")
+        secure_preview = self.module.get_track_preview("file1.mp3", secure=True)
+        self.module.get_track_preview("file1.mp3", secure=True)
+
+        self.assertEqual(preview["port"], 9194)
+        self.assertEqual(secure_preview["port"], 9195)
+        self.assertEqual(preview_server_mock.call_count, 2)
+        preview_server_mock.assert_called_with(
+            self.module.logger,
+            Localmusic.PREVIEW_SECURE_PORT,
+            ssl_context=ssl_context_mock.return_value,
+        )
+        ssl_context_mock.return_value.load_cert_chain.assert_called_once_with(
+            Localmusic.PREVIEW_CERT_FILE, Localmusic.PREVIEW_KEY_FILE
+        )
+
+    @patch("backend.localmusic.ssl.SSLContext")
+    @patch("backend.localmusic.PreviewServer")
+    def test_get_track_preview_secure_no_certificate(
+        self, preview_server_mock, ssl_context_mock
+    ):
+        self.init()
+        ssl_context_mock.return_value.load_cert_chain.side_effect = FileNotFoundError()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.get_track_preview("file1.mp3", secure=True)
+        self.assertEqual(
+            str(cm.exception), "Unable to load certificate for secure preview"
+        )
+        preview_server_mock.assert_not_called()
+
+    def test_get_track_preview_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_track_preview("file1.mp3")
+        self.assertEqual(str(cm.exception), 'File "file1.mp3" was not found')
+
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+        with self.assertRaises(InvalidParameter):
+            self.module.get_track_preview("file1.mp3", secure="yes")
+
+    def test_get_library_changes(self):
+        self.init()
+        self.module._push_library_changes = Mock()
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", [], ("file1.mp3", "file2.mp3")),
+            ]
+            self.module._refresh_music_files()
+            version = self.module.library.version
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", [], ("file1.mp3", "file3.mp3")),
+            ]
+            self.module._refresh_music_files()
+
+        changes = self.module.get_library_changes(version)
+
+        self.assertDictEqual(
+            changes,
+            {
+                "version": version + 1,
+                "reload": False,
+                "added": [
+                    {"filename": "file3.mp3", "path": "/opt/module/localmusic/file3.mp3"}
+                ],
+                "removed": ["file2.mp3"],
+                "changed": [],
+            },
+        )
+
+    def test_get_library_changes_reload(self):
+        self.init()
+
+        changes = self.module.get_library_changes(self.module.library.version + 1)
+
+        self.assertTrue(changes["reload"])
+
+    def test_get_library_changes_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(MissingParameter):
+            self.module.get_library_changes(None)
+
+    def test_get_playlists(self):
+        self.init()
+        self.module._get_config_field = Mock(side_effect=["playlist1", PLAYLISTS])
+        self.module.playlists_version = 2
+
+        result = self.module.get_playlists()
+
+        self.assertDictEqual(
+            result,
+            {
+                "version": 2,
+                "modified": True,
+                "default": "playlist1",
+                "playlists": PLAYLISTS,
+            },
+        )
+
+    def test_get_playlists_not_modified(self):
+        self.init()
+        self.module._get_config_field = Mock()
+        self.module.playlists_version = 2
+
+        result = self.module.get_playlists(if_version=2)
+
+        self.assertDictEqual(
+            result,
+            {"version": 2, "modified": False, "default": None, "playlists": None},
+        )
+        self.module._get_config_field.assert_not_called()
+
+    def test_playlists_version_bumped_on_change(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        version = self.module.playlists_version
+
+        self.module.delete_playlist("playlist2")
+
+        self.assertEqual(self.module.playlists_version, version + 1)
+
+    def test_get_playback(self):
+        self.init()
+
+        playback = self.module.get_playback()
+
+        self.assertEqual(playback, [])
+
+    def test_get_playback_with_players(self):
+        self.init()
+        playback = make_playback("uuid1", index=1)
+        playback["startindex"] = 2
+        self.module.playbacks.add(playback)
+        self.module.playbacks.add(make_playback("uuid2", "default", alarm=True))
+
+        self.assertListEqual(
+            self.module.get_playback(),
+            [
+                {
+                    "playeruuid": "uuid1",
+                    "playlistname": "playlist1",
+                    "index": 3,
+                    "alarm": False,
+                },
+                {
+                    "playeruuid": "uuid2",
+                    "playlistname": "default",
+                    "index": None,
+                    "alarm": True,
+                },
+            ],
+        )
+        self.assertDictEqual(
+            self.module.get_playback("uuid1"),
+            {"playeruuid": "uuid1", "playlistname": "playlist1", "index": 3, "alarm": False},
+        )
+
+    def test_get_playback_unknown_player(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_playback("uuid")
+        self.assertEqual(str(cm.exception), 'Player "uuid" does not exist')
+
+    @patch(
+        "backend.localmusic.audioheader.sniff", Mock(return_value={"codec": "mp3"})
+    )
+    def test_add_music_file(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = False
+            result = self.module.add_music_file("dummy.mp3")
+
+            self.assertTrue(result)
+            self.module._refresh_music_files.assert_called()
+
+    @patch("backend.localmusic.Localmusic.ALLOWED_MUSIC_EXTENSIONS", ["mp3", "ogg"])
+    def test_add_music_file_invalid_extension(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            result = self.module.add_music_file("dummy.wav")
+        self.assertEqual(
+            str(cm.exception), "Invalid file extension (only mp3,ogg allowed)"
+        )
+
+    @patch("backend.localmusic.Transcoder.is_available", Mock(return_value=True))
+    def test_add_music_file_transcode(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.transcoder = Mock()
+        self.module.cleep_filesystem.move.return_value = True
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock, patch(
+            "backend.localmusic.os.makedirs"
+        ):
+            exists_mock.return_value = False
+            result = self.module.add_music_file("/tmp/dummy.wav")
+
+        self.assertTrue(result)
+        incoming_path = os.path.join(
+            self.module.APP_STORAGE_PATH, ".cache", "incoming", "dummy.wav"
+        )
+        self.module.cleep_filesystem.move.assert_called_with(
+            "/tmp/dummy.wav", incoming_path
+        )
+        self.assertEqual(self.module.transcoder.submit.call_args.args[0], incoming_path)
+
+    @patch("backend.localmusic.Transcoder.is_available", Mock(return_value=True))
+    def test_add_music_file_transcode_already_exists(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.transcoder = Mock()
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = True
+            with self.assertRaises(CommandError) as cm:
+                self.module.add_music_file("/tmp/dummy.wav")
+        self.assertEqual(str(cm.exception), 'Music file "dummy.flac" already exists')
+        self.module.transcoder.submit.assert_not_called()
+
+    @patch("backend.localmusic.Transcoder.is_available", Mock(return_value=True))
+    def test_add_music_file_transcode_disabled(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=False)
+        self.module.transcoder = Mock()
+
+        with self.assertRaises(InvalidParameter):
+            self.module.add_music_file("/tmp/dummy.wav")
+        self.module.transcoder.submit.assert_not_called()
+
+    def test__on_transcode_done(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+        self.module.cleep_filesystem.move.return_value = True
+
+        error = self.module._on_transcode_done("/cache/hash.flac", "/storage/dummy.flac")
+
+        self.assertIsNone(error)
+        self.module.cleep_filesystem.move.assert_called_with(
+            "/cache/hash.flac", "/storage/dummy.flac"
+        )
+        self.module._refresh_music_files.assert_called()
+
+    def test__on_transcode_done_move_failed(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+        self.module.cleep_filesystem.move.return_value = False
+
+        error = self.module._on_transcode_done("/cache/hash.flac", "/storage/dummy.flac")
+
+        self.assertEqual(error, 'Unable to save "dummy.flac"')
+        self.module._refresh_music_files.assert_not_called()
+
+    def test__on_transcode_update(self):
+        self.init()
+        self.module.transcode_update_event = Mock()
+        job = {"jobid": "123", "filename": "dummy.wav", "status": "running", "progress": 10}
+
+        self.module._on_transcode_update(job)
+
+        self.module.transcode_update_event.send.assert_called_with(params=job)
+
+    @patch("backend.localmusic.Transcoder.is_available")
+    def test_set_transcode(self, is_available_mock):
+        self.init()
+        self.module._set_config_field = Mock()
+        is_available_mock.return_value = True
+
+        self.module.set_transcode(True)
+
+        self.module._set_config_field.assert_called_with("transcode", True)
+
+    @patch("backend.localmusic.Transcoder.is_available")
+    def test_set_transcode_encoder_not_installed(self, is_available_mock):
+        self.init()
+        self.module._set_config_field = Mock()
+        is_available_mock.return_value = False
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.set_transcode(True)
+        self.assertEqual(str(cm.exception), "Encoder (ffmpeg) is not installed")
+
+        self.module.set_transcode(False)
+        self.module._set_config_field.assert_called_with("transcode", False)
+
+    @patch(
+        "backend.localmusic.audioheader.sniff", Mock(return_value={"codec": "mp3"})
+    )
+    @patch(
+        "backend.localmusic.audioheader.sniff", Mock(return_value={"codec": "aac"})
+    )
+    def test_add_music_file_content_mismatch(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_music_file("/tmp/dummy.mp3")
+        self.assertEqual(
+            str(cm.exception), 'File "dummy.mp3" content is not a valid mp3 file'
+        )
+        self.module.cleep_filesystem.move.assert_not_called()
+
+    @patch("backend.localmusic.audioheader.sniff", Mock(side_effect=OSError()))
+    def test_add_music_file_unreadable(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter):
+            self.module.add_music_file("/tmp/dummy.mp3")
+        self.module.cleep_filesystem.move.assert_not_called()
+
+    def test_add_music_file_already_exists(self):
+        self.init()
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = True
+            with self.assertRaises(CommandError) as cm:
+                result = self.module.add_music_file("dummy.mp3")
+            self.assertEqual(str(cm.exception), 'Music file "dummy.mp3" already exists')
+
+    @patch(
+        "backend.localmusic.audioheader.sniff", Mock(return_value={"codec": "mp3"})
+    )
+    def test_add_music_file_already_exists_in_folder(self):
+        self.init()
+        self.module.library.update(
+            [{"filename": "dummy.mp3", "path": "/music/album/dummy.mp3"}]
+        )
+
+        with patch("backend.localmusic.os.path.exists", Mock(return_value=False)):
+            with self.assertRaises(CommandError) as cm:
+                self.module.add_music_file("/tmp/dummy.mp3")
+        self.assertEqual(str(cm.exception), 'Music file "dummy.mp3" already exists')
+
+    @patch(
+        "backend.localmusic.audioheader.sniff", Mock(return_value={"codec": "mp3"})
+    )
+    def test_add_music_file_unable_to_save(self):
+        self.init()
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = False
+            self.module.cleep_filesystem.move.return_value = False
+            with self.assertRaises(CommandError) as cm:
+                result = self.module.add_music_file("dummy.mp3")
+            self.assertEqual(str(cm.exception), 'Unable to save "dummy.mp3"')
+
+    def test_delete_music_file(self):
+        self.init()
+        self.module._refresh_music_file = Mock()
+        self.module.cleep_filesystem.rm.return_value = True
+
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", [], ("file1.mp3", "file2.mp3", "file3.mp3")),
+            ]
+
+            self.module.delete_music_file("file2.mp3")
+
+            self.module.cleep_filesystem.rm.assert_called_with(
+                "/opt/module/localmusic/file2.mp3"
+            )
+            self.module._refresh_music_file.assert_not_called()
+
+    def test_delete_music_file_file_not_found(self):
+        self.init()
+        self.module._refresh_music_file = Mock()
+        self.module.cleep_filesystem.rm.return_value = True
+
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", [], ("file1.mp3", "file2.mp3", "file3.mp3")),
+            ]
+
+            with self.assertRaises(InvalidParameter) as cm:
+                self.module.delete_music_file("file4.mp3")
+            self.assertEqual(str(cm.exception), 'File "file4.mp3" was not found')
+
+    def test_delete_music_file_unable_to_delete(self):
+        self.init()
+        self.module._refresh_music_file = Mock()
+        self.module.cleep_filesystem.rm.return_value = False
+
+        with patch("backend.localmusic.os.walk") as walk_mock:
+            walk_mock.return_value = [
+                ("/opt/module/localmusic", [], ("file1.mp3", "file2.mp3", "file3.mp3")),
+            ]
+
+            with self.assertRaises(CommandError) as cm:
+                self.module.delete_music_file("file2.mp3")
+            self.assertEqual(str(cm.exception), 'Unable to delete "file2.mp3"')
+
+    def _make_quota_config(self, quota, eviction=False):
+        config = {"storagequota": quota, "quotaeviction": eviction, "default": None}
+        self.module._get_config_field = Mock(side_effect=lambda field: config[field])
+
+    def test__check_storage_quota_disabled(self):
+        self.init()
+        self._make_quota_config(0)
+
+        self.module._check_storage_quota("/tmp/dummy.mp3")
+
+    @patch("backend.localmusic.os.path.getsize", Mock(return_value=30))
+    def test__check_storage_quota(self):
+        self.init()
+        self._make_quota_config(100)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/storage/file1.mp3", "size": 70}]
+        )
+
+        self.module._check_storage_quota("/tmp/dummy.mp3")
+
+    @patch("backend.localmusic.os.path.getsize", Mock(return_value=31))
+    def test__check_storage_quota_exceeded(self):
+        self.init()
+        self._make_quota_config(100)
+        self.module._evict_tracks = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/storage/file1.mp3", "size": 70}]
+        )
+
+        with self.assertRaises(CommandError) as cm:
+            self.module._check_storage_quota("/tmp/dummy.mp3")
+        self.assertEqual(
+            str(cm.exception), "Storage quota exceeded (70 of 100 bytes used)"
+        )
+        self.module._evict_tracks.assert_not_called()
+
+    @patch("backend.localmusic.os.path.getsize", Mock(return_value=31))
+    def test__check_storage_quota_exceeded_with_eviction(self):
+        self.init()
+        self._make_quota_config(100, eviction=True)
+        self.module._evict_tracks = Mock()
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/storage/file1.mp3", "size": 70}]
+        )
+
+        self.module._check_storage_quota("/tmp/dummy.mp3")
+
+        self.module._evict_tracks.assert_called_with(1)
+
+    @patch(
+        "backend.localmusic.audioheader.sniff", Mock(return_value={"codec": "mp3"})
+    )
+    def test_add_music_file_quota_exceeded(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+        self.module._check_storage_quota = Mock(side_effect=CommandError("Quota"))
+
+        with patch("backend.localmusic.os.path.exists") as exists_mock:
+            exists_mock.return_value = False
+            with self.assertRaises(CommandError):
+                self.module.add_music_file("dummy.mp3")
+
+        self.module.cleep_filesystem.move.assert_not_called()
+        self.module._refresh_music_files.assert_not_called()
+
+    def test__on_transcode_done_quota_exceeded(self):
+        self.init()
+        self.module._refresh_music_files = Mock()
+        self.module._check_storage_quota = Mock(side_effect=CommandError("Quota"))
+
+        error = self.module._on_transcode_done("/cache/hash.flac", "/storage/dummy.flac")
+
+        self.assertEqual(error, "Quota")
+        self.module._check_storage_quota.assert_called_with("/cache/hash.flac")
+        self.module.cleep_filesystem.move.assert_not_called()
+
+    def test_set_storage_quota(self):
+        self.init()
+        self.module._update_config = Mock()
+
+        self.module.set_storage_quota(1000, True)
+
+        self.module._update_config.assert_called_with(
+            {"storagequota": 1000, "quotaeviction": True}
+        )
+
+    def test_set_storage_quota_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.set_storage_quota(-1, True)
+        self.assertEqual(str(cm.exception), "Quota must be positive")
+
+    @patch("backend.localmusic.shutil.disk_usage")
+    def test_get_storage_usage(self, disk_usage_mock):
+        self.init()
+        disk_usage_mock.return_value.free = 500
+        self._make_quota_config(100)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/storage/file1.mp3", "size": 70}]
+        )
+
+        self.assertDictEqual(
+            self.module.get_storage_usage(),
+            {"used": 70, "quota": 100, "eviction": False, "free": 500},
+        )
+
+    def _make_eviction_library(self):
+        self.module.library.update(
+            [
+                {
+                    "filename": f"file{index}.mp3",
+                    "path": f"/storage/file{index}.mp3",
+                    "size": index * 10,
+                    "mtime": float(index),
+                }
+                for index in range(1, 5)
+            ]
+        )
+        last_played = {
+            "file1.mp3": 300,
+            "file2.mp3": 0,
+            "file3.mp3": 100,
+            "file4.mp3": 0,
+        }
+        self.module.history = Mock()
+        self.module.history.get_track_stats.side_effect = lambda filename: {
+            "lastplayed": last_played[filename]
+        }
+
+    def test_evict_tracks_dry_run(self):
+        self.init()
+        self._make_eviction_library()
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=["/storage/file4.mp3"]
+        )
+        self.module._refresh_music_files = Mock()
+
+        result = self.module.evict_tracks(40, dry_run=True)
+
+        self.assertDictEqual(
+            result, {"tracks": ["file2.mp3", "file3.mp3"], "freedsize": 50}
+        )
+        self.module.cleep_filesystem.rm.assert_not_called()
+        self.module._refresh_music_files.assert_not_called()
+
+    def test_evict_tracks(self):
+        self.init()
+        self._make_eviction_library()
+        self.module._get_default_playlist_tracks = Mock(return_value=[])
+        self.module.playbacks.add(make_playback(tracks=["/storage/file2.mp3"]))
+        self.module._refresh_music_files = Mock()
+        self.module._check_playlists = Mock()
+        self.module.cleep_filesystem.rm.return_value = True
+
+        result = self.module.evict_tracks(40)
+
+        self.assertDictEqual(result, {"tracks": ["file4.mp3"], "freedsize": 40})
+        self.module.cleep_filesystem.rm.assert_called_once_with("/storage/file4.mp3")
+        self.module._refresh_music_files.assert_called()
+        self.module._check_playlists.assert_called()
+
+    def test_evict_tracks_not_enough_tracks(self):
+        self.init()
+        self._make_eviction_library()
+        self.module._get_default_playlist_tracks = Mock(return_value=[])
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.evict_tracks(1000)
+        self.assertEqual(
+            str(cm.exception), "Not enough evictable tracks to free storage"
+        )
+        self.module.cleep_filesystem.rm.assert_not_called()
+
+    def test_evict_tracks_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.evict_tracks(0)
+        self.assertEqual(str(cm.exception), "Size must be greater than 0")
+
+    def _update_library_folders(self):
+        root = self.module.APP_STORAGE_PATH
+        self.module.library.update(
+            [
+                {"filename": "file1.mp3", "path": f"{root}/file1.mp3", "size": 5},
+                {"filename": "a1.mp3", "path": f"{root}/rock/a1.mp3", "size": 10},
+                {"filename": "a2.mp3", "path": f"{root}/rock/a2.mp3", "size": 10},
+                {"filename": "b1.mp3", "path": f"{root}/rock/b/b1.mp3", "size": 20},
+            ]
+        )
+
+    def test_browse(self):
+        self.init()
+        self._update_library_folders()
+
+        folder = self.module.browse()
+
+        self.assertEqual(folder["path"], "")
+        self.assertEqual(folder["count"], 4)
+        self.assertEqual(folder["size"], 45)
+        self.assertListEqual(
+            folder["folders"],
+            [{"path": "rock", "name": "rock", "count": 3, "size": 40}],
+        )
+        self.assertListEqual(
+            [file_["filename"] for file_ in folder["files"]], ["file1.mp3"]
+        )
+
+    def test_browse_subfolder_paginated(self):
+        self.init()
+        self._update_library_folders()
+
+        folder = self.module.browse("rock", offset=1, limit=1)
+
+        self.assertEqual(folder["path"], "rock")
+        self.assertListEqual(
+            folder["folders"],
+            [{"path": os.path.join("rock", "b"), "name": "b", "count": 1, "size": 20}],
+        )
+        self.assertListEqual(
+            [file_["filename"] for file_ in folder["files"]], ["a2.mp3"]
+        )
+        self.assertEqual(folder["filescount"], 2)
+
+    def test_browse_empty_library(self):
+        self.init()
+
+        folder = self.module.browse()
+
+        self.assertDictEqual(
+            folder,
+            {
+                "path": "",
+                "count": 0,
+                "size": 0,
+                "folders": [],
+                "files": [],
+                "filescount": 0,
+            },
+        )
+
+    def test_browse_invalid_params(self):
+        self.init()
+        self._update_library_folders()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.browse("pop")
+        self.assertEqual(str(cm.exception), 'Folder "pop" was not found')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.browse("../other")
+        self.assertEqual(str(cm.exception), 'Folder "../other" was not found')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.browse(offset=-1)
+        self.assertEqual(str(cm.exception), "Offset must be positive")
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.browse(limit=1000)
+        self.assertEqual(str(cm.exception), "Limit must be between 1 and 500")
+
+    def test_add_folder_playlist(self):
+        self.init()
+        self._update_library_folders()
+        self.module.add_playlist = Mock()
+
+        count = self.module.add_folder_playlist("rock", "Rock")
+
+        self.assertEqual(count, 3)
+        self.module.add_playlist.assert_called_with(
+            "Rock", ["a1.mp3", "a2.mp3", "b1.mp3"], None
+        )
+
+    def test_add_folder_playlist_not_recursive(self):
+        self.init()
+        self._update_library_folders()
+        self.module.add_playlist = Mock()
+
+        self.module.add_folder_playlist(None, "All", recursive=False, if_version=2)
+
+        self.module.add_playlist.assert_called_with("All", ["file1.mp3"], 2)
+
+    def test_add_folder_playlist_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_folder_playlist(None, "All")
+        self.assertEqual(str(cm.exception), "Library has no track")
+
+        self._update_library_folders()
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_folder_playlist("pop", "Pop")
+        self.assertEqual(str(cm.exception), 'Folder "pop" was not found')
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_folder_playlist("/etc", "Etc")
+        self.assertEqual(str(cm.exception), 'Folder "/etc" was not found')
+
+    def _update_library_tags(self):
+        self.module.library.update(deepcopy(FILES))
+        tags = {
+            "file1.mp3": {"artist": "Band", "album": "First", "track": 2, "genre": "Rock"},
+            "file2.mp3": {"artist": "Band", "album": "First", "track": 1},
+            "file3.mp3": {"artist": "Other", "album": "Second", "genre": "Rock"},
+        }
+        for filename, file_tags in tags.items():
+            self.module.library.set_metadata(filename, {"tags": file_tags})
+
+    def test_get_artists(self):
+        self.init()
+        self._update_library_tags()
+
+        artists = self.module.get_artists(offset=1, limit=10)
+
+        self.assertDictEqual(
+            artists,
+            {"count": 2, "artists": [{"name": "Other", "albums": 1, "tracks": 1}]},
+        )
+
+    def test_get_albums(self):
+        self.init()
+        self._update_library_tags()
+
+        albums = self.module.get_albums("Band")
+
+        self.assertDictEqual(
+            albums,
+            {"count": 1, "albums": [{"name": "First", "artist": "Band", "tracks": 2}]},
+        )
+
+    def test_get_genres(self):
+        self.init()
+        self._update_library_tags()
+
+        self.assertDictEqual(
+            self.module.get_genres(), {"count": 1, "genres": [{"name": "Rock", "tracks": 2}]}
+        )
+
+    def test_get_tracks(self):
+        self.init()
+        self._update_library_tags()
+
+        tracks = self.module.get_tracks(artist="Band", limit=1)
+
+        self.assertEqual(tracks["count"], 2)
+        self.assertListEqual(
+            tracks["files"],
+            [
+                {
+                    "filename": "file2.mp3",
+                    "path": "/opt/module/localmusic/file2.mp3",
+                    "tags": {"artist": "Band", "album": "First", "track": 1},
+                }
+            ],
+        )
+        self.assertEqual(self.module.get_tracks(genre="Rock")["count"], 2)
+
+    def test_browse_tags_invalid_params(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_artists(limit=0)
+        self.assertEqual(str(cm.exception), "Limit must be between 1 and 500")
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.get_tracks(offset=-1)
+        self.assertEqual(str(cm.exception), "Offset must be positive")
+
+    def test_add_playlist_from_artist(self):
+        self.init()
+        self._update_library_tags()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        self.module._check_playlists = Mock()
+
+        self.module.add_playlist("playlist3", artist="Band")
+
+        playlists = deepcopy(PLAYLISTS)
+        playlists["playlist3"] = ["file2.mp3", "file1.mp3"]
+        self.module._set_config_field.assert_called_with("playlists", playlists)
+
+    def test_add_playlist_from_album(self):
+        self.init()
+        self._update_library_tags()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        self.module._check_playlists = Mock()
+
+        self.module.add_playlist("playlist3", album="Second")
+
+        playlists = deepcopy(PLAYLISTS)
+        playlists["playlist3"] = ["file3.mp3"]
+        self.module._set_config_field.assert_called_with("playlists", playlists)
+
+    def test_add_playlist_from_unknown_reference(self):
+        self.init()
+        self._update_library_tags()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_playlist("playlist3", artist="Band", album="Second")
+        self.assertEqual(
+            str(cm.exception), "No track found for specified artist and album"
+        )
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_playlist("playlist3")
+        self.assertEqual(str(cm.exception), "Playlist must not be empty")
+
+    def test_add_playlist(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        self.module._check_playlists = Mock()
+
+        files = ["file1.mp3", "file2.mp3"]
+        self.module.add_playlist("playlist3", files)
+
+        playlists = deepcopy(PLAYLISTS)
+        playlists["playlist3"] = files
+        self.module._set_config_field.assert_called_with("playlists", playlists)
+        self.module._check_playlists.assert_called()
+
+    def test_add_playlist_first_add_set_default_playlist(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value={})
+        self.module._check_playlists = Mock()
+        files = ["file1.mp3", "file2.mp3"]
+        self.module.set_default_playlist = Mock()
+
+        self.module.add_playlist("playlist3", files)
+
+        self.module.set_default_playlist.assert_called_with("playlist3")
+
+    def test_add_playlist_invalid_parameters(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_playlist("playlist3", [])
+        self.assertEqual(str(cm.exception), "Playlist must not be empty")
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_playlist("", ["file1.mp3"])
+        self.assertEqual(
+            str(cm.exception), 'Parameter "playlist_name" is invalid (specified="")'
+        )
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_playlist("playlist2", ["file1.mp3"])
+        self.assertEqual(str(cm.exception), 'Playlist "playlist2" already exists')
+
+    def test_update_playlist_update_files_only(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        self.module._check_playlists = Mock()
+
+        files = ["file1.mp3", "file3.mp3"]
+        self.module.update_playlist("playlist2", "playlist2", files)
 
         playlists = deepcopy(PLAYLISTS)
         playlists["playlist2"] = files
@@ -430,6 +2624,8 @@ class TestLocalmusic(unittest.TestCase):
         self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
         self.module._set_config_field = Mock()
         self.module._check_playlists = Mock()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
 
         files = ["file1.mp3", "file3.mp3"]
         self.module.update_playlist("playlist2", "playlist3", files)
@@ -440,6 +2636,7 @@ class TestLocalmusic(unittest.TestCase):
         logging.debug("Playlist: %s", playlists)
         self.module._set_config_field.assert_called_with("playlists", playlists)
         self.module._check_playlists.assert_called()
+        self.module.shuffler.rename.assert_called_with("playlist2", "playlist3")
 
     def test_update_playlist_invalid_parameters(self):
         self.init()
@@ -456,62 +2653,556 @@ class TestLocalmusic(unittest.TestCase):
             str(cm.exception), 'Parameter "playlist_name" is invalid (specified="")'
         )
 
-        with self.assertRaises(InvalidParameter) as cm:
-            self.module.update_playlist("playlist4", "playlist2", ["file1.mp3"])
-        self.assertEqual(str(cm.exception), 'Playlist "playlist4" does not exist')
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.update_playlist("playlist4", "playlist2", ["file1.mp3"])
+        self.assertEqual(str(cm.exception), 'Playlist "playlist4" does not exist')
+
+    def test_delete_playlist(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+
+        self.module.delete_playlist("playlist2")
+
+        playlists = deepcopy(PLAYLISTS)
+        del playlists["playlist2"]
+        self.module._set_config_field.assert_called_with("playlists", playlists)
+        self.module.shuffler.remove.assert_called_with("playlist2")
+
+    def test_delete_playlist_if_version(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        version = self.module.playlists_version
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.delete_playlist("playlist2", if_version=version - 1)
+        self.assertEqual(
+            str(cm.exception), "Playlists have been modified meanwhile, please reload them"
+        )
+        self.module._set_config_field.assert_not_called()
+
+        self.module.delete_playlist("playlist2", if_version=version)
+        self.module._set_config_field.assert_called()
+
+    def test_update_playlist_if_version(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+
+        with self.assertRaises(CommandError):
+            self.module.update_playlist(
+                "playlist2",
+                "playlist2",
+                ["file1.mp3"],
+                if_version=self.module.playlists_version + 1,
+            )
+        self.module._set_config_field.assert_not_called()
+
+    def test_concurrent_commands_and_events(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.files = deepcopy(FILES)
+        self.module.history = Mock()
+        self.module.prefetcher = Mock()
+        self.module._save_position = Mock()
+        config = FakeConfig(
+            {
+                **Localmusic.DEFAULT_CONFIG,
+                "playlists": deepcopy(PLAYLISTS),
+                "default": "playlist1",
+            }
+        )
+        self.module._get_config_field = config.get
+        self.module._set_config_field = config.set
+        audioplayer = FakeAudioplayer()
+        self.module.send_command_advanced = audioplayer.send_command_advanced
+        errors = []
+        running = threading.Event()
+        running.set()
+
+        def run(target, *args):
+            try:
+                target(*args)
+            except Exception as error:
+                errors.append(error)
+
+        def add_playlists(index):
+            for count in range(20):
+                self.module.add_playlist(f"playlist-{index}-{count}", ["file1.mp3"])
+
+        def trigger_alarms():
+            for _ in range(30):
+                self.module._start_alarm(50, False, False)
+                self.module._stop_alarm(random.choice([True, False]))
+
+        def play_playlists():
+            for _ in range(30):
+                self.module.play_playlist(random.choice(["playlist1", "playlist2"]))
+
+        def send_events():
+            while True:
+                stopping = not running.is_set()
+                for player_uuid in audioplayer.pop_stopped():
+                    self.module.on_event(
+                        {
+                            "event": "audioplayer.playback.update",
+                            "params": {
+                                "playeruuid": player_uuid,
+                                "state": "stopped",
+                                "index": 0,
+                            },
+                        }
+                    )
+                for playback in self.module.playbacks.get_all():
+                    self.module.on_event(
+                        {
+                            "event": "audioplayer.playback.update",
+                            "params": {
+                                "playeruuid": playback["playeruuid"],
+                                "state": random.choice(["playing", "paused"]),
+                                "index": random.randint(0, 2),
+                            },
+                        }
+                    )
+                if stopping:
+                    return
+
+        events_thread = threading.Thread(target=run, args=(send_events,))
+        events_thread.start()
+        threads = [
+            threading.Thread(target=run, args=(add_playlists, index))
+            for index in range(4)
+        ]
+        threads += [threading.Thread(target=run, args=(trigger_alarms,)) for _ in range(2)]
+        threads += [threading.Thread(target=run, args=(play_playlists,)) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        running.clear()
+        events_thread.join()
+
+        self.assertListEqual(errors, [])
+        playlists = config.config["playlists"]
+        for index in range(4):
+            for count in range(20):
+                self.assertIn(f"playlist-{index}-{count}", playlists)
+        self.assertGreaterEqual(self.module.playlists_version, 80)
+        alarms = [
+            playback for playback in self.module.playbacks.get_all() if playback["alarm"]
+        ]
+        self.assertLessEqual(len(alarms), 1)
+        for playback in self.module.playbacks.get_all():
+            self.assertIn(playback["playeruuid"], audioplayer.players)
+
+    def test_delete_playlist_invalid_parameters(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.delete_playlist("playlist4")
+        self.assertEqual(str(cm.exception), 'Playlist "playlist4" does not exist')
+
+    def test_set_default_playlist(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+
+        self.module.set_default_playlist("playlist2")
+
+        self.module._set_config_field.assert_called_with("default", "playlist2")
+
+    def test_set_default_playlist_invalid_parameters(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.set_default_playlist("playlist4")
+        self.assertEqual(str(cm.exception), 'Playlist "playlist4" does not exist')
+
+    def test_set_default_playlist_sync_alarm_cache(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._set_config_field = Mock()
+        self.module._sync_alarm_cache = Mock()
+
+        self.module.set_default_playlist("playlist2")
+
+        self.module._sync_alarm_cache.assert_called()
+
+    def _write_playlist_file(self, filename, content):
+        path = os.path.join(self.tmp_path, filename)
+        with open(path, "w", encoding="utf-8") as fdesc:
+            fdesc.write(content)
+        return path
+
+    def test_import_playlist(self):
+        self.init()
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path, ignore_errors=True)
+        self.module.APP_STORAGE_PATH = "/opt/module/localmusic"
+        self.module.library.update(deepcopy(FILES))
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._save_playlists = Mock()
+        filepath = self._write_playlist_file(
+            "imported.m3u",
+            "#EXTM3U\n#EXTINF:10,Title\nC:\\Music\\file3.mp3\n"
+            "unknown.mp3\nfile1.mp3\n",
+        )
+
+        result = self.module.import_playlist(filepath)
+
+        self.assertDictEqual(
+            result,
+            {
+                "playlistname": "imported",
+                "tracks": 2,
+                "unresolved": 1,
+                "unresolvedsamples": [{"line": 4, "entry": "unknown.mp3"}],
+            },
+        )
+        playlists = self.module._save_playlists.call_args.args[0]
+        self.assertListEqual(playlists["imported"], ["file3.mp3", "file1.mp3"])
+
+    def test_import_playlist_with_name(self):
+        self.init()
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path, ignore_errors=True)
+        self.module.library.update(deepcopy(FILES))
+        self.module._get_config_field = Mock(return_value={})
+        self.module._save_playlists = Mock()
+        self.module.set_default_playlist = Mock()
+        filepath = self._write_playlist_file(
+            "imported.pls", "[playlist]\nFile1=file2.mp3\n"
+        )
+
+        result = self.module.import_playlist(filepath, "myplaylist")
+
+        self.assertEqual(result["playlistname"], "myplaylist")
+        self.module._save_playlists.assert_called_with({"myplaylist": ["file2.mp3"]})
+        self.module.set_default_playlist.assert_called_with("myplaylist")
+
+    def test_import_playlist_no_track_found(self):
+        self.init()
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path, ignore_errors=True)
+        self.module.library.update(deepcopy(FILES))
+        self.module._save_playlists = Mock()
+        filepath = self._write_playlist_file("imported.m3u8", "unknown.mp3\n")
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.import_playlist(filepath)
+        self.assertEqual(
+            str(cm.exception), 'No track of playlist "imported" found in library'
+        )
+        self.module._save_playlists.assert_not_called()
+
+    def test_import_playlist_already_exists(self):
+        self.init()
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path, ignore_errors=True)
+        self.module.library.update(deepcopy(FILES))
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        filepath = self._write_playlist_file("playlist1.m3u", "file1.mp3\n")
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.import_playlist(filepath)
+        self.assertEqual(str(cm.exception), 'Playlist "playlist1" already exists')
+
+    def test_import_playlist_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.import_playlist("/tmp/playlist.xspf")
+        self.assertEqual(
+            str(cm.exception), "Invalid playlist format (only m3u,m3u8,pls allowed)"
+        )
+
+    def test_export_playlist(self):
+        self.init()
+        self.tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_path, ignore_errors=True)
+        self.module.APP_STORAGE_PATH = "/opt/module/localmusic"
+        self.module._get_cache_path = Mock(return_value=self.tmp_path)
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._get_playlist_tracks = Mock(
+            return_value=[
+                "/opt/module/localmusic/file1.mp3",
+                "/opt/module/localmusic/artist/file2.mp3",
+            ]
+        )
+
+        result = self.module.export_playlist("playlist1")
+
+        self.assertDictEqual(
+            result,
+            {
+                "filepath": os.path.join(self.tmp_path, "playlist1.m3u8"),
+                "filename": "playlist1.m3u8",
+            },
+        )
+        with open(result["filepath"], encoding="utf-8") as fdesc:
+            self.assertEqual(
+                fdesc.read(),
+                "#EXTM3U\n#EXTINF:-1,file1\nfile1.mp3\n"
+                "#EXTINF:-1,file2\nartist/file2.mp3\n",
+            )
+
+    def test_export_playlist_unknown_playlist(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.export_playlist("playlist3")
+        self.assertEqual(str(cm.exception), 'Playlist "playlist3" does not exist')
+
+    def test_export_playlist_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.export_playlist("playlist1", "xspf")
+        self.assertEqual(
+            str(cm.exception), "Playlist format must be one of m3u,m3u8,pls"
+        )
+
+    def test_set_alarm_cache_enable(self):
+        self.init()
+        self.module._update_config = Mock()
+        self.module._sync_alarm_cache = Mock()
+        self.module.alarm_cache = Mock()
+
+        self.module.set_alarm_cache(True, 1000)
+
+        self.module._update_config.assert_called_with(
+            {"alarmcache": True, "alarmcachesize": 1000}
+        )
+        self.assertTrue(self.module.alarm_cache.enabled)
+        self.assertEqual(self.module.alarm_cache.max_size, 1000)
+        self.module._sync_alarm_cache.assert_called()
+        self.module.alarm_cache.clear.assert_not_called()
+
+    def test_set_alarm_cache_disable(self):
+        self.init()
+        self.module._update_config = Mock()
+        self.module._sync_alarm_cache = Mock()
+        self.module.alarm_cache = Mock()
+
+        self.module.set_alarm_cache(False, 1000)
+
+        self.module._update_config.assert_called_with(
+            {"alarmcache": False, "alarmcachesize": 1000, "trimsilence": False}
+        )
+        self.module._sync_alarm_cache.assert_not_called()
+        self.module.alarm_cache.clear.assert_called()
+
+    def test_set_alarm_cache_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.set_alarm_cache(True, 0)
+        self.assertEqual(str(cm.exception), "Cache size must be greater than 0")
+
+    @patch("backend.localmusic.threading.Thread")
+    def test__sync_alarm_cache(self, thread_mock):
+        self.init()
+        self.module.alarm_cache.enabled = True
+        self.module._get_default_playlist_tracks = Mock(return_value=["/file1.mp3"])
+
+        self.module._sync_alarm_cache()
+
+        thread_mock.assert_called_with(
+            target=self.module.alarm_cache.sync,
+            args=(["/file1.mp3"], {}),
+            name="localmusic-alarmcache",
+            daemon=True,
+        )
+        thread_mock.return_value.start.assert_called()
+
+    @patch("backend.localmusic.threading.Thread")
+    def test__sync_alarm_cache_with_silence_trimming(self, thread_mock):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.alarm_cache.enabled = True
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=["/music/file1.mp3", "/music/file2.mp3"]
+        )
+        self.module.library.update(
+            [
+                {"filename": "file1.mp3", "path": "/music/file1.mp3"},
+                {"filename": "file2.mp3", "path": "/music/file2.mp3"},
+            ]
+        )
+        self.module.library.set_metadata("file1.mp3", {"soundstart": 3.2})
+
+        self.module._sync_alarm_cache()
+
+        self.assertEqual(
+            thread_mock.call_args.kwargs["args"][1],
+            {"/music/file1.mp3": 3.2, "/music/file2.mp3": None},
+        )
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available")
+    def test_set_silence_trimming(self, is_available_mock):
+        self.init()
+        is_available_mock.return_value = True
+        self.module._set_config_field = Mock()
+        self.module._analyze_tracks = Mock()
+        self.module._sync_alarm_cache = Mock()
+        self.module.alarm_cache.enabled = True
+
+        self.module.set_silence_trimming(True)
+
+        self.module._set_config_field.assert_called_with("trimsilence", True)
+        self.module._analyze_tracks.assert_called()
+        self.module._sync_alarm_cache.assert_called()
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available")
+    def test_set_silence_trimming_not_available(self, is_available_mock):
+        self.init()
+        is_available_mock.return_value = False
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.set_silence_trimming(True)
+        self.assertEqual(str(cm.exception), "Silence analysis requires numpy and ffmpeg")
+
+    @patch("backend.localmusic.AudioAnalyzer.is_available", Mock(return_value=True))
+    def test_set_silence_trimming_alarm_cache_disabled(self):
+        self.init()
+        self.module._set_config_field = Mock()
+        self.module.alarm_cache.enabled = False
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.set_silence_trimming(True)
+        self.assertEqual(
+            str(cm.exception), "Silence trimming requires alarm cache to be enabled"
+        )
+        self.module._set_config_field.assert_not_called()
+
+    @patch("backend.localmusic.threading.Thread")
+    def test__sync_alarm_cache_disabled(self, thread_mock):
+        self.init()
+        self.module.alarm_cache.enabled = False
 
-    def test_delete_playlist(self):
+        self.module._sync_alarm_cache()
+
+        thread_mock.assert_not_called()
+
+    def test_play_playlist(self):
         self.init()
-        self.module.files = deepcopy(FILES)
         self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
-        self.module._set_config_field = Mock()
+        self.module._destroy_audio_player = Mock()
+        self.module._create_audio_player = Mock()
+        self.module._change_audio_player_status = Mock()
+        playback = make_playback("uuid2", "playlist2")
+        self.module._create_audio_player.return_value = playback
 
-        self.module.delete_playlist("playlist2")
+        player_uuid = self.module.play_playlist("playlist2")
 
-        playlists = deepcopy(PLAYLISTS)
-        del playlists["playlist2"]
-        self.module._set_config_field.assert_called_with("playlists", playlists)
+        self.assertEqual(player_uuid, "uuid2")
+        self.module._destroy_audio_player.assert_not_called()
+        self.module._create_audio_player.assert_called_with(
+            "playlist2", replaced_uuid=None
+        )
+        self.module._change_audio_player_status.assert_called_with(
+            playback, pause=False, volume=70
+        )
 
-    def test_delete_playlist_invalid_parameters(self):
+    def test_play_playlist_replace_player(self):
         self.init()
-        self.module.files = deepcopy(FILES)
         self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._destroy_audio_player = Mock()
+        self.module._create_audio_player = Mock(return_value=make_playback("uuid2"))
+        self.module._change_audio_player_status = Mock()
+        self.module.playbacks.add(make_playback("uuid1"))
 
-        with self.assertRaises(InvalidParameter) as cm:
-            self.module.delete_playlist("playlist4")
-        self.assertEqual(str(cm.exception), 'Playlist "playlist4" does not exist')
+        player_uuid = self.module.play_playlist("playlist2", "uuid1")
 
-    def test_set_default_playlist(self):
+        self.assertEqual(player_uuid, "uuid2")
+        self.module._create_audio_player.assert_called_with(
+            "playlist2", replaced_uuid="uuid1"
+        )
+
+    def test_play_playlist_alarm_player(self):
         self.init()
-        self.module.files = deepcopy(FILES)
         self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
-        self.module._set_config_field = Mock()
+        self.module._create_audio_player = Mock()
+        self.module.playbacks.add(make_playback("uuid1", alarm=True))
 
-        self.module.set_default_playlist("playlist2")
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.play_playlist("playlist2", "uuid1")
+        self.assertEqual(str(cm.exception), "Alarm player cannot be used")
 
-        self.module._set_config_field.assert_called_with("default", "playlist2")
+        self.module._create_audio_player.assert_not_called()
 
-    def test_set_default_playlist_invalid_parameters(self):
+    def test_play_playlist_stopped_player(self):
         self.init()
-        self.module.files = deepcopy(FILES)
         self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module._destroy_audio_player = Mock()
+        self.module._create_audio_player = Mock(return_value=make_playback("uuid2"))
+        self.module._change_audio_player_status = Mock()
 
-        with self.assertRaises(InvalidParameter) as cm:
-            self.module.set_default_playlist("playlist4")
-        self.assertEqual(str(cm.exception), 'Playlist "playlist4" does not exist')
+        player_uuid = self.module.play_playlist("playlist2", "uuid1")
 
-    def test_play_playlist(self):
+        self.assertEqual(player_uuid, "uuid2")
+        self.module._create_audio_player.assert_called_with(
+            "playlist2", replaced_uuid=None
+        )
+
+    def test_resume_playback(self):
         self.init()
         self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
         self.module._destroy_audio_player = Mock()
         self.module._create_audio_player = Mock()
         self.module._change_audio_player_status = Mock()
+        playback = make_playback("uuid2")
+        self.module._create_audio_player.return_value = playback
+        previous_playback = make_playback("uuid1")
+        previous_playback["volume"] = 40
+        self.module.playbacks.add(previous_playback)
+        self.module.playback_position = {
+            "playlistname": "playlist1",
+            "index": 2,
+            "offset": 12.0,
+        }
+
+        player_uuid = self.module.resume_playback("uuid1")
+
+        self.assertEqual(player_uuid, "uuid2")
+        self.module._create_audio_player.assert_called_with(
+            "playlist1", start_index=2, replaced_uuid="uuid1"
+        )
+        self.module._change_audio_player_status.assert_called_with(
+            playback, pause=False, volume=40
+        )
+
+    def test_resume_playback_no_position(self):
+        self.init()
+
+        with self.assertRaises(CommandError) as cm:
+            self.module.resume_playback()
+        self.assertEqual(str(cm.exception), "No playback to resume")
 
-        self.module.play_playlist("playlist2")
+    def test_resume_playback_playlist_deleted(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+        self.module.playback_position = {
+            "playlistname": "playlist3",
+            "index": 2,
+            "offset": 12.0,
+        }
 
-        self.module._destroy_audio_player.assert_called()
-        self.module._create_audio_player.assert_called_with("playlist2")
-        self.module._change_audio_player_status("playlist2", pause=False)
+        with self.assertRaises(CommandError) as cm:
+            self.module.resume_playback()
+        self.assertEqual(str(cm.exception), 'Playlist "playlist3" does not exist anymore')
 
     def test_play_playlist_unknown_playlist(self):
         self.init()
@@ -539,83 +3230,379 @@ class TestLocalmusic(unittest.TestCase):
         file2 = "/opt/cleep/modules/localmusic/file2.mp3"
         self.module._get_default_playlist_tracks = Mock(return_value=[file1, file2])
 
-        self.module._create_audio_player()
+        self.module._create_audio_player()
+
+        self.session.assert_command_called_with(
+            "start_playback",
+            {
+                "resource": file1,
+                "audio_format": None,
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
+            "audioplayer",
+        )
+        self.session.assert_command_called_with(
+            "add_tracks",
+            {
+                "player_uuid": "uuid",
+                "tracks": [{"audio_format": None, "resource": file2}],
+            },
+            "audioplayer",
+        )
+
+    def test__create_audio_player_alarm_uses_cache(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        self.session.add_mock_command(start_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        file1 = "/opt/cleep/modules/localmusic/file1.mp3"
+        file2 = "/opt/cleep/modules/localmusic/file2.mp3"
+        self.module._get_default_playlist_tracks = Mock(return_value=[file1, file2])
+        self.module.alarm_cache = Mock()
+        self.module.alarm_cache.get_path.side_effect = lambda path: (
+            "/dev/shm/localmusic/cached.mp3" if path == file1 else path
+        )
+
+        self.module._create_audio_player()
+
+        self.session.assert_command_called_with(
+            "start_playback",
+            {
+                "resource": "/dev/shm/localmusic/cached.mp3",
+                "audio_format": None,
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
+            "audioplayer",
+        )
+
+    def test__create_audio_player_sends_audio_format(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        self.session.add_mock_command(start_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        file1 = "/opt/cleep/modules/localmusic/file1.flac"
+        file2 = "/opt/cleep/modules/localmusic/file2.mp3"
+        self.module.library.update(
+            [
+                {"filename": "file1.flac", "path": file1},
+                {"filename": "file2.mp3", "path": file2},
+            ]
+        )
+        self.module.library.set_metadata("file1.flac", {"audioformat": "audio/flac"})
+        self.module.library.set_metadata("file2.mp3", {"audioformat": "audio/mpeg"})
+        self.module._get_playlist_tracks = Mock(return_value=[file1, file2])
+
+        self.module._create_audio_player("playlist1")
+
+        self.session.assert_command_called_with(
+            "start_playback",
+            {
+                "resource": file1,
+                "audio_format": "audio/flac",
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
+            "audioplayer",
+        )
+        self.session.assert_command_called_with(
+            "add_tracks",
+            {
+                "player_uuid": "uuid",
+                "tracks": [{"resource": file2, "audio_format": "audio/mpeg"}],
+            },
+            "audioplayer",
+        )
+
+    def test__create_audio_player_custom_params(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        self.session.add_mock_command(start_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        file1 = "/opt/cleep/modules/localmusic/file1.mp3"
+        file2 = "/opt/cleep/modules/localmusic/file2.mp3"
+        self.module._get_playlist_tracks = Mock(return_value=[file1, file2])
+
+        self.module._create_audio_player(playlist_name="default", repeat=True)
+
+        self.session.assert_command_called_with(
+            "start_playback",
+            {
+                "resource": file1,
+                "audio_format": None,
+                "paused": True,
+                "repeat": True,
+                "shuffle": False,
+            },
+            "audioplayer",
+        )
+        self.session.assert_command_called_with(
+            "add_tracks",
+            {
+                "player_uuid": "uuid",
+                "tracks": [{"audio_format": None, "resource": file2}],
+            },
+            "audioplayer",
+        )
+
+    def test__create_audio_player_reseeds_smart_playlist(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        self.session.add_mock_command(start_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        file1 = "/opt/cleep/modules/localmusic/file1.mp3"
+        self.module._get_playlist_tracks = Mock(return_value=[file1])
+        smart_playlist = Mock()
+        self.module.smart_playlists = {"smart": smart_playlist}
+
+        self.module._create_audio_player(playlist_name="smart")
+
+        smart_playlist.reseed.assert_called_once_with()
+
+    def test__create_audio_player_shuffle(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        self.session.add_mock_command(start_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+        file1 = "/music/file1.mp3"
+        file2 = "/music/file2.mp3"
+        self.module.shuffler.deal.return_value = [file2, file1]
+        playlist_tracks = [file1, file2, "/music/file3.mp3"]
+        self.module._get_playlist_tracks = Mock(return_value=playlist_tracks)
+
+        playback = self.module._create_audio_player(
+            playlist_name="default", repeat=True, shuffle=True, start_index=2
+        )
+
+        self.module.shuffler.deal.assert_called_with("default", playlist_tracks, 4)
+        self.assertTrue(playback["shuffle"])
+        self.assertTrue(playback["repeat"])
+        self.assertEqual(playback["startindex"], 0)
+        # repeat and shuffle are handled by localmusic feeding player
+        self.session.assert_command_called_with(
+            "start_playback",
+            {
+                "resource": file2,
+                "audio_format": None,
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
+            "audioplayer",
+        )
+        self.session.assert_command_called_with(
+            "add_tracks",
+            {
+                "player_uuid": "uuid",
+                "tracks": [{"audio_format": None, "resource": file1}],
+            },
+            "audioplayer",
+        )
+        self.module._schedule_shuffle_save.assert_called()
+
+    def test__create_audio_player_shuffle_not_repeated(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.audioplayer = Mock()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+        self.module.shuffler.deal.return_value = [
+            "/music/file2.mp3",
+            "/music/file1.mp3",
+        ]
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=["/music/file1.mp3", "/music/file2.mp3"]
+        )
+        config = {"default": "playlist1", "prefetchtracks": 0}
+        self.module._get_config_field = Mock(side_effect=lambda field: config[field])
+
+        playback = self.module._create_audio_player(shuffle=True)
+
+        self.module.shuffler.deal.assert_called_with(
+            "playlist1", ["/music/file1.mp3", "/music/file2.mp3"], 2
+        )
+        self.assertTrue(playback["alarm"])
+        self.assertEqual(playback["playlistname"], "playlist1")
+
+    def test__create_audio_player_with_existing_audioplayer(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        self.session.add_mock_command(start_playback_cmd)
+        stop_playback_cmd = self.session.make_mock_command("stop_playback", "uuid")
+        self.session.add_mock_command(stop_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        file1 = "/opt/cleep/modules/localmusic/file1.mp3"
+        file2 = "/opt/cleep/modules/localmusic/file2.mp3"
+        self.module._get_default_playlist_tracks = Mock(return_value=[file1, file2])
+        self.module.playbacks.add(make_playback("olduuid", alarm=True))
+
+        playback = self.module._create_audio_player()
+
+        self.assertTrue(playback["alarm"])
+        self.assertIs(self.module.playbacks.get_alarm(), playback)
+
+        self.session.assert_command_called_with(
+            "start_playback",
+            {
+                "resource": file1,
+                "audio_format": None,
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
+            "audioplayer",
+        )
+        self.session.assert_command_called_with(
+            "add_tracks",
+            {
+                "player_uuid": "uuid",
+                "tracks": [{"audio_format": None, "resource": file2}],
+            },
+            "audioplayer",
+        )
+        self.session.assert_command_called_with(
+            "stop_playback", {"player_uuid": "olduuid"}
+        )
+
+    def test__create_audio_player_replace_player(self):
+        self.init()
+        self.module.has_audioplayer = True
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid2")
+        self.session.add_mock_command(start_playback_cmd)
+        stop_playback_cmd = self.session.make_mock_command("stop_playback")
+        self.session.add_mock_command(stop_playback_cmd)
+        add_tracks_cmd = self.session.make_mock_command("add_tracks")
+        self.session.add_mock_command(add_tracks_cmd)
+        self.module._get_playlist_tracks = Mock(return_value=["/file1.mp3"])
+        self.module.playbacks.add(make_playback("uuid1"))
+
+        playback = self.module._create_audio_player("playlist1", replaced_uuid="uuid1")
+
+        self.assertEqual(playback["playeruuid"], "uuid2")
+        self.session.assert_command_called_with(
+            "stop_playback", {"player_uuid": "uuid1"}
+        )
+
+    def test__create_audio_player_stops_replaced_player_on_failure(self):
+        self.init()
+        self.module.has_audioplayer = True
+        stop_playback_cmd = self.session.make_mock_command("stop_playback")
+        self.session.add_mock_command(stop_playback_cmd)
+        self.module._get_playlist_tracks = Mock(side_effect=Exception("Test exception"))
+
+        with self.assertRaises(Exception):
+            self.module._create_audio_player("playlist1", replaced_uuid="uuid1")
+
+        self.session.assert_command_called_with(
+            "stop_playback", {"player_uuid": "uuid1"}
+        )
+
+    def test__create_audio_player_audioplayer_unavailable(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.audioplayer.call = Mock(return_value=None)
+        self.module._get_playlist_tracks = Mock(return_value=["/file1.mp3"])
+
+        playback = self.module._create_audio_player("playlist1")
+
+        self.assertIsNone(playback)
+        self.assertEqual(len(self.module.playbacks), 0)
+
+    def test__create_audio_player_alarm_bypasses_circuit_breaker(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.audioplayer.call = Mock(return_value="uuid")
+        file1 = "/opt/cleep/modules/localmusic/file1.mp3"
+        self.module._get_default_playlist_tracks = Mock(return_value=[file1, file1])
+
+        self.module._create_audio_player()
+
+        for call in self.module.audioplayer.call.call_args_list:
+            self.assertTrue(call.kwargs["bypass_breaker"])
+
+    def test__create_audio_player_playlist_uses_circuit_breaker(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.audioplayer.call = Mock(return_value="uuid")
+        self.module._get_playlist_tracks = Mock(return_value=["/file1.mp3"])
+
+        self.module._create_audio_player("playlist1")
 
-        self.session.assert_command_called_with(
-            "start_playback",
-            {"resource": file1, "paused": True, "repeat": False, "shuffle": False},
-            "audioplayer",
-        )
-        self.session.assert_command_called_with(
-            "add_tracks",
-            {
-                "player_uuid": "uuid",
-                "tracks": [{"audio_format": None, "resource": file2}],
-            },
-            "audioplayer",
-        )
+        for call in self.module.audioplayer.call.call_args_list:
+            self.assertFalse(call.kwargs["bypass_breaker"])
 
-    def test__create_audio_player_custom_params(self):
+    def test__create_audio_player_keeps_running_players(self):
         self.init()
         self.module.has_audioplayer = True
-        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
+        start_playback_cmd = self.session.make_mock_command("start_playback", "uuid2")
         self.session.add_mock_command(start_playback_cmd)
+        stop_playback_cmd = self.session.make_mock_command("stop_playback")
+        self.session.add_mock_command(stop_playback_cmd)
         add_tracks_cmd = self.session.make_mock_command("add_tracks")
         self.session.add_mock_command(add_tracks_cmd)
-        file1 = "/opt/cleep/modules/localmusic/file1.mp3"
-        file2 = "/opt/cleep/modules/localmusic/file2.mp3"
-        self.module._get_playlist_tracks = Mock(return_value=[file1, file2])
+        self.module._get_playlist_tracks = Mock(return_value=["/file1.mp3"])
+        self.module.playbacks.add(make_playback("uuid1"))
 
-        self.module._create_audio_player(
-            playlist_name="default", repeat=True, shuffle=True
-        )
+        playback = self.module._create_audio_player("playlist1")
 
-        self.session.assert_command_called_with(
-            "start_playback",
-            {"resource": file1, "paused": True, "repeat": True, "shuffle": True},
-            "audioplayer",
-        )
-        self.session.assert_command_called_with(
-            "add_tracks",
-            {
-                "player_uuid": "uuid",
-                "tracks": [{"audio_format": None, "resource": file2}],
-            },
-            "audioplayer",
-        )
+        self.assertEqual(playback["playeruuid"], "uuid2")
+        self.assertFalse(playback["alarm"])
+        self.assertEqual(len(self.module.playbacks), 2)
+        self.session.assert_command_not_called("stop_playback")
 
-    def test__create_audio_player_with_existing_audioplayer(self):
+    def test__create_audio_player_with_start_index(self):
         self.init()
         self.module.has_audioplayer = True
         start_playback_cmd = self.session.make_mock_command("start_playback", "uuid")
         self.session.add_mock_command(start_playback_cmd)
-        stop_playback_cmd = self.session.make_mock_command("stop_playback", "uuid")
-        self.session.add_mock_command(stop_playback_cmd)
         add_tracks_cmd = self.session.make_mock_command("add_tracks")
         self.session.add_mock_command(add_tracks_cmd)
         file1 = "/opt/cleep/modules/localmusic/file1.mp3"
         file2 = "/opt/cleep/modules/localmusic/file2.mp3"
-        self.module._get_default_playlist_tracks = Mock(return_value=[file1, file2])
-        self.module.playback = {"playeruuid": "uuid"}
+        file3 = "/opt/cleep/modules/localmusic/file3.mp3"
+        self.module._get_playlist_tracks = Mock(return_value=[file1, file2, file3])
 
-        self.module._create_audio_player()
+        playback = self.module._create_audio_player("playlist1", start_index=1)
 
         self.session.assert_command_called_with(
             "start_playback",
-            {"resource": file1, "paused": True, "repeat": False, "shuffle": False},
+            {
+                "resource": file2,
+                "audio_format": None,
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
             "audioplayer",
         )
         self.session.assert_command_called_with(
             "add_tracks",
             {
                 "player_uuid": "uuid",
-                "tracks": [{"audio_format": None, "resource": file2}],
+                "tracks": [{"audio_format": None, "resource": file3}],
             },
             "audioplayer",
         )
-        self.session.assert_command_called_with(
-            "stop_playback", {"player_uuid": "uuid"}
-        )
+        self.assertEqual(playback["startindex"], 1)
+        self.assertListEqual(playback["tracks"], [file2, file3])
 
     def test__create_audio_player_failed_to_create_player(self):
         self.init()
@@ -628,8 +3615,10 @@ class TestLocalmusic(unittest.TestCase):
         file2 = "/opt/cleep/modules/localmusic/file2.mp3"
         self.module._get_default_playlist_tracks = Mock(return_value=[file1, file2])
 
-        self.module._create_audio_player()
+        playback = self.module._create_audio_player()
 
+        self.assertIsNone(playback)
+        self.assertEqual(len(self.module.playbacks), 0)
         self.assertEqual(self.session.command_call_count("add_tracks"), 0)
 
     def test__create_audio_player_no_audioplayer_app(self):
@@ -656,7 +3645,13 @@ class TestLocalmusic(unittest.TestCase):
 
         self.session.assert_command_called_with(
             "start_playback",
-            {"resource": file1, "paused": True, "repeat": False, "shuffle": False},
+            {
+                "resource": file1,
+                "audio_format": None,
+                "paused": True,
+                "repeat": False,
+                "shuffle": False,
+            },
             "audioplayer",
         )
         self.assertEqual(self.session.command_call_count("add_tracks"), 1)
@@ -678,32 +3673,129 @@ class TestLocalmusic(unittest.TestCase):
         self.init()
         stop_playback_cmd = self.session.make_mock_command("stop_playback")
         self.session.add_mock_command(stop_playback_cmd)
-        self.module.playback = {
-            "playeruuid": "uuid",
-            "index": 0,
-            "playlistname": "playlist1",
-        }
 
-        self.module._destroy_audio_player()
+        self.module._destroy_audio_player("uuid")
+
+        self.session.assert_command_called_with(
+            "stop_playback", {"player_uuid": "uuid"}
+        )
+
+    def test__destroy_audio_player_no_wait(self):
+        self.init()
+        stop_playback_cmd = self.session.make_mock_command("stop_playback")
+        self.session.add_mock_command(stop_playback_cmd)
+
+        future = self.module._destroy_audio_player("uuid", wait=False)
+        self.module.audioplayer.wait([future])
 
         self.session.assert_command_called_with(
             "stop_playback", {"player_uuid": "uuid"}
         )
 
+    def test__send_audioplayer_command(self):
+        self.init()
+        self.module.send_command_advanced = Mock(return_value="uuid")
+
+        result = self.module._send_audioplayer_command(
+            "start_playback", {"resource": "/file1.mp3"}, 5.0
+        )
+
+        self.assertEqual(result, "uuid")
+        self.module.send_command_advanced.assert_called_with(
+            "start_playback", "audioplayer", {"resource": "/file1.mp3"}, timeout=5.0
+        )
+
+    def test__send_audioplayer_command_timeout(self):
+        self.init()
+
+        def send_command_advanced(*args, **kwargs):
+            time.sleep(0.06)
+            raise Exception("No response")
+
+        self.module.send_command_advanced = send_command_advanced
+
+        with self.assertRaises(TimeoutError):
+            self.module._send_audioplayer_command("start_playback", {}, 0.05)
+
+    def test__send_audioplayer_command_error(self):
+        self.init()
+        self.module.send_command_advanced = Mock(side_effect=Exception("Invalid track"))
+
+        with self.assertRaises(Exception) as cm:
+            self.module._send_audioplayer_command("start_playback", {}, 5.0)
+        self.assertNotIsInstance(cm.exception, TimeoutError)
+        self.assertEqual(str(cm.exception), "Invalid track")
+
     def test__destroy_audio_player_no_player_uuid(self):
         self.init()
         stop_playback_cmd = self.session.make_mock_command("stop_playback")
         self.session.add_mock_command(stop_playback_cmd)
-        self.module.playback = {
-            "playeruuid": None,
-            "index": 0,
-            "playlistname": "playlist1",
-        }
 
-        self.module._destroy_audio_player()
+        self.module._destroy_audio_player(None)
 
         self.session.assert_command_not_called("stop_playback")
 
+    def test__prefetch_tracks(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        self.module._get_config_field = Mock(return_value=1)
+        playback = make_playback(tracks=["/file1.mp3", "/file2.mp3", "/file3.mp3"])
+
+        self.module._prefetch_tracks(playback, 1)
+
+        self.module.prefetcher.prefetch.assert_called_with(["/file2.mp3"])
+
+    def test__prefetch_tracks_disabled(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        self.module._get_config_field = Mock(return_value=0)
+        playback = make_playback(tracks=["/file1.mp3", "/file2.mp3", "/file3.mp3"])
+
+        self.module._prefetch_tracks(playback, 1)
+
+        self.module.prefetcher.prefetch.assert_not_called()
+
+    def test__prefetch_tracks_end_of_playlist(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        self.module._get_config_field = Mock(return_value=2)
+        playback = make_playback(tracks=["/file1.mp3"])
+
+        self.module._prefetch_tracks(playback, 1)
+
+        self.module.prefetcher.prefetch.assert_not_called()
+
+    def test_set_prefetch(self):
+        self.init()
+        self.module._update_config = Mock()
+
+        self.module.set_prefetch(3, 1000)
+
+        self.module._update_config.assert_called_with(
+            {"prefetchtracks": 3, "prefetchbudget": 1000}
+        )
+        self.assertEqual(self.module.prefetcher.budget, 1000)
+
+    def test_set_prefetch_invalid_parameters(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.set_prefetch(-1, 1000)
+        self.assertEqual(str(cm.exception), "Number of tracks must be positive")
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.set_prefetch(2, 0)
+        self.assertEqual(str(cm.exception), "Budget must be greater than 0")
+
+    def test_get_prefetch_stats(self):
+        self.init()
+        self.module.prefetcher = Mock()
+        self.module.prefetcher.get_stats.return_value = {"prefetchedtracks": 1}
+
+        stats = self.module.get_prefetch_stats()
+
+        self.assertDictEqual(stats, {"prefetchedtracks": 1})
+
     def test__get_default_playlist_tracks(self):
         self.init()
         self.module.files = deepcopy(FILES)
@@ -735,6 +3827,26 @@ class TestLocalmusic(unittest.TestCase):
 
         self.assertEqual(tracks, ["/opt/module/localmusic/file2.mp3"])
 
+    def test__get_playlist_tracks_excludes_corrupt_tracks(self):
+        self.init()
+        self.module.files = deepcopy(FILES)
+        self.module.library.update(deepcopy(FILES))
+        self.module.library.set_metadata("file2.mp3", {"valid": False})
+        self.module.library.set_metadata("file3.mp3", {"valid": True})
+        self.module._get_config_field = Mock(side_effect=[deepcopy(PLAYLISTS)])
+        smart_playlist = Mock()
+        smart_playlist.materialize.return_value = [FILES[1]["path"], FILES[0]["path"]]
+        self.module.smart_playlists = {"smart": smart_playlist}
+
+        self.assertEqual(
+            self.module._get_playlist_tracks("playlist1"),
+            ["/opt/module/localmusic/file1.mp3", "/opt/module/localmusic/file3.mp3"],
+        )
+        self.assertEqual(
+            self.module._get_playlist_tracks("smart"),
+            ["/opt/module/localmusic/file1.mp3"],
+        )
+
     def test__get_playlist_tracks_playlist_not_found(self):
         self.init()
         self.module.files = deepcopy(FILES)
@@ -745,54 +3857,316 @@ class TestLocalmusic(unittest.TestCase):
 
         self.assertEqual(tracks, [])
 
+    def test__get_playlist_tracks_smart_playlist(self):
+        self.init()
+        smart_playlist = Mock()
+        smart_playlist.materialize.return_value = ["/opt/module/localmusic/file1.mp3"]
+        self.module.smart_playlists = {"smart": smart_playlist}
+
+        tracks = self.module._get_playlist_tracks("smart")
+
+        self.assertEqual(tracks, ["/opt/module/localmusic/file1.mp3"])
+        smart_playlist.materialize.assert_called_with(
+            self.module._get_track_play_stats
+        )
+
+    def test_add_smart_playlist(self):
+        self.init()
+        self.module._get_config_field = Mock(side_effect=[deepcopy(PLAYLISTS), {}])
+        self.module._set_config_field = Mock()
+        self.module.library.get_entries = Mock(return_value=[])
+        version = self.module.playlists_version
+
+        self.module.add_smart_playlist("smart", {"folder": "rock"})
+
+        self.module._set_config_field.assert_called_with(
+            "smartplaylists", {"smart": {"folder": "rock"}}
+        )
+        self.assertIn("smart", self.module.smart_playlists)
+        self.assertEqual(self.module.playlists_version, version + 1)
+
+    def test_add_smart_playlist_already_exists(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=deepcopy(PLAYLISTS))
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_smart_playlist("playlist1", {"folder": "rock"})
+        self.assertEqual(str(cm.exception), 'Playlist "playlist1" already exists')
+
+    def test_add_smart_playlist_invalid_rules(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value={})
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.add_smart_playlist("smart", {"order": "dummy"})
+        self.assertEqual(
+            str(cm.exception), 'Rule "order" must be one of name, random, leastplayed'
+        )
+
+    def test_update_smart_playlist(self):
+        self.init()
+        self.module.smart_playlists = {"smart": Mock()}
+        self.module._get_config_field = Mock(
+            side_effect=[{"smart": {"folder": "rock"}}, "playlist1"]
+        )
+        self.module._set_config_field = Mock()
+        self.module._sync_alarm_cache = Mock()
+
+        self.module.update_smart_playlist("smart", {"folder": "jazz"})
+
+        self.module._set_config_field.assert_called_with(
+            "smartplaylists", {"smart": {"folder": "jazz"}}
+        )
+        self.assertDictEqual(self.module.smart_playlists["smart"].rules, {"folder": "jazz"})
+        self.module._sync_alarm_cache.assert_not_called()
+
+    def test_update_smart_playlist_not_exists(self):
+        self.init()
+
+        with self.assertRaises(InvalidParameter) as cm:
+            self.module.update_smart_playlist("smart", {"folder": "jazz"})
+        self.assertEqual(str(cm.exception), 'Playlist "smart" does not exist')
+
+    def test_delete_smart_playlist(self):
+        self.init()
+        self.module.smart_playlists = {"smart": Mock()}
+        self.module._get_config_field = Mock(return_value={"smart": {"folder": "rock"}})
+        self.module._set_config_field = Mock()
+        self.module._schedule_shuffle_save = Mock()
+        self.module.shuffler = Mock()
+
+        self.module.delete_smart_playlist("smart")
+
+        self.module._set_config_field.assert_called_with("smartplaylists", {})
+        self.assertDictEqual(self.module.smart_playlists, {})
+        self.module.shuffler.remove.assert_called_with("smart")
+
+    def test_get_smart_playlists(self):
+        self.init()
+        smart_playlist = Mock(rules={"folder": "rock"})
+        smart_playlist.__len__ = Mock(return_value=3)
+        self.module.smart_playlists = {"smart": smart_playlist}
+
+        smart_playlists = self.module.get_smart_playlists()
+
+        self.assertDictEqual(
+            smart_playlists, {"smart": {"rules": {"folder": "rock"}, "count": 3}}
+        )
+
+    def test__update_smart_playlists(self):
+        self.init()
+        smart_playlist = Mock()
+        self.module.smart_playlists = {"smart": smart_playlist}
+        entry = {"filename": "file1.mp3", "path": "/opt/module/localmusic/file1.mp3"}
+        self.module.library.get_entry = Mock(return_value=entry)
+
+        self.module._update_smart_playlists(
+            {"added": [{"filename": "file1.mp3"}], "removed": ["file2.mp3"], "changed": []}
+        )
+
+        smart_playlist.update.assert_called_with([entry], ["file2.mp3"])
+
     def test__start_alarm_with_existing_player(self):
         self.init()
         self.module.has_audioplayer = True
-        self.module.playback["playeruuid"] = "uuid"
+        playback = make_playback(alarm=True)
+        self.module.playbacks.add(playback)
+        self.module.playbacks.add(make_playback("otheruuid"))
         self.module._change_audio_player_status = Mock()
 
         self.module._start_alarm(12, False, False)
 
         self.module._change_audio_player_status.assert_called_with(
-            pause=False, volume=12
+            playback, pause=False, volume=12
         )
 
     def test__start_alarm_should_create_player(self):
         self.init()
         self.module.has_audioplayer = True
-        self.module.playback["playeruuid"] = None
+        self.module.playbacks.add(make_playback("otheruuid"))
         self.module._change_audio_player_status = Mock()
         self.module._create_audio_player = Mock()
+        self.module._check_alarm_playlist = Mock(return_value=None)
 
         self.module._start_alarm(12, False, True)
 
+        self.module._check_alarm_playlist.assert_called_with(warm=False)
         self.module._create_audio_player.assert_called_with(repeat=False, shuffle=True)
 
+    def test__start_alarm_fallback_if_check_failed(self):
+        self.init()
+        self.module._change_audio_player_status = Mock()
+        self.module._create_audio_player = Mock()
+        self.module._check_alarm_playlist = Mock(return_value="Test reason")
+        fallback = make_playback(alarm=True)
+        self.module._create_fallback_player = Mock(return_value=fallback)
+
+        self.module._start_alarm(12, False, True)
+
+        self.module._create_audio_player.assert_not_called()
+        self.module._create_fallback_player.assert_called_with("Test reason")
+        self.module._change_audio_player_status.assert_called_with(
+            fallback, pause=False, volume=12
+        )
+
+    def test__start_alarm_fallback_if_player_creation_failed(self):
+        self.init()
+        self.module._change_audio_player_status = Mock()
+        self.module._create_audio_player = Mock(return_value=None)
+        self.module._check_alarm_playlist = Mock(return_value=None)
+        self.module._create_fallback_player = Mock()
+
+        self.module._start_alarm(12, False, True)
+
+        self.module._create_fallback_player.assert_called_with(
+            "Unable to create alarm player"
+        )
+
+    def test__create_fallback_player(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.alarm_degraded_event = Mock()
+        self.module.audioplayer.call = Mock(return_value="fallbackuuid")
+
+        playback = self.module._create_fallback_player("Test reason")
+
+        self.module.audioplayer.call.assert_called_with(
+            "start_playback",
+            {
+                "resource": Localmusic.FALLBACK_TONE,
+                "audio_format": "audio/flac",
+                "paused": True,
+                "repeat": True,
+                "shuffle": False,
+            },
+            bypass_breaker=True,
+        )
+        self.assertTrue(os.path.exists(Localmusic.FALLBACK_TONE))
+        self.assertIs(self.module.playbacks.get_alarm(), playback)
+        self.assertIsNone(playback["playlistname"])
+        self.module.alarm_degraded_event.send.assert_called_with(
+            params={"reason": "Test reason", "fallback": True}
+        )
+
+    def test__create_fallback_player_failed(self):
+        self.init()
+        self.module.has_audioplayer = True
+        self.module.alarm_degraded_event = Mock()
+        self.module.audioplayer.call = Mock(return_value=None)
+
+        playback = self.module._create_fallback_player("Test reason")
+
+        self.assertIsNone(playback)
+        self.assertIsNone(self.module.playbacks.get_alarm())
+
+    def test__check_alarm_playlist(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value="playlist1")
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=[f["path"] for f in FILES]
+        )
+        self.module._is_track_readable = Mock(return_value=True)
+        self.module.alarm_cache.enabled = False
+        self.module.prefetcher = Mock()
+        self.module.alarm_degraded_event = Mock()
+
+        reason = self.module._check_alarm_playlist()
+
+        self.assertIsNone(reason)
+        self.assertTrue(self.module.get_alarm_health()["healthy"])
+        self.module.prefetcher.prefetch.assert_called_with(
+            [f["path"] for f in FILES]
+        )
+        self.module.alarm_degraded_event.send.assert_not_called()
+
+    def test__check_alarm_playlist_warm_alarm_cache(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value="playlist1")
+        self.module._get_default_playlist_tracks = Mock(return_value=[FILES[0]["path"]])
+        self.module._is_track_readable = Mock(return_value=True)
+        self.module.alarm_cache.enabled = True
+        self.module._sync_alarm_cache = Mock()
+
+        self.module._check_alarm_playlist()
+
+        self.module._sync_alarm_cache.assert_called()
+
+    def test__check_alarm_playlist_empty(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value="playlist1")
+        self.module._get_default_playlist_tracks = Mock(return_value=[])
+        self.module.prefetcher = Mock()
+        self.module.alarm_degraded_event = Mock()
+
+        reason = self.module._check_alarm_playlist()
+        self.module._check_alarm_playlist()
+
+        self.assertEqual(reason, 'Default playlist "playlist1" has no track in library')
+        health = self.module.get_alarm_health()
+        self.assertFalse(health["healthy"])
+        self.assertEqual(health["reason"], reason)
+        self.assertIsNotNone(health["checked"])
+        # event is sent once per degradation
+        self.module.alarm_degraded_event.send.assert_called_once_with(
+            params={"reason": reason, "fallback": False}
+        )
+        self.module.prefetcher.prefetch.assert_not_called()
+
+    def test__check_alarm_playlist_unreadable_tracks(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value="playlist1")
+        self.module._get_default_playlist_tracks = Mock(
+            return_value=[f["path"] for f in FILES]
+        )
+        self.module._is_track_readable = Mock(side_effect=[True, False, True])
+        self.module.alarm_degraded_event = Mock()
+
+        reason = self.module._check_alarm_playlist(warm=False)
+
+        self.assertEqual(reason, "Alarm tracks are not readable: file2.mp3")
+
+    def test__check_alarm_playlist_no_default_playlist(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=None)
+        self.module.alarm_degraded_event = Mock()
+
+        reason = self.module._check_alarm_playlist()
+
+        self.assertIsNone(reason)
+        self.module.alarm_degraded_event.send.assert_not_called()
+
+    def test__is_track_readable(self):
+        self.init()
+
+        self.assertTrue(self.module._is_track_readable(Localmusic.FALLBACK_TONE))
+        self.assertFalse(self.module._is_track_readable("/dummy/file.mp3"))
+
     def test__stop_alarm_snoozed_disabled(self):
         self.init()
-        self.module.playback["playeruuid"] = "uuid"
+        self.module.playbacks.add(make_playback(alarm=True))
         self.module._destroy_audio_player = Mock()
         self.module._change_audio_player_status = Mock()
 
         self.module._stop_alarm(False)
 
-        self.module._destroy_audio_player.assert_called()
+        self.module._destroy_audio_player.assert_called_with("uuid")
         self.module._change_audio_player_status.assert_not_called()
 
     def test__stop_alarm_snoozed_enabled(self):
         self.init()
-        self.module.playback["playeruuid"] = "uuid"
+        playback = make_playback(alarm=True)
+        self.module.playbacks.add(playback)
         self.module._destroy_audio_player = Mock()
         self.module._change_audio_player_status = Mock()
 
         self.module._stop_alarm(True)
 
         self.module._destroy_audio_player.assert_not_called()
-        self.module._change_audio_player_status.assert_called_with(pause=True)
+        self.module._change_audio_player_status.assert_called_with(playback, pause=True)
 
     def test__stop_alarm_no_player(self):
         self.init()
-        self.module.playback["playeruuid"] = None
+        self.module.playbacks.add(make_playback())
         self.module._destroy_audio_player = Mock()
         self.module._change_audio_player_status = Mock()
 
@@ -803,11 +4177,10 @@ class TestLocalmusic(unittest.TestCase):
 
     def test__change_audio_player_status_start_playback(self):
         self.init()
-        self.module.playback["playeruuid"] = "uuid"
         pause_playback_cmd = self.session.make_mock_command("pause_playback")
         self.session.add_mock_command(pause_playback_cmd)
 
-        self.module._change_audio_player_status(pause=False, volume=50)
+        self.module._change_audio_player_status(make_playback(), pause=False, volume=50)
 
         self.session.assert_command_called_with(
             "pause_playback",
@@ -821,11 +4194,10 @@ class TestLocalmusic(unittest.TestCase):
 
     def test__change_audio_player_status_start_playback_without_volume(self):
         self.init()
-        self.module.playback["playeruuid"] = "uuid"
         pause_playback_cmd = self.session.make_mock_command("pause_playback")
         self.session.add_mock_command(pause_playback_cmd)
 
-        self.module._change_audio_player_status(pause=False)
+        self.module._change_audio_player_status(make_playback(), pause=False)
 
         self.session.assert_command_called_with(
             "pause_playback",
@@ -834,11 +4206,10 @@ class TestLocalmusic(unittest.TestCase):
 
     def test__change_audio_player_status_pause_playback(self):
         self.init()
-        self.module.playback["playeruuid"] = "uuid"
         pause_playback_cmd = self.session.make_mock_command("pause_playback")
         self.session.add_mock_command(pause_playback_cmd)
 
-        self.module._change_audio_player_status(pause=True, volume=50)
+        self.module._change_audio_player_status(make_playback(), pause=True, volume=50)
 
         self.session.assert_command_called_with(
             "pause_playback",
@@ -850,13 +4221,88 @@ class TestLocalmusic(unittest.TestCase):
             },
         )
 
+    def test__change_audio_player_status_with_track_gain(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        playback = make_playback(
+            tracks=["/music/file1.mp3", "/music/file2.mp3"], index=1
+        )
+        self.module.library.update(
+            [{"filename": "file2.mp3", "path": "/music/file2.mp3"}]
+        )
+        self.module.library.set_metadata("file2.mp3", {"gain": -6.0})
+        pause_playback_cmd = self.session.make_mock_command("pause_playback")
+        self.session.add_mock_command(pause_playback_cmd)
+
+        self.module._change_audio_player_status(playback, pause=False, volume=80)
+
+        self.session.assert_command_called_with(
+            "pause_playback",
+            {
+                "player_uuid": "uuid",
+                "force_pause": False,
+                "force_play": True,
+                "volume": 40,
+            },
+        )
+        self.assertEqual(playback["volume"], 80)
+
+    def test__get_track_volume(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        playback = make_playback(tracks=["/music/file1.mp3"], index=0)
+        self.module.library.update(
+            [{"filename": "file1.mp3", "path": "/music/file1.mp3"}]
+        )
+
+        self.assertEqual(self.module._get_track_volume(playback, 50), 50)
+
+        self.module.library.set_metadata("file1.mp3", {"gain": 12.0})
+        self.assertEqual(self.module._get_track_volume(playback, 50), 100)
+
+        self.module._get_config_field = Mock(return_value=False)
+        self.assertEqual(self.module._get_track_volume(playback, 50), 50)
+
+    def test__apply_track_gain(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.audioplayer = Mock()
+        self.module.library.update([deepcopy(FILES[0])])
+        self.module.library.set_metadata("file1.mp3", {"gain": -6.0})
+        playback = make_playback(tracks=[FILES[0]["path"]], index=0)
+        playback["volume"] = 60
+
+        self.module._apply_track_gain(playback)
+
+        # command is not waited for
+        self.module.audioplayer.call.assert_not_called()
+        self.module.audioplayer.submit.assert_called_once_with(
+            "pause_playback",
+            {
+                "player_uuid": "uuid",
+                "force_pause": False,
+                "force_play": True,
+                "volume": 30,
+            },
+            bypass_breaker=False,
+        )
+        self.assertEqual(playback["volume"], 60)
+
+    def test__apply_track_gain_no_volume(self):
+        self.init()
+        self.module._get_config_field = Mock(return_value=True)
+        self.module.audioplayer = Mock()
+
+        self.module._apply_track_gain(make_playback())
+
+        self.module.audioplayer.submit.assert_not_called()
+
     def test__change_audio_player_no_player(self):
         self.init()
-        self.module.playback["playeruuid"] = None
         pause_playback_cmd = self.session.make_mock_command("pause_playback")
         self.session.add_mock_command(pause_playback_cmd)
 
-        self.module._change_audio_player_status(pause=True)
+        self.module._change_audio_player_status(None, pause=True)
 
         self.session.assert_command_not_called("pause_playback")
 
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from cleep.libs.tests import session
+import unittest
+import logging
+import sys
+
+sys.path.append("../")
+from backend.localmusicalarmdegradedevent import LocalmusicAlarmDegradedEvent
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+class TestLocalmusicAlarmDegradedEvent(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.session = session.TestSession(self)
+        self.event = self.session.setup_event(LocalmusicAlarmDegradedEvent)
+
+    def tearDown(self):
+        self.session.clean()
+
+    def test_event_params(self):
+        self.assertListEqual(
+            self.event.EVENT_PARAMS,
+            ["reason", "fallback"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import threading
+
+sys.path.append("../")
+from backend.playbackregistry import PlaybackRegistry
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+class TestPlaybackRegistry(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.registry = PlaybackRegistry()
+
+    def test_new_playback(self):
+        playback = PlaybackRegistry.new_playback(
+            "uuid", "playlist1", ["/file1.mp3"], start_index=2
+        )
+
+        self.assertDictEqual(
+            playback,
+            {
+                "playeruuid": "uuid",
+                "playlistname": "playlist1",
+                "alarm": False,
+                "index": None,
+                "tracks": ["/file1.mp3"],
+                "startindex": 2,
+                "shuffle": False,
+                "repeat": False,
+                "volume": None,
+                "playingtrack": None,
+            },
+        )
+
+    def test_get_infos(self):
+        playback = PlaybackRegistry.new_playback(
+            "uuid", "playlist1", ["/file1.mp3"], start_index=2
+        )
+        self.assertIsNone(PlaybackRegistry.get_infos(playback)["index"])
+
+        playback["index"] = 1
+        self.assertDictEqual(
+            PlaybackRegistry.get_infos(playback),
+            {"playeruuid": "uuid", "playlistname": "playlist1", "index": 3, "alarm": False},
+        )
+
+    def test_add_get_remove(self):
+        playback = PlaybackRegistry.new_playback("uuid", "playlist1", [])
+
+        self.registry.add(playback)
+
+        self.assertIn("uuid", self.registry)
+        self.assertEqual(len(self.registry), 1)
+        self.assertIs(self.registry.get("uuid"), playback)
+        self.assertIsNone(self.registry.get("dummy"))
+        self.assertIs(self.registry.remove("uuid"), playback)
+        self.assertIsNone(self.registry.remove("uuid"))
+        self.assertEqual(len(self.registry), 0)
+
+    def test_get_alarm(self):
+        playback = PlaybackRegistry.new_playback("uuid1", "playlist1", [])
+        alarm = PlaybackRegistry.new_playback("uuid2", "default", [], alarm=True)
+        self.registry.add(playback)
+        self.assertIsNone(self.registry.get_alarm())
+
+        self.registry.add(alarm)
+        self.assertIs(self.registry.get_alarm(), alarm)
+
+        self.registry.remove("uuid2")
+        self.assertIsNone(self.registry.get_alarm())
+        self.assertListEqual(self.registry.get_all(), [playback])
+
+    def test_concurrent_access(self):
+        def worker(index):
+            for count in range(200):
+                player_uuid = f"uuid{index}-{count}"
+                self.registry.add(PlaybackRegistry.new_playback(player_uuid, "p", []))
+                self.registry.get_all()
+                self.registry.remove(player_uuid)
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.registry), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
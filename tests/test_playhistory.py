@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import os
+import sys
+import sqlite3
+import tempfile
+
+sys.path.append("../")
+from backend.playhistory import PlayHistory
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+class TestPlayHistory(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "cache", "history.db")
+        self.history = self.make_history()
+
+    def tearDown(self):
+        self.history.close()
+        self.tmpdir.cleanup()
+
+    def make_history(self, buffer_size=3):
+        history = PlayHistory(
+            logging.getLogger("test"),
+            db_path=self.db_path,
+            buffer_size=buffer_size,
+            flush_delay=60.0,
+        )
+        history.open()
+        return history
+
+    def count_records(self):
+        with sqlite3.connect(self.db_path) as connection:
+            return connection.execute("SELECT COUNT(*) FROM plays").fetchone()[0]
+
+    def test_record_is_buffered(self):
+        self.history.record("file1.mp3", "playlist1", 120.0, timestamp=100)
+        self.history.record("file1.mp3", "playlist1", 120.0, timestamp=200)
+
+        self.assertEqual(self.count_records(), 0)
+        self.assertDictEqual(
+            self.history.get_track_stats("file1.mp3"),
+            {"playcount": 2, "skipcount": 0, "lastplayed": 200, "playtime": 240.0},
+        )
+
+    def test_record_flush_when_buffer_is_full(self):
+        for timestamp in range(3):
+            self.history.record("file1.mp3", "playlist1", 120.0, timestamp=timestamp + 1)
+
+        self.assertEqual(self.count_records(), 3)
+
+    def test_flush(self):
+        self.history.record("file1.mp3", "playlist1", 120.0)
+
+        self.history.flush()
+
+        self.assertEqual(self.count_records(), 1)
+
+    def test_flush_limit_records(self):
+        self.history.MAX_RECORDS = 2
+        for timestamp in range(3):
+            self.history.record("file1.mp3", None, 120.0, timestamp=timestamp + 1)
+
+        self.assertEqual(self.count_records(), 2)
+
+    def test_flush_limit_records_keeps_aggregates(self):
+        self.history.MAX_RECORDS = 2
+        self.history.record("file1.mp3", None, 120.0, timestamp=1)
+        self.history.record("file1.mp3", None, 10.0, timestamp=2)
+        self.history.record("file2.mp3", None, 60.0, timestamp=3)
+        self.history.record("file1.mp3", None, 120.0, timestamp=4)
+        self.history.record("file2.mp3", None, 60.0, timestamp=5)
+        self.history.record("file2.mp3", None, 60.0, timestamp=6)
+        expected = {
+            filename: self.history.get_track_stats(filename)
+            for filename in ("file1.mp3", "file2.mp3")
+        }
+
+        history = self.make_history()
+
+        self.assertEqual(self.count_records(), 2)
+        self.assertDictEqual(
+            expected["file1.mp3"],
+            {"playcount": 2, "skipcount": 1, "lastplayed": 4, "playtime": 250.0},
+        )
+        for filename, stats in expected.items():
+            self.assertDictEqual(history.get_track_stats(filename), stats)
+
+    def test_open_loads_aggregates(self):
+        self.history.record("file1.mp3", "playlist1", 120.0, timestamp=100)
+        self.history.record("file1.mp3", "playlist1", 10.0, timestamp=150)
+        self.history.record("file2.mp3", "playlist1", 60.0, timestamp=200)
+
+        history = self.make_history()
+
+        self.assertDictEqual(
+            history.get_track_stats("file1.mp3"),
+            {"playcount": 1, "skipcount": 1, "lastplayed": 150, "playtime": 130.0},
+        )
+        self.assertEqual(history.get_track_stats("file2.mp3")["playcount"], 1)
+
+    def test_get_track_stats_unknown_track(self):
+        self.assertDictEqual(
+            self.history.get_track_stats("file1.mp3"),
+            {"playcount": 0, "skipcount": 0, "lastplayed": 0, "playtime": 0.0},
+        )
+
+    def test_get_stats(self):
+        self.history.record("file1.mp3", "playlist1", 120.0, timestamp=100)
+        self.history.record("file2.mp3", "playlist1", 120.0, timestamp=200)
+        self.history.record("file2.mp3", "playlist1", 5.0, timestamp=300)
+        self.history.record("file2.mp3", "playlist1", 120.0, timestamp=400)
+        self.history.record("deleted.mp3", "playlist1", 120.0, timestamp=500)
+
+        stats = self.history.get_stats(["file1.mp3", "file2.mp3", "file3.mp3"])
+
+        self.assertEqual(stats["totalplays"], 3)
+        self.assertEqual(stats["totalplaytime"], 365.0)
+        self.assertListEqual(
+            [track["filename"] for track in stats["mostplayed"]],
+            ["file2.mp3", "file1.mp3"],
+        )
+        self.assertListEqual(
+            [track["filename"] for track in stats["mostskipped"]], ["file2.mp3"]
+        )
+        self.assertListEqual(stats["neverplayed"], ["file3.mp3"])
+
+    def test_get_stats_limit(self):
+        self.history.record("file1.mp3", "playlist1", 120.0)
+        self.history.record("file2.mp3", "playlist1", 120.0)
+
+        stats = self.history.get_stats(["file1.mp3", "file2.mp3"], limit=1)
+
+        self.assertEqual(len(stats["mostplayed"]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
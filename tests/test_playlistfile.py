@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import os
+import shutil
+import tempfile
+
+sys.path.append("../")
+from backend.playlistfile import PlaylistFile, PlaylistResolver
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+ROOT = "/opt/cleep/modules/localmusic"
+ENTRIES = [
+    {"filename": "track1.mp3", "path": f"{ROOT}/track1.mp3"},
+    {"filename": "track2.mp3", "path": f"{ROOT}/artist/album/track2.mp3"},
+    {"filename": "Track3.flac", "path": f"{ROOT}/artist/Track3.flac"},
+]
+
+
+class TestPlaylistFile(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _write(self, filename, content):
+        path = os.path.join(self.path, filename)
+        with open(path, "w", encoding="utf-8") as fdesc:
+            fdesc.write(content)
+        return path
+
+    def test_get_format(self):
+        self.assertEqual(PlaylistFile.get_format("/tmp/list.M3U"), "m3u")
+        self.assertEqual(PlaylistFile.get_format("/tmp/list.m3u8"), "m3u8")
+        self.assertEqual(PlaylistFile.get_format("/tmp/list.pls"), "pls")
+        self.assertIsNone(PlaylistFile.get_format("/tmp/list.xspf"))
+
+    def test_read_m3u(self):
+        path = self._write(
+            "list.m3u",
+            "\ufeff#EXTM3U\n#EXTINF:123,Artist - Title\ntrack1.mp3\n\n"
+            "  artist/track2.mp3  \r\n",
+        )
+
+        entries = list(PlaylistFile.read(path))
+
+        self.assertListEqual(entries, [(3, "track1.mp3"), (5, "artist/track2.mp3")])
+
+    def test_read_pls(self):
+        path = self._write(
+            "list.pls",
+            "[playlist]\nFile1=track1.mp3\nTitle1=Title\nLength1=12\nFile2=\n"
+            "file3=track2.mp3\nNumberOfEntries=3\n",
+        )
+
+        entries = list(PlaylistFile.read(path))
+
+        self.assertListEqual(entries, [(2, "track1.mp3"), (6, "track2.mp3")])
+
+    def test_read_is_lazy(self):
+        path = self._write("list.m3u", "track1.mp3\n" * 1000)
+
+        entries = PlaylistFile.read(path)
+
+        self.assertEqual(next(entries), (1, "track1.mp3"))
+        entries.close()
+
+    def test_read_invalid_format(self):
+        with self.assertRaises(ValueError):
+            list(PlaylistFile.read("/tmp/list.xspf"))
+
+    def test_write_m3u8(self):
+        path = os.path.join(self.path, "list.m3u8")
+
+        tracks = [("a/track1.mp3", "track1", 61.6), ("track2.mp3", "track2", None)]
+
+        PlaylistFile.write(path, iter(tracks))
+
+        with open(path, encoding="utf-8") as fdesc:
+            self.assertEqual(
+                fdesc.read(),
+                "#EXTM3U\n#EXTINF:62,track1\na/track1.mp3\n"
+                "#EXTINF:-1,track2\ntrack2.mp3\n",
+            )
+
+    def test_write_pls(self):
+        path = os.path.join(self.path, "list.pls")
+
+        PlaylistFile.write(path, [("track1.mp3", "track1", 10)])
+
+        with open(path, encoding="utf-8") as fdesc:
+            self.assertEqual(
+                fdesc.read(),
+                "[playlist]\nFile1=track1.mp3\nTitle1=track1\nLength1=10\n"
+                "NumberOfEntries=1\nVersion=2\n",
+            )
+
+    def test_write_read_roundtrip(self):
+        path = os.path.join(self.path, "list.pls")
+        PlaylistFile.write(
+            path, [("track1.mp3", "track1", None), ("é/track2.mp3", "track2", None)]
+        )
+
+        entries = [location for _, location in PlaylistFile.read(path)]
+
+        self.assertListEqual(entries, ["track1.mp3", "é/track2.mp3"])
+
+
+class TestPlaylistResolver(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.resolver = PlaylistResolver(ENTRIES, ROOT)
+
+    def test_resolve_relative_path(self):
+        self.assertEqual(
+            self.resolver.resolve(1, "artist/album/track2.mp3"), "track2.mp3"
+        )
+        self.assertEqual(self.resolver.resolve(2, "track1.mp3"), "track1.mp3")
+
+    def test_resolve_foreign_absolute_path(self):
+        self.assertEqual(
+            self.resolver.resolve(1, "/home/user/Music/artist/album/track2.mp3"),
+            "track2.mp3",
+        )
+        self.assertEqual(
+            self.resolver.resolve(2, "C:\\Music\\Artist\\track3.FLAC"), "Track3.flac"
+        )
+
+    def test_resolve_file_url(self):
+        self.assertEqual(
+            self.resolver.resolve(1, "file:///home/user/Music/track1%2Emp3"),
+            "track1.mp3",
+        )
+
+    def test_resolve_filename_only(self):
+        self.assertEqual(
+            self.resolver.resolve(1, "/other/folder/track2.mp3"), "track2.mp3"
+        )
+
+    def test_resolve_unresolved(self):
+        self.assertIsNone(self.resolver.resolve(1, "unknown.mp3"))
+        self.assertIsNone(self.resolver.resolve(2, "http://radio.example.com/stream"))
+
+        self.assertEqual(self.resolver.unresolved_count, 2)
+        self.assertListEqual(
+            self.resolver.unresolved_samples,
+            [
+                {"line": 1, "entry": "unknown.mp3"},
+                {"line": 2, "entry": "http://radio.example.com/stream"},
+            ],
+        )
+
+    def test_resolve_unresolved_samples_are_bounded(self):
+        for line in range(PlaylistResolver.MAX_UNRESOLVED_SAMPLES + 5):
+            self.resolver.resolve(line, "unknown.mp3")
+
+        self.assertEqual(
+            self.resolver.unresolved_count, PlaylistResolver.MAX_UNRESOLVED_SAMPLES + 5
+        )
+        self.assertEqual(
+            len(self.resolver.unresolved_samples),
+            PlaylistResolver.MAX_UNRESOLVED_SAMPLES,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import os
+import ssl
+import shutil
+import subprocess
+import tempfile
+import threading
+import http.client
+from unittest.mock import patch
+
+sys.path.append("../")
+from backend.previewserver import PreviewServer, parse_range
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+CONTENT = bytes(range(256)) * 4096
+
+
+class TestParseRange(unittest.TestCase):
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(parse_range("bytes=900-", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=900-5000", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-100", 1000), (900, 999))
+        self.assertEqual(parse_range("bytes=-5000", 1000), (0, 999))
+        self.assertEqual(parse_range(None, 1000), (0, 999))
+
+    def test_parse_range_not_satisfiable(self):
+        self.assertIsNone(parse_range("bytes=1000-", 1000))
+        self.assertIsNone(parse_range("bytes=10-5", 1000))
+        self.assertIsNone(parse_range("bytes=-0", 1000))
+
+    def test_parse_range_unsupported(self):
+        with self.assertRaises(ValueError):
+            parse_range("bytes=0-10,20-30", 1000)
+        with self.assertRaises(ValueError):
+            parse_range("items=0-10", 1000)
+        with self.assertRaises(ValueError):
+            parse_range("bytes=-", 1000)
+
+
+class TestPreviewServer(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.mkdtemp()
+        self.track = os.path.join(self.tmpdir, "track.mp3")
+        with open(self.track, "wb") as fdesc:
+            fdesc.write(CONTENT)
+        self.server = PreviewServer(logging.getLogger("test"), 0)
+        self.server.start()
+        self.url_path = self.server.register(self.track, "audio/mpeg")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _request(self, path, headers=None, method="GET"):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+        try:
+            connection.request(method, path, headers=headers or {})
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+    def test_get_whole_file(self):
+        response, body = self._request(self.url_path)
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Type"), "audio/mpeg")
+        self.assertEqual(response.getheader("Accept-Ranges"), "bytes")
+        self.assertEqual(body, CONTENT)
+
+    def test_get_range(self):
+        response, body = self._request(self.url_path, {"Range": "bytes=1000-1999"})
+
+        self.assertEqual(response.status, 206)
+        self.assertEqual(
+            response.getheader("Content-Range"), f"bytes 1000-1999/{len(CONTENT)}"
+        )
+        self.assertEqual(body, CONTENT[1000:2000])
+
+    def test_get_range_mmap_fallback(self):
+        with patch("backend.previewserver.os.sendfile", side_effect=OSError(22, "")):
+            response, body = self._request(self.url_path, {"Range": "bytes=-300000"})
+
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, CONTENT[-300000:])
+
+    def test_get_range_not_satisfiable(self):
+        response, _ = self._request(self.url_path, {"Range": f"bytes={len(CONTENT)}-"})
+
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.getheader("Content-Range"), f"bytes */{len(CONTENT)}")
+
+    def test_head(self):
+        response, body = self._request(self.url_path, method="HEAD")
+
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Content-Length"), str(len(CONTENT)))
+        self.assertEqual(body, b"")
+
+    def test_unknown_token(self):
+        response, _ = self._request("/preview/unknown")
+
+        self.assertEqual(response.status, 404)
+
+    def test_expired_token(self):
+        with patch("backend.previewserver.time.monotonic", return_value=1e12):
+            response, _ = self._request(self.url_path)
+
+        self.assertEqual(response.status, 404)
+
+    def test_concurrent_streams_limit(self):
+        release = threading.Event()
+        sending = threading.Event()
+        original_send_range = self.server.send_range
+
+        def send_range(*args):
+            sending.set()
+            release.wait(5)
+            original_send_range(*args)
+
+        self.server.streams = threading.BoundedSemaphore(1)
+        self.server.send_range = send_range
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self._request(self.url_path))
+        )
+        thread.start()
+        sending.wait(5)
+
+        response, _ = self._request(self.url_path)
+        release.set()
+        thread.join(5)
+
+        self.assertEqual(response.status, 503)
+        self.assertEqual(results[0][0].status, 200)
+        self.assertEqual(results[0][1], CONTENT)
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "openssl is not installed")
+class TestSecurePreviewServer(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.mkdtemp()
+        self.track = os.path.join(self.tmpdir, "track.mp3")
+        with open(self.track, "wb") as fdesc:
+            fdesc.write(CONTENT)
+        certfile = os.path.join(self.tmpdir, "cert.pem")
+        keyfile = os.path.join(self.tmpdir, "key.pem")
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                "-keyout", keyfile, "-out", certfile, "-days", "1",
+                "-subj", "/CN=localhost",
+            ],
+            check=True,
+            capture_output=True,
+        )  # fmt: skip
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        self.server = PreviewServer(logging.getLogger("test"), 0, ssl_context=context)
+        self.server.start()
+        self.url_path = self.server.register(self.track, "audio/mpeg")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _request(self, path, headers=None):
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        connection = http.client.HTTPSConnection(
+            "127.0.0.1", self.server.port, timeout=5, context=context
+        )
+        try:
+            connection.request("GET", path, headers=headers or {})
+            response = connection.getresponse()
+            return response, response.read()
+        finally:
+            connection.close()
+
+    def test_secure(self):
+        self.assertTrue(self.server.secure)
+
+    def test_get_range(self):
+        with patch("backend.previewserver.os.sendfile") as sendfile_mock:
+            response, body = self._request(self.url_path, {"Range": "bytes=1000-"})
+
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, CONTENT[1000:])
+        sendfile_mock.assert_not_called()
+
+    def test_plain_http_request(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=5)
+        try:
+            with self.assertRaises((http.client.HTTPException, OSError)):
+                connection.request("GET", self.url_path)
+                connection.getresponse()
+        finally:
+            connection.close()
+
+        response, body = self._request(self.url_path)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, CONTENT)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+import random
+
+sys.path.append("../")
+from backend.shuffleengine import ShuffleEngine
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+TRACKS = [f"/music/file{index}.mp3" for index in range(10)]
+
+
+class TestShuffleEngine(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.engine = ShuffleEngine(random.Random(42))
+
+    def test_deal_whole_permutation_without_repeat(self):
+        dealt = []
+        for _ in range(5):
+            dealt += self.engine.deal("playlist1", TRACKS, 2)
+
+        self.assertCountEqual(dealt, TRACKS)
+        self.assertNotEqual(dealt, TRACKS)
+
+    def test_deal_new_permutation_when_exhausted(self):
+        first = self.engine.deal("playlist1", TRACKS, 10)
+
+        second = self.engine.deal("playlist1", TRACKS, 10)
+
+        self.assertCountEqual(second, TRACKS)
+        self.assertNotEqual(second[0], first[-1])
+
+    def test_deal_new_permutation_never_starts_with_last_track(self):
+        for seed in range(50):
+            engine = ShuffleEngine(random.Random(seed))
+            dealt = engine.deal("playlist1", TRACKS[:2], 20)
+
+            for previous, current in zip(dealt, dealt[1:]):
+                self.assertNotEqual(previous, current)
+
+    def test_deal_per_playlist(self):
+        self.engine.deal("playlist1", TRACKS, 9)
+
+        dealt = self.engine.deal("playlist2", TRACKS, 10)
+
+        self.assertCountEqual(dealt, TRACKS)
+
+    def test_deal_empty_playlist(self):
+        self.assertListEqual(self.engine.deal("playlist1", [], 3), [])
+
+    def test_deal_merges_playlist_changes(self):
+        dealt = self.engine.deal("playlist1", TRACKS, 4)
+        removed = [track for track in TRACKS if track not in dealt][0]
+        tracks = [track for track in TRACKS if track != removed] + ["/music/new.mp3"]
+
+        remaining = self.engine.deal("playlist1", tracks, 6)
+
+        self.assertCountEqual(dealt + remaining, tracks)
+
+    def test_restore(self):
+        dealt = self.engine.deal("playlist1", TRACKS, 4)
+
+        self.engine.restore("playlist1", dealt[2:])
+
+        self.assertListEqual(self.engine.deal("playlist1", TRACKS, 2), dealt[2:])
+        self.assertCountEqual(dealt + self.engine.deal("playlist1", TRACKS, 6), TRACKS)
+
+    def test_restore_after_new_permutation(self):
+        self.engine.deal("playlist1", TRACKS, 9)
+        dealt = self.engine.deal("playlist1", TRACKS, 3)
+
+        self.engine.restore("playlist1", dealt[1:])
+
+        self.assertListEqual(self.engine.deal("playlist1", TRACKS, 2), dealt[1:])
+
+    def test_restore_unknown(self):
+        self.engine.restore("playlist1", ["/music/file1.mp3"])
+        self.engine.deal("playlist1", TRACKS, 1)
+        self.engine.restore("playlist1", ["/music/unknown.mp3"])
+
+        self.assertEqual(self.engine.export_state()["playlist1"]["cursor"], 1)
+
+    def test_rename_and_remove(self):
+        self.engine.deal("playlist1", TRACKS, 1)
+
+        self.engine.rename("playlist1", "playlist2")
+        self.assertListEqual(list(self.engine.export_state().keys()), ["playlist2"])
+
+        self.engine.remove("playlist2")
+        self.assertDictEqual(self.engine.export_state(), {})
+
+    def test_export_import_state(self):
+        dealt = self.engine.deal("playlist1", TRACKS, 3)
+        state = self.engine.export_state()
+
+        engine = ShuffleEngine()
+        engine.import_state(state)
+
+        self.assertCountEqual(dealt + engine.deal("playlist1", TRACKS, 7), TRACKS)
+
+    def test_import_invalid_state(self):
+        self.engine.import_state(
+            {
+                "playlist1": {"permutation": TRACKS, "cursor": 20},
+                "playlist2": {"cursor": 1},
+                "playlist3": {"permutation": TRACKS, "cursor": "invalid"},
+            }
+        )
+
+        state = self.engine.export_state()
+        self.assertListEqual(list(state.keys()), ["playlist1"])
+        self.assertEqual(state["playlist1"]["cursor"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
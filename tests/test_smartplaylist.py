@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import sys
+
+sys.path.append("../")
+from backend.smartplaylist import SmartPlaylist
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+ROOT = "/opt/module/localmusic"
+
+
+def make_entry(filename, folder="", mtime=1.0, metadata=None):
+    path = f"{ROOT}/{folder}/{filename}" if folder else f"{ROOT}/{filename}"
+    return {
+        "id": 1,
+        "filename": filename,
+        "path": path,
+        "size": 10,
+        "mtime": mtime,
+        "metadata": metadata or {},
+    }
+
+
+class TestSmartPlaylist(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+
+    def test_check_rules(self):
+        SmartPlaylist.check_rules({"folder": "rock", "order": "random", "limit": 10})
+        SmartPlaylist.check_rules({"tag": {"name": "genre", "value": "jazz"}})
+
+    def test_check_rules_invalid(self):
+        invalid_rules = [
+            {},
+            [],
+            {"unknown": 1},
+            {"folder": 1},
+            {"tag": {"name": "genre"}},
+            {"minduration": True},
+            {"order": "dummy"},
+            {"limit": 0},
+        ]
+        for rules in invalid_rules:
+            with self.assertRaises(ValueError, msg=rules):
+                SmartPlaylist.check_rules(rules)
+
+    def test_matches_folder(self):
+        playlist = SmartPlaylist({"folder": "/rock/"}, ROOT)
+
+        self.assertTrue(playlist.matches(make_entry("a.mp3", folder="rock")))
+        self.assertTrue(playlist.matches(make_entry("a.mp3", folder="rock/70s")))
+        self.assertFalse(playlist.matches(make_entry("a.mp3", folder="rockabilly")))
+        self.assertFalse(playlist.matches(make_entry("a.mp3")))
+
+    def test_matches_tag(self):
+        playlist = SmartPlaylist({"tag": {"name": "Genre", "value": "jazz"}}, ROOT)
+
+        self.assertTrue(
+            playlist.matches(make_entry("a.mp3", metadata={"tags": {"genre": "Jazz"}}))
+        )
+        self.assertFalse(
+            playlist.matches(make_entry("a.mp3", metadata={"tags": {"genre": "Rock"}}))
+        )
+        self.assertFalse(playlist.matches(make_entry("a.mp3")))
+
+    def test_matches_added_since(self):
+        playlist = SmartPlaylist({"addedsince": 100}, ROOT)
+
+        self.assertTrue(playlist.matches(make_entry("a.mp3", mtime=150)))
+        self.assertFalse(playlist.matches(make_entry("a.mp3", mtime=50)))
+
+    def test_matches_duration(self):
+        playlist = SmartPlaylist({"minduration": 60, "maxduration": 300}, ROOT)
+
+        self.assertTrue(playlist.matches(make_entry("a.mp3", metadata={"duration": 120})))
+        self.assertFalse(playlist.matches(make_entry("a.mp3", metadata={"duration": 30})))
+        self.assertFalse(playlist.matches(make_entry("a.mp3", metadata={"duration": 400})))
+        self.assertFalse(playlist.matches(make_entry("a.mp3")))
+
+    def test_evaluate_and_update(self):
+        playlist = SmartPlaylist({"folder": "rock"}, ROOT)
+        playlist.evaluate(
+            [make_entry("a.mp3", folder="rock"), make_entry("b.mp3", folder="jazz")]
+        )
+        self.assertEqual(len(playlist), 1)
+
+        playlist.update([make_entry("c.mp3", folder="rock")], [])
+        self.assertEqual(len(playlist), 2)
+
+        playlist.update([make_entry("c.mp3", folder="jazz")], ["a.mp3"])
+        self.assertEqual(len(playlist), 0)
+
+    def test_materialize_by_name_with_limit(self):
+        playlist = SmartPlaylist({"limit": 2}, ROOT)
+        playlist.evaluate([make_entry("c.mp3"), make_entry("a.mp3"), make_entry("b.mp3")])
+
+        self.assertListEqual(playlist.materialize(), [f"{ROOT}/a.mp3", f"{ROOT}/b.mp3"])
+
+    def test_materialize_random(self):
+        playlist = SmartPlaylist({"order": "random", "limit": 2}, ROOT)
+        playlist.evaluate([make_entry("c.mp3"), make_entry("a.mp3"), make_entry("b.mp3")])
+
+        tracks = playlist.materialize()
+
+        self.assertEqual(len(tracks), 2)
+        self.assertEqual(len(set(tracks)), 2)
+
+    def test_materialize_random_is_stable_until_reseeded(self):
+        playlist = SmartPlaylist({"order": "random", "limit": 5}, ROOT)
+        playlist.evaluate([make_entry(f"{index:02}.mp3") for index in range(50)])
+
+        tracks = playlist.materialize()
+
+        self.assertListEqual(playlist.materialize(), tracks)
+        playlist.reseed()
+        self.assertNotEqual(playlist.materialize(), tracks)
+
+    def test_materialize_least_played(self):
+        stats = {"a.mp3": (3, 10), "b.mp3": (0, 0), "c.mp3": (3, 5)}
+        playlist = SmartPlaylist({"order": "leastplayed"}, ROOT)
+        playlist.evaluate([make_entry("c.mp3"), make_entry("a.mp3"), make_entry("b.mp3")])
+
+        tracks = playlist.materialize(lambda filename: stats[filename])
+
+        self.assertListEqual(
+            tracks, [f"{ROOT}/b.mp3", f"{ROOT}/c.mp3", f"{ROOT}/a.mp3"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append("../")
+from backend.trackprefetcher import TrackPrefetcher
+from cleep.libs.tests.common import get_log_level
+
+LOG_LEVEL = get_log_level()
+
+
+class TestTrackPrefetcher(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for index in range(3):
+            path = os.path.join(self.tmpdir.name, f"file{index}.mp3")
+            with open(path, "wb") as fd:
+                fd.write(b"\x00" * 1000)
+            self.paths.append(path)
+        self.prefetcher = TrackPrefetcher(logging.getLogger("test"), budget=2500)
+
+    def tearDown(self):
+        self.prefetcher.stop()
+        self.tmpdir.cleanup()
+
+    def wait_stats(self, key, value, timeout=2.0):
+        end = time.time() + timeout
+        while time.time() < end:
+            if self.prefetcher.get_stats()[key] >= value:
+                break
+            time.sleep(0.01)
+        return self.prefetcher.get_stats()
+
+    def test_prefetch(self):
+        self.prefetcher.start()
+
+        self.prefetcher.prefetch(self.paths[:2])
+        stats = self.wait_stats("prefetchedtracks", 2)
+
+        self.assertEqual(stats["prefetchedtracks"], 2)
+        self.assertEqual(stats["prefetchedbytes"], 2000)
+        self.assertGreaterEqual(stats["readtimesaved"], 0.0)
+
+    def test_prefetch_respects_budget(self):
+        self.prefetcher.start()
+
+        self.prefetcher.prefetch(self.paths)
+        stats = self.wait_stats("prefetchedbytes", 2500)
+
+        self.assertEqual(stats["prefetchedbytes"], 2500)
+
+    def test_prefetch_unknown_file(self):
+        self.prefetcher.start()
+
+        self.prefetcher.prefetch(["/dummy/file.mp3", self.paths[0]])
+        stats = self.wait_stats("prefetchedtracks", 1)
+
+        self.assertEqual(stats["prefetchedtracks"], 1)
+        self.assertEqual(stats["prefetchedbytes"], 1000)
+
+    def test_prefetch_not_started(self):
+        self.prefetcher.prefetch(self.paths)
+        time.sleep(0.1)
+
+        self.assertEqual(self.prefetcher.get_stats()["prefetchedtracks"], 0)
+
+    def test_stop(self):
+        self.prefetcher.start()
+
+        self.prefetcher.stop()
+        self.prefetcher.prefetch(self.paths)
+        time.sleep(0.1)
+
+        self.assertEqual(self.prefetcher.get_stats()["prefetchedtracks"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
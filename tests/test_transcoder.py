@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import unittest
+import logging
+import os
+import sys
+import tempfile
+import time
+import hashlib
+
+sys.path.append("../")
+from backend.transcoder import Transcoder
+from cleep.libs.tests.common import get_log_level
+from unittest.mock import Mock, patch
+
+LOG_LEVEL = get_log_level()
+
+
+class TestTranscoder(unittest.TestCase):
+    def setUp(self):
+        logging.basicConfig(
+            level=LOG_LEVEL,
+            format="%(asctime)s %(name)s:%(lineno)d %(levelname)s : %(message)s",
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, "cache")
+        self.on_update = Mock()
+        self.transcoder = Transcoder(
+            logging.getLogger("test"), self.cache_path, self.on_update
+        )
+
+    def tearDown(self):
+        self.transcoder.stop()
+        self.tmpdir.cleanup()
+
+    def make_file(self, filename, content=b"RIFF"):
+        path = os.path.join(self.tmpdir.name, filename)
+        with open(path, "wb") as fd:
+            fd.write(content)
+        return path
+
+    def wait_jobs(self, timeout=2.0):
+        end = time.time() + timeout
+        while time.time() < end:
+            if self.on_update.call_args and self.on_update.call_args.args[0][
+                "status"
+            ] in ("done", "failed"):
+                break
+            time.sleep(0.01)
+
+    def test_get_output_extension(self):
+        self.assertEqual(Transcoder.get_output_extension("/dummy/file.wav"), "flac")
+        self.assertEqual(Transcoder.get_output_extension("/dummy/file.M4A"), "ogg")
+        self.assertEqual(Transcoder.get_output_extension("/dummy/file.opus"), "ogg")
+        self.assertIsNone(Transcoder.get_output_extension("/dummy/file.mp3"))
+
+    @patch("backend.transcoder.shutil.which")
+    def test_is_available(self, which_mock):
+        which_mock.return_value = "/usr/bin/ffmpeg"
+        self.assertTrue(Transcoder.is_available())
+
+        which_mock.return_value = None
+        self.assertFalse(Transcoder.is_available())
+
+    def test_get_content_hash(self):
+        path = self.make_file("file.wav", b"content")
+
+        self.assertEqual(
+            self.transcoder.get_content_hash(path),
+            hashlib.sha256(b"content").hexdigest(),
+        )
+
+    def make_cached_output(self, content=b"content", ext="flac", mtime=None):
+        os.makedirs(self.cache_path, exist_ok=True)
+        output_path = os.path.join(
+            self.cache_path, f"{hashlib.sha256(content).hexdigest()}.{ext}"
+        )
+        with open(output_path, "wb") as fd:
+            fd.write(b"flac")
+        if mtime:
+            os.utime(output_path, (mtime, mtime))
+        return output_path
+
+    def test_submit_cached_output(self):
+        path = self.make_file("file.wav", b"content")
+        output_path = self.make_cached_output(mtime=1000)
+        outputs = []
+        on_done = Mock(side_effect=lambda _, output: outputs.append(output))
+
+        job_id = self.transcoder.submit(path, on_done)
+        self.wait_jobs()
+
+        on_done.assert_called_once()
+        # callback receives its own link to cached output
+        self.assertNotEqual(outputs[0], output_path)
+        self.assertTrue(outputs[0].endswith(".flac"))
+        statuses = [call.args[0]["status"] for call in self.on_update.call_args_list]
+        self.assertListEqual(statuses, ["queued", "running", "done"])
+        self.assertEqual(self.on_update.call_args.args[0]["jobid"], job_id)
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(outputs[0]))
+        self.assertListEqual(os.listdir(self.cache_path), [os.path.basename(output_path)])
+        self.assertGreater(os.path.getmtime(output_path), 1000)
+
+    def test_submit_output_moved(self):
+        path = self.make_file("file.wav", b"content")
+        output_path = self.make_cached_output()
+        new_path = os.path.join(self.tmpdir.name, "file.flac")
+
+        self.transcoder.submit(path, lambda _, output: os.replace(output, new_path))
+        self.wait_jobs()
+
+        self.assertEqual(self.on_update.call_args.args[0]["status"], "done")
+        with open(new_path, "rb") as fd:
+            self.assertEqual(fd.read(), b"flac")
+        # output is still cached
+        self.assertListEqual(os.listdir(self.cache_path), [os.path.basename(output_path)])
+
+    def test_submit_output_save_failed(self):
+        path = self.make_file("file.wav", b"content")
+        output_path = self.make_cached_output()
+        on_done = Mock(return_value="Storage quota exceeded")
+
+        self.transcoder.submit(path, on_done)
+        self.wait_jobs()
+
+        job = self.on_update.call_args.args[0]
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "Storage quota exceeded")
+        self.assertListEqual(self.transcoder.get_jobs(), [])
+        self.assertListEqual(os.listdir(self.cache_path), [os.path.basename(output_path)])
+
+    def test_trim_cache(self):
+        self.transcoder.max_cache_size = 8
+        oldest = self.make_cached_output(b"content1", mtime=1000)
+        middle = self.make_cached_output(b"content2", mtime=2000)
+        newest = self.make_cached_output(b"content3", mtime=3000)
+
+        self.transcoder.trim_cache()
+
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(middle))
+        self.assertTrue(os.path.exists(newest))
+
+    def test_clear(self):
+        output_path = self.make_cached_output()
+        for filename in ("hash.part.flac", "jobid.handoff.ogg"):
+            with open(os.path.join(self.cache_path, filename), "wb") as fd:
+                fd.write(b"flac")
+
+        self.transcoder.clear()
+
+        self.assertListEqual(os.listdir(self.cache_path), [os.path.basename(output_path)])
+
+    def test_clear_no_cache(self):
+        self.transcoder.clear()
+
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    @patch("backend.transcoder.subprocess.Popen")
+    def test_submit_transcode_failed(self, popen_mock):
+        process = popen_mock.return_value.__enter__.return_value
+        process.stdout = iter(["out_time_us=1000\n"])
+        process.stderr.read.return_value = "error"
+        process.returncode = 1
+        path = self.make_file("file.wav")
+        on_done = Mock()
+
+        self.transcoder.submit(path, on_done)
+        self.wait_jobs()
+
+        on_done.assert_not_called()
+        self.assertEqual(self.on_update.call_args.args[0]["status"], "failed")
+        self.assertEqual(self.on_update.call_args.args[0]["error"], "Transcoding failed")
+        self.assertFalse(os.path.exists(path))
+
+    @patch("backend.transcoder.shutil.which")
+    @patch("backend.transcoder.subprocess.run")
+    @patch("backend.transcoder.subprocess.Popen")
+    def test_submit_transcode_progress(self, popen_mock, run_mock, which_mock):
+        which_mock.return_value = "/usr/bin/dummy"
+        run_mock.return_value.stdout = "10.0\n"
+        process = popen_mock.return_value.__enter__.return_value
+        process.stdout = iter(
+            ["out_time_us=2500000\n", "out_time_us=5000000\n", "progress=end\n"]
+        )
+        process.stderr.read.return_value = ""
+        process.returncode = 0
+        path = self.make_file("file.m4a")
+        outputs = []
+        on_done = Mock(
+            side_effect=lambda _, output: outputs.append(os.path.exists(output))
+        )
+
+        def create_output(command, **kwargs):
+            with open(command[-1], "wb") as fd:
+                fd.write(b"ogg")
+            return popen_mock.return_value
+
+        popen_mock.side_effect = create_output
+
+        self.transcoder.submit(path, on_done)
+        self.wait_jobs()
+
+        command = popen_mock.call_args.args[0]
+        self.assertEqual(command[:6], ["ionice", "-c", "3", "nice", "-n", "19"])
+        self.assertIn("libvorbis", command)
+        progresses = [call.args[0]["progress"] for call in self.on_update.call_args_list]
+        self.assertListEqual(progresses, [0, 0, 25, 50, 100])
+        output_path = on_done.call_args.args[1]
+        self.assertTrue(output_path.endswith(".ogg"))
+        self.assertListEqual(outputs, [True])
+
+
+if __name__ == "__main__":
+    unittest.main()